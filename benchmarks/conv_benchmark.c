@@ -0,0 +1,213 @@
+/**
+ * Compares k2c_conv2d, which multiplies the kernel at each output pixel in
+ * turn, with k2c_conv2d_im2col, which copies the patches under the kernel to
+ * a matrix and multiplies it by the kernel all at once, and for 3x3 kernels
+ * with a stride of 1 with k2c_conv2d_winograd, with 2x2 and 4x4 tiles.
+ * prints the speed of each in GFLOP/s of the direct convolution for shapes
+ * typical of the layers of image models, and the largest difference between
+ * their outputs and that of k2c_conv2d, relative to its largest output.
+ *
+ * build from this directory with
+ * gcc -O3 -std=c99 -I../include conv_benchmark.c ../include/libkeras2c.a -lm -o conv_benchmark
+ */
+
+#if !defined(_WIN32) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 200809L
+#endif
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include "k2c_include.h"
+
+
+static double now() {
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec + 1e-9*t.tv_nsec;
+}
+
+
+static void fill(float x[], const size_t size) {
+    for (size_t i = 0; i < size; ++i) {
+        x[i] = 2.0f*rand()/RAND_MAX - 1.0f;
+    }
+}
+
+
+static k2c_tensor make_tensor(const size_t ndim, const size_t shape[]) {
+    k2c_tensor t = {NULL, ndim, 1, {1,1,1,1,1}};
+    for (size_t i = 0; i < ndim; ++i) {
+        t.shape[i] = shape[i];
+        t.numel *= shape[i];
+    }
+    t.array = malloc(t.numel*sizeof(float));
+    fill(t.array, t.numel);
+    return t;
+}
+
+
+/**
+ * Transforms a 3x3 kernel for Winograd convolution, as keras2c.convolution.winograd_kernel does.
+ * computes G g G^T for each pair of input and output channels.
+ */
+static void winograd_kernel(float U[], const float g[], const size_t tile,
+                            const size_t in_channels, const size_t out_channels) {
+
+    const float G2[4*3] = {1.0f, 0.0f, 0.0f, 0.5f, 0.5f, 0.5f, 0.5f, -0.5f, 0.5f,
+                           0.0f, 0.0f, 1.0f
+                          };
+    const float G4[6*3] = {1.0f/4, 0.0f, 0.0f, -1.0f/6, -1.0f/6, -1.0f/6,
+                           -1.0f/6, 1.0f/6, -1.0f/6, 1.0f/24, 1.0f/12, 1.0f/6,
+                           1.0f/24, -1.0f/12, 1.0f/6, 0.0f, 0.0f, 1.0f
+                          };
+    const float * G = tile == 2 ? G2 : G4;
+    const size_t n = tile + 2;
+    const size_t channels = in_channels*out_channels;
+    for (size_t i = 0; i < n; ++i) {
+        for (size_t j = 0; j < n; ++j) {
+            for (size_t c = 0; c < channels; ++c) {
+                float u = 0.0f;
+                for (size_t k = 0; k < 3; ++k) {
+                    for (size_t l = 0; l < 3; ++l) {
+                        u += G[i*3+k]*g[(k*3+l)*channels+c]*G[j*3+l];
+                    }
+                }
+                U[(i*n+j)*channels+c] = u;
+            }
+        }
+    }
+}
+
+
+/**
+ * Times k2c_conv2d_winograd with tiles of tile x tile, and sets the error relative to out0.
+ */
+static double time_winograd(k2c_tensor* output, const k2c_tensor* input,
+                            const k2c_tensor* kernel, const k2c_tensor* bias,
+                            const k2c_tensor* out0, const size_t tile, const size_t reps,
+                            float* err) {
+
+    const size_t n = tile + 2;
+    const size_t pad[4] = {0, 0, 0, 0};
+    const size_t in_channels = input->shape[2];
+    const size_t out_channels = output->shape[2];
+    const size_t channels = in_channels > out_channels ? in_channels : out_channels;
+    const size_t ntiles = ((output->shape[0] + tile - 1)/tile)*((output->shape[1] + tile - 1)/tile);
+    size_t block = 65536/(n*n*(in_channels + out_channels));
+    block = block > K2C_GEMM_MC ? block : K2C_GEMM_MC;
+    block = block < ntiles ? block : ntiles;
+    k2c_tensor U = {malloc(n*n*in_channels*out_channels*sizeof(float)), 4,
+                    n*n*in_channels*out_channels, {n, n, in_channels, out_channels, 1}
+                   };
+    float * work = malloc(n*n*(block*(in_channels + out_channels) + 2*channels)
+                          *sizeof(float));
+    winograd_kernel(U.array, kernel->array, tile, in_channels, out_channels);
+
+    const double t0 = now();
+    for (size_t r = 0; r < reps; ++r) {
+        k2c_conv2d_winograd(output, input, &U, bias, pad, k2c_linear, work, block);
+    }
+    const double t = now() - t0;
+    float maxerr = 0.0f;
+    float maxout = 0.0f;
+    for (size_t i = 0; i < out0->numel; ++i) {
+        maxerr = fmaxf(maxerr, fabsf(out0->array[i] - output->array[i]));
+        maxout = fmaxf(maxout, fabsf(out0->array[i]));
+    }
+    *err = maxerr/maxout;
+    free(U.array);
+    free(work);
+    return t;
+}
+
+
+int main() {
+
+    const char * levels[] = {"generic", "avx2", "avx512"};
+    printf("kernels: %s\n", levels[k2c_simd_init()]);
+
+    // rows, cols, in channels, out channels, kernel size, stride
+    const size_t shapes[][6] = {
+        {32, 32, 3, 16, 3, 1},     // first layer of a small image model
+        {28, 28, 1, 32, 5, 1},     // first layer of a digit classifier
+        {16, 16, 32, 32, 3, 1},
+        {16, 16, 64, 64, 3, 1},
+        {8, 8, 128, 128, 3, 1},
+        {16, 16, 64, 64, 1, 1},    // pointwise
+        {32, 32, 16, 32, 3, 2},    // strided
+        {8, 8, 16, 2, 3, 1},       // few output channels
+        {64, 64, 8, 8, 3, 1},
+    };
+    const size_t nshapes = sizeof(shapes)/sizeof(shapes[0]);
+    const size_t dilation[2] = {1, 1};
+    const size_t pad[4] = {0, 0, 0, 0};
+    // output positions done at a time by k2c_conv2d_im2col
+    const size_t max_cols = 65536;
+
+    printf("%6s %6s %6s %6s %6s %6s %8s %8s %10s %10s %10s %10s %10s\n", "rows", "cols",
+           "in ch", "out ch", "kernel", "stride", "direct", "im2col", "winograd2",
+           "winograd4", "im2col err", "wino2 err", "wino4 err");
+    for (size_t s = 0; s < nshapes; ++s) {
+        const size_t k = shapes[s][4];
+        const size_t stride[2] = {shapes[s][5], shapes[s][5]};
+        const size_t in_shape[3] = {shapes[s][0], shapes[s][1], shapes[s][2]};
+        const size_t out_shape[3] = {(shapes[s][0] - k)/stride[0] + 1,
+                                     (shapes[s][1] - k)/stride[1] + 1, shapes[s][3]};
+        const size_t kernel_shape[4] = {k, k, shapes[s][2], shapes[s][3]};
+        const size_t bias_shape[1] = {shapes[s][3]};
+        k2c_tensor input = make_tensor(3, in_shape);
+        k2c_tensor kernel = make_tensor(4, kernel_shape);
+        k2c_tensor bias = make_tensor(1, bias_shape);
+        k2c_tensor out0 = make_tensor(3, out_shape);
+        k2c_tensor out1 = make_tensor(3, out_shape);
+        const size_t patch = k*k*shapes[s][2];
+        const size_t npos = out_shape[0]*out_shape[1];
+        size_t block = max_cols/patch > K2C_GEMM_MC ? max_cols/patch : K2C_GEMM_MC;
+        block = block < npos ? block : npos;
+        float * cols = malloc(block*patch*sizeof(float));
+
+        // enough repeats for about 2e9 flops
+        const double flops = 2.0*out0.numel*patch;
+        const size_t reps = (size_t) (2e9/flops) + 1;
+
+        double t0 = now();
+        for (size_t r = 0; r < reps; ++r) {
+            k2c_conv2d(&out0, &input, &kernel, &bias, stride, dilation, pad, k2c_linear);
+        }
+        const double tdirect = now() - t0;
+        t0 = now();
+        for (size_t r = 0; r < reps; ++r) {
+            k2c_conv2d_im2col(&out1, &input, &kernel, &bias, stride, dilation, pad,
+                              k2c_linear, cols, block);
+        }
+        const double tim2col = now() - t0;
+
+        float maxerr = 0.0f;
+        float maxout = 0.0f;
+        for (size_t i = 0; i < out0.numel; ++i) {
+            maxerr = fmaxf(maxerr, fabsf(out0.array[i] - out1.array[i]));
+            maxout = fmaxf(maxout, fabsf(out0.array[i]));
+        }
+        printf("%6zu %6zu %6zu %6zu %6zu %6zu %8.2f %8.2f", shapes[s][0], shapes[s][1],
+               shapes[s][2], shapes[s][3], k, stride[0], 1e-9*flops*reps/tdirect,
+               1e-9*flops*reps/tim2col);
+        if (k == 3 && stride[0] == 1) {
+            float err2, err4;
+            const double t2 = time_winograd(&out1, &input, &kernel, &bias, &out0, 2, reps, &err2);
+            const double t4 = time_winograd(&out1, &input, &kernel, &bias, &out0, 4, reps, &err4);
+            printf(" %10.2f %10.2f %10.2e %10.2e %10.2e\n", 1e-9*flops*reps/t2,
+                   1e-9*flops*reps/t4, maxerr/maxout, err2, err4);
+        }
+        else {
+            printf(" %10s %10s %10.2e %10s %10s\n", "-", "-", maxerr/maxout, "-", "-");
+        }
+        free(input.array);
+        free(kernel.array);
+        free(bias.array);
+        free(out0.array);
+        free(out1.array);
+        free(cols);
+    }
+    return 0;
+}
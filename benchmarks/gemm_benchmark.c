@@ -0,0 +1,152 @@
+/**
+ * Compares k2c_affine_matmul with the plain loops it replaced,
+ * and with k2c_affine_matmul_p on a kernel packed ahead of time.
+ * prints the speed of each in GFLOP/s for shapes typical of Dense layers,
+ * batched Dense layers and recurrent cells, and the largest difference
+ * between their outputs. The kernels chosen by k2c_simd_init are used, set
+ * K2C_SIMD=generic or K2C_SIMD=avx2 to compare against the slower ones.
+ *
+ * build from this directory with
+ * gcc -O3 -std=c99 -I../include gemm_benchmark.c ../include/libkeras2c.a -lm -o gemm_benchmark
+ */
+
+#if !defined(_WIN32) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 200809L
+#endif
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include "k2c_include.h"
+
+
+/**
+ * Affine matrix multiplication as written before blocking, copied from
+ * k2c_affine_matmul. computes C = A*B + d, with a dot product for each
+ * element of C.
+ */
+static void reference_affine_matmul(float C[], const float A[], const float B[],
+                                    const float d[], const size_t outrows,
+                                    const size_t outcols, const size_t innerdim) {
+
+    // make sure output is empty
+    memset(C, 0, outrows*outcols*sizeof(C[0]));
+
+    for (size_t i = 0 ; i < outrows; ++i) {
+        const size_t outrowidx = i*outcols;
+        const size_t inneridx = i*innerdim;
+        for (size_t j = 0;  j < outcols; ++j) {
+            for (size_t k = 0; k < innerdim; ++k) {
+                C[outrowidx+j] += A[inneridx+k] * B[k*outcols+j];
+            }
+            C[outrowidx+j] += d[j];
+        }
+    }
+}
+
+
+/**
+ * Packs B into panels of K2C_GEMM_NC cols, as keras2c.packing.pack_kernel does.
+ */
+static void pack(float Bp[], const float B[], const size_t rows, const size_t cols) {
+
+    for (size_t jc = 0; jc < cols; jc += K2C_GEMM_NC) {
+        for (size_t k = 0; k < rows; ++k) {
+            for (size_t j = 0; j < K2C_GEMM_NC; ++j) {
+                Bp[jc*rows+k*K2C_GEMM_NC+j] = jc + j < cols ? B[k*cols+jc+j] : 0.0f;
+            }
+        }
+    }
+}
+
+
+static double now() {
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec + 1e-9*t.tv_nsec;
+}
+
+
+static void fill(float x[], const size_t size) {
+    for (size_t i = 0; i < size; ++i) {
+        x[i] = 2.0f*rand()/RAND_MAX - 1.0f;
+    }
+}
+
+
+int main() {
+
+    const char * levels[] = {"generic", "avx2", "avx512"};
+    printf("kernels: %s\n", levels[k2c_simd_init()]);
+
+    // outrows, outcols, innerdim
+    const size_t shapes[][3] = {
+        {1, 10, 784},     // Dense classifier head
+        {1, 128, 256},    // Dense
+        {1, 64, 64},      // recurrent kernel of one gate
+        {1, 256, 1024},   // wide Dense
+        {8, 128, 256},    // Dense, batch of 8
+        {32, 128, 256},   // Dense, batch of 32
+        {32, 512, 512},   // wide Dense, batch of 32
+        {100, 32, 27},    // 3x3x3 convolution over 100 pixels
+        {256, 256, 256},
+    };
+    const size_t nshapes = sizeof(shapes)/sizeof(shapes[0]);
+
+    printf("%8s %8s %8s %12s %12s %12s %10s %10s\n", "outrows", "outcols", "innerdim",
+           "ref GFLOP/s", "k2c GFLOP/s", "packed", "speedup", "max err");
+    for (size_t s = 0; s < nshapes; ++s) {
+        const size_t outrows = shapes[s][0];
+        const size_t outcols = shapes[s][1];
+        const size_t innerdim = shapes[s][2];
+        float * A = malloc(outrows*innerdim*sizeof(float));
+        float * B = malloc(innerdim*outcols*sizeof(float));
+        float * d = malloc(outcols*sizeof(float));
+        float * C0 = malloc(outrows*outcols*sizeof(float));
+        float * C1 = malloc(outrows*outcols*sizeof(float));
+        float * C2 = malloc(outrows*outcols*sizeof(float));
+        float * Bp = malloc(k2c_packed_size(innerdim, outcols)*sizeof(float));
+        fill(A, outrows*innerdim);
+        fill(B, innerdim*outcols);
+        fill(d, outcols);
+        pack(Bp, B, innerdim, outcols);
+
+        // enough repeats for about 2e9 flops
+        const double flops = 2.0*outrows*outcols*innerdim;
+        const size_t reps = (size_t) (2e9/flops) + 1;
+
+        double t0 = now();
+        for (size_t r = 0; r < reps; ++r) {
+            reference_affine_matmul(C0, A, B, d, outrows, outcols, innerdim);
+        }
+        const double tref = now() - t0;
+        t0 = now();
+        for (size_t r = 0; r < reps; ++r) {
+            k2c_affine_matmul(C1, A, B, d, outrows, outcols, innerdim);
+        }
+        const double tk2c = now() - t0;
+        t0 = now();
+        for (size_t r = 0; r < reps; ++r) {
+            k2c_affine_matmul_p(C2, A, Bp, d, outrows, outcols, innerdim);
+        }
+        const double tpacked = now() - t0;
+
+        float maxerr = 0.0f;
+        for (size_t i = 0; i < outrows*outcols; ++i) {
+            maxerr = fmaxf(maxerr, fabsf(C0[i] - C1[i]));
+            maxerr = fmaxf(maxerr, fabsf(C0[i] - C2[i]));
+        }
+        printf("%8zu %8zu %8zu %12.2f %12.2f %12.2f %10.2f %10.2e\n", outrows, outcols,
+               innerdim, 1e-9*flops*reps/tref, 1e-9*flops*reps/tk2c,
+               1e-9*flops*reps/tpacked, tref/tk2c, maxerr);
+        free(A);
+        free(B);
+        free(d);
+        free(C0);
+        free(C1);
+        free(C2);
+        free(Bp);
+    }
+    return 0;
+}
@@ -126,7 +126,8 @@ void k2c_pad3d(k2c_tensor* output, const k2c_tensor* input, const float fill,
 
 /**
  * 1D (temporal) Convolution.
- * Assumes a "channels last" structure.
+ * Assumes a "channels last" structure. The input is padded implicitly: parts of the
+ * kernel that fall in the padding are skipped.
  *
  * :param output: output tensor.
  * :param input: input tensor.
@@ -134,38 +135,39 @@ void k2c_pad3d(k2c_tensor* output, const k2c_tensor* input, const float fill,
  * :param bias: bias tensor.
  * :param stride: stride length of the convolution.
  * :param dilation: dilation rate to use for dilated convolution.
+ * :param pad: array[2] of padding of the input with zeros. Order is {before dim 1, after dim 1}.
  * :param activation: activation function to apply to output.
  */
 void k2c_conv1d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                 const k2c_tensor* bias, const size_t stride, const size_t dilation,
-                k2c_activationType *activation) {
-
-    memset(output->array,0,output->numel*sizeof(output->array[0]));
+                const size_t pad[], k2c_activationType *activation) {
 
     const size_t out_times = output->shape[0];
     const size_t out_channels = output->shape[1];
+    const size_t in_times = input->shape[0];
     const size_t in_channels = input->shape[1];
+    const size_t work = output->numel*kernel->shape[0]*in_channels;
 
+    #pragma omp parallel for if (work >= K2C_PARALLEL_MIN_WORK)
     for (size_t x0=0; x0 < out_times; ++x0) {
-        for (size_t z=0; z < kernel->shape[0]; ++z) {
-            for (size_t q=0; q < in_channels; ++q) {
-                for (size_t k=0; k < out_channels; ++k) {
-                    output->array[x0*out_channels + k] +=
-                        kernel->array[z*(kernel->shape[2]*kernel->shape[1]) +
-                                                                            q*(kernel->shape[2]) + k]*
-                        input->array[(x0*stride + dilation*z)*in_channels + q];
-                }
-            }
+        float * y = &output->array[x0*out_channels];
+        memcpy(y, bias->array, out_channels*sizeof(y[0]));
+        size_t first, last;
+        k2c_window(&first, &last, x0, stride, dilation, pad[0], in_times, kernel->shape[0]);
+        for (size_t z=first; z < last; ++z) {
+            const float * x = &input->array[(x0*stride + dilation*z - pad[0])*in_channels];
+            k2c_gemv(y, x, &kernel->array[z*in_channels*out_channels], out_channels,
+                     in_channels);
         }
     }
-    k2c_bias_add(output,bias);
     activation(output->array,output->numel);
 }
 
 
 /**
  * 2D (spatial) Convolution.
- * Assumes a "channels last" structure.
+ * Assumes a "channels last" structure. The input is padded implicitly: parts of the
+ * kernel that fall in the padding are skipped.
  *
  * :param output: output tensor.
  * :param input: input tensor.
@@ -173,100 +175,866 @@ void k2c_conv1d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* k
  * :param bias: bias tensor.
  * :param stride: array[2] of stride length of the convolution. Order is {stride dim 1, stride dim 2}.
  * :param dilation: array[2] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2}.
+ * :param pad: array[4] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
  * :param activation: activation function to apply to output.
  */
 void k2c_conv2d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                 const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
-                k2c_activationType *activation) {
+                const size_t pad[], k2c_activationType *activation) {
+
+    const size_t out_rows = output->shape[0];
+    const size_t out_cols = output->shape[1];
+    const size_t out_channels = output->shape[2];
+    const size_t in_rows = input->shape[0];
+    const size_t in_cols = input->shape[1];
+    const size_t in_channels = input->shape[2];
+    const size_t work = output->numel*kernel->shape[0]*kernel->shape[1]*in_channels;
+
+    #pragma omp parallel for collapse(2) if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t x0=0; x0 < out_rows; ++x0) {
+        for (size_t x1=0; x1 < out_cols; ++x1) {
+            float * y = &output->array[(x0*out_cols + x1)*out_channels];
+            memcpy(y, bias->array, out_channels*sizeof(y[0]));
+            size_t first0, last0, first1, last1;
+            k2c_window(&first0, &last0, x0, stride[0], dilation[0], pad[0], in_rows,
+                       kernel->shape[0]);
+            k2c_window(&first1, &last1, x1, stride[1], dilation[1], pad[2], in_cols,
+                       kernel->shape[1]);
+            for (size_t z0=first0; z0 < last0; ++z0) {
+                for (size_t z1=first1; z1 < last1; ++z1) {
+                    const float * x = &input->array[((x0*stride[0] + dilation[0]*z0 - pad[0])*in_cols
+                                                     + x1*stride[1] + dilation[1]*z1 - pad[2])
+                                                    *in_channels];
+                    const float * w = &kernel->array[(z0*kernel->shape[1] + z1)
+                                                     *in_channels*out_channels];
+                    k2c_gemv(y, x, w, out_channels, in_channels);
+                }
+            }
+        }
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * 3D (spatial or spatio-temporal) Convolution.
+ * Assumes a "channels last" structure. The input is padded implicitly: parts of the
+ * kernel that fall in the padding are skipped.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: array[3] of stride length of the convolution. Order is {stride dim 1, stride dim 2, stride dim 3}.
+ * :param dilation: array[3] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2, dilation dim 3}.
+ * :param pad: array[6] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2, before dim 3, after dim 3}.
+ * :param activation: activation function to apply to output.
+ */
+void k2c_conv3d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                const size_t pad[], k2c_activationType *activation) {
+
+    const size_t dim1 = output->shape[0];
+    const size_t dim2 = output->shape[1];
+    const size_t dim3 = output->shape[2];
+    const size_t out_channels = output->shape[3];
+    const size_t in_dim1 = input->shape[0];
+    const size_t in_dim2 = input->shape[1];
+    const size_t in_dim3 = input->shape[2];
+    const size_t in_channels = input->shape[3];
+    const size_t work = output->numel*kernel->shape[0]*kernel->shape[1]*kernel->shape[2]
+                        *in_channels;
+
+    #pragma omp parallel for collapse(3) if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t x0=0; x0 < dim1; ++x0) {
+        for (size_t x1=0; x1 < dim2; ++x1) {
+            for (size_t x2=0; x2 < dim3; ++x2) {
+                float * y = &output->array[((x0*dim2 + x1)*dim3 + x2)*out_channels];
+                memcpy(y, bias->array, out_channels*sizeof(y[0]));
+                size_t first0, last0, first1, last1, first2, last2;
+                k2c_window(&first0, &last0, x0, stride[0], dilation[0], pad[0], in_dim1,
+                           kernel->shape[0]);
+                k2c_window(&first1, &last1, x1, stride[1], dilation[1], pad[2], in_dim2,
+                           kernel->shape[1]);
+                k2c_window(&first2, &last2, x2, stride[2], dilation[2], pad[4], in_dim3,
+                           kernel->shape[2]);
+                for (size_t z0=first0; z0 < last0; ++z0) {
+                    for (size_t z1=first1; z1 < last1; ++z1) {
+                        for (size_t z2=first2; z2 < last2; ++z2) {
+                            const float * x = &input->array[(((x0*stride[0] + dilation[0]*z0 - pad[0])*in_dim2
+                                                              + x1*stride[1] + dilation[1]*z1 - pad[2])*in_dim3
+                                                             + x2*stride[2] + dilation[2]*z2 - pad[4])*in_channels];
+                            const float * w = &kernel->array[((z0*kernel->shape[1] + z1)
+                                                              *kernel->shape[2] + z2)
+                                                             *in_channels*out_channels];
+                            k2c_gemv(y, x, w, out_channels, in_channels);
+                        }
+                    }
+                }
+            }
+        }
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * Convolution in any number of spatial dimensions, computed as a matrix product.
+ * Patches of the input under the kernel are copied to the rows of a matrix (im2col),
+ * which is multiplied by the kernel, viewed as a matrix with one column per output
+ * channel. Blocks of output positions are done at a time, so that only a block of
+ * the patches is stored at once. Kernels of size 1 with strides of 1 multiply the
+ * input directly. The input is padded implicitly: patches that overlap the padding
+ * are set to zero and only the part inside the input is copied.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: kernel tensor.
+ * :param bias: bias tensor.
+ * :param ndim: number of spatial dimensions, at most 3.
+ * :param stride: array[ndim] of stride length of the convolution.
+ * :param dilation: array[ndim] dilation rate to use for dilated convolution.
+ * :param pad: array[2*ndim] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, ...}.
+ * :param activation: activation function to apply to output.
+ * :param cols: array[block*size of patch] to store the patches. Not used for kernels of size 1 with strides of 1.
+ * :param block: number of output positions done at a time.
+ */
+static void k2c_conv_im2col(k2c_tensor* output, const k2c_tensor* input,
+                            const k2c_tensor* kernel, const k2c_tensor* bias,
+                            const size_t ndim, const size_t stride[],
+                            const size_t dilation[], const size_t pad[],
+                            k2c_activationType *activation, float cols[],
+                            const size_t block) {
+
+    // spatial dimensions are padded with leading ones to 3
+    size_t out_shape[3] = {1,1,1};
+    size_t in_shape[3] = {1,1,1};
+    size_t kernel_shape[3] = {1,1,1};
+    size_t st[3] = {1,1,1};
+    size_t dil[3] = {1,1,1};
+    size_t pd[3] = {0,0,0};
+    for (size_t i=0; i < ndim; ++i) {
+        out_shape[3-ndim+i] = output->shape[i];
+        in_shape[3-ndim+i] = input->shape[i];
+        kernel_shape[3-ndim+i] = kernel->shape[i];
+        st[3-ndim+i] = stride[i];
+        dil[3-ndim+i] = dilation[i];
+        pd[3-ndim+i] = pad[2*i];
+    }
+    const size_t in_channels = input->shape[ndim];
+    const size_t out_channels = output->shape[ndim];
+    const size_t npos = output->numel/out_channels;
+    const size_t patch = kernel->numel/out_channels;
+
+    if (patch == in_channels && st[0] == 1 && st[1] == 1 && st[2] == 1) {
+        k2c_affine_matmul(output->array, input->array, kernel->array, bias->array,
+                          npos, out_channels, in_channels);
+        activation(output->array,output->numel);
+        return;
+    }
+
+    for (size_t p0=0; p0 < npos; p0 += block) {
+        const size_t rows = npos - p0 < block ? npos - p0 : block;
+        for (size_t r=0; r < rows; ++r) {
+            const size_t p = p0 + r;
+            const size_t x[3] = {p/(out_shape[2]*out_shape[1]),
+                                 (p/out_shape[2]) % out_shape[1],
+                                 p % out_shape[2]
+                                };
+            size_t first[3], last[3];
+            int inside = 1;
+            for (size_t i=0; i < 3; ++i) {
+                k2c_window(&first[i], &last[i], x[i], st[i], dil[i], pd[i], in_shape[i],
+                           kernel_shape[i]);
+                inside = inside && first[i] == 0 && last[i] == kernel_shape[i];
+            }
+            float * c = &cols[r*patch];
+            if (!inside) {
+                memset(c, 0, patch*sizeof(c[0]));
+            }
+            // the part of each row of the kernel along the last dimension inside the
+            // input is contiguous in the input if it is not dilated
+            const size_t run = dil[2] == 1 ? (last[2] - first[2])*in_channels : in_channels;
+            const size_t nruns = dil[2] == 1 ? 1 : last[2] - first[2];
+            for (size_t z0=first[0]; z0 < last[0]; ++z0) {
+                for (size_t z1=first[1]; z1 < last[1]; ++z1) {
+                    const size_t start = ((x[0]*st[0] + dil[0]*z0 - pd[0])*in_shape[1]
+                                          + x[1]*st[1] + dil[1]*z1 - pd[1])*in_shape[2]
+                                         + x[2]*st[2] + dil[2]*first[2] - pd[2];
+                    float * cz = &c[((z0*kernel_shape[1] + z1)*kernel_shape[2] + first[2])
+                                    *in_channels];
+                    for (size_t z2=0; z2 < nruns; ++z2) {
+                        memcpy(&cz[z2*in_channels], &input->array[(start + dil[2]*z2)*in_channels],
+                               run*sizeof(c[0]));
+                    }
+                }
+            }
+        }
+        k2c_affine_matmul(&output->array[p0*out_channels], cols, kernel->array,
+                          bias->array, rows, out_channels, patch);
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * 1D (temporal) Convolution, computed as a matrix product.
+ * Assumes a "channels last" structure. Gives the same result as k2c_conv1d.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: stride length of the convolution.
+ * :param dilation: dilation rate to use for dilated convolution.
+ * :param pad: array[2] of padding of the input with zeros. Order is {before dim 1, after dim 1}.
+ * :param activation: activation function to apply to output.
+ * :param cols: array[block*kernel size*input channels] working space. May be NULL if the kernel size and stride are 1.
+ * :param block: number of output times done at a time.
+ */
+void k2c_conv1d_im2col(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                       const k2c_tensor* bias, const size_t stride, const size_t dilation,
+                       const size_t pad[], k2c_activationType *activation, float cols[],
+                       const size_t block) {
+
+    k2c_conv_im2col(output, input, kernel, bias, 1, &stride, &dilation, pad, activation,
+                    cols, block);
+}
+
+
+/**
+ * 2D (spatial) Convolution, computed as a matrix product.
+ * Assumes a "channels last" structure. Gives the same result as k2c_conv2d.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: array[2] of stride length of the convolution. Order is {stride dim 1, stride dim 2}.
+ * :param dilation: array[2] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2}.
+ * :param pad: array[4] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
+ * :param activation: activation function to apply to output.
+ * :param cols: array[block*kernel size*input channels] working space. May be NULL if the kernel size and strides are 1.
+ * :param block: number of output positions done at a time.
+ */
+void k2c_conv2d_im2col(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                       const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                       const size_t pad[], k2c_activationType *activation, float cols[],
+                       const size_t block) {
+
+    k2c_conv_im2col(output, input, kernel, bias, 2, stride, dilation, pad, activation,
+                    cols, block);
+}
+
+
+/**
+ * 3D (spatial or spatio-temporal) Convolution, computed as a matrix product.
+ * Assumes a "channels last" structure. Gives the same result as k2c_conv3d.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: array[3] of stride length of the convolution. Order is {stride dim 1, stride dim 2, stride dim 3}.
+ * :param dilation: array[3] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2, dilation dim 3}.
+ * :param pad: array[6] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2, before dim 3, after dim 3}.
+ * :param activation: activation function to apply to output.
+ * :param cols: array[block*kernel size*input channels] working space. May be NULL if the kernel size and strides are 1.
+ * :param block: number of output positions done at a time.
+ */
+void k2c_conv3d_im2col(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                       const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                       const size_t pad[], k2c_activationType *activation, float cols[],
+                       const size_t block) {
+
+    k2c_conv_im2col(output, input, kernel, bias, 3, stride, dilation, pad, activation,
+                    cols, block);
+}
+
+
+/**
+ * Applies B^T of F(2x2,3x3) Winograd convolution along one dimension of an input tile.
+ * each of the 4 inputs and outputs is a vector of channels.
+ *
+ * :param r: array to store the outputs, spaced rs apart.
+ * :param rs: distance between outputs.
+ * :param d: inputs, spaced ds apart.
+ * :param ds: distance between inputs.
+ * :param channels: size of each vector.
+ */
+static void k2c_winograd2_BT(float r[], const size_t rs, const float d[], const size_t ds,
+                             const size_t channels) {
+
+    for (size_t c=0; c < channels; ++c) {
+        const float d0 = d[c];
+        const float d1 = d[ds+c];
+        const float d2 = d[2*ds+c];
+        const float d3 = d[3*ds+c];
+        r[c] = d0 - d2;
+        r[rs+c] = d1 + d2;
+        r[2*rs+c] = d2 - d1;
+        r[3*rs+c] = d1 - d3;
+    }
+}
+
+
+/**
+ * Applies A^T of F(2x2,3x3) Winograd convolution along one dimension of an output tile.
+ * each of the 4 inputs and 2 outputs is a vector of channels.
+ *
+ * :param r: array to store the outputs, spaced rs apart.
+ * :param rs: distance between outputs.
+ * :param m: inputs, spaced ms apart.
+ * :param ms: distance between inputs.
+ * :param bias: array[channels] added to each output, or NULL.
+ * :param channels: size of each vector.
+ */
+static void k2c_winograd2_AT(float r[], const size_t rs, const float m[], const size_t ms,
+                             const float bias[], const size_t channels) {
+
+    for (size_t c=0; c < channels; ++c) {
+        const float b = bias ? bias[c] : 0.0f;
+        const float m0 = m[c];
+        const float m1 = m[ms+c];
+        const float m2 = m[2*ms+c];
+        const float m3 = m[3*ms+c];
+        r[c] = m0 + m1 + m2 + b;
+        r[rs+c] = m1 - m2 - m3 + b;
+    }
+}
+
+
+/**
+ * Applies B^T of F(4x4,3x3) Winograd convolution along one dimension of an input tile.
+ * each of the 6 inputs and outputs is a vector of channels.
+ *
+ * :param r: array to store the outputs, spaced rs apart.
+ * :param rs: distance between outputs.
+ * :param d: inputs, spaced ds apart.
+ * :param ds: distance between inputs.
+ * :param channels: size of each vector.
+ */
+static void k2c_winograd4_BT(float r[], const size_t rs, const float d[], const size_t ds,
+                             const size_t channels) {
+
+    for (size_t c=0; c < channels; ++c) {
+        const float d0 = d[c];
+        const float d1 = d[ds+c];
+        const float d2 = d[2*ds+c];
+        const float d3 = d[3*ds+c];
+        const float d4 = d[4*ds+c];
+        const float d5 = d[5*ds+c];
+        r[c] = 4.0f*d0 - 5.0f*d2 + d4;
+        r[rs+c] = d3 + d4 - 4.0f*(d1 + d2);
+        r[2*rs+c] = d4 - d3 + 4.0f*(d1 - d2);
+        r[3*rs+c] = d4 - d2 + 2.0f*(d3 - d1);
+        r[4*rs+c] = d4 - d2 - 2.0f*(d3 - d1);
+        r[5*rs+c] = 4.0f*d1 - 5.0f*d3 + d5;
+    }
+}
+
+
+/**
+ * Applies A^T of F(4x4,3x3) Winograd convolution along one dimension of an output tile.
+ * each of the 6 inputs and 4 outputs is a vector of channels.
+ *
+ * :param r: array to store the outputs, spaced rs apart.
+ * :param rs: distance between outputs.
+ * :param m: inputs, spaced ms apart.
+ * :param ms: distance between inputs.
+ * :param bias: array[channels] added to each output, or NULL.
+ * :param channels: size of each vector.
+ */
+static void k2c_winograd4_AT(float r[], const size_t rs, const float m[], const size_t ms,
+                             const float bias[], const size_t channels) {
+
+    for (size_t c=0; c < channels; ++c) {
+        const float b = bias ? bias[c] : 0.0f;
+        const float m0 = m[c];
+        const float m1 = m[ms+c];
+        const float m2 = m[2*ms+c];
+        const float m3 = m[3*ms+c];
+        const float m4 = m[4*ms+c];
+        const float m5 = m[5*ms+c];
+        const float s12 = m1 + m2;
+        const float d12 = m1 - m2;
+        const float s34 = m3 + m4;
+        const float d34 = m3 - m4;
+        r[c] = m0 + s12 + s34 + b;
+        r[rs+c] = d12 + 2.0f*d34 + b;
+        r[2*rs+c] = s12 + 4.0f*s34 + b;
+        r[3*rs+c] = d12 + 8.0f*d34 + m5 + b;
+    }
+}
+
+
+/**
+ * 2D (spatial) Convolution by the Winograd minimal filtering algorithm.
+ * Assumes a "channels last" structure, a 3x3 kernel and strides and dilations of 1.
+ * The output is split into tiles of 2x2 or 4x4. Each 4x4 or 6x6 tile of the input is
+ * transformed, multiplied by the transformed kernel at each of its 16 or 36 points, and
+ * the products are transformed back, so each output needs 4 or 2.25 multiplies per
+ * input channel instead of 9. Results differ from k2c_conv2d by rounding, more so for
+ * the 4x4 tiles. Blocks of tiles are done at a time, so that each product is a matrix
+ * product over the tiles of the block. The input is padded implicitly: tiles that
+ * overlap the padding or the far edges of the input are copied with zeros around them.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: transformed kernel, of shape {4,4,in channels,out channels} for 2x2 tiles or {6,6,in channels,out channels} for 4x4 tiles.
+ * :param bias: bias tensor.
+ * :param pad: array[4] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
+ * :param activation: activation function to apply to output.
+ * :param work: array[n*n*(block*(in channels + out channels) + 2*max(in channels, out channels))] working space, where n is 4 for 2x2 tiles or 6 for 4x4 tiles.
+ * :param block: number of tiles done at a time.
+ */
+void k2c_conv2d_winograd(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                         const k2c_tensor* bias, const size_t pad[],
+                         k2c_activationType *activation, float work[], const size_t block) {
+
+    const size_t n = kernel->shape[0];
+    const size_t m = n - 2;
+    const size_t out_rows = output->shape[0];
+    const size_t out_cols = output->shape[1];
+    const size_t out_channels = output->shape[2];
+    const size_t in_rows = input->shape[0];
+    const size_t in_cols = input->shape[1];
+    const size_t in_channels = input->shape[2];
+    const size_t tile_rows = (out_rows + m - 1)/m;
+    const size_t tile_cols = (out_cols + m - 1)/m;
+    const size_t ntiles = tile_rows*tile_cols;
+
+    // transformed inputs, one matrix of block by in_channels for each point of the tile
+    float * V = work;
+    // their products with the kernel, one matrix of block by out_channels for each point
+    float * M = &work[n*n*block*in_channels];
+    // tiles half transformed, and tiles at the edges of the input and output
+    float * tmp = &M[n*n*block*out_channels];
+    float * edge = &tmp[n*n*(in_channels > out_channels ? in_channels : out_channels)];
+
+    for (size_t t0=0; t0 < ntiles; t0 += block) {
+        const size_t rows = ntiles - t0 < block ? ntiles - t0 : block;
+
+        for (size_t t=0; t < rows; ++t) {
+            const size_t y0 = ((t0 + t)/tile_cols)*m;
+            const size_t x0 = ((t0 + t)%tile_cols)*m;
+            // the tile starts at y0 - pad[0], x0 - pad[2] in the input
+            const float * d = edge;
+            size_t ds = n*in_channels;
+            if (y0 >= pad[0] && x0 >= pad[2] && y0 + n <= in_rows + pad[0] &&
+                    x0 + n <= in_cols + pad[2]) {
+                d = &input->array[((y0 - pad[0])*in_cols + x0 - pad[2])*in_channels];
+                ds = in_cols*in_channels;
+            }
+            else {
+                // parts of tiles in the padding or past the edge of the input are zeros
+                for (size_t i=0; i < n; ++i) {
+                    for (size_t j=0; j < n; ++j) {
+                        float * e = &edge[(i*n+j)*in_channels];
+                        if (y0 + i >= pad[0] && y0 + i < in_rows + pad[0] &&
+                                x0 + j >= pad[2] && x0 + j < in_cols + pad[2]) {
+                            memcpy(e, &input->array[((y0 + i - pad[0])*in_cols + x0 + j - pad[2])
+                                                    *in_channels], in_channels*sizeof(e[0]));
+                        }
+                        else {
+                            memset(e, 0, in_channels*sizeof(e[0]));
+                        }
+                    }
+                }
+            }
+            // along columns then rows, each point of the tile goes to its own matrix
+            for (size_t j=0; j < n; ++j) {
+                if (m == 2) {
+                    k2c_winograd2_BT(&tmp[j*in_channels], n*in_channels, &d[j*in_channels],
+                                     ds, in_channels);
+                }
+                else {
+                    k2c_winograd4_BT(&tmp[j*in_channels], n*in_channels, &d[j*in_channels],
+                                     ds, in_channels);
+                }
+            }
+            for (size_t i=0; i < n; ++i) {
+                float * v = &V[(i*n*rows + t)*in_channels];
+                if (m == 2) {
+                    k2c_winograd2_BT(v, rows*in_channels, &tmp[i*n*in_channels], in_channels,
+                                     in_channels);
+                }
+                else {
+                    k2c_winograd4_BT(v, rows*in_channels, &tmp[i*n*in_channels], in_channels,
+                                     in_channels);
+                }
+            }
+        }
+
+        for (size_t p=0; p < n*n; ++p) {
+            k2c_matmul(&M[p*rows*out_channels], &V[p*rows*in_channels],
+                       &kernel->array[p*in_channels*out_channels], rows,
+                       out_channels, in_channels);
+        }
+
+        for (size_t t=0; t < rows; ++t) {
+            const size_t y0 = ((t0 + t)/tile_cols)*m;
+            const size_t x0 = ((t0 + t)%tile_cols)*m;
+            const int inside = y0 + m <= out_rows && x0 + m <= out_cols;
+            float * y = inside ? &output->array[(y0*out_cols + x0)*out_channels] : edge;
+            const size_t ys = inside ? out_cols*out_channels : m*out_channels;
+            for (size_t j=0; j < n; ++j) {
+                const float * mj = &M[(j*rows + t)*out_channels];
+                if (m == 2) {
+                    k2c_winograd2_AT(&tmp[j*out_channels], n*out_channels, mj,
+                                     n*rows*out_channels, NULL, out_channels);
+                }
+                else {
+                    k2c_winograd4_AT(&tmp[j*out_channels], n*out_channels, mj,
+                                     n*rows*out_channels, NULL, out_channels);
+                }
+            }
+            for (size_t i=0; i < m; ++i) {
+                if (m == 2) {
+                    k2c_winograd2_AT(&y[i*ys], out_channels, &tmp[i*n*out_channels],
+                                     out_channels, bias->array, out_channels);
+                }
+                else {
+                    k2c_winograd4_AT(&y[i*ys], out_channels, &tmp[i*n*out_channels],
+                                     out_channels, bias->array, out_channels);
+                }
+            }
+            if (!inside) {
+                for (size_t i=0; i < m && y0 + i < out_rows; ++i) {
+                    for (size_t j=0; j < m && x0 + j < out_cols; ++j) {
+                        memcpy(&output->array[((y0+i)*out_cols + x0+j)*out_channels],
+                               &edge[(i*m+j)*out_channels], out_channels*sizeof(edge[0]));
+                    }
+                }
+            }
+        }
+    }
+    activation(output->array,output->numel);
+}
 
-    memset(output->array,0,output->numel*sizeof(output->array[0]));
+
+/**
+ * int8 quantized 1D (temporal) Convolution.
+ * Assumes a "channels last" structure, and pads the input implicitly. Input is quantized with a fixed scale,
+ * products are accumulated in int32 and converted back to float before adding the bias.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: quantized kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: stride length of the convolution.
+ * :param dilation: dilation rate to use for dilated convolution.
+ * :param pad: array[2] of padding of the input with zeros. Order is {before dim 1, after dim 1}.
+ * :param input_scale: quantization step of the input.
+ * :param activation: activation function to apply to output.
+ * :param qwork: array of working space, size(qwork) = size(input).
+ * :param acc: array of working space, size(acc) = number of output channels.
+ */
+void k2c_conv1d_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                   const k2c_tensor* bias, const size_t stride, const size_t dilation,
+                   const size_t pad[], const float input_scale,
+                   k2c_activationType *activation, int8_t qwork[], int32_t acc[]) {
+
+    const size_t out_times = output->shape[0];
+    const size_t out_channels = output->shape[1];
+    const size_t in_times = input->shape[0];
+    const size_t in_channels = input->shape[1];
+
+    k2c_quantize(qwork, input->array, input->numel, input_scale);
+    for (size_t x0=0; x0 < out_times; ++x0) {
+        memset(acc, 0, out_channels*sizeof(acc[0]));
+        size_t first, last;
+        k2c_window(&first, &last, x0, stride, dilation, pad[0], in_times, kernel->shape[0]);
+        for (size_t z=first; z < last; ++z) {
+            const int8_t * x = &qwork[(x0*stride + dilation*z - pad[0])*in_channels];
+            const int8_t * w = &kernel->array[z*in_channels*out_channels];
+            for (size_t q=0; q < in_channels; ++q) {
+                for (size_t k=0; k < out_channels; ++k) {
+                    acc[k] += (int32_t)x[q]*w[q*out_channels + k];
+                }
+            }
+        }
+        k2c_requantize(&output->array[x0*out_channels], acc, kernel->scale,
+                       input_scale, bias->array, out_channels);
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * int8 quantized 2D (spatial) Convolution.
+ * Assumes a "channels last" structure, and pads the input implicitly. Input is quantized with a fixed scale,
+ * products are accumulated in int32 and converted back to float before adding the bias.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: quantized kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: array[2] of stride length of the convolution. Order is {stride dim 1, stride dim 2}.
+ * :param dilation: array[2] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2}.
+ * :param pad: array[4] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
+ * :param input_scale: quantization step of the input.
+ * :param activation: activation function to apply to output.
+ * :param qwork: array of working space, size(qwork) = size(input).
+ * :param acc: array of working space, size(acc) = number of output channels.
+ */
+void k2c_conv2d_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                   const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                   const size_t pad[], const float input_scale,
+                   k2c_activationType *activation, int8_t qwork[], int32_t acc[]) {
 
     const size_t out_rows = output->shape[0];
     const size_t out_cols = output->shape[1];
     const size_t out_channels = output->shape[2];
+    const size_t in_rows = input->shape[0];
+    const size_t in_cols = input->shape[1];
     const size_t in_channels = input->shape[2];
 
+    k2c_quantize(qwork, input->array, input->numel, input_scale);
     for (size_t x0=0; x0 < out_rows; ++x0) {
         for (size_t x1=0; x1 < out_cols; ++x1) {
-            for (size_t z0=0; z0 < kernel->shape[0]; ++z0) {
-                for (size_t z1=0; z1 < kernel->shape[1]; ++z1) {
+            memset(acc, 0, out_channels*sizeof(acc[0]));
+            size_t first0, last0, first1, last1;
+            k2c_window(&first0, &last0, x0, stride[0], dilation[0], pad[0], in_rows,
+                       kernel->shape[0]);
+            k2c_window(&first1, &last1, x1, stride[1], dilation[1], pad[2], in_cols,
+                       kernel->shape[1]);
+            for (size_t z0=first0; z0 < last0; ++z0) {
+                for (size_t z1=first1; z1 < last1; ++z1) {
+                    const int8_t * x = &qwork[((x0*stride[0] + dilation[0]*z0 - pad[0])*in_cols
+                                               + x1*stride[1] + dilation[1]*z1 - pad[2])*in_channels];
+                    const int8_t * w = &kernel->array[(z0*kernel->shape[1] + z1)
+                                                      *in_channels*out_channels];
                     for (size_t q=0; q < in_channels; ++q) {
                         for (size_t k=0; k < out_channels; ++k) {
-                            output->array[x0*(output->shape[2]*output->shape[1])
-                                          + x1*(output->shape[2]) + k] +=
-                                              kernel->array[z0*(kernel->shape[3]*kernel->shape[2]*kernel->shape[1])
-                                                            + z1*(kernel->shape[3]*kernel->shape[2])
-                                                            + q*(kernel->shape[3]) + k]*
-                                              input->array[(x0*stride[0]
-                                                            + dilation[0]*z0)*(input->shape[2]*input->shape[1])
-                                                           + (x1*stride[1] + dilation[1]*z1)*(input->shape[2]) + q];
+                            acc[k] += (int32_t)x[q]*w[q*out_channels + k];
                         }
                     }
                 }
             }
+            k2c_requantize(&output->array[(x0*out_cols + x1)*out_channels], acc,
+                           kernel->scale, input_scale, bias->array, out_channels);
         }
     }
-    k2c_bias_add(output,bias);
     activation(output->array,output->numel);
 }
 
 
 /**
- * 3D (spatial or spatio-temporal) Convolution.
- * Assumes a "channels last" structure.
+ * int8 quantized 3D (spatial or spatio-temporal) Convolution.
+ * Assumes a "channels last" structure, and pads the input implicitly. Input is quantized with a fixed scale,
+ * products are accumulated in int32 and converted back to float before adding the bias.
  *
  * :param output: output tensor.
  * :param input: input tensor.
- * :param kernel: kernel tensor.
+ * :param kernel: quantized kernel tensor.
  * :param bias: bias tensor.
  * :param stride: array[3] of stride length of the convolution. Order is {stride dim 1, stride dim 2, stride dim 3}.
  * :param dilation: array[3] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2, dilation dim 3}.
+ * :param pad: array[6] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2, before dim 3, after dim 3}.
+ * :param input_scale: quantization step of the input.
  * :param activation: activation function to apply to output.
+ * :param qwork: array of working space, size(qwork) = size(input).
+ * :param acc: array of working space, size(acc) = number of output channels.
  */
-void k2c_conv3d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
-                const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
-                k2c_activationType *activation) {
+void k2c_conv3d_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                   const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                   const size_t pad[], const float input_scale,
+                   k2c_activationType *activation, int8_t qwork[], int32_t acc[]) {
 
-    memset(output->array,0,output->numel*sizeof(output->array[0]));
     const size_t dim1 = output->shape[0];
     const size_t dim2 = output->shape[1];
     const size_t dim3 = output->shape[2];
     const size_t out_channels = output->shape[3];
+    const size_t in_dim1 = input->shape[0];
+    const size_t in_dim2 = input->shape[1];
+    const size_t in_dim3 = input->shape[2];
     const size_t in_channels = input->shape[3];
 
+    k2c_quantize(qwork, input->array, input->numel, input_scale);
     for (size_t x0=0; x0 < dim1; ++x0) {
         for (size_t x1=0; x1 < dim2; ++x1) {
-            for (size_t x2=0; x2<dim3; ++x2) {
-                for (size_t z0=0; z0 < kernel->shape[0]; ++z0) {
-                    for (size_t z1=0; z1 < kernel->shape[1]; ++z1) {
-                        for (size_t z2=0; z2 < kernel->shape[2]; ++z2) {
+            for (size_t x2=0; x2 < dim3; ++x2) {
+                memset(acc, 0, out_channels*sizeof(acc[0]));
+                size_t first0, last0, first1, last1, first2, last2;
+                k2c_window(&first0, &last0, x0, stride[0], dilation[0], pad[0], in_dim1,
+                           kernel->shape[0]);
+                k2c_window(&first1, &last1, x1, stride[1], dilation[1], pad[2], in_dim2,
+                           kernel->shape[1]);
+                k2c_window(&first2, &last2, x2, stride[2], dilation[2], pad[4], in_dim3,
+                           kernel->shape[2]);
+                for (size_t z0=first0; z0 < last0; ++z0) {
+                    for (size_t z1=first1; z1 < last1; ++z1) {
+                        for (size_t z2=first2; z2 < last2; ++z2) {
+                            const int8_t * x = &qwork[(((x0*stride[0] + dilation[0]*z0 - pad[0])*in_dim2
+                                                        + x1*stride[1] + dilation[1]*z1 - pad[2])*in_dim3
+                                                       + x2*stride[2] + dilation[2]*z2 - pad[4])*in_channels];
+                            const int8_t * w = &kernel->array[((z0*kernel->shape[1] + z1)
+                                                               *kernel->shape[2] + z2)
+                                                              *in_channels*out_channels];
                             for (size_t q=0; q < in_channels; ++q) {
                                 for (size_t k=0; k < out_channels; ++k) {
-                                    output->array[x0*(output->shape[3]*output->shape[2]
-                                                      *output->shape[1])
-                                                  + x1*(output->shape[3]*output->shape[2])
-                                                  + x2*(output->shape[3]) + k] +=
-                                                      kernel->array[z0*(kernel->shape[4]*kernel->shape[3]
-                                                                        *kernel->shape[2]*kernel->shape[1])
-                                                                    + z1*(kernel->shape[4]*kernel->shape[3]
-                                                                          *kernel->shape[2])
-                                                                    + z2*(kernel->shape[4]*kernel->shape[3])
-                                                                    + q*(kernel->shape[4]) + k]
-                                                      *input->array[(x0*stride[0] + dilation[0]*z0)
-                                                                    *(input->shape[3]*input->shape[2]*input->shape[1])
-                                                                    + (x1*stride[1] + dilation[1]*z1)
-                                                                    *(input->shape[3]*input->shape[2])
-                                                                    + (x2*stride[2] + dilation[2]*z2)
-                                                                    *(input->shape[3]) + q];
+                                    acc[k] += (int32_t)x[q]*w[q*out_channels + k];
                                 }
                             }
                         }
                     }
                 }
+                k2c_requantize(&output->array[((x0*dim2 + x1)*dim3 + x2)*out_channels],
+                               acc, kernel->scale, input_scale, bias->array, out_channels);
+            }
+        }
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * 1D (temporal) Convolution with a 16 bit floating point kernel.
+ * Assumes a "channels last" structure, and pads the input implicitly. The kernel is converted to float as it is used.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: 16 bit kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: stride length of the convolution.
+ * :param dilation: dilation rate to use for dilated convolution.
+ * :param pad: array[2] of padding of the input with zeros. Order is {before dim 1, after dim 1}.
+ * :param activation: activation function to apply to output.
+ */
+void k2c_conv1d_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                  const k2c_tensor* bias, const size_t stride, const size_t dilation,
+                  const size_t pad[], k2c_activationType *activation) {
+
+    const size_t out_times = output->shape[0];
+    const size_t out_channels = output->shape[1];
+    const size_t in_times = input->shape[0];
+    const size_t in_channels = input->shape[1];
+
+    for (size_t x0=0; x0 < out_times; ++x0) {
+        float * y = &output->array[x0*out_channels];
+        memcpy(y, bias->array, out_channels*sizeof(y[0]));
+        size_t first, last;
+        k2c_window(&first, &last, x0, stride, dilation, pad[0], in_times, kernel->shape[0]);
+        for (size_t z=first; z < last; ++z) {
+            const float * x = &input->array[(x0*stride + dilation*z - pad[0])*in_channels];
+            const uint16_t * w = &kernel->array[z*in_channels*out_channels];
+            for (size_t q=0; q < in_channels; ++q) {
+                k2c_axpy_h(y, x[q], &w[q*out_channels], out_channels, kernel->format);
+            }
+        }
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * 2D (spatial) Convolution with a 16 bit floating point kernel.
+ * Assumes a "channels last" structure, and pads the input implicitly. The kernel is converted to float as it is used.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: 16 bit kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: array[2] of stride length of the convolution. Order is {stride dim 1, stride dim 2}.
+ * :param dilation: array[2] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2}.
+ * :param pad: array[4] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
+ * :param activation: activation function to apply to output.
+ */
+void k2c_conv2d_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                  const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                  const size_t pad[], k2c_activationType *activation) {
+
+    const size_t out_rows = output->shape[0];
+    const size_t out_cols = output->shape[1];
+    const size_t out_channels = output->shape[2];
+    const size_t in_rows = input->shape[0];
+    const size_t in_cols = input->shape[1];
+    const size_t in_channels = input->shape[2];
+
+    for (size_t x0=0; x0 < out_rows; ++x0) {
+        for (size_t x1=0; x1 < out_cols; ++x1) {
+            float * y = &output->array[(x0*out_cols + x1)*out_channels];
+            memcpy(y, bias->array, out_channels*sizeof(y[0]));
+            size_t first0, last0, first1, last1;
+            k2c_window(&first0, &last0, x0, stride[0], dilation[0], pad[0], in_rows,
+                       kernel->shape[0]);
+            k2c_window(&first1, &last1, x1, stride[1], dilation[1], pad[2], in_cols,
+                       kernel->shape[1]);
+            for (size_t z0=first0; z0 < last0; ++z0) {
+                for (size_t z1=first1; z1 < last1; ++z1) {
+                    const float * x = &input->array[((x0*stride[0] + dilation[0]*z0 - pad[0])*in_cols
+                                                     + x1*stride[1] + dilation[1]*z1 - pad[2])*in_channels];
+                    const uint16_t * w = &kernel->array[(z0*kernel->shape[1] + z1)
+                                                        *in_channels*out_channels];
+                    for (size_t q=0; q < in_channels; ++q) {
+                        k2c_axpy_h(y, x[q], &w[q*out_channels], out_channels, kernel->format);
+                    }
+                }
+            }
+        }
+    }
+    activation(output->array,output->numel);
+}
+
+
+/**
+ * 3D (spatial or spatio-temporal) Convolution with a 16 bit floating point kernel.
+ * Assumes a "channels last" structure, and pads the input implicitly. The kernel is converted to float as it is used.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: 16 bit kernel tensor.
+ * :param bias: bias tensor.
+ * :param stride: array[3] of stride length of the convolution. Order is {stride dim 1, stride dim 2, stride dim 3}.
+ * :param dilation: array[3] dilation rate to use for dilated convolution. Order is {dilation dim 1, dilation dim 2, dilation dim 3}.
+ * :param pad: array[6] of padding of the input with zeros. Order is {before dim 1, after dim 1, before dim 2, after dim 2, before dim 3, after dim 3}.
+ * :param activation: activation function to apply to output.
+ */
+void k2c_conv3d_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                  const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                  const size_t pad[], k2c_activationType *activation) {
+
+    const size_t dim1 = output->shape[0];
+    const size_t dim2 = output->shape[1];
+    const size_t dim3 = output->shape[2];
+    const size_t out_channels = output->shape[3];
+    const size_t in_dim1 = input->shape[0];
+    const size_t in_dim2 = input->shape[1];
+    const size_t in_dim3 = input->shape[2];
+    const size_t in_channels = input->shape[3];
+
+    for (size_t x0=0; x0 < dim1; ++x0) {
+        for (size_t x1=0; x1 < dim2; ++x1) {
+            for (size_t x2=0; x2 < dim3; ++x2) {
+                float * y = &output->array[((x0*dim2 + x1)*dim3 + x2)*out_channels];
+                memcpy(y, bias->array, out_channels*sizeof(y[0]));
+                size_t first0, last0, first1, last1, first2, last2;
+                k2c_window(&first0, &last0, x0, stride[0], dilation[0], pad[0], in_dim1,
+                           kernel->shape[0]);
+                k2c_window(&first1, &last1, x1, stride[1], dilation[1], pad[2], in_dim2,
+                           kernel->shape[1]);
+                k2c_window(&first2, &last2, x2, stride[2], dilation[2], pad[4], in_dim3,
+                           kernel->shape[2]);
+                for (size_t z0=first0; z0 < last0; ++z0) {
+                    for (size_t z1=first1; z1 < last1; ++z1) {
+                        for (size_t z2=first2; z2 < last2; ++z2) {
+                            const float * x = &input->array[(((x0*stride[0] + dilation[0]*z0 - pad[0])*in_dim2
+                                                              + x1*stride[1] + dilation[1]*z1 - pad[2])*in_dim3
+                                                             + x2*stride[2] + dilation[2]*z2 - pad[4])*in_channels];
+                            const uint16_t * w = &kernel->array[((z0*kernel->shape[1] + z1)
+                                                                 *kernel->shape[2] + z2)
+                                                                *in_channels*out_channels];
+                            for (size_t q=0; q < in_channels; ++q) {
+                                k2c_axpy_h(y, x[q], &w[q*out_channels], out_channels,
+                                           kernel->format);
+                            }
+                        }
+                    }
+                }
             }
         }
     }
-    k2c_bias_add(output,bias);
     activation(output->array,output->numel);
 }
 
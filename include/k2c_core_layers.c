@@ -12,36 +12,116 @@
  * :param kernel: kernel tensor.
  * :param bias: bias tensor.
  * :param activation: activation function to apply to output.
- * :param fwork: array of working space, size(fwork) = size(input) + size(kernel)
+ * :param fwork: not used, may be NULL. Inputs of any rank are multiplied as a matrix of rows.
  */
 void k2c_dense(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                const k2c_tensor* bias, k2c_activationType *activation, float fwork[]) {
 
-    if (input->ndim <=2) {
-        size_t outrows;
-
-        if (input->ndim>1) {
-            outrows = input->shape[0];
-        }
-        else {
-            outrows = 1;
-        }
-        const size_t outcols = kernel->shape[1];
-        const size_t innerdim = kernel->shape[0];
-        const size_t outsize = outrows*outcols;
+    // the kernel acts on the last axis, so the input is a matrix of rows
+    const size_t outcols = kernel->shape[1];
+    const size_t innerdim = kernel->shape[0];
+    const size_t outrows = input->numel/innerdim;
+    (void) fwork;
+    if (kernel->layout == K2C_PACKED) {
+        k2c_affine_matmul_p(output->array,input->array,kernel->array,bias->array,
+                            outrows,outcols,innerdim);
+    }
+    else {
         k2c_affine_matmul(output->array,input->array,kernel->array,bias->array,
                           outrows,outcols,innerdim);
-        activation(output->array,outsize);
     }
-    else {
-        const size_t axesA[1] = {input->ndim-1};
-        const size_t axesB[1] = {0};
-        const size_t naxes = 1;
-        const int normalize = 0;
-
-        k2c_dot(output, input, kernel, axesA, axesB, naxes, normalize, fwork);
-        k2c_bias_add(output, bias);
-        activation(output->array, output->numel);
+    // activation acts on each row, so softmax is taken over the last axis
+    for (size_t i = 0; i < outrows; ++i) {
+        activation(&output->array[i*outcols],outcols);
+    }
+}
+
+
+/**
+ * int8 quantized Dense (fully connected) Layer.
+ * input is quantized with a fixed scale, products are accumulated in int32 and
+ * converted back to float before adding the bias.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: quantized kernel tensor.
+ * :param bias: bias tensor.
+ * :param input_scale: quantization step of the input.
+ * :param activation: activation function to apply to output.
+ * :param qwork: array of working space, size(qwork) = size(input).
+ * :param acc: array of working space, size(acc) = number of units.
+ */
+void k2c_dense_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                  const k2c_tensor* bias, const float input_scale,
+                  k2c_activationType *activation, int8_t qwork[], int32_t acc[]) {
+
+    const size_t outcols = kernel->shape[1];
+    const size_t innerdim = kernel->shape[0];
+    const size_t outrows = input->numel/innerdim;
+
+    k2c_quantize(qwork, input->array, input->numel, input_scale);
+    for (size_t i = 0; i < outrows; ++i) {
+        memset(acc, 0, outcols*sizeof(acc[0]));
+        for (size_t k = 0; k < innerdim; ++k) {
+            const int32_t a = qwork[i*innerdim + k];
+            const int8_t * w = &kernel->array[k*outcols];
+            for (size_t j = 0; j < outcols; ++j) {
+                acc[j] += a*w[j];
+            }
+        }
+        k2c_requantize(&output->array[i*outcols], acc, kernel->scale, input_scale,
+                       bias->array, outcols);
+        activation(&output->array[i*outcols], outcols);
+    }
+}
+
+
+/**
+ * Dense (fully connected) Layer with a 16 bit floating point kernel.
+ * The kernel is converted to float as it is used, all arithmetic is in float.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: 16 bit kernel tensor.
+ * :param bias: bias tensor.
+ * :param activation: activation function to apply to output.
+ */
+void k2c_dense_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                 const k2c_tensor* bias, k2c_activationType *activation) {
+
+    const size_t outcols = kernel->shape[1];
+    const size_t innerdim = kernel->shape[0];
+    const size_t outrows = input->numel/innerdim;
+
+    k2c_affine_matmul_h(output->array,input->array,kernel->array,kernel->format,
+                        bias->array,outrows,outcols,innerdim);
+    for (size_t i = 0; i < outrows; ++i) {
+        activation(&output->array[i*outcols],outcols);
+    }
+}
+
+
+/**
+ * Dense (fully connected) Layer with a sparse kernel.
+ * Only the nonzeros of the kernel are used.
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param kernel: sparse kernel tensor.
+ * :param bias: bias tensor.
+ * :param activation: activation function to apply to output.
+ */
+void k2c_dense_s(k2c_tensor* output, const k2c_tensor* input, const k2c_stensor* kernel,
+                 const k2c_tensor* bias, k2c_activationType *activation) {
+
+    const size_t outcols = kernel->shape[1];
+    const size_t innerdim = kernel->shape[0];
+    const size_t outrows = input->numel/innerdim;
+
+    k2c_affine_matmul_s(output->array,input->array,kernel->values,kernel->indices,
+                        kernel->indptr,bias->array,outrows,outcols,innerdim);
+    for (size_t i = 0; i < outrows; ++i) {
+        activation(&output->array[i*outcols],outcols);
     }
 }
 
@@ -1,10 +1,324 @@
+#if !defined(_WIN32) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 200809L
+#endif
 #include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <stdint.h>
+#ifndef _WIN32
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#endif
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 #include "k2c_include.h"
 
 
+/**
+ * Multiplies K2C_GEMM_MR rows of A by a packed block of B, in plain C.
+ * computes C[r] = init[r] + A[r]*Bp for each row r of a K2C_GEMM_MR x K2C_GEMM_NR tile.
+ * the whole tile is accumulated in local arrays that the compiler keeps in
+ * vector registers. This is the version used if the CPU has none of the
+ * instruction sets in k2c_simd.c.
+ *
+ * :param C: array[K2C_GEMM_MR] of pointers to the rows of the tile of the output.
+ * :param A: array[K2C_GEMM_MR] of pointers to the rows of the tile of input array 1.
+ * :param init: array[K2C_GEMM_MR] of pointers to the values to start each row from.
+ * :param Bp: block of input array 2, K2C_GEMM_NR cols wide.
+ * :param kb: number of cols of A and rows of Bp.
+ * :param ldb: stride between rows of Bp.
+ */
+void k2c_gemm_kernel_generic(float * const C[], const float * const A[],
+                             const float * const init[], const float Bp[],
+                             const size_t kb, const size_t ldb) {
+
+    const float * A0 = A[0];
+    const float * A1 = A[1];
+    const float * A2 = A[2];
+    const float * A3 = A[3];
+    float acc0[K2C_GEMM_NR];
+    float acc1[K2C_GEMM_NR];
+    float acc2[K2C_GEMM_NR];
+    float acc3[K2C_GEMM_NR];
+    for (size_t j = 0; j < K2C_GEMM_NR; ++j) {
+        acc0[j] = init[0][j];
+        acc1[j] = init[1][j];
+        acc2[j] = init[2][j];
+        acc3[j] = init[3][j];
+    }
+    for (size_t k = 0; k < kb; ++k) {
+        const float * Bk = &Bp[k*ldb];
+        const float a0 = A0[k];
+        const float a1 = A1[k];
+        const float a2 = A2[k];
+        const float a3 = A3[k];
+        for (size_t j = 0; j < K2C_GEMM_NR; ++j) {
+            acc0[j] += a0*Bk[j];
+            acc1[j] += a1*Bk[j];
+            acc2[j] += a2*Bk[j];
+            acc3[j] += a3*Bk[j];
+        }
+    }
+    float * C0 = C[0];
+    float * C1 = C[1];
+    float * C2 = C[2];
+    float * C3 = C[3];
+    for (size_t j = 0; j < K2C_GEMM_NR; ++j) {
+        C0[j] = acc0[j];
+        C1[j] = acc1[j];
+        C2[j] = acc2[j];
+        C3[j] = acc3[j];
+    }
+}
+
+
+/**
+ * Multiplies a tile of rows of A by a packed block of B.
+ * computes C = init + A*Bp for a tile of at most K2C_GEMM_MR x K2C_GEMM_NR.
+ * edge tiles are staged through a padded copy, so that k2c_gemm_kernel always
+ * works on a full tile. rows of the tile past mr repeat the first row of A,
+ * and columns past nr are zero in Bp. neither is stored.
+ *
+ * :param C: first element of the tile of the output array.
+ * :param A: first element of the tile of input array 1.
+ * :param Bp: block of input array 2, zero padded to K2C_GEMM_NR cols.
+ * :param init: values to start the tile from, row r at init[r*ldi]. NULL to start from zero.
+ * :param ldi: stride between rows of init, 0 to start every row from the same vector.
+ * :param mr: number of rows of the tile to store.
+ * :param nr: number of cols of the tile to store.
+ * :param kb: number of cols of A and rows of Bp.
+ * :param ldc: stride between rows of C.
+ * :param lda: stride between rows of A.
+ * :param ldb: stride between rows of Bp, at least K2C_GEMM_NR.
+ */
+static inline void k2c_gemm_tile(float C[], const float A[], const float Bp[],
+                                 const float init[], const size_t ldi, const size_t mr,
+                                 const size_t nr, const size_t kb, const size_t ldc,
+                                 const size_t lda, const size_t ldb) {
+
+    static const float zeros[K2C_GEMM_NR] = {0};
+    float edge[K2C_GEMM_MR][K2C_GEMM_NR];
+    const int full = nr == K2C_GEMM_NR && mr == K2C_GEMM_MR;
+    float * Cr[K2C_GEMM_MR];
+    const float * Ar[K2C_GEMM_MR];
+    const float * Ir[K2C_GEMM_MR];
+
+    if (init && !full) {
+        memset(edge, 0, sizeof(edge));
+        for (size_t r = 0; r < mr; ++r) {
+            memcpy(edge[r], &init[r*ldi], nr*sizeof(float));
+        }
+    }
+    for (size_t r = 0; r < K2C_GEMM_MR; ++r) {
+        Ar[r] = r < mr ? &A[r*lda] : A;
+        Cr[r] = full ? &C[r*ldc] : edge[r];
+        if (!init) {
+            Ir[r] = zeros;
+        }
+        else {
+            Ir[r] = full ? &init[r*ldi] : edge[r];
+        }
+    }
+    k2c_gemm_kernel(Cr, Ar, Ir, Bp, kb, ldb);
+    if (!full) {
+        for (size_t r = 0; r < mr; ++r) {
+            memcpy(&C[r*ldc], edge[r], nr*sizeof(float));
+        }
+    }
+}
+
+
+/**
+ * Multiplies a row vector by a block of columns of B, in plain C.
+ * computes y = init + x*B[:,0:nc], with y accumulated in a local array.
+ *
+ * :param y: array[nc] output.
+ * :param x: array[innerdim] input vector.
+ * :param B: first column of the block of input array 2.
+ * :param init: array[nc] to start y from, NULL to start from zero.
+ * :param nc: number of cols in the block, at most K2C_GEMM_NC.
+ * :param innerdim: length of x and number of rows of B.
+ * :param ldb: stride between rows of B.
+ */
+static inline void k2c_gemv_block(float y[], const float x[], const float B[],
+                                  const float init[], const size_t nc,
+                                  const size_t innerdim, const size_t ldb) {
+
+    float acc[K2C_GEMM_NC];
+    for (size_t j = 0; j < nc; ++j) {
+        acc[j] = init ? init[j] : 0.0f;
+    }
+    for (size_t k = 0; k < innerdim; ++k) {
+        const float * Bk = &B[k*ldb];
+        const float a = x[k];
+        for (size_t j = 0; j < nc; ++j) {
+            acc[j] += a*Bk[j];
+        }
+    }
+    for (size_t j = 0; j < nc; ++j) {
+        y[j] = acc[j];
+    }
+}
+
+
+/**
+ * Multiplies a row vector by a block of columns of B, in plain C.
+ * This is the version of k2c_gemv_kernel used if the CPU has none of the
+ * instruction sets in k2c_simd.c.
+ *
+ * :param y: array[nc] output.
+ * :param x: array[innerdim] input vector.
+ * :param B: first column of the block of input array 2.
+ * :param init: array[nc] to start y from, NULL to start from zero.
+ * :param nc: number of cols in the block, at most K2C_GEMM_NC.
+ * :param innerdim: length of x and number of rows of B.
+ * :param ldb: stride between rows of B.
+ */
+void k2c_gemv_kernel_generic(float y[], const float x[], const float B[],
+                             const float init[], const size_t nc,
+                             const size_t innerdim, const size_t ldb) {
+
+    // full blocks are written with a constant size so they get unrolled
+    if (nc == K2C_GEMM_NC) {
+        k2c_gemv_block(y, x, B, init, K2C_GEMM_NC, innerdim, ldb);
+    }
+    else {
+        k2c_gemv_block(y, x, B, init, nc, innerdim, ldb);
+    }
+}
+
+
+/**
+ * Cache blocked matrix multiplication.
+ * computes C = A*B + d, or C = A*B if d is NULL.
+ * B is copied one K2C_GEMM_KC x K2C_GEMM_NC block at a time into a packed
+ * buffer on the stack that stays in cache while up to K2C_GEMM_MC rows of A
+ * are multiplied by it, K2C_GEMM_MR rows at a time. Products with fewer than
+ * K2C_GEMM_MR rows are not worth packing for, and stream through B directly.
+ * If B was packed when the model was converted, its panels are used in place.
+ * When built with OpenMP, large products split the blocks of C between threads.
+ *
+ * :param C: output array.
+ * :param A: input array 1.
+ * :param B: input array 2.
+ * :param d: input array 3, or NULL.
+ * :param outrows: number of rows of C and A.
+ * :param outcols: number of cols of C and B.
+ * :param innerdim: number of cols of A and rows of B
+ * :param packed: whether B is stored in panels of K2C_GEMM_NC cols (1) or row major (0).
+ */
+static void k2c_gemm(float C[], const float A[], const float B[], const float d[],
+                     const size_t outrows, const size_t outcols, const size_t innerdim,
+                     const int packed) {
+
+    // start of the block of B at col jc, and the stride between its rows
+    const size_t ldb = packed ? K2C_GEMM_NC : outcols;
+    const size_t blockstep = packed ? innerdim : 1;
+
+    const size_t work = outrows*outcols*innerdim;
+
+    if (outrows < K2C_GEMM_MR) {
+        #pragma omp parallel for if (work >= K2C_PARALLEL_MIN_WORK)
+        for (size_t jc = 0; jc < outcols; jc += K2C_GEMM_NC) {
+            const size_t nc = outcols - jc < K2C_GEMM_NC ? outcols - jc : K2C_GEMM_NC;
+            for (size_t i = 0; i < outrows; ++i) {
+                k2c_gemv_kernel(&C[i*outcols+jc], &A[i*innerdim], &B[jc*blockstep],
+                                d ? &d[jc] : NULL, nc, innerdim, ldb);
+            }
+        }
+        return;
+    }
+    if (innerdim == 0) {
+        for (size_t i = 0; i < outrows; ++i) {
+            for (size_t j = 0; j < outcols; ++j) {
+                C[i*outcols+j] = d ? d[j] : 0.0f;
+            }
+        }
+        return;
+    }
+
+    // each block of rows and cols of C is done by one thread, with its own
+    // packed copy of B
+    #pragma omp parallel for collapse(2) if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t jc = 0; jc < outcols; jc += K2C_GEMM_NC) {
+        for (size_t ic = 0; ic < outrows; ic += K2C_GEMM_MC) {
+            const size_t nc = outcols - jc < K2C_GEMM_NC ? outcols - jc : K2C_GEMM_NC;
+            const size_t mc = outrows - ic < K2C_GEMM_MC ? outrows - ic : K2C_GEMM_MC;
+            float Bp[K2C_GEMM_KC*K2C_GEMM_NC];
+            for (size_t kc = 0; kc < innerdim; kc += K2C_GEMM_KC) {
+                const size_t kb = innerdim - kc < K2C_GEMM_KC ? innerdim - kc : K2C_GEMM_KC;
+
+                // pack B into panels of K2C_GEMM_NR cols, padded with zeros
+                for (size_t jr = 0; jr < nc && !packed; jr += K2C_GEMM_NR) {
+                    const size_t nr = nc - jr < K2C_GEMM_NR ? nc - jr : K2C_GEMM_NR;
+                    float * panel = &Bp[jr*kb];
+                    const float * Bj = &B[kc*outcols+jc+jr];
+                    if (nr == K2C_GEMM_NR) {
+                        for (size_t k = 0; k < kb; ++k) {
+                            memcpy(&panel[k*K2C_GEMM_NR], &Bj[k*outcols],
+                                   K2C_GEMM_NR*sizeof(float));
+                        }
+                    }
+                    else {
+                        memset(panel, 0, kb*K2C_GEMM_NR*sizeof(float));
+                        for (size_t k = 0; k < kb; ++k) {
+                            memcpy(&panel[k*K2C_GEMM_NR], &Bj[k*outcols], nr*sizeof(float));
+                        }
+                    }
+                }
+
+                for (size_t i = ic; i < ic + mc; i += K2C_GEMM_MR) {
+                    const size_t mr = ic + mc - i < K2C_GEMM_MR ? ic + mc - i : K2C_GEMM_MR;
+                    for (size_t jr = 0; jr < nc; jr += K2C_GEMM_NR) {
+                        const size_t nr = nc - jr < K2C_GEMM_NR ? nc - jr : K2C_GEMM_NR;
+                        float * Ct = &C[i*outcols+jc+jr];
+                        // the first block starts from the bias, later ones from C
+                        const float * init = Ct;
+                        size_t ldi = outcols;
+                        if (kc == 0) {
+                            init = d ? &d[jc+jr] : NULL;
+                            ldi = 0;
+                        }
+                        if (packed) {
+                            k2c_gemm_tile(Ct, &A[i*innerdim+kc],
+                                          &B[jc*innerdim+kc*K2C_GEMM_NC+jr], init, ldi,
+                                          mr, nr, kb, outcols, innerdim, K2C_GEMM_NC);
+                        }
+                        else {
+                            k2c_gemm_tile(Ct, &A[i*innerdim+kc], &Bp[jr*kb], init, ldi,
+                                          mr, nr, kb, outcols, innerdim, K2C_GEMM_NR);
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+/**
+ * Sets the number of threads used by large layers.
+ * only has an effect if the library is built with OpenMP. Otherwise the
+ * OMP_NUM_THREADS environment variable, or the number of cores, is used.
+ *
+ * :param num_threads: number of threads, or 0 to leave it unchanged.
+ */
+void k2c_set_num_threads(const int num_threads) {
+
+#ifdef _OPENMP
+    if (num_threads > 0) {
+        omp_set_num_threads(num_threads);
+    }
+#else
+    (void) num_threads;
+#endif
+}
+
+
 /**
  * Just your basic 1d matrix multipication.
  * computes C = A*B
@@ -20,18 +334,7 @@
 void k2c_matmul(float C[], const float A[], const float B[], const size_t outrows,
                 const size_t outcols, const size_t innerdim) {
 
-    // make sure output is empty
-    memset(C, 0, outrows*outcols*sizeof(C[0]));
-
-    for (size_t i = 0 ; i < outrows; ++i) {
-        const size_t outrowidx = i*outcols;
-        const size_t inneridx = i*innerdim;
-        for (size_t k = 0; k < innerdim; ++k) {
-            for (size_t j = 0;  j < outcols; ++j) {
-                C[outrowidx+j] += A[inneridx+k] * B[k*outcols+j];
-            }
-        }
-    }
+    k2c_gemm(C, A, B, NULL, outrows, outcols, innerdim, 0);
 }
 
 
@@ -44,7 +347,7 @@ void k2c_matmul(float C[], const float A[], const float B[], const size_t outrow
  * :param C: output array.
  * :param A: input array 1.
  * :param B: input array 2.
- * :param d: input array 3.
+ * :param d: input array 3, or NULL.
  * :param outrows: number of rows of C, A and d.
  * :param outcols: number of cols of C and B.
  * :param innderdim: number of cols of A and rows of B
@@ -52,18 +355,92 @@ void k2c_matmul(float C[], const float A[], const float B[], const size_t outrow
 void k2c_affine_matmul(float C[], const float A[], const float B[], const float d[],
                        const size_t outrows,const size_t outcols, const size_t innerdim) {
 
-    // make sure output is empty
-    memset(C, 0, outrows*outcols*sizeof(C[0]));
+    k2c_gemm(C, A, B, d, outrows, outcols, innerdim, 0);
+}
+
 
-    for (size_t i = 0 ; i < outrows; ++i) {
-        const size_t outrowidx = i*outcols;
-        const size_t inneridx = i*innerdim;
-        for (size_t j = 0;  j < outcols; ++j) {
-            for (size_t k = 0; k < innerdim; ++k) {
-                C[outrowidx+j] += A[inneridx+k] * B[k*outcols+j];
-            }
-            C[outrowidx+j] += d[j];
-        }
+/**
+ * Matrix vector multiplication, accumulated into the output.
+ * computes y = y + x*B, where B is stored in row major order.
+ *
+ * :param y: array[outcols] output.
+ * :param x: array[innerdim] input vector.
+ * :param B: input matrix.
+ * :param outcols: length of y and number of cols of B.
+ * :param innerdim: length of x and number of rows of B.
+ */
+void k2c_gemv(float y[], const float x[], const float B[], const size_t outcols,
+              const size_t innerdim) {
+
+    for (size_t jc = 0; jc < outcols; jc += K2C_GEMM_NC) {
+        const size_t nc = outcols - jc < K2C_GEMM_NC ? outcols - jc : K2C_GEMM_NC;
+        k2c_gemv_kernel(&y[jc], x, &B[jc], &y[jc], nc, innerdim, outcols);
+    }
+}
+
+
+/**
+ * Affine matrix multiplication with a packed matrix.
+ * computes C = A*B + d, or C = A*B if d is NULL, where B was packed when
+ * the model was converted into panels of K2C_GEMM_NC cols. each panel holds
+ * all innerdim rows of its cols contiguously, and the last one is padded
+ * with zeros, so every load from B is unit stride.
+ *
+ * :param C: output array.
+ * :param A: input array 1.
+ * :param Bp: input array 2, of size k2c_packed_size(innerdim,outcols).
+ * :param d: input array 3, or NULL.
+ * :param outrows: number of rows of C, A and d.
+ * :param outcols: number of cols of C and B.
+ * :param innderdim: number of cols of A and rows of B
+ */
+void k2c_affine_matmul_p(float C[], const float A[], const float Bp[], const float d[],
+                         const size_t outrows, const size_t outcols, const size_t innerdim) {
+
+    k2c_gemm(C, A, Bp, d, outrows, outcols, innerdim, 1);
+}
+
+
+/**
+ * Size of a matrix packed for k2c_affine_matmul_p.
+ *
+ * :param rows: number of rows of the matrix.
+ * :param cols: number of cols of the matrix.
+ * :return: number of elements in the packed matrix.
+ */
+size_t k2c_packed_size(const size_t rows, const size_t cols) {
+
+    return rows*((cols + K2C_GEMM_NC - 1)/K2C_GEMM_NC)*K2C_GEMM_NC;
+}
+
+
+/**
+ * Finds the part of a kernel or pooling window that lies inside the input, along one dimension.
+ * The input is padded implicitly: the window of output position x starts at x*stride - pad,
+ * and positions of the window outside the input are left out.
+ *
+ * :param first: first position of the window inside the input.
+ * :param last: one past the last position of the window inside the input. Equal to first if the window is entirely outside it.
+ * :param x: output position.
+ * :param stride: stride of the window.
+ * :param dilation: spacing between positions of the window.
+ * :param pad: amount of padding before the input.
+ * :param in_size: size of the input.
+ * :param size: number of positions in the window.
+ */
+void k2c_window(size_t* first, size_t* last, const size_t x, const size_t stride,
+                const size_t dilation, const size_t pad, const size_t in_size,
+                const size_t size) {
+
+    const size_t start = x*stride;
+    const size_t end = pad + in_size;
+    *first = start < pad ? (pad - start + dilation - 1)/dilation : 0;
+    *last = start < end ? (end - start + dilation - 1)/dilation : 0;
+    if (*last > size) {
+        *last = size;
+    }
+    if (*first > *last) {
+        *first = *last;
     }
 }
 
@@ -270,6 +647,181 @@ void k2c_bias_add(k2c_tensor* A, const k2c_tensor* b) {
 }
 
 
+/**
+ * Quantizes an array to int8.
+ * values are divided by scale and rounded to the nearest integer, saturating at +/-127.
+ *
+ * :param q: array[size] of quantized values. Overwritten with outputs.
+ * :param x: array[size] of values to quantize.
+ * :param size: number of values.
+ * :param scale: quantization step.
+ */
+void k2c_quantize(int8_t q[], const float x[], const size_t size, const float scale) {
+
+    const float inv_scale = 1.0f/scale;
+    for (size_t i=0; i<size; ++i) {
+        float y = x[i]*inv_scale;
+        if (y > 127.0f) {
+            y = 127.0f;
+        }
+        else if (y < -127.0f) {
+            y = -127.0f;
+        }
+        q[i] = (int8_t) lrintf(y);
+    }
+}
+
+
+/**
+ * Converts int32 accumulators of a quantized product back to float and adds bias.
+ * y[i] = acc[i]*input_scale*scale[i] + bias[i]
+ *
+ * :param y: array[size] of outputs. Overwritten with outputs.
+ * :param acc: array[size] of accumulated products of quantized values.
+ * :param scale: array[size] of weight scales.
+ * :param input_scale: scale of the quantized input.
+ * :param bias: array[size] of biases.
+ * :param size: number of values.
+ */
+void k2c_requantize(float y[], const int32_t acc[], const float scale[],
+                    const float input_scale, const float bias[], const size_t size) {
+
+    for (size_t i=0; i<size; ++i) {
+        y[i] = (float)acc[i]*(input_scale*scale[i]) + bias[i];
+    }
+}
+
+
+/**
+ * Converts 16 bit floating point values to float.
+ *
+ * :param y: array[size] of float values. Overwritten with outputs.
+ * :param x: array[size] of 16 bit values.
+ * :param size: number of values.
+ * :param format: format of the 16 bit values.
+ */
+void k2c_widen(float y[], const uint16_t x[], const size_t size,
+               const k2c_half_format format) {
+
+    if (format == K2C_BFLOAT16) {
+        for (size_t i=0; i<size; ++i) {
+            const uint32_t u = (uint32_t)x[i] << 16;
+            memcpy(&y[i], &u, sizeof(u));
+        }
+    }
+    else {
+        for (size_t i=0; i<size; ++i) {
+            const uint32_t sign = (uint32_t)(x[i] & 0x8000) << 16;
+            const uint32_t exponent = (x[i] >> 10) & 0x1f;
+            const uint32_t mantissa = x[i] & 0x3ff;
+            uint32_t u;
+            if (exponent == 0) {
+                // zero or subnormal, mantissa*2^-24
+                const float f = (float)mantissa*5.9604645e-8f;
+                memcpy(&u, &f, sizeof(u));
+                u |= sign;
+            }
+            else if (exponent == 0x1f) {
+                // inf or nan
+                u = sign | 0x7f800000 | (mantissa << 13);
+            }
+            else {
+                u = sign | ((exponent + 112) << 23) | (mantissa << 13);
+            }
+            memcpy(&y[i], &u, sizeof(u));
+        }
+    }
+}
+
+
+/**
+ * Adds a scalar multiple of a 16 bit floating point array to a float array.
+ * y += a*x, with x converted to float K2C_WIDEN_BLOCK values at a time.
+ *
+ * :param y: array[size]. Overwritten with outputs.
+ * :param a: scalar.
+ * :param x: array[size] of 16 bit values.
+ * :param size: number of values.
+ * :param format: format of the 16 bit values.
+ */
+void k2c_axpy_h(float y[], const float a, const uint16_t x[], const size_t size,
+                const k2c_half_format format) {
+
+    float w[K2C_WIDEN_BLOCK];
+    for (size_t j0=0; j0<size; j0 += K2C_WIDEN_BLOCK) {
+        const size_t n = size - j0 < K2C_WIDEN_BLOCK ? size - j0 : K2C_WIDEN_BLOCK;
+        k2c_widen(w, &x[j0], n, format);
+        for (size_t j=0; j<n; ++j) {
+            y[j0+j] += a*w[j];
+        }
+    }
+}
+
+
+/**
+ * Affine matrix multiplication with a 16 bit floating point matrix.
+ * computes C = A*B + d, or C = A*B if d is NULL, where d is a vector that is added to each
+ * row of A*B. B is converted to float as it is used, and all arithmetic is in float.
+ *
+ * :param C: output array.
+ * :param A: input array 1.
+ * :param B: input array 2, of 16 bit values.
+ * :param format: format of the values of B.
+ * :param d: input array 3, or NULL.
+ * :param outrows: number of rows of C and A.
+ * :param outcols: number of cols of C, B and d.
+ * :param innerdim: number of cols of A and rows of B
+ */
+void k2c_affine_matmul_h(float C[], const float A[], const uint16_t B[],
+                         const k2c_half_format format, const float d[],
+                         const size_t outrows, const size_t outcols, const size_t innerdim) {
+
+    for (size_t i = 0; i < outrows; ++i) {
+        float * Ci = &C[i*outcols];
+        for (size_t j = 0; j < outcols; ++j) {
+            Ci[j] = d ? d[j] : 0.0f;
+        }
+        for (size_t k = 0; k < innerdim; ++k) {
+            k2c_axpy_h(Ci, A[i*innerdim+k], &B[k*outcols], outcols, format);
+        }
+    }
+}
+
+
+/**
+ * Affine matrix multiplication with a sparse matrix.
+ * computes C = A*B + d, or C = A*B if d is NULL, where d is a vector that is added to each
+ * row of A*B, and B is in compressed sparse row format, so only nonzeros of B are used.
+ *
+ * :param C: output array.
+ * :param A: input array 1.
+ * :param values: nonzero values of input array 2.
+ * :param indices: column index of each nonzero of input array 2.
+ * :param indptr: array[innerdim+1] of offsets of the start of each row of input array 2 in values.
+ * :param d: input array 3, or NULL.
+ * :param outrows: number of rows of C and A.
+ * :param outcols: number of cols of C, B and d.
+ * :param innerdim: number of cols of A and rows of B
+ */
+void k2c_affine_matmul_s(float C[], const float A[], const float values[],
+                         const uint32_t indices[], const uint32_t indptr[], const float d[],
+                         const size_t outrows, const size_t outcols, const size_t innerdim) {
+
+    for (size_t i = 0; i < outrows; ++i) {
+        float * Ci = &C[i*outcols];
+        for (size_t j = 0; j < outcols; ++j) {
+            Ci[j] = d ? d[j] : 0.0f;
+        }
+        for (size_t k = 0; k < innerdim; ++k) {
+            const float a = A[i*innerdim+k];
+            for (size_t p = indptr[k]; p < indptr[k+1]; ++p) {
+                Ci[indices[p]] += a*values[p];
+            }
+        }
+    }
+}
+
+
 /**
  * Flips a tensor along specified axis.
  * overwrites input with flipped output.
@@ -336,3 +888,160 @@ float* k2c_read_array(const char* filename, const size_t array_size) {
     fclose(finp);
     return ptr;
 }
+
+
+/**
+ * Reads a little endian unsigned integer from a weight file header.
+ *
+ * :param bytes: pointer to first byte of the integer.
+ * :param nbytes: size of the integer in bytes.
+ * :return: value of the integer.
+ */
+static uint64_t k2c_read_uint(const unsigned char* bytes, const size_t nbytes) {
+
+    uint64_t x = 0;
+    for (size_t i = 0; i < nbytes; ++i) {
+        x |= ((uint64_t) bytes[i]) << (8*i);
+    }
+    return x;
+}
+
+
+/**
+ * Adler-32 checksum.
+ *
+ * :param data: bytes to checksum.
+ * :param size: number of bytes.
+ * :return: checksum of data.
+ */
+static uint32_t k2c_adler32(const unsigned char* data, const size_t size) {
+
+    uint32_t a = 1;
+    uint32_t b = 0;
+    for (size_t i = 0; i < size; ++i) {
+        a = (a + data[i]) % 65521;
+        b = (b + a) % 65521;
+    }
+    return (b << 16) | a;
+}
+
+
+/**
+ * Maps a binary weight file into memory.
+ * The file starts with a K2C_WEIGHTS_HEADER_SIZE byte header:
+ * 8 byte magic "K2CWGHTS", uint32 version, uint32 alignment, uint64 number of arrays,
+ * uint64 file size, uint32 Adler-32 checksum of everything after the header,
+ * followed by a table of (uint64 offset, uint64 numel) for each array.
+ * Arrays are stored as little endian float32, each starting at a multiple of
+ * alignment bytes from the start of the file.
+ * The file is mapped read only, so pages are shared between processes using
+ * the same weights and only read from disk when first used. On systems
+ * without mmap the file is read into memory instead.
+ *
+ * :param filename: file to read from.
+ * :param size: set to the size of the file in bytes.
+ * :param verify: whether to check the checksum, which reads the whole file.
+ * :return: pointer to start of the file in memory.
+ */
+const char* k2c_map_weights(const char* filename, size_t* size, const int verify) {
+
+    char* blob;
+#ifdef _WIN32
+    FILE *finp = fopen(filename, "rb");
+    if (NULL == finp) {
+        printf("Unable to open file %s \n",filename);
+        exit(-1);
+    }
+    fseek(finp, 0, SEEK_END);
+    *size = (size_t) ftell(finp);
+    fseek(finp, 0, SEEK_SET);
+    blob = (char*) malloc(*size);
+    if (NULL == blob || fread(blob, 1, *size, finp) != *size) {
+        printf("Unable to read file %s \n",filename);
+        exit(-1);
+    }
+    fclose(finp);
+#else
+    struct stat st;
+    int fd = open(filename, O_RDONLY);
+    if (fd < 0 || fstat(fd, &st) != 0) {
+        printf("Unable to open file %s \n",filename);
+        exit(-1);
+    }
+    *size = (size_t) st.st_size;
+    blob = (char*) mmap(NULL, *size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (MAP_FAILED == (void*) blob) {
+        printf("Unable to map file %s \n",filename);
+        exit(-1);
+    }
+#endif
+
+    const unsigned char* bytes = (const unsigned char*) blob;
+    if (*size < K2C_WEIGHTS_HEADER_SIZE || memcmp(blob, "K2CWGHTS", 8) != 0 ||
+            k2c_read_uint(&bytes[8], 4) != K2C_WEIGHTS_VERSION ||
+            k2c_read_uint(&bytes[24], 8) != *size) {
+        printf("File %s is not a valid weight file \n",filename);
+        exit(-1);
+    }
+    if (verify && k2c_read_uint(&bytes[32], 4) !=
+            k2c_adler32(&bytes[K2C_WEIGHTS_HEADER_SIZE], *size - K2C_WEIGHTS_HEADER_SIZE)) {
+        printf("Checksum of weight file %s does not match \n",filename);
+        exit(-1);
+    }
+    return blob;
+}
+
+
+/**
+ * Gets an array from a mapped weight file.
+ * Exits if the table of arrays or the array itself extends past the end of
+ * the file, as in a truncated or mismatched file.
+ *
+ * :param blob: pointer returned by k2c_map_weights.
+ * :param size: size of the file in bytes, as set by k2c_map_weights.
+ * :param index: position of the array in the file.
+ * :param array_size: expected number of values in the array.
+ * :return: pointer to the array. Values must not be modified.
+ */
+float* k2c_weights_array(const char* blob, const size_t size, const size_t index,
+                         const size_t array_size) {
+
+    const unsigned char* bytes = (const unsigned char*) blob;
+    const size_t num_arrays = (size_t) k2c_read_uint(&bytes[16], 8);
+    if (index >= num_arrays || num_arrays > (size - K2C_WEIGHTS_HEADER_SIZE)/16) {
+        printf("Weight file has no array %zu \n",index);
+        exit(-1);
+    }
+    const unsigned char* entry = &bytes[K2C_WEIGHTS_HEADER_SIZE + 16*index];
+    const size_t offset = (size_t) k2c_read_uint(&entry[0], 8);
+    if ((size_t) k2c_read_uint(&entry[8], 8) != array_size) {
+        printf("Weight file array %zu has the wrong size \n",index);
+        exit(-1);
+    }
+    if (offset > size || array_size > (size - offset)/sizeof(float)) {
+        printf("Weight file array %zu extends past the end of the file \n",index);
+        exit(-1);
+    }
+    // weights are read only, cast away const to match the tensor struct
+    return (float*) &blob[offset];
+}
+
+
+/**
+ * Releases a weight file mapped by k2c_map_weights.
+ *
+ * :param blob: pointer returned by k2c_map_weights.
+ * :param size: size of the file in bytes.
+ */
+void k2c_unmap_weights(const char* blob, const size_t size) {
+
+    if (NULL == blob) {
+        return;
+    }
+#ifdef _WIN32
+    free((void*) blob);
+#else
+    munmap((void*) blob, size);
+#endif
+}
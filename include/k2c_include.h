@@ -42,13 +42,49 @@ void k2c_pad3d(k2c_tensor* output, const k2c_tensor* input, const float fill,
                const size_t pad[]);
 void k2c_conv1d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                 const k2c_tensor* bias, const size_t stride, const size_t dilation,
-                k2c_activationType *activation);
+                const size_t pad[], k2c_activationType *activation);
 void k2c_conv2d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                 const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
-                k2c_activationType *activation);
+                const size_t pad[], k2c_activationType *activation);
 void k2c_conv3d(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                 const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
-                k2c_activationType *activation);
+                const size_t pad[], k2c_activationType *activation);
+void k2c_conv1d_im2col(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                       const k2c_tensor* bias, const size_t stride, const size_t dilation,
+                       const size_t pad[], k2c_activationType *activation, float cols[],
+                       const size_t block);
+void k2c_conv2d_im2col(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                       const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                       const size_t pad[], k2c_activationType *activation, float cols[],
+                       const size_t block);
+void k2c_conv3d_im2col(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                       const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                       const size_t pad[], k2c_activationType *activation, float cols[],
+                       const size_t block);
+void k2c_conv2d_winograd(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
+                         const k2c_tensor* bias, const size_t pad[],
+                         k2c_activationType *activation, float work[], const size_t block);
+void k2c_conv1d_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                   const k2c_tensor* bias, const size_t stride, const size_t dilation,
+                   const size_t pad[], const float input_scale,
+                   k2c_activationType *activation, int8_t qwork[], int32_t acc[]);
+void k2c_conv2d_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                   const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                   const size_t pad[], const float input_scale,
+                   k2c_activationType *activation, int8_t qwork[], int32_t acc[]);
+void k2c_conv3d_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                   const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                   const size_t pad[], const float input_scale,
+                   k2c_activationType *activation, int8_t qwork[], int32_t acc[]);
+void k2c_conv1d_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                  const k2c_tensor* bias, const size_t stride, const size_t dilation,
+                  const size_t pad[], k2c_activationType *activation);
+void k2c_conv2d_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                  const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                  const size_t pad[], k2c_activationType *activation);
+void k2c_conv3d_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                  const k2c_tensor* bias, const size_t stride[], const size_t dilation[],
+                  const size_t pad[], k2c_activationType *activation);
 void k2c_crop1d(k2c_tensor* output, const k2c_tensor* input, const size_t crop[]);
 void k2c_crop2d(k2c_tensor* output, const k2c_tensor* input, const size_t crop[]);
 void k2c_crop3d(k2c_tensor* output, const k2c_tensor* input, const size_t crop[]);
@@ -59,6 +95,13 @@ void k2c_upsampling3d(k2c_tensor* output, const k2c_tensor* input, const size_t
 // Core Layers
 void k2c_dense(k2c_tensor* output, const k2c_tensor* input, const k2c_tensor* kernel,
                const k2c_tensor* bias, k2c_activationType *activation, float fwork[]);
+void k2c_dense_q8(k2c_tensor* output, const k2c_tensor* input, const k2c_qtensor* kernel,
+                  const k2c_tensor* bias, const float input_scale,
+                  k2c_activationType *activation, int8_t qwork[], int32_t acc[]);
+void k2c_dense_h(k2c_tensor* output, const k2c_tensor* input, const k2c_htensor* kernel,
+                 const k2c_tensor* bias, k2c_activationType *activation);
+void k2c_dense_s(k2c_tensor* output, const k2c_tensor* input, const k2c_stensor* kernel,
+                 const k2c_tensor* bias, k2c_activationType *activation);
 void k2c_flatten(k2c_tensor *output, const k2c_tensor* input);
 void k2c_reshape(k2c_tensor *output, const k2c_tensor* input, const size_t newshp[],
                  const size_t newndim);
@@ -69,18 +112,111 @@ void k2c_repeat_vector(k2c_tensor* output, const k2c_tensor* input, const size_t
 // Embedding
 void k2c_embedding(k2c_tensor* outputs, const k2c_tensor* inputs, const k2c_tensor* kernel);
 
+// SIMD kernels
+/** Instruction sets with their own versions of the innermost kernels. */
+enum k2c_simd_level
+{
+    K2C_SIMD_GENERIC,
+    K2C_SIMD_AVX2,
+    K2C_SIMD_AVX512
+};
+typedef enum k2c_simd_level k2c_simd_level;
+k2c_simd_level k2c_simd_init(void);
+
+// Threading
+/** Layers with fewer multiply adds than this are always run on one thread,
+    when the library is built with OpenMP. */
+#ifndef K2C_PARALLEL_MIN_WORK
+#define K2C_PARALLEL_MIN_WORK 262144
+#endif
+void k2c_set_num_threads(const int num_threads);
+/** Size in bytes of the stack of each thread that runs tasks. */
+#ifndef K2C_TASK_STACK_SIZE
+#define K2C_TASK_STACK_SIZE (8*1024*1024)
+#endif
+void k2c_start_threads(const size_t num_threads);
+void k2c_stop_threads(void);
+void k2c_run_tasks(const k2c_task_graph* graph, void* args);
+
+// Binary weight files
+/** Version of the weight file format written by keras2c. */
+#define K2C_WEIGHTS_VERSION 1
+/** Size in bytes of the fixed part of the weight file header. */
+#define K2C_WEIGHTS_HEADER_SIZE 40
+/** Set to 1 to check the weight file checksum when it is loaded. */
+#ifndef K2C_VERIFY_WEIGHTS
+#define K2C_VERIFY_WEIGHTS 0
+#endif
+
 // Helper functions
+/** Rows of A multiplied at a time by k2c_matmul and k2c_affine_matmul. */
+#define K2C_GEMM_MR 4
+/** Columns of B multiplied at a time, should be a multiple of the vector width. */
+#define K2C_GEMM_NR 16
+/** Rows of B packed at a time. */
+#define K2C_GEMM_KC 128
+/** Columns of B packed at a time, a multiple of K2C_GEMM_NR. Also the width of
+    the panels of kernels packed when the model is converted. */
+#define K2C_GEMM_NC 64
+/** Rows of A multiplied by each packed block of B, the unit of work given to
+    each thread. */
+#define K2C_GEMM_MC 64
+typedef void k2c_gemm_kernelType(float * const C[], const float * const A[],
+                                 const float * const init[], const float Bp[],
+                                 const size_t kb, const size_t ldb);
+typedef void k2c_gemv_kernelType(float y[], const float x[], const float B[],
+                                 const float init[], const size_t nc,
+                                 const size_t innerdim, const size_t ldb);
+/** Kernels used by k2c_matmul and k2c_affine_matmul, set by k2c_simd_init. */
+extern k2c_gemm_kernelType * k2c_gemm_kernel;
+extern k2c_gemv_kernelType * k2c_gemv_kernel;
+void k2c_gemm_kernel_generic(float * const C[], const float * const A[],
+                             const float * const init[], const float Bp[],
+                             const size_t kb, const size_t ldb);
+void k2c_gemv_kernel_generic(float y[], const float x[], const float B[],
+                             const float init[], const size_t nc,
+                             const size_t innerdim, const size_t ldb);
 void k2c_matmul(float C[], const float A[], const float B[], const size_t outrows,
                 const size_t outcols, const size_t innerdim);
 void k2c_affine_matmul(float C[], const float A[], const float B[], const float d[],
                        const size_t outrows,const size_t outcols, const size_t innerdim);
+void k2c_affine_matmul_p(float C[], const float A[], const float Bp[], const float d[],
+                         const size_t outrows, const size_t outcols, const size_t innerdim);
+size_t k2c_packed_size(const size_t rows, const size_t cols);
+void k2c_gemv(float y[], const float x[], const float B[], const size_t outcols,
+              const size_t innerdim);
+typedef void k2c_matmulType(float C[], const float A[], const float B[], const float d[],
+                            const size_t outrows, const size_t outcols,
+                            const size_t innerdim);
+void k2c_window(size_t* first, size_t* last, const size_t x, const size_t stride,
+                const size_t dilation, const size_t pad, const size_t in_size,
+                const size_t size);
 size_t k2c_sub2idx(const size_t sub[], const size_t shape[], const size_t ndim);
 void k2c_idx2sub(const size_t idx, size_t sub[], const size_t shape[], const size_t ndim);
 void k2c_dot(k2c_tensor* C, const k2c_tensor* A, const k2c_tensor* B, const size_t axesA[],
              const size_t axesB[], const size_t naxes, const int normalize, float fwork[]);
 void k2c_bias_add(k2c_tensor* A, const k2c_tensor* b);
+void k2c_quantize(int8_t q[], const float x[], const size_t size, const float scale);
+void k2c_requantize(float y[], const int32_t acc[], const float scale[],
+                    const float input_scale, const float bias[], const size_t size);
+/** Number of 16 bit values converted to float at a time by k2c_axpy_h. */
+#define K2C_WIDEN_BLOCK 64
+void k2c_widen(float y[], const uint16_t x[], const size_t size,
+               const k2c_half_format format);
+void k2c_axpy_h(float y[], const float a, const uint16_t x[], const size_t size,
+                const k2c_half_format format);
+void k2c_affine_matmul_h(float C[], const float A[], const uint16_t B[],
+                         const k2c_half_format format, const float d[],
+                         const size_t outrows, const size_t outcols, const size_t innerdim);
+void k2c_affine_matmul_s(float C[], const float A[], const float values[],
+                         const uint32_t indices[], const uint32_t indptr[], const float d[],
+                         const size_t outrows, const size_t outcols, const size_t innerdim);
 void k2c_flip(k2c_tensor *A, const size_t axis);
 float* k2c_read_array(const char* filename, const size_t array_size);
+const char* k2c_map_weights(const char* filename, size_t* size, const int verify);
+float* k2c_weights_array(const char* blob, const size_t size, const size_t index,
+                         const size_t array_size);
+void k2c_unmap_weights(const char* blob, const size_t size);
 
 // Merge layers
 void k2c_add(k2c_tensor* output, const size_t num_tensors,...);
@@ -101,34 +237,35 @@ void k2c_batch_norm(k2c_tensor* outputs, const k2c_tensor* inputs, const k2c_ten
 void k2c_global_max_pooling(k2c_tensor* output, const k2c_tensor* input);
 void k2c_global_avg_pooling(k2c_tensor* output, const k2c_tensor* input);
 void k2c_maxpool1d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size,
-                   const size_t stride);
+                   const size_t stride, const size_t pad[]);
 void k2c_maxpool2d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size[],
-                   const size_t stride[]);
+                   const size_t stride[], const size_t pad[]);
 void k2c_avgpool1d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size,
-                   const size_t stride);
+                   const size_t stride, const size_t pad[]);
 void k2c_avgpool2d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size[],
-                   const size_t stride[]);
+                   const size_t stride[], const size_t pad[]);
 
 // Recurrent layers
-void k2c_lstmcell(float state[], const float input[], const k2c_tensor* kernel,
-                  const k2c_tensor* recurrent_kernel, const k2c_tensor* bias, float fwork[],
-                  k2c_activationType *recurrent_activation,
+/** Timesteps whose input product is found at once by the recurrent layers,
+    which bounds the size of their working arrays. */
+#define K2C_RNN_BLOCK 32
+void k2c_lstmcell(float state[], const float x[], const k2c_tensor* recurrent_kernel,
+                  float fwork[], k2c_activationType *recurrent_activation,
                   k2c_activationType *output_activation);
 void k2c_lstm(k2c_tensor* output, const k2c_tensor* input, float state[],
               const k2c_tensor* kernel, const k2c_tensor* recurrent_kernel,
               const k2c_tensor* bias, float fwork[], const int go_backwards,
               const int return_sequences, k2c_activationType *recurrent_activation,
               k2c_activationType *output_activation);
-void k2c_simpleRNNcell(float state[], const float input[], const k2c_tensor* kernel,
-                       const k2c_tensor* recurrent_kernel, const k2c_tensor* bias,
+void k2c_simpleRNNcell(float state[], const float x[], const k2c_tensor* recurrent_kernel,
                        float fwork[], k2c_activationType *output_activation);
 void k2c_simpleRNN(k2c_tensor* output, const k2c_tensor* input, float state[],
                    const k2c_tensor* kernel, const k2c_tensor* recurrent_kernel,
                    const k2c_tensor* bias, float fwork[], const int go_backwards,
                    const int return_sequences, k2c_activationType *output_activation);
-void k2c_grucell(float state[], const float input[], const k2c_tensor* kernel,
-                 const k2c_tensor* recurrent_kernel, const k2c_tensor* bias, float fwork[],
-                 const int reset_after, k2c_activationType *recurrent_activation,
+void k2c_grucell(float state[], const float x[], const k2c_tensor* recurrent_kernel,
+                 const k2c_tensor* bias, float fwork[], const int reset_after,
+                 k2c_activationType *recurrent_activation,
                  k2c_activationType *output_activation);
 void k2c_gru(k2c_tensor* output, const k2c_tensor* input, float state[],
              const k2c_tensor* kernel, const k2c_tensor* recurrent_kernel,
@@ -136,4 +273,52 @@ void k2c_gru(k2c_tensor* output, const k2c_tensor* input, float state[],
              const int go_backwards, const int return_sequences,
              k2c_activationType *recurrent_activation,
              k2c_activationType *output_activation);
+void k2c_lstmcell_h(float state[], const float x[], const k2c_htensor* recurrent_kernel,
+                    float fwork[], k2c_activationType *recurrent_activation,
+                    k2c_activationType *output_activation);
+void k2c_lstm_h(k2c_tensor* output, const k2c_tensor* input, float state[],
+                const k2c_htensor* kernel, const k2c_htensor* recurrent_kernel,
+                const k2c_tensor* bias, float fwork[], const int go_backwards,
+                const int return_sequences, k2c_activationType *recurrent_activation,
+                k2c_activationType *output_activation);
+void k2c_simpleRNNcell_h(float state[], const float x[], const k2c_htensor* recurrent_kernel,
+                         float fwork[], k2c_activationType *output_activation);
+void k2c_simpleRNN_h(k2c_tensor* output, const k2c_tensor* input, float state[],
+                     const k2c_htensor* kernel, const k2c_htensor* recurrent_kernel,
+                     const k2c_tensor* bias, float fwork[], const int go_backwards,
+                     const int return_sequences, k2c_activationType *output_activation);
+void k2c_grucell_h(float state[], const float x[], const k2c_htensor* recurrent_kernel,
+                   const k2c_tensor* bias, float fwork[], const int reset_after,
+                   k2c_activationType *recurrent_activation,
+                   k2c_activationType *output_activation);
+void k2c_gru_h(k2c_tensor* output, const k2c_tensor* input, float state[],
+               const k2c_htensor* kernel, const k2c_htensor* recurrent_kernel,
+               const k2c_tensor* bias, float fwork[], const int reset_after,
+               const int go_backwards, const int return_sequences,
+               k2c_activationType *recurrent_activation,
+               k2c_activationType *output_activation);
+void k2c_lstmcell_s(float state[], const float x[], const k2c_stensor* recurrent_kernel,
+                    float fwork[], k2c_activationType *recurrent_activation,
+                    k2c_activationType *output_activation);
+void k2c_lstm_s(k2c_tensor* output, const k2c_tensor* input, float state[],
+                const k2c_stensor* kernel, const k2c_stensor* recurrent_kernel,
+                const k2c_tensor* bias, float fwork[], const int go_backwards,
+                const int return_sequences, k2c_activationType *recurrent_activation,
+                k2c_activationType *output_activation);
+void k2c_simpleRNNcell_s(float state[], const float x[], const k2c_stensor* recurrent_kernel,
+                         float fwork[], k2c_activationType *output_activation);
+void k2c_simpleRNN_s(k2c_tensor* output, const k2c_tensor* input, float state[],
+                     const k2c_stensor* kernel, const k2c_stensor* recurrent_kernel,
+                     const k2c_tensor* bias, float fwork[], const int go_backwards,
+                     const int return_sequences, k2c_activationType *output_activation);
+void k2c_grucell_s(float state[], const float x[], const k2c_stensor* recurrent_kernel,
+                   const k2c_tensor* bias, float fwork[], const int reset_after,
+                   k2c_activationType *recurrent_activation,
+                   k2c_activationType *output_activation);
+void k2c_gru_s(k2c_tensor* output, const k2c_tensor* input, float state[],
+               const k2c_stensor* kernel, const k2c_stensor* recurrent_kernel,
+               const k2c_tensor* bias, float fwork[], const int reset_after,
+               const int go_backwards, const int return_sequences,
+               k2c_activationType *recurrent_activation,
+               k2c_activationType *output_activation);
 
@@ -50,22 +50,33 @@ void k2c_global_avg_pooling(k2c_tensor* output, const k2c_tensor* input) {
 
 /**
  * Max pooling for 1D (temporal) data.
+ * The input is padded implicitly: the window is clamped to the part inside the input.
  *
  * :param output: output tensor.
  * :param input: input tensor.
  * :param pool_size: size of the max pooling window.
  * :param stride: factor by which to downscale.
+ * :param pad: array[2] of padding of the input. Order is {before dim 1, after dim 1}.
  */
 void k2c_maxpool1d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size,
-                   const size_t stride) {
-    const size_t channels = input->shape[1];
+                   const size_t stride, const size_t pad[]) {
 
-    for(size_t i=0; i<channels; ++i) {
-        for (size_t j=0, k=0; j<output->shape[0]*channels; j+=channels, k+=stride*channels) {
-            output->array[j+i] = input->array[k+i];
-            for (size_t l=0; l<pool_size*channels; l+=channels) {
-                if (output->array[j+i] < input->array[k+i+l]) {
-                    output->array[j+i] = input->array[k+i+l];
+    const size_t out_times = output->shape[0];
+    const size_t in_times = input->shape[0];
+    const size_t channels = input->shape[1];
+    const size_t work = output->numel*pool_size;
+
+    #pragma omp parallel for if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t x0=0; x0 < out_times; ++x0) {
+        float * y = &output->array[x0*channels];
+        size_t first, last;
+        k2c_window(&first, &last, x0, stride, 1, pad[0], in_times, pool_size);
+        const float * x = &input->array[(x0*stride + first - pad[0])*channels];
+        memcpy(y, x, channels*sizeof(y[0]));
+        for (size_t z=1; z < last - first; ++z) {
+            for (size_t k=0; k < channels; ++k) {
+                if (y[k] < x[z*channels + k]) {
+                    y[k] = x[z*channels + k];
                 }
             }
         }
@@ -75,30 +86,40 @@ void k2c_maxpool1d(k2c_tensor* output, const k2c_tensor* input, const size_t poo
 
 /**
  * Max pooling for 2D (spatial) data.
+ * The input is padded implicitly: the window is clamped to the part inside the input.
  *
  * :param output: output tensor.
  * :param input: input tensor.
  * :param pool_size: array[2] size of the max pooling window. Order is {pool size dim 1, pool size dim 2}.
  * :param stride: array[2] factor by which to downscale. Order is {stride dim 1, stride dim 2}.
+ * :param pad: array[4] of padding of the input. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
  */
 void k2c_maxpool2d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size[],
-                   const size_t stride[]) {
-
+                   const size_t stride[], const size_t pad[]) {
 
+    const size_t out_rows = output->shape[0];
+    const size_t out_cols = output->shape[1];
+    const size_t in_rows = input->shape[0];
+    const size_t in_cols = input->shape[1];
     const size_t channels = input->shape[2];
-    // i,j,l output indices
-    /// i, k, m input indices
-    for (size_t i=0; i< channels; ++i) {
-        for (size_t j=0, k=0; j<output->shape[1]*channels;
-                j+=channels, k+=channels*stride[1]) {
-            for (size_t l=0, m=0; l<output->numel; l+=channels*output->shape[1],
-                    m+=channels*input->shape[1]*stride[0]) {
-                output->array[l+j+i] = input->array[m+k+i];
-                for (size_t n=0; n<pool_size[1]*channels; n+=channels) {
-                    for (size_t p=0; p<pool_size[0]*channels*input->shape[1];
-                            p+=channels*input->shape[1]) {
-                        if (output->array[l+j+i] < input->array[m+k+i+n+p]) {
-                            output->array[l+j+i] = input->array[m+k+i+n+p];
+    const size_t work = output->numel*pool_size[0]*pool_size[1];
+
+    #pragma omp parallel for collapse(2) if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t x0=0; x0 < out_rows; ++x0) {
+        for (size_t x1=0; x1 < out_cols; ++x1) {
+            float * y = &output->array[(x0*out_cols + x1)*channels];
+            size_t first0, last0, first1, last1;
+            k2c_window(&first0, &last0, x0, stride[0], 1, pad[0], in_rows, pool_size[0]);
+            k2c_window(&first1, &last1, x1, stride[1], 1, pad[2], in_cols, pool_size[1]);
+            const float * x = &input->array[((x0*stride[0] + first0 - pad[0])*in_cols
+                                             + x1*stride[1] + first1 - pad[2])*channels];
+            memcpy(y, x, channels*sizeof(y[0]));
+            for (size_t z0=0; z0 < last0 - first0; ++z0) {
+                for (size_t z1=0; z1 < last1 - first1; ++z1) {
+                    const float * xz = &x[(z0*in_cols + z1)*channels];
+                    for (size_t k=0; k < channels; ++k) {
+                        if (y[k] < xz[k]) {
+                            y[k] = xz[k];
                         }
                     }
                 }
@@ -110,27 +131,36 @@ void k2c_maxpool2d(k2c_tensor* output, const k2c_tensor* input, const size_t poo
 
 /**
  * Average pooling for 1D (temporal) data.
+ * The input is padded implicitly: the window is clamped to the part inside the input,
+ * and padding is left out of the average.
  *
  * :param output: output tensor.
  * :param input: input tensor.
  * :param pool_size: size of the average pooling window.
  * :param stride: factor by which to downscale.
+ * :param pad: array[2] of padding of the input. Order is {before dim 1, after dim 1}.
  */
 void k2c_avgpool1d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size,
-                   const size_t stride) {
+                   const size_t stride, const size_t pad[]) {
 
+    const size_t out_times = output->shape[0];
+    const size_t in_times = input->shape[0];
     const size_t channels = input->shape[1];
-    memset(output->array,0,output->numel*sizeof(output->array[0]));
-    for(size_t i=0; i<channels; ++i) {
-        for (size_t j=0, k=0; j<output->numel; j+=channels, k+=stride*channels) {
-            int count = 0;
-            for (size_t l=0; l<pool_size*channels; l+=channels) {
-                if (input->array[k+i+l] > -HUGE_VALF) {
-                    output->array[j+i] += input->array[k+i+l];
-                    ++count;
-                }
+    const size_t work = output->numel*pool_size;
+
+    #pragma omp parallel for if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t x0=0; x0 < out_times; ++x0) {
+        float * y = &output->array[x0*channels];
+        size_t first, last;
+        k2c_window(&first, &last, x0, stride, 1, pad[0], in_times, pool_size);
+        const float * x = &input->array[(x0*stride + first - pad[0])*channels];
+        const float count_inv = 1.0f/(float)(last - first);
+        for (size_t k=0; k < channels; ++k) {
+            float sum = 0.0f;
+            for (size_t z=0; z < last - first; ++z) {
+                sum += x[z*channels + k];
             }
-            output->array[i+j] /= (float)count;
+            y[k] = sum*count_inv;
         }
     }
 }
@@ -138,34 +168,48 @@ void k2c_avgpool1d(k2c_tensor* output, const k2c_tensor* input, const size_t poo
 
 /**
  * Average pooling for 2D (spatial) data.
+ * The input is padded implicitly: the window is clamped to the part inside the input,
+ * and padding is left out of the average.
  *
  * :param output: output tensor.
  * :param input: input tensor.
  * :param pool_size: array[2] size of the average pooling window. Order is {pool size dim 1, pool size dim 2}.
  * :param stride: array[2] factor by which to downscale. Order is {stride dim 1, stride dim 2}.
+ * :param pad: array[4] of padding of the input. Order is {before dim 1, after dim 1, before dim 2, after dim 2}.
  */
 void k2c_avgpool2d(k2c_tensor* output, const k2c_tensor* input, const size_t pool_size[],
-                   const size_t stride[]) {
-    memset(output->array,0,output->numel*sizeof(output->array[0]));
+                   const size_t stride[], const size_t pad[]) {
+
+    const size_t out_rows = output->shape[0];
+    const size_t out_cols = output->shape[1];
+    const size_t in_rows = input->shape[0];
+    const size_t in_cols = input->shape[1];
     const size_t channels = input->shape[2];
-    // i,j,l output indices
-    /// i, k, m input indices
-    for (size_t i=0; i< channels; ++i) {
-        for (size_t j=0, k=0; j<output->shape[1]*channels;
-                j+=channels, k+=channels*stride[1]) {
-            for (size_t l=0, m=0; l<output->numel; l+=channels*output->shape[1],
-                    m+=channels*input->shape[1]*stride[0]) {
-                size_t count = 0;
-                for (size_t n=0; n<pool_size[1]*channels; n+=channels) {
-                    for (size_t p=0; p<pool_size[0]*channels*input->shape[1];
-                            p+=channels*input->shape[1]) {
-                        if (-HUGE_VALF < input->array[m+k+i+n+p]) {
-                            output->array[l+j+i] += input->array[m+k+i+n+p];
-                            ++count;
-                        }
+    const size_t work = output->numel*pool_size[0]*pool_size[1];
+
+    #pragma omp parallel for collapse(2) if (work >= K2C_PARALLEL_MIN_WORK)
+    for (size_t x0=0; x0 < out_rows; ++x0) {
+        for (size_t x1=0; x1 < out_cols; ++x1) {
+            float * y = &output->array[(x0*out_cols + x1)*channels];
+            size_t first0, last0, first1, last1;
+            k2c_window(&first0, &last0, x0, stride[0], 1, pad[0], in_rows, pool_size[0]);
+            k2c_window(&first1, &last1, x1, stride[1], 1, pad[2], in_cols, pool_size[1]);
+            const float * x = &input->array[((x0*stride[0] + first0 - pad[0])*in_cols
+                                             + x1*stride[1] + first1 - pad[2])*channels];
+            const float count_inv = 1.0f/(float)((last0 - first0)*(last1 - first1));
+            for (size_t k=0; k < channels; ++k) {
+                y[k] = 0.0f;
+            }
+            for (size_t z0=0; z0 < last0 - first0; ++z0) {
+                for (size_t z1=0; z1 < last1 - first1; ++z1) {
+                    const float * xz = &x[(z0*in_cols + z1)*channels];
+                    for (size_t k=0; k < channels; ++k) {
+                        y[k] += xz[k];
                     }
                 }
-                output->array[l+j+i] /= (float)count;
+            }
+            for (size_t k=0; k < channels; ++k) {
+                y[k] *= count_inv;
             }
         }
     }
@@ -6,81 +6,45 @@
 /**
  * Cell for the LSTM layer.
  * "units" is the dimension of the output space
+ * The gates are side by side in the order i, f, o, c.
  *
  * :param state: array[2*units] recurrent state.
- * :param input: array of input data.
- * :param kernel: kernel tensor.
+ * :param x: array[4*units] product of the input and kernel, plus bias, at this timestep.
  * :param recurrent_kernel: recurrent kernel tensor
- * :param bias: bias tensor.
- * :param fwork: array[8*units] working storage.
+ * :param fwork: array[4*units] working storage.
  * :param recurrent_activation: activation function to apply to internal state.
  * :param output_activation: activation function to apply to output.
  */
-void k2c_lstmcell(float state[], const float input[], const k2c_tensor* kernel,
-                  const k2c_tensor* recurrent_kernel, const k2c_tensor* bias, float fwork[],
-                  k2c_activationType *recurrent_activation,
+void k2c_lstmcell(float state[], const float x[], const k2c_tensor* recurrent_kernel,
+                  float fwork[], k2c_activationType *recurrent_activation,
                   k2c_activationType *output_activation) {
 
 
-    const size_t units = recurrent_kernel->shape[1];
-    const size_t in_width = kernel->shape[0]/4;
+    const size_t units = recurrent_kernel->shape[0];
 
     float *h_tm1 = &state[0];  // previous memory state
     float *c_tm1 = &state[units];  // previous carry state
     const size_t outrows = 1;
-    const float * const Wi = &kernel->array[0];
-    const float * const Wf = &kernel->array[in_width*units];
-    const float * const Wc = &kernel->array[2*in_width*units];
-    const float * const Wo = &kernel->array[3*in_width*units];
-    const float * const Ui = &recurrent_kernel->array[0];
-    const float * const Uf = &recurrent_kernel->array[units*units];
-    const float * const Uc = &recurrent_kernel->array[2*units*units];
-    const float * const Uo = &recurrent_kernel->array[3*units*units];
-    const float * const bi = &bias->array[0];
-    const float * const bf = &bias->array[units];
-    const float * const bc = &bias->array[2*units];
-    const float * const bo = &bias->array[3*units];
-    float *xi = &fwork[0];
-    float *xf = &fwork[units];
-    float *xc = &fwork[2*units];
-    float *xo = &fwork[3*units];
-    float *yi = &fwork[4*units];
-    float *yf = &fwork[5*units];
-    float *yc = &fwork[6*units];
-    float *yo = &fwork[7*units];
-
-
-    //xi = input*Wi + bi;
-    k2c_affine_matmul(xi, input, Wi, bi, outrows, units, in_width);
-    //xf = input*Wf + bf;
-    k2c_affine_matmul(xf, input, Wf, bf, outrows, units, in_width);
-    //xc = input*Wc + bc;
-    k2c_affine_matmul(xc, input, Wc, bc, outrows, units, in_width);
-    //xo = input*Wo + bo;
-    k2c_affine_matmul(xo, input, Wo, bo, outrows, units, in_width);
-
-    // yi = recurrent_activation(xi + h_tm1*Ui);
-    k2c_affine_matmul(yi, h_tm1, Ui, xi, outrows, units, units);
-    recurrent_activation(yi, units);
-
-    // yf = recurrent_activation(xf + h_tm1*Uf);
-    k2c_affine_matmul(yf, h_tm1, Uf, xf, outrows, units, units);
-    recurrent_activation(yf, units);
-
-    // yc = yf.*c_tm1 + yi.*output_activation(xc + h_tm1*Uc);
-    k2c_affine_matmul(yc, h_tm1, Uc, xc, outrows, units, units);
+    k2c_matmulType *Umatmul = recurrent_kernel->layout == K2C_PACKED ?
+                              k2c_affine_matmul_p : k2c_affine_matmul;
+    float *y = &fwork[0];
+    float *yi = &y[0];
+    float *yf = &y[units];
+    float *yo = &y[2*units];
+    float *yc = &y[3*units];
+
+    // y = h_tm1*recurrent_kernel + x, for all gates at once
+    Umatmul(y, h_tm1, recurrent_kernel->array, x, outrows, 4*units, units);
+
+    // i, f and o are next to each other
+    recurrent_activation(y, 3*units);
     output_activation(yc, units);
-    for (size_t i=0; i < units; ++i) {
-        yc[i] = yf[i]*c_tm1[i] + yi[i]*yc[i];
-    }
 
-    // yo = recurrent_activation(xo + h_tm1*Uo);
-    k2c_affine_matmul(yo, h_tm1, Uo, xo, outrows, units, units);
-    recurrent_activation(yo, units);
-
-    // h = yo.*output_activation(yc);
-    // state = [h;yc];
+    // c = f.*c_tm1 + i.*c
+    // h = o.*output_activation(c)
+    // state = [h;c]
     for (size_t i=0; i < units; ++i) {
+        yc[i] = yf[i]*c_tm1[i] + yi[i]*yc[i];
         state[units+i] = yc[i];
     }
 
@@ -103,7 +67,7 @@ void k2c_lstmcell(float state[], const float input[], const k2c_tensor* kernel,
  * :param kernel: kernel tensor.
  * :param recurrent_kernel: recurrent kernel tensor
  * :param bias: bias tensor.
- * :param fwork: array[8*units] working storage.
+ * :param fwork: array[(min(timesteps,K2C_RNN_BLOCK)+1)*4*units] working storage.
  * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
  * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
  * :param recurrent_activation: activation function to apply to internal state.
@@ -118,25 +82,24 @@ void k2c_lstm(k2c_tensor* output, const k2c_tensor* input, float state[],
 
     const size_t in_height = input->shape[0];
     const size_t in_width = input->shape[1];
-    const size_t units = recurrent_kernel->shape[1];
-    if (go_backwards) {
-        for (int i=in_height-1; i>-1; --i) {
-            k2c_lstmcell(state, &input->array[i*in_width], kernel, recurrent_kernel,
-                         bias, fwork, recurrent_activation, output_activation);
+    const size_t units = recurrent_kernel->shape[0];
+    // the input product does not depend on the state, so it is found for
+    // K2C_RNN_BLOCK timesteps at a time with one matrix product, before the
+    // recurrence over them
+    float *x = &fwork[4*units];
+    k2c_matmulType *Wmatmul = kernel->layout == K2C_PACKED ?
+                              k2c_affine_matmul_p : k2c_affine_matmul;
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        Wmatmul(x, &input->array[first*in_width], kernel->array, bias->array, nt, 4*units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_lstmcell(state, &x[i*4*units], recurrent_kernel, fwork,
+                         recurrent_activation, output_activation);
             if (return_sequences) {
                 for (size_t j=0; j<units; ++j) {
-                    output->array[(in_height-1-i)*units+j] = state[j];
-                }
-            }
-        }
-    }
-    else {
-        for (size_t i=0; i < in_height; ++i) {
-            k2c_lstmcell(state, &input->array[i*in_width], kernel, recurrent_kernel,
-                         bias, fwork, recurrent_activation, output_activation);
-            if (return_sequences) {
-                for (size_t j=0; j<units; ++j) {
-                    output->array[i*units+j] = state[j];
+                    output->array[t*units+j] = state[j];
                 }
             }
         }
@@ -154,32 +117,26 @@ void k2c_lstm(k2c_tensor* output, const k2c_tensor* input, float state[],
  * "units" is the dimension of the output space
  *
  * :param state: array[units] recurrent state.
- * :param input: array of input data.
- * :param kernel: kernel tensor.
+ * :param x: array[units] product of the input and kernel, plus bias, at this timestep.
  * :param recurrent_kernel: recurrent kernel tensor
- * :param bias: bias tensor.
- * :param fwork: array[2*units] working storage.
+ * :param fwork: array[units] working storage.
  * :param output_activation: activation function to apply to output.
  */
-void k2c_simpleRNNcell(float state[], const float input[], const k2c_tensor* kernel,
-                       const k2c_tensor* recurrent_kernel, const k2c_tensor* bias,
+void k2c_simpleRNNcell(float state[], const float x[], const k2c_tensor* recurrent_kernel,
                        float fwork[], k2c_activationType *output_activation) {
 
     const size_t units = recurrent_kernel->shape[1];
-    const size_t in_width = kernel->shape[0];
 
     const size_t outrows = 1;
-    float *h1 = &fwork[0];
-    float *h2 = &fwork[units];
-    // h1 = input*kernel+bias
-    k2c_affine_matmul(h1,input,kernel->array,bias->array,outrows,units,in_width);
-
-    // h2 = state*recurrent_kernel + h1
-    k2c_affine_matmul(h2,state,recurrent_kernel->array,h1,outrows,units,units);
-    output_activation(h2,units);
+    k2c_matmulType *Umatmul = recurrent_kernel->layout == K2C_PACKED ?
+                              k2c_affine_matmul_p : k2c_affine_matmul;
+    float *h = &fwork[0];
+    // h = state*recurrent_kernel + x
+    Umatmul(h, state, recurrent_kernel->array, x, outrows, units, units);
+    output_activation(h,units);
 
     for (size_t i=0; i<units; ++i) {
-        state[i] = h2[i];
+        state[i] = h[i];
     }
 }
 
@@ -194,7 +151,7 @@ void k2c_simpleRNNcell(float state[], const float input[], const k2c_tensor* ker
  * :param kernel: kernel tensor.
  * :param recurrent_kernel: recurrent kernel tensor
  * :param bias: bias tensor.
- * :param fwork: array[2*units] working storage.
+ * :param fwork: array[(min(timesteps,K2C_RNN_BLOCK)+1)*units] working storage.
  * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
  * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
  * :param output_activation: activation function to apply to output.
@@ -207,25 +164,21 @@ void k2c_simpleRNN(k2c_tensor* output, const k2c_tensor* input, float state[],
     const size_t in_width = input->shape[1];
     const size_t in_height = input->shape[0];
     const size_t units = recurrent_kernel->shape[1];
-
-    if (go_backwards) {
-        for (int i=in_height-1; i>-1; --i) {
-            k2c_simpleRNNcell(state,&input->array[i*in_width],kernel,recurrent_kernel,bias,
-                              fwork, output_activation);
-            if (return_sequences) {
-                for (size_t j=0; j<units; ++j) {
-                    output->array[(in_height-1-i)*units+j] = state[j];
-                }
-            }
-        }
-    }
-    else {
-        for (size_t i=0; i<in_height; ++i) {
-            k2c_simpleRNNcell(state,&input->array[i*in_width],kernel,recurrent_kernel,bias,
-                              fwork, output_activation);
+    // input product for K2C_RNN_BLOCK timesteps at a time, found before the
+    // recurrence over them
+    float *x = &fwork[units];
+    k2c_matmulType *Wmatmul = kernel->layout == K2C_PACKED ?
+                              k2c_affine_matmul_p : k2c_affine_matmul;
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        Wmatmul(x, &input->array[first*in_width], kernel->array, bias->array, nt, units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_simpleRNNcell(state, &x[i*units], recurrent_kernel, fwork, output_activation);
             if (return_sequences) {
                 for (size_t j=0; j<units; ++j) {
-                    output->array[i*units+j] = state[j];
+                    output->array[t*units+j] = state[j];
                 }
             }
         }
@@ -241,72 +194,54 @@ void k2c_simpleRNN(k2c_tensor* output, const k2c_tensor* input, float state[],
 /**
  * Cell for the GRU layer.
  * "units" is the dimension of the output space
+ * The gates are side by side in the order z, r, h. Without reset_after, the
+ * recurrent kernel holds the columns of z and r, then those of h.
  *
  * :param state: array[units] recurrent state.
- * :param input: array of input data.
- * :param kernel: kernel tensor.
+ * :param x: array[3*units] product of the input and kernel, plus input bias, at this timestep.
  * :param recurrent_kernel: recurrent kernel tensor
  * :param bias: bias tensor.
- * :param fwork: array[6*units] working storage.
+ * :param fwork: array[4*units] working storage.
  * :param reset_after: whether to apply the reset gate before (0) or after (1) the matrix multiplication.
  * :param recurrent_activation: activation function to apply to internal state.
  * :param output_activation: activation function to apply to output.
  */
-void k2c_grucell(float state[], const float input[], const k2c_tensor* kernel,
-                 const k2c_tensor* recurrent_kernel, const k2c_tensor* bias, float fwork[],
-                 const int reset_after, k2c_activationType *recurrent_activation,
+void k2c_grucell(float state[], const float x[], const k2c_tensor* recurrent_kernel,
+                 const k2c_tensor* bias, float fwork[], const int reset_after,
+                 k2c_activationType *recurrent_activation,
                  k2c_activationType *output_activation) {
 
-    const size_t units = recurrent_kernel->shape[1];
-    const size_t in_width = kernel->shape[0]/3;
+    const size_t units = recurrent_kernel->shape[0];
 
     float *h_tm1 = &state[0];
     const size_t outrows = 1;
-    const float * const Wz = &kernel->array[0];
-    const float * const Wr = &kernel->array[in_width*units];
-    const float * const Wh = &kernel->array[2*in_width*units];
-    const float * const Uz = &recurrent_kernel->array[0];
-    const float * const Ur = &recurrent_kernel->array[units*units];
-    const float * const Uh = &recurrent_kernel->array[2*units*units];
-    const float * const bz = &bias->array[0];
-    const float * const br = &bias->array[units];
-    const float * const bh = &bias->array[2*units];
-    const float * const rbz = &bias->array[3*units];
-    const float * const rbr = &bias->array[4*units];
-    const float * const rbh = &bias->array[5*units];
-    float *xz = &fwork[0];
-    float *xr = &fwork[units];
-    float *xh = &fwork[2*units];
-    float *yz = &fwork[3*units];
-    float *yr = &fwork[4*units];
-    float *yh = &fwork[5*units];
-
-    //     x_z = input*kernel_z + input_bias_z
-    k2c_affine_matmul(xz, input, Wz, bz, outrows, units, in_width);
-    //    x_r = input@kernel_r + input_bias_r
-    k2c_affine_matmul(xr, input, Wr, br, outrows, units, in_width);
-    //    x_h = input@kernel_h + input_bias_h
-    k2c_affine_matmul(xh, input, Wh, bh, outrows, units, in_width);
-
-    //   recurrent_z = h_tm1@recurrent_kernel_z
-    k2c_affine_matmul(yz, h_tm1, Uz, rbz, outrows, units, units);
-    //    recurrent_r = h_tm1@recurrent_kernel_r
-    k2c_affine_matmul(yr, h_tm1, Ur, rbr, outrows, units, units);
-
-    //    z = np.tanh(x_z + recurrent_z)
-    //    r = np.tanh(x_r + recurrent_r)
-    for (size_t i=0; i<units; ++i) {
-        yz[i] = xz[i] + yz[i];
-        yr[i] = xr[i] + yr[i];
+    // without reset_after only z and r are found from the state
+    const size_t Ucols = reset_after ? 3*units : 2*units;
+    const int Upacked = recurrent_kernel->layout == K2C_PACKED;
+    k2c_matmulType *Umatmul = Upacked ? k2c_affine_matmul_p : k2c_affine_matmul;
+    const float * const Uh = &recurrent_kernel->array[Upacked ?
+                             k2c_packed_size(units,2*units) : 2*units*units];
+    const float * const rb = &bias->array[3*units];
+    const float * const xh = &x[2*units];
+    float *y = &fwork[0];
+    float *yz = &y[0];
+    float *yr = &y[units];
+    float *yh = &y[2*units];
+    float *rh = &fwork[3*units];
+
+    //    y = h_tm1*recurrent_kernel + recurrent_bias
+    Umatmul(y, h_tm1, recurrent_kernel->array, rb, outrows, Ucols, units);
+
+    //    z = recurrent_activation(x_z + y_z)
+    //    r = recurrent_activation(x_r + y_r)
+    for (size_t i=0; i<2*units; ++i) {
+        y[i] = x[i] + y[i];
     }
-    recurrent_activation(yz, units);
-    recurrent_activation(yr, units);
+    recurrent_activation(y, 2*units);
 
     //    reset gate applied after/before matrix multiplication
     if (reset_after) {
-        //        recurrent_h = h_tm1*recurrent_kernel_h + recurrent_bias_h
-        k2c_affine_matmul(yh, h_tm1, Uh, rbh, outrows, units, units);
-        //        recurrent_h = r .* recurrent_h
+        //        recurrent_h = r .* y_h
         for (size_t i=0; i<units; ++i) {
             yh[i] = yr[i] * yh[i];
         }
@@ -314,22 +249,19 @@ void k2c_grucell(float state[], const float input[], const k2c_tensor* kernel,
     else {
         //        recurrent_h = (r .* h_tm1)*recurrent_kernel_h
         for (size_t i=0; i<units; ++i) {
-            yh[i] = yr[i]*h_tm1[i];
-        }
-        k2c_matmul(xz, yh, Uh, outrows, units, units); //reuse xz as new yh
-        for (size_t i=0; i<units; ++i) {
-            yh[i] = xz[i];
+            rh[i] = yr[i]*h_tm1[i];
         }
+        Umatmul(yh, rh, Uh, NULL, outrows, units, units);
     }
-    //    hh = np.tanh(x_h + recurrent_h)
+    //    hh = output_activation(x_h + recurrent_h)
     for (size_t i=0; i<units; ++i) {
-        xr[i] = xh[i] + yh[i];  // reuse xr = hh
+        yh[i] = xh[i] + yh[i];
     }
-    output_activation(xr, units);
+    output_activation(yh, units);
 
     //    h = z .* h_tm1 + (1 - z) .* hh
     for (size_t i=0; i<units; ++i) {
-        state[i] = yz[i] * h_tm1[i] + (1.0f-yz[i])*xr[i];
+        state[i] = yz[i] * h_tm1[i] + (1.0f-yz[i])*yh[i];
     }
 }
 
@@ -344,7 +276,7 @@ void k2c_grucell(float state[], const float input[], const k2c_tensor* kernel,
  * :param kernel: kernel tensor.
  * :param recurrent_kernel: recurrent kernel tensor
  * :param bias: bias tensor.
- * :param fwork: array[6*units] working storage.
+ * :param fwork: array[(3*min(timesteps,K2C_RNN_BLOCK)+4)*units] working storage.
  * :param reset_after: whether to apply the reset gate before (0) or after (1) the matrix multiplication.
  * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
  * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
@@ -361,33 +293,656 @@ void k2c_gru(k2c_tensor* output, const k2c_tensor* input, float state[],
 
     const size_t in_width = input->shape[1];
     const size_t in_height = input->shape[0];
+    const size_t units = recurrent_kernel->shape[0];
+    // input product for K2C_RNN_BLOCK timesteps at a time, found before the
+    // recurrence over them
+    float *x = &fwork[4*units];
+    k2c_matmulType *Wmatmul = kernel->layout == K2C_PACKED ?
+                              k2c_affine_matmul_p : k2c_affine_matmul;
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        Wmatmul(x, &input->array[first*in_width], kernel->array, bias->array, nt, 3*units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_grucell(state, &x[i*3*units], recurrent_kernel, bias, fwork, reset_after,
+                        recurrent_activation, output_activation);
+            if (return_sequences) {
+                for (size_t j=0; j<units; ++j) {
+                    output->array[t*units+j] = state[j];
+                }
+            }
+        }
+    }
+    if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
+            output->array[i] = state[i];
+        }
+    }
+}
+
+
+/**
+ * Cell for the LSTM layer, with 16 bit floating point kernels.
+ * "units" is the dimension of the output space
+ * The gates are side by side in the order i, f, o, c.
+ *
+ * :param state: array[2*units] recurrent state.
+ * :param x: array[4*units] product of the input and kernel, plus bias, at this timestep.
+ * :param recurrent_kernel: 16 bit recurrent kernel tensor
+ * :param fwork: array[4*units] working storage.
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_lstmcell_h(float state[], const float x[], const k2c_htensor* recurrent_kernel,
+                    float fwork[], k2c_activationType *recurrent_activation,
+                    k2c_activationType *output_activation) {
+
+
+    const size_t units = recurrent_kernel->shape[0];
+
+    float *h_tm1 = &state[0];  // previous memory state
+    float *c_tm1 = &state[units];  // previous carry state
+    const size_t outrows = 1;
+    float *y = &fwork[0];
+    float *yi = &y[0];
+    float *yf = &y[units];
+    float *yo = &y[2*units];
+    float *yc = &y[3*units];
+
+    // y = h_tm1*recurrent_kernel + x, for all gates at once
+    k2c_affine_matmul_h(y, h_tm1, recurrent_kernel->array, recurrent_kernel->format,
+                        x, outrows, 4*units, units);
+
+    // i, f and o are next to each other
+    recurrent_activation(y, 3*units);
+    output_activation(yc, units);
+
+    // c = f.*c_tm1 + i.*c
+    // h = o.*output_activation(c)
+    // state = [h;c]
+    for (size_t i=0; i < units; ++i) {
+        yc[i] = yf[i]*c_tm1[i] + yi[i]*yc[i];
+        state[units+i] = yc[i];
+    }
+
+    output_activation(yc, units);
+
+    for (size_t i=0; i < units; ++i) {
+        state[i] = yo[i]*yc[i];
+    }
+
+}
+
+
+/**
+ * Long Short-Term Memory (LSTM) layer, with 16 bit floating point kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param state: array[2*units] recurrent state.
+ * :param kernel: 16 bit kernel tensor.
+ * :param recurrent_kernel: 16 bit recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[(min(timesteps,K2C_RNN_BLOCK)+1)*4*units] working storage.
+ * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
+ * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_lstm_h(k2c_tensor* output, const k2c_tensor* input, float state[],
+                const k2c_htensor* kernel, const k2c_htensor* recurrent_kernel,
+                const k2c_tensor* bias, float fwork[], const int go_backwards,
+                const int return_sequences, k2c_activationType *recurrent_activation,
+                k2c_activationType *output_activation) {
+
+
+    const size_t in_height = input->shape[0];
+    const size_t in_width = input->shape[1];
+    const size_t units = recurrent_kernel->shape[0];
+    // the input product does not depend on the state, so it is found for
+    // K2C_RNN_BLOCK timesteps at a time with one matrix product, before the
+    // recurrence over them
+    float *x = &fwork[4*units];
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        k2c_affine_matmul_h(x, &input->array[first*in_width], kernel->array, kernel->format, bias->array,
+                            nt, 4*units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_lstmcell_h(state, &x[i*4*units], recurrent_kernel, fwork,
+                           recurrent_activation, output_activation);
+            if (return_sequences) {
+                for (size_t j=0; j<units; ++j) {
+                    output->array[t*units+j] = state[j];
+                }
+            }
+        }
+    }
+    if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
+            output->array[i] = state[i];
+        }
+    }
+}
+
+
+/**
+ * Cell for the RNN layer, with 16 bit floating point kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param state: array[units] recurrent state.
+ * :param x: array[units] product of the input and kernel, plus bias, at this timestep.
+ * :param recurrent_kernel: 16 bit recurrent kernel tensor
+ * :param fwork: array[units] working storage.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_simpleRNNcell_h(float state[], const float x[], const k2c_htensor* recurrent_kernel,
+                         float fwork[], k2c_activationType *output_activation) {
+
     const size_t units = recurrent_kernel->shape[1];
 
-    if (go_backwards) {
-        for (int i=in_height-1; i>-1; --i) {
-            k2c_grucell(state, &input->array[i*in_width], kernel, recurrent_kernel, bias,
-                        fwork, reset_after, recurrent_activation, output_activation);
+    const size_t outrows = 1;
+    float *h = &fwork[0];
+    // h = state*recurrent_kernel + x
+    k2c_affine_matmul_h(h, state, recurrent_kernel->array, recurrent_kernel->format,
+                        x, outrows, units, units);
+    output_activation(h,units);
+
+    for (size_t i=0; i<units; ++i) {
+        state[i] = h[i];
+    }
+}
+
+
+/**
+ * Fully-connected RNN where the output is to be fed back to input, with 16 bit floating point kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param state: array[units] recurrent state.
+ * :param kernel: 16 bit kernel tensor.
+ * :param recurrent_kernel: 16 bit recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[(min(timesteps,K2C_RNN_BLOCK)+1)*units] working storage.
+ * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
+ * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_simpleRNN_h(k2c_tensor* output, const k2c_tensor* input, float state[],
+                     const k2c_htensor* kernel, const k2c_htensor* recurrent_kernel,
+                     const k2c_tensor* bias, float fwork[], const int go_backwards,
+                     const int return_sequences, k2c_activationType *output_activation) {
+
+    const size_t in_width = input->shape[1];
+    const size_t in_height = input->shape[0];
+    const size_t units = recurrent_kernel->shape[1];
+    // input product for K2C_RNN_BLOCK timesteps at a time, found before the
+    // recurrence over them
+    float *x = &fwork[units];
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        k2c_affine_matmul_h(x, &input->array[first*in_width], kernel->array, kernel->format, bias->array,
+                            nt, units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_simpleRNNcell_h(state, &x[i*units], recurrent_kernel, fwork, output_activation);
             if (return_sequences) {
                 for (size_t j=0; j<units; ++j) {
-                    output->array[(in_height-1-i)*units+j] = state[j];
+                    output->array[t*units+j] = state[j];
                 }
             }
         }
     }
+    if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
+            output->array[i] = state[i];
+        }
+    }
+}
+
+
+/**
+ * Cell for the GRU layer, with 16 bit floating point kernels.
+ * "units" is the dimension of the output space
+ * The gates are side by side in the order z, r, h. Without reset_after, the
+ * recurrent kernel holds the columns of z and r, then those of h.
+ *
+ * :param state: array[units] recurrent state.
+ * :param x: array[3*units] product of the input and kernel, plus input bias, at this timestep.
+ * :param recurrent_kernel: 16 bit recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[4*units] working storage.
+ * :param reset_after: whether to apply the reset gate before (0) or after (1) the matrix multiplication.
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_grucell_h(float state[], const float x[], const k2c_htensor* recurrent_kernel,
+                   const k2c_tensor* bias, float fwork[], const int reset_after,
+                   k2c_activationType *recurrent_activation,
+                   k2c_activationType *output_activation) {
+
+    const size_t units = recurrent_kernel->shape[0];
+
+    float *h_tm1 = &state[0];
+    const size_t outrows = 1;
+    // without reset_after only z and r are found from the state
+    const size_t Ucols = reset_after ? 3*units : 2*units;
+    const uint16_t * const Uh = &recurrent_kernel->array[2*units*units];
+    const float * const rb = &bias->array[3*units];
+    const float * const xh = &x[2*units];
+    float *y = &fwork[0];
+    float *yz = &y[0];
+    float *yr = &y[units];
+    float *yh = &y[2*units];
+    float *rh = &fwork[3*units];
+
+    //    y = h_tm1*recurrent_kernel + recurrent_bias
+    k2c_affine_matmul_h(y, h_tm1, recurrent_kernel->array, recurrent_kernel->format,
+                        rb, outrows, Ucols, units);
+
+    //    z = recurrent_activation(x_z + y_z)
+    //    r = recurrent_activation(x_r + y_r)
+    for (size_t i=0; i<2*units; ++i) {
+        y[i] = x[i] + y[i];
+    }
+    recurrent_activation(y, 2*units);
+
+    //    reset gate applied after/before matrix multiplication
+    if (reset_after) {
+        //        recurrent_h = r .* y_h
+        for (size_t i=0; i<units; ++i) {
+            yh[i] = yr[i] * yh[i];
+        }
+    }
     else {
-        for (int i=0; i<in_height; ++i) {
-            k2c_grucell(state, &input->array[i*in_width], kernel, recurrent_kernel, bias,
-                        fwork, reset_after, recurrent_activation, output_activation);
+        //        recurrent_h = (r .* h_tm1)*recurrent_kernel_h
+        for (size_t i=0; i<units; ++i) {
+            rh[i] = yr[i]*h_tm1[i];
+        }
+        k2c_affine_matmul_h(yh, rh, Uh, recurrent_kernel->format, NULL, outrows,
+                            units, units);
+    }
+    //    hh = output_activation(x_h + recurrent_h)
+    for (size_t i=0; i<units; ++i) {
+        yh[i] = xh[i] + yh[i];
+    }
+    output_activation(yh, units);
+
+    //    h = z .* h_tm1 + (1 - z) .* hh
+    for (size_t i=0; i<units; ++i) {
+        state[i] = yz[i] * h_tm1[i] + (1.0f-yz[i])*yh[i];
+    }
+}
+
+
+/**
+ * Gated Recurrent Unit, with 16 bit floating point kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param state: array[units] recurrent state.
+ * :param kernel: 16 bit kernel tensor.
+ * :param recurrent_kernel: 16 bit recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[(3*min(timesteps,K2C_RNN_BLOCK)+4)*units] working storage.
+ * :param reset_after: whether to apply the reset gate before (0) or after (1) the matrix multiplication.
+ * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
+ * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_gru_h(k2c_tensor* output, const k2c_tensor* input, float state[],
+               const k2c_htensor* kernel, const k2c_htensor* recurrent_kernel,
+               const k2c_tensor* bias, float fwork[], const int reset_after,
+               const int go_backwards, const int return_sequences,
+               k2c_activationType *recurrent_activation,
+               k2c_activationType *output_activation) {
+
+
+    const size_t in_width = input->shape[1];
+    const size_t in_height = input->shape[0];
+    const size_t units = recurrent_kernel->shape[0];
+    // input product for K2C_RNN_BLOCK timesteps at a time, found before the
+    // recurrence over them
+    float *x = &fwork[4*units];
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        k2c_affine_matmul_h(x, &input->array[first*in_width], kernel->array, kernel->format, bias->array,
+                            nt, 3*units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_grucell_h(state, &x[i*3*units], recurrent_kernel, bias, fwork, reset_after,
+                          recurrent_activation, output_activation);
             if (return_sequences) {
                 for (size_t j=0; j<units; ++j) {
-                    output->array[i*units+j] = state[j];
+                    output->array[t*units+j] = state[j];
                 }
             }
         }
     }
+    if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
+            output->array[i] = state[i];
+        }
+    }
+}
+
+
+/**
+ * Cell for the LSTM layer, with sparse kernels.
+ * "units" is the dimension of the output space
+ * The gates are side by side in the order i, f, o, c.
+ *
+ * :param state: array[2*units] recurrent state.
+ * :param x: array[4*units] product of the input and kernel, plus bias, at this timestep.
+ * :param recurrent_kernel: sparse recurrent kernel tensor
+ * :param fwork: array[4*units] working storage.
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_lstmcell_s(float state[], const float x[], const k2c_stensor* recurrent_kernel,
+                    float fwork[], k2c_activationType *recurrent_activation,
+                    k2c_activationType *output_activation) {
+
+
+    const size_t units = recurrent_kernel->shape[0];
+
+    float *h_tm1 = &state[0];  // previous memory state
+    float *c_tm1 = &state[units];  // previous carry state
+    const size_t outrows = 1;
+    float *y = &fwork[0];
+    float *yi = &y[0];
+    float *yf = &y[units];
+    float *yo = &y[2*units];
+    float *yc = &y[3*units];
+
+    // y = h_tm1*recurrent_kernel + x, for all gates at once
+    k2c_affine_matmul_s(y, h_tm1, recurrent_kernel->values, recurrent_kernel->indices,
+                        recurrent_kernel->indptr, x, outrows, 4*units, units);
+
+    // i, f and o are next to each other
+    recurrent_activation(y, 3*units);
+    output_activation(yc, units);
+
+    // c = f.*c_tm1 + i.*c
+    // h = o.*output_activation(c)
+    // state = [h;c]
+    for (size_t i=0; i < units; ++i) {
+        yc[i] = yf[i]*c_tm1[i] + yi[i]*yc[i];
+        state[units+i] = yc[i];
+    }
+
+    output_activation(yc, units);
 
+    for (size_t i=0; i < units; ++i) {
+        state[i] = yo[i]*yc[i];
+    }
+
+}
+
+
+/**
+ * Long Short-Term Memory (LSTM) layer, with sparse kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param state: array[2*units] recurrent state.
+ * :param kernel: sparse kernel tensor.
+ * :param recurrent_kernel: sparse recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[(min(timesteps,K2C_RNN_BLOCK)+1)*4*units] working storage.
+ * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
+ * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_lstm_s(k2c_tensor* output, const k2c_tensor* input, float state[],
+                const k2c_stensor* kernel, const k2c_stensor* recurrent_kernel,
+                const k2c_tensor* bias, float fwork[], const int go_backwards,
+                const int return_sequences, k2c_activationType *recurrent_activation,
+                k2c_activationType *output_activation) {
+
+
+    const size_t in_height = input->shape[0];
+    const size_t in_width = input->shape[1];
+    const size_t units = recurrent_kernel->shape[0];
+    // the input product does not depend on the state, so it is found for
+    // K2C_RNN_BLOCK timesteps at a time with one matrix product, before the
+    // recurrence over them
+    float *x = &fwork[4*units];
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        k2c_affine_matmul_s(x, &input->array[first*in_width], kernel->values, kernel->indices,
+                            kernel->indptr, bias->array, nt, 4*units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_lstmcell_s(state, &x[i*4*units], recurrent_kernel, fwork,
+                           recurrent_activation, output_activation);
+            if (return_sequences) {
+                for (size_t j=0; j<units; ++j) {
+                    output->array[t*units+j] = state[j];
+                }
+            }
+        }
+    }
     if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
+            output->array[i] = state[i];
+        }
+    }
+}
+
+
+/**
+ * Cell for the RNN layer, with sparse kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param state: array[units] recurrent state.
+ * :param x: array[units] product of the input and kernel, plus bias, at this timestep.
+ * :param recurrent_kernel: sparse recurrent kernel tensor
+ * :param fwork: array[units] working storage.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_simpleRNNcell_s(float state[], const float x[], const k2c_stensor* recurrent_kernel,
+                         float fwork[], k2c_activationType *output_activation) {
+
+    const size_t units = recurrent_kernel->shape[1];
+
+    const size_t outrows = 1;
+    float *h = &fwork[0];
+    // h = state*recurrent_kernel + x
+    k2c_affine_matmul_s(h, state, recurrent_kernel->values, recurrent_kernel->indices,
+                        recurrent_kernel->indptr, x, outrows, units, units);
+    output_activation(h,units);
+
+    for (size_t i=0; i<units; ++i) {
+        state[i] = h[i];
+    }
+}
+
+
+/**
+ * Fully-connected RNN where the output is to be fed back to input, with sparse kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param state: array[units] recurrent state.
+ * :param kernel: sparse kernel tensor.
+ * :param recurrent_kernel: sparse recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[(min(timesteps,K2C_RNN_BLOCK)+1)*units] working storage.
+ * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
+ * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_simpleRNN_s(k2c_tensor* output, const k2c_tensor* input, float state[],
+                     const k2c_stensor* kernel, const k2c_stensor* recurrent_kernel,
+                     const k2c_tensor* bias, float fwork[], const int go_backwards,
+                     const int return_sequences, k2c_activationType *output_activation) {
+
+    const size_t in_width = input->shape[1];
+    const size_t in_height = input->shape[0];
+    const size_t units = recurrent_kernel->shape[1];
+    // input product for K2C_RNN_BLOCK timesteps at a time, found before the
+    // recurrence over them
+    float *x = &fwork[units];
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        k2c_affine_matmul_s(x, &input->array[first*in_width], kernel->values, kernel->indices,
+                            kernel->indptr, bias->array, nt, units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_simpleRNNcell_s(state, &x[i*units], recurrent_kernel, fwork, output_activation);
+            if (return_sequences) {
+                for (size_t j=0; j<units; ++j) {
+                    output->array[t*units+j] = state[j];
+                }
+            }
+        }
+    }
+    if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
+            output->array[i] = state[i];
+        }
+    }
+}
+
+
+/**
+ * Cell for the GRU layer, with sparse kernels.
+ * "units" is the dimension of the output space
+ * The gates are side by side in the order z, r, h. Without reset_after, the
+ * recurrent kernel holds the columns of z and r, then those of h.
+ *
+ * :param state: array[units] recurrent state.
+ * :param x: array[3*units] product of the input and kernel, plus input bias, at this timestep.
+ * :param recurrent_kernel: sparse recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[4*units] working storage.
+ * :param reset_after: whether to apply the reset gate before (0) or after (1) the matrix multiplication.
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_grucell_s(float state[], const float x[], const k2c_stensor* recurrent_kernel,
+                   const k2c_tensor* bias, float fwork[], const int reset_after,
+                   k2c_activationType *recurrent_activation,
+                   k2c_activationType *output_activation) {
+
+    const size_t units = recurrent_kernel->shape[0];
+
+    float *h_tm1 = &state[0];
+    const size_t outrows = 1;
+    // without reset_after only z and r are found from the state
+    const size_t Ucols = reset_after ? 3*units : 2*units;
+    // rows of the columns of h start at an offset into indptr
+    const uint32_t * const Uh = &recurrent_kernel->indptr[units];
+    const float * const rb = &bias->array[3*units];
+    const float * const xh = &x[2*units];
+    float *y = &fwork[0];
+    float *yz = &y[0];
+    float *yr = &y[units];
+    float *yh = &y[2*units];
+    float *rh = &fwork[3*units];
+
+    //    y = h_tm1*recurrent_kernel + recurrent_bias
+    k2c_affine_matmul_s(y, h_tm1, recurrent_kernel->values, recurrent_kernel->indices,
+                        recurrent_kernel->indptr, rb, outrows, Ucols, units);
+
+    //    z = recurrent_activation(x_z + y_z)
+    //    r = recurrent_activation(x_r + y_r)
+    for (size_t i=0; i<2*units; ++i) {
+        y[i] = x[i] + y[i];
+    }
+    recurrent_activation(y, 2*units);
+
+    //    reset gate applied after/before matrix multiplication
+    if (reset_after) {
+        //        recurrent_h = r .* y_h
+        for (size_t i=0; i<units; ++i) {
+            yh[i] = yr[i] * yh[i];
+        }
+    }
+    else {
+        //        recurrent_h = (r .* h_tm1)*recurrent_kernel_h
         for (size_t i=0; i<units; ++i) {
+            rh[i] = yr[i]*h_tm1[i];
+        }
+        k2c_affine_matmul_s(yh, rh, recurrent_kernel->values, recurrent_kernel->indices, Uh,
+                            NULL, outrows, units, units);
+    }
+    //    hh = output_activation(x_h + recurrent_h)
+    for (size_t i=0; i<units; ++i) {
+        yh[i] = xh[i] + yh[i];
+    }
+    output_activation(yh, units);
+
+    //    h = z .* h_tm1 + (1 - z) .* hh
+    for (size_t i=0; i<units; ++i) {
+        state[i] = yz[i] * h_tm1[i] + (1.0f-yz[i])*yh[i];
+    }
+}
+
+
+/**
+ * Gated Recurrent Unit, with sparse kernels.
+ * "units" is the dimension of the output space
+ *
+ * :param output: output tensor.
+ * :param input: input tensor.
+ * :param state: array[units] recurrent state.
+ * :param kernel: sparse kernel tensor.
+ * :param recurrent_kernel: sparse recurrent kernel tensor
+ * :param bias: bias tensor.
+ * :param fwork: array[(3*min(timesteps,K2C_RNN_BLOCK)+4)*units] working storage.
+ * :param reset_after: whether to apply the reset gate before (0) or after (1) the matrix multiplication.
+ * :param go_backwards: whether to process input sequences forwards (1) or backwards (0).
+ * :param return_sequences: whether to return the last output in the output sequence (0), or the full sequence (1).
+ * :param recurrent_activation: activation function to apply to internal state.
+ * :param output_activation: activation function to apply to output.
+ */
+void k2c_gru_s(k2c_tensor* output, const k2c_tensor* input, float state[],
+               const k2c_stensor* kernel, const k2c_stensor* recurrent_kernel,
+               const k2c_tensor* bias, float fwork[], const int reset_after,
+               const int go_backwards, const int return_sequences,
+               k2c_activationType *recurrent_activation,
+               k2c_activationType *output_activation) {
+
+
+    const size_t in_width = input->shape[1];
+    const size_t in_height = input->shape[0];
+    const size_t units = recurrent_kernel->shape[0];
+    // input product for K2C_RNN_BLOCK timesteps at a time, found before the
+    // recurrence over them
+    float *x = &fwork[4*units];
+    for (size_t t0=0; t0 < in_height; t0 += K2C_RNN_BLOCK) {
+        const size_t nt = in_height-t0 < K2C_RNN_BLOCK ? in_height-t0 : K2C_RNN_BLOCK;
+        const size_t first = go_backwards ? in_height-t0-nt : t0;
+        k2c_affine_matmul_s(x, &input->array[first*in_width], kernel->values, kernel->indices,
+                            kernel->indptr, bias->array, nt, 3*units, in_width);
+        for (size_t t=t0; t < t0+nt; ++t) {
+            const size_t i = (go_backwards ? in_height-1-t : t) - first;
+            k2c_grucell_s(state, &x[i*3*units], recurrent_kernel, bias, fwork, reset_after,
+                          recurrent_activation, output_activation);
+            if (return_sequences) {
+                for (size_t j=0; j<units; ++j) {
+                    output->array[t*units+j] = state[j];
+                }
+            }
+        }
+    }
+    if (!return_sequences) {
+        for (size_t i=0; i < units; ++i) {
             output->array[i] = state[i];
         }
     }
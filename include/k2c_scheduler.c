@@ -0,0 +1,233 @@
+#if !defined(_WIN32) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 200809L
+#endif
+#include <stdlib.h>
+#include "k2c_include.h"
+
+/*
+ * A small pool of threads that runs the layers of a model as tasks, so that
+ * independent branches of the model are evaluated at the same time. The pool
+ * is shared by every model in the program. Each call to k2c_run_tasks keeps
+ * its own state, so several graphs (of the same model or of different ones)
+ * may run at once, with each calling thread running tasks of its own graph
+ * too. Without pthreads the tasks are run one after another, in order.
+ */
+#ifndef _WIN32
+#define K2C_THREADS
+#include <pthread.h>
+#include <unistd.h>
+#endif
+
+
+#ifdef K2C_THREADS
+
+/** Largest number of threads in the pool, besides the calling thread. */
+#define K2C_MAX_THREADS 64
+
+/** State of one call to k2c_run_tasks, guarded by k2c_pool.lock. */
+struct k2c_task_run {
+    const k2c_task_graph * graph;
+    void * args;
+    // number of unfinished tasks each task is waiting for
+    size_t * waiting;
+    // stack of tasks that are ready to run
+    size_t * queue;
+    size_t nqueued;
+    size_t nfinished;
+    // next graph being run
+    struct k2c_task_run * next;
+};
+
+static struct {
+    // held while the pool is being started or stopped
+    pthread_mutex_t start_lock;
+    // guards everything below
+    pthread_mutex_t lock;
+    // signalled when tasks are ready, a graph is finished or the pool is stopping
+    pthread_cond_t ready;
+    pthread_t threads[K2C_MAX_THREADS];
+    size_t nthreads;
+    size_t users;
+    int stop;
+    // graphs being run
+    struct k2c_task_run * runs;
+} k2c_pool = {PTHREAD_MUTEX_INITIALIZER, PTHREAD_MUTEX_INITIALIZER, PTHREAD_COND_INITIALIZER};
+
+
+/**
+ * Runs the next ready task of a graph, then marks the tasks waiting for it as ready.
+ * must be called with k2c_pool.lock held, which is released while the task runs.
+ */
+static void k2c_run_next_task(struct k2c_task_run * run) {
+
+    const size_t task = run->queue[--run->nqueued];
+    const k2c_task_graph * graph = run->graph;
+    pthread_mutex_unlock(&k2c_pool.lock);
+    graph->run(run->args, task);
+    pthread_mutex_lock(&k2c_pool.lock);
+
+    for (size_t i = graph->succ_start[task]; i < graph->succ_start[task+1]; ++i) {
+        const size_t next = graph->succ[i];
+        if (--run->waiting[next] == 0) {
+            run->queue[run->nqueued++] = next;
+        }
+    }
+    ++run->nfinished;
+    pthread_cond_broadcast(&k2c_pool.ready);
+}
+
+
+static void * k2c_worker(void * arg) {
+
+    (void) arg;
+    pthread_mutex_lock(&k2c_pool.lock);
+    while (!k2c_pool.stop) {
+        struct k2c_task_run * run = k2c_pool.runs;
+        while (run && run->nqueued == 0) {
+            run = run->next;
+        }
+        if (run) {
+            k2c_run_next_task(run);
+        }
+        else {
+            pthread_cond_wait(&k2c_pool.ready, &k2c_pool.lock);
+        }
+    }
+    pthread_mutex_unlock(&k2c_pool.lock);
+    return NULL;
+}
+
+#endif
+
+
+/**
+ * Starts the threads that run tasks.
+ * each call should be matched by a call to k2c_stop_threads. If threads are
+ * already running, more are started if needed but none are stopped.
+ *
+ * :param num_threads: number of threads to run tasks on, including the calling thread. 0 to use one per core.
+ */
+void k2c_start_threads(const size_t num_threads) {
+
+#ifdef K2C_THREADS
+    size_t n = num_threads;
+    if (n == 0) {
+        const long cores = sysconf(_SC_NPROCESSORS_ONLN);
+        n = cores > 0 ? (size_t) cores : 1;
+    }
+    pthread_mutex_lock(&k2c_pool.start_lock);
+    ++k2c_pool.users;
+    pthread_attr_t attr;
+    pthread_attr_init(&attr);
+    pthread_attr_setstacksize(&attr, K2C_TASK_STACK_SIZE);
+    pthread_mutex_lock(&k2c_pool.lock);
+    while (k2c_pool.nthreads + 1 < n && k2c_pool.nthreads < K2C_MAX_THREADS) {
+        if (pthread_create(&k2c_pool.threads[k2c_pool.nthreads], &attr, k2c_worker, NULL)) {
+            break;
+        }
+        ++k2c_pool.nthreads;
+    }
+    pthread_mutex_unlock(&k2c_pool.lock);
+    pthread_attr_destroy(&attr);
+    pthread_mutex_unlock(&k2c_pool.start_lock);
+#else
+    (void) num_threads;
+#endif
+}
+
+
+/**
+ * Stops the threads that run tasks.
+ * they are only stopped once every call to k2c_start_threads has been matched.
+ * Graphs still running finish on their calling threads.
+ */
+void k2c_stop_threads(void) {
+
+#ifdef K2C_THREADS
+    pthread_mutex_lock(&k2c_pool.start_lock);
+    if (k2c_pool.users > 0 && --k2c_pool.users == 0) {
+        pthread_mutex_lock(&k2c_pool.lock);
+        k2c_pool.stop = 1;
+        pthread_cond_broadcast(&k2c_pool.ready);
+        const size_t nthreads = k2c_pool.nthreads;
+        k2c_pool.nthreads = 0;
+        pthread_mutex_unlock(&k2c_pool.lock);
+        for (size_t i = 0; i < nthreads; ++i) {
+            pthread_join(k2c_pool.threads[i], NULL);
+        }
+        pthread_mutex_lock(&k2c_pool.lock);
+        k2c_pool.stop = 0;
+        pthread_mutex_unlock(&k2c_pool.lock);
+    }
+    pthread_mutex_unlock(&k2c_pool.start_lock);
+#endif
+}
+
+
+/**
+ * Runs every task of a graph, and waits for them to finish.
+ * tasks are run as soon as the tasks they wait for have finished, on the
+ * threads started by k2c_start_threads and the calling thread. If no threads
+ * were started, they are run in order on the calling thread.
+ * Calls from several threads may run at once, unless the graph has a lock,
+ * in which case calls running the same graph take turns.
+ *
+ * :param graph: tasks to run.
+ * :param args: arguments passed to each task.
+ */
+void k2c_run_tasks(const k2c_task_graph* graph, void* args) {
+
+#ifdef K2C_THREADS
+    if (graph->lock) {
+        pthread_mutex_lock(graph->lock);
+    }
+    struct k2c_task_run run = {graph, args, NULL, NULL, 0, 0, NULL};
+    pthread_mutex_lock(&k2c_pool.lock);
+    const int pooled = k2c_pool.nthreads > 0 && graph->ntasks > 1;
+    pthread_mutex_unlock(&k2c_pool.lock);
+    if (pooled) {
+        run.waiting = (size_t*) malloc(2*graph->ntasks*sizeof(size_t));
+    }
+    if (run.waiting) {
+        run.queue = &run.waiting[graph->ntasks];
+        // push in reverse, so the first tasks are taken first
+        for (size_t i = graph->ntasks; i-- > 0;) {
+            run.waiting[i] = graph->ndeps[i];
+            if (run.waiting[i] == 0) {
+                run.queue[run.nqueued++] = i;
+            }
+        }
+        pthread_mutex_lock(&k2c_pool.lock);
+        run.next = k2c_pool.runs;
+        k2c_pool.runs = &run;
+        pthread_cond_broadcast(&k2c_pool.ready);
+        while (run.nfinished < graph->ntasks) {
+            if (run.nqueued > 0) {
+                k2c_run_next_task(&run);
+            }
+            else {
+                pthread_cond_wait(&k2c_pool.ready, &k2c_pool.lock);
+            }
+        }
+        struct k2c_task_run ** prev = &k2c_pool.runs;
+        while (*prev != &run) {
+            prev = &(*prev)->next;
+        }
+        *prev = run.next;
+        pthread_mutex_unlock(&k2c_pool.lock);
+        free(run.waiting);
+    }
+    else {
+        for (size_t i = 0; i < graph->ntasks; ++i) {
+            graph->run(args, i);
+        }
+    }
+    if (graph->lock) {
+        pthread_mutex_unlock(graph->lock);
+    }
+#else
+    for (size_t i = 0; i < graph->ntasks; ++i) {
+        graph->run(args, i);
+    }
+#endif
+}
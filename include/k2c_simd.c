@@ -0,0 +1,344 @@
+#include <stdlib.h>
+#include <string.h>
+#include "k2c_include.h"
+#ifndef _WIN32
+#include <pthread.h>
+#else
+#include <windows.h>
+#endif
+
+/*
+ * Versions of the innermost kernels written with x86 intrinsics. Each one is
+ * compiled for its own instruction set with a target attribute, so the
+ * library itself can be built for any x86-64 machine, and k2c_simd_init
+ * picks the best version the CPU supports when the model is initialized.
+ * Other compilers and architectures only get the plain C versions.
+ */
+#if (defined(__GNUC__) || defined(__clang__)) && defined(__x86_64__) && \
+    K2C_GEMM_MR == 4 && K2C_GEMM_NR == 16 && K2C_GEMM_NC == 64
+#define K2C_X86_SIMD
+#include <immintrin.h>
+#endif
+
+
+k2c_gemm_kernelType * k2c_gemm_kernel = k2c_gemm_kernel_generic;
+k2c_gemv_kernelType * k2c_gemv_kernel = k2c_gemv_kernel_generic;
+
+
+#ifdef K2C_X86_SIMD
+
+/**
+ * Multiplies K2C_GEMM_MR rows of A by a packed block of B, with AVX2 and FMA.
+ * each row of the tile is held in two 8 wide registers.
+ *
+ * :param C: array[K2C_GEMM_MR] of pointers to the rows of the tile of the output.
+ * :param A: array[K2C_GEMM_MR] of pointers to the rows of the tile of input array 1.
+ * :param init: array[K2C_GEMM_MR] of pointers to the values to start each row from.
+ * :param Bp: block of input array 2, K2C_GEMM_NR cols wide.
+ * :param kb: number of cols of A and rows of Bp.
+ * :param ldb: stride between rows of Bp.
+ */
+__attribute__((target("avx2,fma")))
+static void k2c_gemm_kernel_avx2(float * const C[], const float * const A[],
+                                 const float * const init[], const float Bp[],
+                                 const size_t kb, const size_t ldb) {
+
+    __m256 c00 = _mm256_loadu_ps(init[0]);
+    __m256 c01 = _mm256_loadu_ps(init[0] + 8);
+    __m256 c10 = _mm256_loadu_ps(init[1]);
+    __m256 c11 = _mm256_loadu_ps(init[1] + 8);
+    __m256 c20 = _mm256_loadu_ps(init[2]);
+    __m256 c21 = _mm256_loadu_ps(init[2] + 8);
+    __m256 c30 = _mm256_loadu_ps(init[3]);
+    __m256 c31 = _mm256_loadu_ps(init[3] + 8);
+    for (size_t k = 0; k < kb; ++k) {
+        const __m256 b0 = _mm256_loadu_ps(&Bp[k*ldb]);
+        const __m256 b1 = _mm256_loadu_ps(&Bp[k*ldb + 8]);
+        __m256 a = _mm256_broadcast_ss(&A[0][k]);
+        c00 = _mm256_fmadd_ps(a, b0, c00);
+        c01 = _mm256_fmadd_ps(a, b1, c01);
+        a = _mm256_broadcast_ss(&A[1][k]);
+        c10 = _mm256_fmadd_ps(a, b0, c10);
+        c11 = _mm256_fmadd_ps(a, b1, c11);
+        a = _mm256_broadcast_ss(&A[2][k]);
+        c20 = _mm256_fmadd_ps(a, b0, c20);
+        c21 = _mm256_fmadd_ps(a, b1, c21);
+        a = _mm256_broadcast_ss(&A[3][k]);
+        c30 = _mm256_fmadd_ps(a, b0, c30);
+        c31 = _mm256_fmadd_ps(a, b1, c31);
+    }
+    _mm256_storeu_ps(C[0], c00);
+    _mm256_storeu_ps(C[0] + 8, c01);
+    _mm256_storeu_ps(C[1], c10);
+    _mm256_storeu_ps(C[1] + 8, c11);
+    _mm256_storeu_ps(C[2], c20);
+    _mm256_storeu_ps(C[2] + 8, c21);
+    _mm256_storeu_ps(C[3], c30);
+    _mm256_storeu_ps(C[3] + 8, c31);
+}
+
+
+/**
+ * Multiplies a row vector by a block of columns of B, with AVX2 and FMA.
+ * full blocks are held in eight 8 wide registers. partial blocks use masked
+ * loads and stores, which never touch memory past the last column.
+ *
+ * :param y: array[nc] output.
+ * :param x: array[innerdim] input vector.
+ * :param B: first column of the block of input array 2.
+ * :param init: array[nc] to start y from, NULL to start from zero.
+ * :param nc: number of cols in the block, at most K2C_GEMM_NC.
+ * :param innerdim: length of x and number of rows of B.
+ * :param ldb: stride between rows of B.
+ */
+__attribute__((target("avx2,fma")))
+static void k2c_gemv_kernel_avx2(float y[], const float x[], const float B[],
+                                 const float init[], const size_t nc,
+                                 const size_t innerdim, const size_t ldb) {
+
+    if (nc < K2C_GEMM_NC) {
+        // each 8 wide chunk is done on its own, with four rows of B at a time
+        // going to separate accumulators to hide the latency of the FMAs
+        const __m256i iota = _mm256_setr_epi32(0, 1, 2, 3, 4, 5, 6, 7);
+        for (size_t j = 0; j < nc; j += 8) {
+            const __m256i mask = _mm256_cmpgt_epi32(_mm256_set1_epi32((int) (nc - j)), iota);
+            __m256 acc0 = init ? _mm256_maskload_ps(&init[j], mask) : _mm256_setzero_ps();
+            __m256 acc1 = _mm256_setzero_ps();
+            __m256 acc2 = _mm256_setzero_ps();
+            __m256 acc3 = _mm256_setzero_ps();
+            size_t k = 0;
+            for (; k + 4 <= innerdim; k += 4) {
+                acc0 = _mm256_fmadd_ps(_mm256_broadcast_ss(&x[k]),
+                                       _mm256_maskload_ps(&B[k*ldb + j], mask), acc0);
+                acc1 = _mm256_fmadd_ps(_mm256_broadcast_ss(&x[k+1]),
+                                       _mm256_maskload_ps(&B[(k+1)*ldb + j], mask), acc1);
+                acc2 = _mm256_fmadd_ps(_mm256_broadcast_ss(&x[k+2]),
+                                       _mm256_maskload_ps(&B[(k+2)*ldb + j], mask), acc2);
+                acc3 = _mm256_fmadd_ps(_mm256_broadcast_ss(&x[k+3]),
+                                       _mm256_maskload_ps(&B[(k+3)*ldb + j], mask), acc3);
+            }
+            for (; k < innerdim; ++k) {
+                acc0 = _mm256_fmadd_ps(_mm256_broadcast_ss(&x[k]),
+                                       _mm256_maskload_ps(&B[k*ldb + j], mask), acc0);
+            }
+            acc0 = _mm256_add_ps(_mm256_add_ps(acc0, acc1), _mm256_add_ps(acc2, acc3));
+            _mm256_maskstore_ps(&y[j], mask, acc0);
+        }
+        return;
+    }
+    __m256 acc[8];
+    for (size_t j = 0; j < 8; ++j) {
+        acc[j] = init ? _mm256_loadu_ps(&init[8*j]) : _mm256_setzero_ps();
+    }
+    for (size_t k = 0; k < innerdim; ++k) {
+        const __m256 a = _mm256_broadcast_ss(&x[k]);
+        const float * Bk = &B[k*ldb];
+        for (size_t j = 0; j < 8; ++j) {
+            acc[j] = _mm256_fmadd_ps(a, _mm256_loadu_ps(&Bk[8*j]), acc[j]);
+        }
+    }
+    for (size_t j = 0; j < 8; ++j) {
+        _mm256_storeu_ps(&y[8*j], acc[j]);
+    }
+}
+
+
+/**
+ * Multiplies K2C_GEMM_MR rows of A by a packed block of B, with AVX-512.
+ * each row of the tile fits in one 16 wide register. even and odd rows of B
+ * go to separate accumulators, so there are enough independent sums to keep
+ * both FMA units busy.
+ *
+ * :param C: array[K2C_GEMM_MR] of pointers to the rows of the tile of the output.
+ * :param A: array[K2C_GEMM_MR] of pointers to the rows of the tile of input array 1.
+ * :param init: array[K2C_GEMM_MR] of pointers to the values to start each row from.
+ * :param Bp: block of input array 2, K2C_GEMM_NR cols wide.
+ * :param kb: number of cols of A and rows of Bp.
+ * :param ldb: stride between rows of Bp.
+ */
+__attribute__((target("avx512f")))
+static void k2c_gemm_kernel_avx512(float * const C[], const float * const A[],
+                                   const float * const init[], const float Bp[],
+                                   const size_t kb, const size_t ldb) {
+
+    __m512 c0 = _mm512_loadu_ps(init[0]);
+    __m512 c1 = _mm512_loadu_ps(init[1]);
+    __m512 c2 = _mm512_loadu_ps(init[2]);
+    __m512 c3 = _mm512_loadu_ps(init[3]);
+    __m512 d0 = _mm512_setzero_ps();
+    __m512 d1 = _mm512_setzero_ps();
+    __m512 d2 = _mm512_setzero_ps();
+    __m512 d3 = _mm512_setzero_ps();
+    size_t k = 0;
+    for (; k + 2 <= kb; k += 2) {
+        const __m512 b0 = _mm512_loadu_ps(&Bp[k*ldb]);
+        const __m512 b1 = _mm512_loadu_ps(&Bp[(k+1)*ldb]);
+        c0 = _mm512_fmadd_ps(_mm512_set1_ps(A[0][k]), b0, c0);
+        c1 = _mm512_fmadd_ps(_mm512_set1_ps(A[1][k]), b0, c1);
+        c2 = _mm512_fmadd_ps(_mm512_set1_ps(A[2][k]), b0, c2);
+        c3 = _mm512_fmadd_ps(_mm512_set1_ps(A[3][k]), b0, c3);
+        d0 = _mm512_fmadd_ps(_mm512_set1_ps(A[0][k+1]), b1, d0);
+        d1 = _mm512_fmadd_ps(_mm512_set1_ps(A[1][k+1]), b1, d1);
+        d2 = _mm512_fmadd_ps(_mm512_set1_ps(A[2][k+1]), b1, d2);
+        d3 = _mm512_fmadd_ps(_mm512_set1_ps(A[3][k+1]), b1, d3);
+    }
+    if (k < kb) {
+        const __m512 b0 = _mm512_loadu_ps(&Bp[k*ldb]);
+        c0 = _mm512_fmadd_ps(_mm512_set1_ps(A[0][k]), b0, c0);
+        c1 = _mm512_fmadd_ps(_mm512_set1_ps(A[1][k]), b0, c1);
+        c2 = _mm512_fmadd_ps(_mm512_set1_ps(A[2][k]), b0, c2);
+        c3 = _mm512_fmadd_ps(_mm512_set1_ps(A[3][k]), b0, c3);
+    }
+    _mm512_storeu_ps(C[0], _mm512_add_ps(c0, d0));
+    _mm512_storeu_ps(C[1], _mm512_add_ps(c1, d1));
+    _mm512_storeu_ps(C[2], _mm512_add_ps(c2, d2));
+    _mm512_storeu_ps(C[3], _mm512_add_ps(c3, d3));
+}
+
+
+/**
+ * Multiplies a row vector by a block of columns of B, with AVX-512.
+ * full blocks are held in four 16 wide registers, with even and odd rows of
+ * B accumulated separately. partial blocks use masked loads and stores.
+ *
+ * :param y: array[nc] output.
+ * :param x: array[innerdim] input vector.
+ * :param B: first column of the block of input array 2.
+ * :param init: array[nc] to start y from, NULL to start from zero.
+ * :param nc: number of cols in the block, at most K2C_GEMM_NC.
+ * :param innerdim: length of x and number of rows of B.
+ * :param ldb: stride between rows of B.
+ */
+__attribute__((target("avx512f")))
+static void k2c_gemv_kernel_avx512(float y[], const float x[], const float B[],
+                                   const float init[], const size_t nc,
+                                   const size_t innerdim, const size_t ldb) {
+
+    if (nc < K2C_GEMM_NC) {
+        // each 16 wide chunk is done on its own, with four rows of B at a time
+        // going to separate accumulators to hide the latency of the FMAs
+        for (size_t j = 0; j < nc; j += 16) {
+            const __mmask16 mask = nc - j >= 16 ? 0xFFFF : (__mmask16) ((1u << (nc - j)) - 1);
+            __m512 acc0 = init ? _mm512_maskz_loadu_ps(mask, &init[j]) : _mm512_setzero_ps();
+            __m512 acc1 = _mm512_setzero_ps();
+            __m512 acc2 = _mm512_setzero_ps();
+            __m512 acc3 = _mm512_setzero_ps();
+            size_t k = 0;
+            for (; k + 4 <= innerdim; k += 4) {
+                acc0 = _mm512_fmadd_ps(_mm512_set1_ps(x[k]),
+                                       _mm512_maskz_loadu_ps(mask, &B[k*ldb + j]), acc0);
+                acc1 = _mm512_fmadd_ps(_mm512_set1_ps(x[k+1]),
+                                       _mm512_maskz_loadu_ps(mask, &B[(k+1)*ldb + j]), acc1);
+                acc2 = _mm512_fmadd_ps(_mm512_set1_ps(x[k+2]),
+                                       _mm512_maskz_loadu_ps(mask, &B[(k+2)*ldb + j]), acc2);
+                acc3 = _mm512_fmadd_ps(_mm512_set1_ps(x[k+3]),
+                                       _mm512_maskz_loadu_ps(mask, &B[(k+3)*ldb + j]), acc3);
+            }
+            for (; k < innerdim; ++k) {
+                acc0 = _mm512_fmadd_ps(_mm512_set1_ps(x[k]),
+                                       _mm512_maskz_loadu_ps(mask, &B[k*ldb + j]), acc0);
+            }
+            acc0 = _mm512_add_ps(_mm512_add_ps(acc0, acc1), _mm512_add_ps(acc2, acc3));
+            _mm512_mask_storeu_ps(&y[j], mask, acc0);
+        }
+        return;
+    }
+    __m512 acc[4];
+    __m512 odd[4];
+    for (size_t j = 0; j < 4; ++j) {
+        acc[j] = init ? _mm512_loadu_ps(&init[16*j]) : _mm512_setzero_ps();
+        odd[j] = _mm512_setzero_ps();
+    }
+    size_t k = 0;
+    for (; k + 2 <= innerdim; k += 2) {
+        const __m512 a0 = _mm512_set1_ps(x[k]);
+        const __m512 a1 = _mm512_set1_ps(x[k+1]);
+        const float * B0 = &B[k*ldb];
+        const float * B1 = &B[(k+1)*ldb];
+        for (size_t j = 0; j < 4; ++j) {
+            acc[j] = _mm512_fmadd_ps(a0, _mm512_loadu_ps(&B0[16*j]), acc[j]);
+            odd[j] = _mm512_fmadd_ps(a1, _mm512_loadu_ps(&B1[16*j]), odd[j]);
+        }
+    }
+    if (k < innerdim) {
+        const __m512 a0 = _mm512_set1_ps(x[k]);
+        for (size_t j = 0; j < 4; ++j) {
+            acc[j] = _mm512_fmadd_ps(a0, _mm512_loadu_ps(&B[k*ldb + 16*j]), acc[j]);
+        }
+    }
+    for (size_t j = 0; j < 4; ++j) {
+        _mm512_storeu_ps(&y[16*j], _mm512_add_ps(acc[j], odd[j]));
+    }
+}
+
+#endif
+
+
+/** Instruction set chosen by k2c_simd_choose. */
+static k2c_simd_level k2c_simd_chosen = K2C_SIMD_GENERIC;
+
+
+/**
+ * Chooses the versions of the innermost kernels to use, and sets the kernel pointers.
+ * the best instruction set supported by the CPU is used, unless the
+ * environment variable K2C_SIMD is set to "generic" or "avx2" to limit it.
+ */
+static void k2c_simd_choose(void) {
+
+    k2c_simd_level level = K2C_SIMD_GENERIC;
+#ifdef K2C_X86_SIMD
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma")) {
+        level = K2C_SIMD_AVX2;
+        if (__builtin_cpu_supports("avx512f")) {
+            level = K2C_SIMD_AVX512;
+        }
+    }
+#endif
+    const char * limit = getenv("K2C_SIMD");
+    if (limit && strcmp(limit, "generic") == 0) {
+        level = K2C_SIMD_GENERIC;
+    }
+    else if (limit && strcmp(limit, "avx2") == 0 && level > K2C_SIMD_AVX2) {
+        level = K2C_SIMD_AVX2;
+    }
+
+#ifdef K2C_X86_SIMD
+    if (level == K2C_SIMD_AVX2) {
+        k2c_gemm_kernel = k2c_gemm_kernel_avx2;
+        k2c_gemv_kernel = k2c_gemv_kernel_avx2;
+    }
+    else if (level == K2C_SIMD_AVX512) {
+        k2c_gemm_kernel = k2c_gemm_kernel_avx512;
+        k2c_gemv_kernel = k2c_gemv_kernel_avx512;
+    }
+#endif
+    k2c_simd_chosen = level;
+}
+
+
+/**
+ * Chooses the versions of the innermost kernels to use.
+ * the choice is made once per program, the first time this is called, so
+ * models may be initialized from several threads at once while others run.
+ * Called by the initialize function of each model, calling it again is harmless.
+ *
+ * :return: instruction set that was chosen.
+ */
+k2c_simd_level k2c_simd_init(void) {
+
+#ifndef _WIN32
+    static pthread_once_t once = PTHREAD_ONCE_INIT;
+    pthread_once(&once, k2c_simd_choose);
+#else
+    static volatile LONG once = 0;
+    if (InterlockedCompareExchange(&once, 1, 0) == 0) {
+        k2c_simd_choose();
+        InterlockedExchange(&once, 2);
+    }
+    while (once != 2) {
+        YieldProcessor();
+    }
+#endif
+    return k2c_simd_chosen;
+}
@@ -1,5 +1,6 @@
 #pragma once
 #include <stdlib.h>
+#include <stdint.h>
 
 
 /**
@@ -9,6 +10,21 @@
 #define K2C_MAX_NDIM 5
 
 
+/**
+ * Layouts of the array of a tensor.
+ * K2C_ROW_MAJOR is the layout used by keras. K2C_PACKED is used for read only
+ * 2D kernels, which are stored as panels of K2C_GEMM_NC columns, see
+ * k2c_affine_matmul_p. Recurrent kernels are packed one gate at a time.
+ */
+enum k2c_layout
+{
+    K2C_ROW_MAJOR,
+    K2C_PACKED
+};
+
+typedef enum k2c_layout k2c_layout;
+
+
 /**
  * tensor type for keras2c.
  */
@@ -25,6 +41,153 @@ struct k2c_tensor
 
     /** Array, size of the tensor in each dimension. */
     size_t shape[K2C_MAX_NDIM];
+
+    /** Layout of the array, K2C_ROW_MAJOR unless given. */
+    k2c_layout layout;
 };
 
 typedef struct k2c_tensor k2c_tensor;
+
+
+/**
+ * int8 quantized tensor type for keras2c.
+ * Used for read only weights. Element i of the last axis of the tensor has
+ * value array[...,i]*scale[i].
+ */
+struct k2c_qtensor
+{
+    /** Pointer to array of quantized tensor values. */
+    const int8_t *array;
+
+    /** Rank of the tensor (number of dimensions). */
+    size_t ndim;
+
+    /** Number of elements in the tensor. */
+    size_t numel;
+
+    /** Array, size of the tensor in each dimension. */
+    size_t shape[K2C_MAX_NDIM];
+
+    /** Array[shape[ndim-1]], scale of each slice along the last axis. */
+    const float *scale;
+};
+
+typedef struct k2c_qtensor k2c_qtensor;
+
+
+/**
+ * Formats of 16 bit floating point values.
+ * K2C_FLOAT16 is IEEE 754 half precision, K2C_BFLOAT16 is the upper half of a float.
+ */
+enum k2c_half_format
+{
+    K2C_FLOAT16,
+    K2C_BFLOAT16
+};
+
+typedef enum k2c_half_format k2c_half_format;
+
+
+/**
+ * 16 bit floating point tensor type for keras2c.
+ * Used for read only weights, which are converted to float as they are used.
+ */
+struct k2c_htensor
+{
+    /** Pointer to array of 16 bit tensor values. */
+    const uint16_t *array;
+
+    /** Rank of the tensor (number of dimensions). */
+    size_t ndim;
+
+    /** Number of elements in the tensor. */
+    size_t numel;
+
+    /** Array, size of the tensor in each dimension. */
+    size_t shape[K2C_MAX_NDIM];
+
+    /** Format of the values in array. */
+    k2c_half_format format;
+};
+
+typedef struct k2c_htensor k2c_htensor;
+
+
+/**
+ * sparse tensor type for keras2c.
+ * Used for read only 2D weights, stored in compressed sparse row (CSR) format.
+ * The nonzeros of row i are values[indptr[i]:indptr[i+1]], in columns indices[indptr[i]:indptr[i+1]].
+ */
+struct k2c_stensor
+{
+    /** Pointer to array of nonzero tensor values. */
+    const float *values;
+
+    /** Pointer to array of column indices of the nonzero values. */
+    const uint32_t *indices;
+
+    /** Pointer to array[shape[0]+1] of offsets of the start of each row in values. */
+    const uint32_t *indptr;
+
+    /** Rank of the tensor (number of dimensions). */
+    size_t ndim;
+
+    /** Number of elements in the tensor, including zeros. */
+    size_t numel;
+
+    /** Array, size of the tensor in each dimension. */
+    size_t shape[K2C_MAX_NDIM];
+};
+
+typedef struct k2c_stensor k2c_stensor;
+
+
+/**
+ * Function that evaluates one task of a model.
+ * Takes the arguments of the call to the model, and the number of the task.
+ */
+typedef void k2c_taskType(void * args, const size_t task);
+
+
+/**
+ * Lock that makes calls running the same task graph take turns.
+ * Initialized with K2C_TASK_LOCK_INIT.
+ */
+#ifndef _WIN32
+#include <pthread.h>
+typedef pthread_mutex_t k2c_task_lock;
+#define K2C_TASK_LOCK_INIT PTHREAD_MUTEX_INITIALIZER
+#else
+typedef int k2c_task_lock;
+#define K2C_TASK_LOCK_INIT 0
+#endif
+
+
+/**
+ * task graph type for keras2c.
+ * Tasks are numbered in an order in which they can be run one after another.
+ * Task i can start once ndeps[i] other tasks have finished, and the tasks
+ * waiting for it are succ[succ_start[i]:succ_start[i+1]].
+ */
+struct k2c_task_graph
+{
+    /** Function that evaluates each task. */
+    k2c_taskType *run;
+
+    /** Number of tasks. */
+    size_t ntasks;
+
+    /** Pointer to array[ntasks] of the number of tasks each task waits for. */
+    const size_t *ndeps;
+
+    /** Pointer to array[ntasks+1] of offsets of the start of the successors of each task in succ. */
+    const size_t *succ_start;
+
+    /** Pointer to array of the tasks waiting for each task. */
+    const size_t *succ;
+
+    /** Pointer to lock held while the graph runs, for models whose calls share state. NULL if calls may run at once. */
+    k2c_task_lock *lock;
+};
+
+typedef struct k2c_task_graph k2c_task_graph;
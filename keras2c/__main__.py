@@ -4,6 +4,7 @@ Runs keras2c
 """
 import argparse
 import sys
+import numpy as np
 from keras2c.keras2c_main import k2c
 
 
@@ -25,7 +26,37 @@ def parse_args(args):
     parser.add_argument(
         "function_name", help="What to name the resulting C function")
     parser.add_argument("-m", "--malloc", action="store_true",
-                        help="""Use dynamic memory for large arrays. Weights will be saved to .csv files that will be loaded at runtime""")
+                        help="""Use dynamic memory for large arrays. Weights will be saved to a binary file that will be mapped into memory at runtime""")
+    parser.add_argument("-s", "--static_weights", action="store_true",
+                        help="""Store weights as static const arrays at file scope instead of on the stack""")
+    parser.add_argument("-p", "--plan_memory", action="store_true",
+                        help="""Share memory between intermediate tensors that are not in use at the same time""")
+    parser.add_argument("-w", "--separate_weights", action="store_true",
+                        help="""Write weights to a separate source file that only needs to be compiled once""")
+    parser.add_argument("-b", "--batch_size", type=int,
+                        help="""Also write a batched function that evaluates this many samples at a time""", metavar='')
+    parser.add_argument("-c", "--cache_dir",
+                        help="""Directory in which to cache converted models, so unchanged models are not converted again""", metavar='')
+    parser.add_argument("-r", "--reentrant", action="store_true",
+                        help="""Keep all mutable state in a context passed to each call, so several threads can run the model at once""")
+    parser.add_argument("-q", "--quantize", choices=['per_tensor', 'per_channel'],
+                        help="""Store kernels of Dense and Conv layers as int8, with one scale per tensor or per output channel""")
+    parser.add_argument("-d", "--calibration_data",
+                        help="""File path to a .npy file of representative inputs, used to calibrate quantized layers""", metavar='')
+    parser.add_argument("-f", "--weight_dtype", choices=['float16', 'bfloat16'],
+                        help="""Store kernels of Dense, Conv and recurrent layers as 16 bit floats""")
+    parser.add_argument("-z", "--sparse_threshold", type=float,
+                        help="""Store kernels of Dense and recurrent layers with at least this fraction of zeros in sparse format""", metavar='')
+    parser.add_argument("-k", "--specialize", action="store_true",
+                        help="""Write kernels for Dense and Conv layers with their sizes as constants""")
+    parser.add_argument("-l", "--pack_weights", action="store_true",
+                        help="""Store kernels of Dense and recurrent layers in the panel layout used by the matrix multiplication""")
+    parser.add_argument("-j", "--num_threads", type=int,
+                        help="""Number of threads used by large layers, if the library is built with OpenMP""", metavar='')
+    parser.add_argument("-g", "--parallel_layers", action="store_true",
+                        help="""Run independent branches of the model at the same time, on a pool of threads""")
+    parser.add_argument("-a", "--conv_algorithm", choices=['direct', 'im2col', 'winograd', 'auto'],
+                        help="""How Conv layers are evaluated: at each output position in turn, as one matrix product of the patches under the kernel, by Winograd convolution for 3x3 Conv2D layers, or chosen for each layer by its size. Default is direct""")
     parser.add_argument("-t", "--num_tests", type=int,
                         help="""Number of tests to generate. Default is 10""", metavar='')
 
@@ -43,8 +74,19 @@ def main(args=sys.argv[1:]):
         num_tests = args.num_tests
     else:
         num_tests = 10
+    calibration_data = None
+    if args.calibration_data:
+        calibration_data = np.load(args.calibration_data)
 
-    k2c(args.model_path, args.function_name, malloc, num_tests)
+    k2c(args.model_path, args.function_name, malloc, num_tests,
+        static_weights=args.static_weights, plan_memory=args.plan_memory,
+        batch_size=args.batch_size, separate_weights=args.separate_weights,
+        cache_dir=args.cache_dir, reentrant=args.reentrant,
+        quantize=args.quantize, calibration_data=calibration_data,
+        weight_dtype=args.weight_dtype, sparse_threshold=args.sparse_threshold,
+        specialize=args.specialize, pack_weights=args.pack_weights,
+        num_threads=args.num_threads, parallel_layers=args.parallel_layers,
+        conv_algorithm=args.conv_algorithm or 'direct')
 
 
 if __name__ == '__main__':
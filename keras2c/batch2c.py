@@ -0,0 +1,244 @@
+"""batch2c.py
+This file is part of keras2c
+Writes a version of the main function that evaluates many samples per call
+"""
+
+# imports
+import numpy as np
+from keras2c.io_parsing import layer_type, get_model_schedule, flatten
+from keras2c.layer2c import Layers2C
+from keras2c.memory_planner import get_tensor_aliases
+import tensorflow as tf
+tf.compat.v1.disable_eager_execution()
+maxndim = 5
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+class Batch2C(Layers2C):
+    """Writes the layers of the batched function
+
+    Samples are processed in chunks of batch_size. Dense layers are evaluated
+    for the whole chunk at once as a single matrix-matrix product, so each
+    weight is loaded once per chunk instead of once per sample. All other
+    layers are evaluated one sample at a time, with runs of consecutive
+    per sample layers fused into a single loop over the chunk.
+    """
+
+    def __init__(self, model, function_name, malloc, weights, batch_size,
+                 specialize=False):
+        super().__init__(model, malloc, weights.activation_scales,
+                         weights.half_kernels, weights.sparse_layers, specialize,
+                         weights.packed_kernels, weights.im2col_layers,
+                         weights.winograd_layers)
+        self.function_name = function_name
+        self.weights = weights
+        self.batch_size = int(batch_size)
+        self.aliases = get_tensor_aliases(model, weights.buffers)
+        self.sample_shapes = {}
+        for inp, tensor in zip(self.model_inputs, model.inputs):
+            self.sample_shapes[inp] = [int(i) for i in tensor.shape[1:]]
+        for outp, tensor in zip(self.model_outputs, model.outputs):
+            self.sample_shapes[outp] = [int(i) for i in tensor.shape[1:]]
+        for layer, _, outp, i in get_model_schedule(model):
+            tensors = flatten(layer.get_output_at(i))
+            for node, tensor in zip(flatten(outp), tensors):
+                self.sample_shapes.setdefault(
+                    node, [int(j) for j in tensor.shape[1:]])
+
+    def root(self, node):
+        return self.aliases.get(node, node)
+
+    def write_recurrent_reset(self, layer):
+        # state of non stateful layers starts from zero for every sample
+        if not layer.get_config()['stateful']:
+            self.layers += 'memset(' + layer.name + '_state,0,sizeof(' + \
+                layer.name + '_state)); \n'
+
+    def write_layer_LSTM(self, layer, inputs, outputs, i):
+        self.write_recurrent_reset(layer)
+        super().write_layer_LSTM(layer, inputs, outputs, i)
+
+    def write_layer_GRU(self, layer, inputs, outputs, i):
+        self.write_recurrent_reset(layer)
+        super().write_layer_GRU(layer, inputs, outputs, i)
+
+    def write_layer_SimpleRNN(self, layer, inputs, outputs, i):
+        self.write_recurrent_reset(layer)
+        super().write_layer_SimpleRNN(layer, inputs, outputs, i)
+
+    def is_rename(self, layer, outp):
+        # layers that do no work, since their output is a view of their input
+        # and all of their consumers make their own views
+        if layer_type(layer) in ['Activation', 'LeakyReLU', 'ReLU', 'ELU',
+                                 'PReLU', 'ThresholdedReLU'] and \
+           layer not in self.fused_activations:
+            return False
+        return all(node in self.aliases or node in self.output_redirects.values()
+                   for node in flatten(outp))
+
+    def get_segments(self):
+        segments = []
+        for step in get_model_schedule(self.model):
+            layer = step[0]
+            if layer_type(layer) in ['Input', 'InputLayer']:
+                continue
+            # quantized layers are evaluated one sample at a time
+            batched = layer_type(layer) == 'Dense' and \
+                layer.name not in self.quantized
+            if batched or not segments or segments[-1][0]:
+                segments.append((batched, [step]))
+            else:
+                segments[-1][1].append(step)
+        return segments
+
+    def sample_ptr(self, node, sample, offsets):
+        per = str(int(np.prod(self.sample_shapes[node])))
+        if node in self.model_inputs:
+            return '&' + node + '_input_batch->array[(b0+' + sample + ')*' + \
+                per + ']'
+        if node in self.model_outputs:
+            return '&' + node + '_output_batch->array[(b0+' + sample + ')*' + \
+                per + ']'
+        return '&batch_workspace[' + str(offsets[node + '_output']) + '+' + \
+            sample + '*' + per + ']'
+
+    def write_batched_Dense(self, layer, inputs, outputs, i, offsets):
+        nm = layer.name
+        inshp = [int(j) for j in layer.get_input_at(i).shape[1:]]
+        outshp = [int(j) for j in layer.get_output_at(i).shape[1:]]
+        rows = str(int(np.prod(inshp[:-1])))
+        activation = self.get_kernel_activation(layer)
+        s = '{ \n'
+        s += 'k2c_tensor ' + nm + '_batch_input = {' + \
+            self.sample_ptr(self.root(inputs), '0', offsets) + ',2,nb*' + \
+            str(int(np.prod(inshp))) + ',{nb*' + rows + ',' + \
+            str(inshp[-1]) + ',1,1,1}}; \n'
+        s += 'k2c_tensor ' + nm + '_batch_output = {' + \
+            self.sample_ptr(self.root(outputs), '0', offsets) + ',2,nb*' + \
+            str(int(np.prod(outshp))) + ',{nb*' + rows + ',' + \
+            str(outshp[-1]) + ',1,1,1}}; \n'
+        if self.get_kernel_suffix(layer):
+            s += 'k2c_dense' + self.get_kernel_suffix(layer) + '(&' + nm + \
+                '_batch_output,&' + nm + '_batch_input,&' + nm + '_kernel, \n\t&' + \
+                nm + '_bias,' + activation + '); \n'
+        elif self.is_specialized(layer):
+            fname, rows = self.write_specialized_Dense(layer, i, activation)
+            s += fname + '(' + nm + '_batch_output.array,' + nm + \
+                '_batch_input.array,' + nm + '_kernel.array, \n\t' + nm + \
+                '_bias.array,nb*' + str(rows) + '); \n'
+        else:
+            s += 'k2c_dense(&' + nm + '_batch_output,&' + nm + '_batch_input,&' + \
+                nm + '_kernel, \n\t&' + nm + '_bias,' + activation + ',NULL); \n'
+        fused = self.activation_fusions.get(nm)
+        if fused is not None and layer_type(fused) == 'PReLU':
+            # alpha is per sample
+            per = str(int(np.prod(outshp)))
+            s += 'for (size_t b = 0; b < nb; ++b) { \n'
+            s += 'k2c_PReLU(&' + nm + '_batch_output.array[b*' + per + '],' + \
+                per + ',' + fused.name + '_alpha.array); \n'
+            s += '} \n'
+        else:
+            self.layers = ''
+            self.write_activation_epilogue(layer, '&' + nm + '_batch_output')
+            s += self.layers
+        s += '} \n'
+        return s
+
+    def write_batch_layers(self, verbose=True):
+        segments = self.get_segments()
+
+        # tensors used by more than one segment, or by a batched layer, need
+        # room for the whole chunk. Everything else is reused for each sample
+        touched = {}
+        for seg, (batched, steps) in enumerate(segments):
+            for _, inp, outp, _ in steps:
+                for node in flatten(inp) + flatten(outp):
+                    touched.setdefault(self.root(node), set()).add(seg)
+        sizes = {}
+        lifetimes = {}
+        for node, segs in touched.items():
+            if node in self.model_inputs or node in self.model_outputs or \
+               node + '_output' not in self.weights.buffers:
+                continue
+            if len(segs) > 1 or any(segments[seg][0] for seg in segs):
+                sizes[node + '_output'] = self.batch_size * \
+                    int(np.prod(self.sample_shapes[node]))
+                lifetimes[node + '_output'] = (min(segs), max(segs))
+        workspace, offsets = self.weights.write_batch_workspace(
+            sizes, lifetimes, verbose)
+
+        s = workspace
+        for node in self.model_inputs:
+            s += self.write_sample_tensor(node, '_input')
+        for node in self.model_outputs:
+            s += self.write_sample_tensor(node, '_output')
+        s += '\nfor (size_t b0 = 0; b0 < n; b0 += ' + str(self.batch_size) + \
+            ') { \n'
+        s += 'const size_t nb = n - b0 < ' + str(self.batch_size) + ' ? n - b0 : ' + \
+            str(self.batch_size) + '; \n'
+        for batched, steps in segments:
+            if batched:
+                layer, inp, outp, i = steps[0]
+                if verbose:
+                    print('Writing layer ', outp)
+                s += self.write_batched_Dense(layer, inp, outp, i, offsets)
+                continue
+            if all(self.is_rename(layer, outp) for layer, _, outp, _ in steps):
+                continue
+            s += 'for (size_t b = 0; b < nb; ++b) { \n'
+            nodes = []
+            produced = []
+            for _, inp, outp, _ in steps:
+                produced += flatten(outp)
+                for node in flatten(inp) + flatten(outp):
+                    if node not in nodes:
+                        nodes.append(node)
+            roots = []
+            for node in nodes:
+                if self.root(node) not in roots:
+                    roots.append(self.root(node))
+            for node in roots:
+                if node in self.model_inputs:
+                    s += node + '_input_sample.array = ' + \
+                        self.sample_ptr(node, 'b', offsets) + '; \n'
+                elif node in self.model_outputs:
+                    s += node + '_output_sample.array = ' + \
+                        self.sample_ptr(node, 'b', offsets) + '; \n'
+                elif node + '_output' in offsets:
+                    s += node + '_output.array = ' + \
+                        self.sample_ptr(node, 'b', offsets) + '; \n'
+            # views of data written by an earlier loop
+            for node in nodes:
+                if node != self.root(node) and node not in produced:
+                    s += self.format_view(node + '_output',
+                                          self.sample_ptr(self.root(node), 'b', offsets),
+                                          self.sample_shapes[node])
+            for layer, inp, outp, i in steps:
+                if verbose:
+                    print('Writing layer ', outp)
+                self.layers = ''
+                self.write_redirected_output(layer, outp, i)
+                method = getattr(self, 'write_layer_' + layer_type(layer))
+                method(layer, inp, outp, i)
+                s += self.layers
+            s += '} \n'
+        s += '} \n'
+        return s
+
+    def write_sample_tensor(self, node, suffix):
+        shape = self.sample_shapes[node]
+        ndim = len(shape)
+        shp = np.concatenate((shape, np.ones(maxndim-ndim)))
+        s = 'k2c_tensor ' + node + suffix + '_sample = {' + node + suffix + \
+            '_batch->array,' + str(ndim) + ',' + \
+            str(int(np.prod(shape))) + ',{' + \
+            np.array2string(shp.astype(int), separator=',')[1:-1] + '}}; \n'
+        s += 'k2c_tensor * ' + node + suffix + ' = &' + node + suffix + \
+            '_sample; \n'
+        return s
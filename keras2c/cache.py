@@ -0,0 +1,175 @@
+"""cache.py
+This file is part of keras2c
+Caches converted models so unchanged models are not converted again
+"""
+
+# imports
+import hashlib
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def get_output_files(function_name):
+    """Lists the files that converting a model may write
+
+    Args:
+        function_name (str): name of main function
+
+    Returns:
+        files (list): names of files that may be written
+    """
+
+    return [function_name + suffix for suffix in
+            ['.c', '.h', '_test_suite.c', '_weights.c', '_weights.bin']]
+
+
+def get_cache_key(model, options):
+    """Hashes everything that the converted code depends on
+
+    The key covers the model architecture, the values of all weights, the
+    options passed to the converter and the source of the converter itself,
+    so any change to one of them gives a new key.
+
+    Args:
+        model (keras Model): model to convert
+        options (dict): options passed to the converter
+
+    Returns:
+        key (str): hex digest identifying the conversion
+    """
+
+    h = hashlib.sha256()
+    h.update(model.to_json().encode())
+    for weight in model.get_weights():
+        h.update(str(weight.dtype).encode())
+        h.update(str(weight.shape).encode())
+        h.update(weight.tobytes())
+    h.update(repr(sorted(options.items())).encode())
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for fname in sorted(os.listdir(source_dir)):
+        if fname.endswith('.py'):
+            with open(os.path.join(source_dir, fname), 'rb') as f:
+                h.update(fname.encode())
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def hash_arrays(arrays):
+    """Hashes the values of arrays passed as options to the converter
+
+    Args:
+        arrays (array or list of arrays): arrays to hash, or None
+
+    Returns:
+        digest (str): hex digest of the shapes and values of the arrays, or
+            None if arrays is None
+    """
+
+    if arrays is None:
+        return None
+    if not isinstance(arrays, (list, tuple)):
+        arrays = [arrays]
+    h = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update(str(array.dtype).encode())
+        h.update(str(array.shape).encode())
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+
+def load_from_cache(cache_dir, key, function_name):
+    """Copies cached outputs of a conversion to the working directory
+
+    Args:
+        cache_dir (str): path to cache directory
+        key (str): key of the conversion, from get_cache_key
+        function_name (str): name of main function
+
+    Raises:
+        FileExistsError: if one of the outputs already exists
+
+    Returns:
+        hit (bool): whether the conversion was found in the cache
+    """
+
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return False
+    for fname in get_output_files(function_name):
+        cached = os.path.join(entry, fname)
+        if os.path.exists(cached):
+            with open(cached, 'rb') as src, open(fname, 'xb') as dst:
+                shutil.copyfileobj(src, dst)
+    # mark as recently used
+    os.utime(entry)
+    return True
+
+
+def save_to_cache(cache_dir, key, files, max_size=2**30):
+    """Stores outputs of a conversion in the cache
+
+    Entries are written to a temporary directory and renamed into place, so
+    other processes never see a partially written entry. Only the files
+    written by the conversion are stored, so stale outputs of an earlier
+    conversion with other options are never cached.
+
+    Args:
+        cache_dir (str): path to cache directory
+        key (str): key of the conversion, from get_cache_key
+        files (list): names of the files written by the conversion
+        max_size (int): size of the cache in bytes above which least recently
+            used entries are removed
+
+    Returns:
+        None
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    temp = tempfile.mkdtemp(prefix='.tmp', dir=cache_dir)
+    for fname in files:
+        shutil.copyfile(fname, os.path.join(temp, fname))
+    try:
+        os.rename(temp, entry)
+    except OSError:
+        # entry was added by someone else in the meantime
+        shutil.rmtree(temp, ignore_errors=True)
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size):
+    """Removes least recently used entries until the cache fits in max_size
+
+    Args:
+        cache_dir (str): path to cache directory
+        max_size (int): maximum size of the cache in bytes
+
+    Returns:
+        None
+    """
+
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('.') or not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, f))
+                   for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+        total += size
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
@@ -0,0 +1,251 @@
+"""convolution.py
+This file is part of keras2c
+Chooses how each convolution layer is evaluated
+"""
+
+# imports
+import numpy as np
+from keras2c.io_parsing import layer_type
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+# must match K2C_GEMM_MC in k2c_include.h
+GEMM_ROWS = 64
+# values of the working arrays of a block of outputs, enough to stay in cache
+# between being written and multiplied
+BLOCK_SIZE = 65536
+# layers that would need more working space than this for im2col are
+# evaluated directly
+IM2COL_MAX_SIZE = 2**20
+CONV_ALGORITHMS = ['direct', 'im2col', 'winograd', 'auto']
+# kernel transforms of Winograd convolution F(2x2,3x3) and F(4x4,3x3)
+WINOGRAD_G = {2: np.array([[1, 0, 0],
+                           [1/2, 1/2, 1/2],
+                           [1/2, -1/2, 1/2],
+                           [0, 0, 1]]),
+              4: np.array([[1/4, 0, 0],
+                           [-1/6, -1/6, -1/6],
+                           [-1/6, 1/6, -1/6],
+                           [1/24, 1/12, 1/6],
+                           [1/24, -1/12, 1/6],
+                           [0, 0, 1]])}
+
+
+def get_conv_shapes(layer):
+    """Gets the sizes of the matrix product a convolution is lowered to
+
+    Args:
+        layer (keras Layer): Conv1D, Conv2D or Conv3D layer
+
+    Returns:
+        positions (int): number of output positions, the rows of the product
+        patch (int): number of values under the kernel at each position, the
+            inner dimension of the product
+        out_channels (int): number of output channels, the columns of the
+            product
+        pointwise (bool): whether the input can be multiplied directly, ie the
+            kernel size and strides are all 1
+    """
+
+    config = layer.get_config()
+    outshp = [int(i) for i in layer.get_output_at(0).shape[1:]]
+    in_channels = int(layer.get_input_at(0).shape[-1])
+    positions = int(np.prod(outshp[:-1]))
+    patch = int(np.prod(config['kernel_size']))*in_channels
+    pointwise = all(k == 1 for k in config['kernel_size']) and \
+        all(s == 1 for s in config['strides'])
+    return positions, patch, outshp[-1], pointwise
+
+
+def get_padding(layer):
+    """Finds the padding a convolution or pooling layer applies to its input
+
+    Follows TensorFlow: 'same' padding is split between the start and end of
+    each dimension, with any extra at the end, and 'causal' padding is all at
+    the start.
+
+    Args:
+        layer (keras Layer): Conv1D, Conv2D, Conv3D, or 1D or 2D pooling layer
+
+    Returns:
+        pad (list): amount of padding before and after each spatial dimension,
+            in the order {before dim 1, after dim 1, before dim 2, ...}
+    """
+
+    config = layer.get_config()
+    inshp = [int(i) for i in layer.get_input_at(0).shape[1:-1]]
+    outshp = [int(i) for i in layer.get_output_at(0).shape[1:-1]]
+    if 'pool_size' in config:
+        window = config['pool_size']
+        dilation = [1]*len(window)
+    else:
+        window = config['kernel_size']
+        dilation = config['dilation_rate']
+    pad = []
+    for n_in, n_out, k, s, d in zip(inshp, outshp, window, config['strides'],
+                                    dilation):
+        if config['padding'] == 'valid':
+            pad += [0, 0]
+        elif config['padding'] == 'causal':
+            pad += [d*(k-1), 0]
+        else:
+            total = max((n_out - 1)*s + d*(k - 1) + 1 - n_in, 0)
+            pad += [total // 2, total - total // 2]
+    return pad
+
+
+def im2col_block(layer):
+    """Finds the number of output positions whose patches are stored at once
+
+    Args:
+        layer (keras Layer): Conv1D, Conv2D or Conv3D layer
+
+    Returns:
+        block (int): number of output positions, at least GEMM_ROWS (or every
+            position if there are fewer), and no more than fit in BLOCK_SIZE
+            values. 0 if the layer is pointwise and no patches are stored
+    """
+
+    positions, patch, _, pointwise = get_conv_shapes(layer)
+    if pointwise:
+        return 0
+    return min(positions, max(GEMM_ROWS, BLOCK_SIZE // patch))
+
+
+def is_winograd_eligible(layer):
+    """Checks if a layer can be evaluated by Winograd convolution
+
+    Args:
+        layer (keras Layer): layer to check
+
+    Returns:
+        eligible (bool): whether the layer is a Conv2D with a 3x3 kernel, and
+            strides and dilation rates of 1
+    """
+
+    if layer_type(layer) != 'Conv2D':
+        return False
+    config = layer.get_config()
+    return tuple(config['kernel_size']) == (3, 3) and \
+        tuple(config['strides']) == (1, 1) and \
+        tuple(config['dilation_rate']) == (1, 1)
+
+
+def winograd_tile(layer):
+    """Chooses the size of the output tiles of Winograd convolution
+
+    4x4 tiles take fewer multiplies than 2x2 tiles, but more work to
+    transform, and their outputs have about 10 times the rounding error.
+    They are used if the output has at least 24 rows and columns.
+
+    Args:
+        layer (keras Layer): Conv2D layer
+
+    Returns:
+        tile (int): 2 or 4
+    """
+
+    outshp = [int(i) for i in layer.get_output_at(0).shape[1:]]
+    if min(outshp[:2]) >= 24:
+        return 4
+    return 2
+
+
+def winograd_block(layer, tile):
+    """Finds the number of tiles done at once by Winograd convolution
+
+    Args:
+        layer (keras Layer): Conv2D layer
+        tile (int): size of the output tiles, 2 or 4
+
+    Returns:
+        block (int): number of tiles, at least GEMM_ROWS (or every tile if
+            there are fewer), and no more than fit in BLOCK_SIZE values
+        size (int): size of the working array needed
+    """
+
+    outshp = [int(i) for i in layer.get_output_at(0).shape[1:]]
+    in_channels = int(layer.get_input_at(0).shape[-1])
+    points = (tile + 2)**2
+    tiles = int(np.prod([-(-n // tile) for n in outshp[:2]]))
+    block = min(tiles, max(GEMM_ROWS, BLOCK_SIZE // (points*(in_channels + outshp[-1]))))
+    size = points*(block*(in_channels + outshp[-1]) + 2*max(in_channels, outshp[-1]))
+    return block, size
+
+
+def winograd_kernel(kernel, tile):
+    """Transforms a 3x3 kernel for Winograd convolution
+
+    Computes G g G^T for each pair of input and output channels, in double
+    precision.
+
+    Args:
+        kernel (array): kernel of shape (3, 3, in channels, out channels)
+        tile (int): size of the output tiles, 2 or 4
+
+    Returns:
+        transformed (array): float32 array of shape (tile+2, tile+2, in
+            channels, out channels)
+    """
+
+    G = WINOGRAD_G[tile]
+    return np.einsum('ik,jl,klco->ijco', G, G,
+                     np.asarray(kernel, dtype=np.float64)).astype(np.float32)
+
+
+def get_conv_algorithm(layer, conv_algorithm):
+    """Chooses how a convolution layer is evaluated
+
+    'direct' multiplies the kernel at each output position in turn, and
+    'im2col' copies the patches of the input under the kernel to the rows of
+    a matrix and multiplies it by the kernel with one matrix product.
+    'winograd' uses Winograd convolution for layers where it is eligible, and
+    evaluates the others directly. With 'auto', Winograd convolution is used
+    for eligible layers with at least 16 input and output channels, and
+    otherwise im2col is used if the product has enough rows and columns to
+    make use of the blocked matrix multiplication, and its working space is
+    no more than IM2COL_MAX_SIZE values.
+
+    Args:
+        layer (keras Layer): Conv1D, Conv2D or Conv3D layer
+        conv_algorithm (str): one of CONV_ALGORITHMS
+
+    Returns:
+        algorithm (str): one of 'direct', 'im2col' or 'winograd'
+    """
+
+    if conv_algorithm == 'winograd':
+        return 'winograd' if is_winograd_eligible(layer) else 'direct'
+    if conv_algorithm != 'auto':
+        return conv_algorithm
+    positions, patch, out_channels, _ = get_conv_shapes(layer)
+    if is_winograd_eligible(layer) and out_channels >= 16 and \
+            int(layer.get_input_at(0).shape[-1]) >= 16:
+        return 'winograd'
+    if positions >= 4 and out_channels >= 4 and \
+            im2col_block(layer)*patch <= IM2COL_MAX_SIZE:
+        return 'im2col'
+    return 'direct'
+
+
+def get_winograd_layers(model, conv_algorithm):
+    """Finds the layers of a model evaluated by Winograd convolution
+
+    Args:
+        model (keras Model): model to parse
+        conv_algorithm (str): one of CONV_ALGORITHMS
+
+    Returns:
+        layers (dict): names of layers mapped to the size of their output
+            tiles
+    """
+
+    return {layer.name: winograd_tile(layer) for layer in model.layers
+            if is_winograd_eligible(layer) and
+            get_conv_algorithm(layer, conv_algorithm) == 'winograd'}
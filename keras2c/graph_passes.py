@@ -0,0 +1,233 @@
+"""graph_passes.py
+This file is part of keras2c
+Finds layers that can be merged with their neighbours before writing C code
+"""
+
+# imports
+from keras2c.io_parsing import layer_type, get_model_io_names, get_model_schedule, \
+    get_layer_io_names, get_layer_num_io, flatten
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def get_single_consumer_producers(model):
+    """Finds layers whose output is only used by a single other layer
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        producers (dict): names of layers evaluated only once, that have a
+            single input, mapped to the layer that produces that input if the
+            producer is also evaluated only once and its output is used by
+            nothing else
+    """
+
+    model_inputs, model_outputs = get_model_io_names(model)
+    schedule = [step for step in get_model_schedule(model)
+                if layer_type(step[0]) not in ['InputLayer', 'Input']]
+    producer = {}
+    num_consumers = {}
+    for layer, inp, outp, _ in schedule:
+        for o in flatten(outp):
+            producer[o] = layer
+        for node in flatten(inp):
+            num_consumers[node] = num_consumers.get(node, 0) + 1
+
+    producers = {}
+    for layer, inp, outp, _ in schedule:
+        inp = flatten(inp)
+        if len(inp) != 1 or get_layer_num_io(layer) != (1, 1):
+            continue
+        node = inp[0]
+        if node not in producer or node in model_outputs or \
+           num_consumers[node] != 1:
+            continue
+        if get_layer_num_io(producer[node]) != (1, 1):
+            continue
+        producers[layer.name] = producer[node]
+    return producers
+
+
+def get_folded_batch_norms(model):
+    """Finds BatchNormalization layers that can be folded into the previous layer
+
+    A BatchNormalization layer that normalizes the channels of the output of
+    a Dense or ConvND layer with linear activation, which is used by nothing
+    else, is the same as scaling and shifting that layer's kernel and bias.
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        folded (dict): BatchNormalization layers mapped to the layer they are
+            folded into
+    """
+
+    producers = get_single_consumer_producers(model)
+    folded = {}
+    for layer in model.layers:
+        if layer_type(layer) != 'BatchNormalization' or layer.name not in producers:
+            continue
+        producer = producers[layer.name]
+        if layer_type(producer) not in ['Dense', 'Conv1D', 'Conv2D', 'Conv3D'] or \
+           producer.get_config()['activation'] != 'linear':
+            continue
+        ndim = len(layer.input_shape)
+        axis = flatten(layer.get_config()['axis'])
+        if len(axis) != 1 or axis[0] % ndim != ndim - 1:
+            continue
+        folded[layer] = producer
+    return folded
+
+
+def get_fused_activations(model):
+    """Finds activation layers that can be applied by the layer before them
+
+    An activation layer (Activation, LeakyReLU, ReLU, ELU, PReLU or
+    ThresholdedReLU) whose input is the output of a Dense or ConvND layer that
+    is used by nothing else can be applied to that output right after it is
+    computed, while it is still in cache. A folded BatchNormalization layer
+    between the two does not prevent this.
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        fused (dict): activation layers mapped to the layer they are fused into
+    """
+
+    producers = get_single_consumer_producers(model)
+    folded = get_folded_batch_norms(model)
+    fused = {}
+    for layer in model.layers:
+        if layer_type(layer) not in ['Activation', 'LeakyReLU', 'ReLU', 'ELU',
+                                     'PReLU', 'ThresholdedReLU'] or \
+           layer.name not in producers:
+            continue
+        producer = producers[layer.name]
+        if producer in folded:
+            producer = folded[producer]
+        if layer_type(producer) not in ['Dense', 'Conv1D', 'Conv2D', 'Conv3D']:
+            continue
+        # softmax is over the last axis, convolutions apply their activation
+        # to the whole output
+        if layer_type(layer) == 'Activation' and \
+           layer.get_config()['activation'] == 'softmax' and \
+           layer_type(producer) != 'Dense':
+            continue
+        fused[layer] = producer
+    return fused
+
+
+def get_output_redirects(model):
+    """Finds nodes that can be written straight into an output of the model
+
+    Layers that only rename their input (eg, Dropout, Flatten, or an
+    activation applied in place) give an output of the model that holds the
+    same data as their input. The layer that computes that data can write it
+    into the output of the model directly, instead of into a buffer that is
+    then copied.
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        redirects (dict): names of nodes mapped to the name of the model output
+            that holds their data
+    """
+
+    model_inputs, model_outputs = get_model_io_names(model)
+    folded = get_folded_batch_norms(model)
+    views = ['Dropout', 'SpatialDropout1D', 'SpatialDropout2D', 'SpatialDropout3D',
+             'GaussianNoise', 'GaussianDropout', 'AlphaDropout',
+             'ActivityRegularization', 'Flatten', 'Reshape', 'Activation',
+             'LeakyReLU', 'ReLU', 'ELU', 'PReLU', 'ThresholdedReLU']
+
+    def is_view(layer):
+        return (layer_type(layer) in views or layer in folded) and \
+            get_layer_num_io(layer) == (1, 1)
+
+    producer = {}
+    num_consumers = {}
+    for layer, inp, outp, _ in get_model_schedule(model):
+        for o in flatten(outp):
+            producer[o] = layer
+        for node in flatten(inp):
+            num_consumers[node] = num_consumers.get(node, 0) + 1
+
+    redirects = {}
+    for output in model_outputs:
+        layer = producer[output]
+        if not is_view(layer):
+            continue
+        node = get_layer_io_names(layer)[0][0]
+        while node not in model_inputs and node not in model_outputs and \
+                num_consumers[node] == 1 and is_view(producer[node]):
+            node = get_layer_io_names(producer[node])[0][0]
+        if node in model_inputs or node in model_outputs or \
+           num_consumers[node] != 1 or \
+           get_layer_num_io(producer[node]) != (1, 1) or \
+           len(get_layer_io_names(producer[node])[1]) != 1:
+            continue
+        redirects[node] = output
+    return redirects
+
+
+def get_copied_activations(model):
+    """Finds activation layers that must not be applied in place
+
+    An activation layer that is not fused into the layer before it is applied
+    to its input in place. That is only safe if nothing else reads the data:
+    walking back through layers that only rename their input (eg, Reshape,
+    Flatten or Dropout), every tensor must be used only by the next layer,
+    and the walk must not reach an input or output of the model. Otherwise
+    the activation is applied to a copy of its input.
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        copied (set): names of the output nodes of activation layers that are
+            applied to a copy of their input
+    """
+
+    model_inputs, model_outputs = get_model_io_names(model)
+    folded = get_folded_batch_norms(model)
+    fused = get_fused_activations(model)
+    activations = ['Activation', 'LeakyReLU', 'ReLU', 'ELU', 'PReLU',
+                   'ThresholdedReLU']
+    views = ['Dropout', 'SpatialDropout1D', 'SpatialDropout2D', 'SpatialDropout3D',
+             'GaussianNoise', 'GaussianDropout', 'AlphaDropout',
+             'ActivityRegularization', 'Flatten', 'Reshape'] + activations
+
+    num_consumers = {}
+    for layer, inp, outp, _ in get_model_schedule(model):
+        for node in flatten(inp):
+            num_consumers[node] = num_consumers.get(node, 0) + 1
+
+    # nodes that share the data of another, mapped to that node
+    source = {}
+    copied = set()
+    for layer, inp, outp, _ in get_model_schedule(model):
+        inp = flatten(inp)
+        outp = flatten(outp)
+        if len(inp) != 1 or len(outp) != 1 or \
+           (layer_type(layer) not in views and layer not in folded):
+            continue
+        if layer_type(layer) in activations and layer not in fused:
+            node = inp[0]
+            while node not in model_inputs and node not in model_outputs and \
+                    num_consumers[node] == 1 and node in source:
+                node = source[node]
+            if node in model_inputs or node in model_outputs or \
+               num_consumers[node] != 1:
+                copied.add(outp[0])
+                continue
+        source[outp[0]] = inp[0]
+    return copied
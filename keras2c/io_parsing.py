@@ -138,6 +138,37 @@ def get_model_io_names(model):
     return inputs, outputs
 
 
+def get_model_schedule(model):
+    """Gets the order in which the layers of a model are evaluated
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        schedule (list): tuples of (layer, inputs, outputs, i) in the order they
+            are evaluated, where i is the index of the node of the layer being
+            evaluated. Shared layers appear once for each node.
+    """
+
+    model_inputs, _ = get_model_io_names(model)
+    written_io = set(model_inputs)
+    unwritten_io = set(get_all_io_names(model)) - written_io
+    schedule = []
+    while len(unwritten_io) > 0:
+        for layer in model.layers:
+            layer_inputs, layer_outputs = get_layer_io_names(layer)
+            for i, (inp, outp) in enumerate(zip(layer_inputs, layer_outputs)):
+                if (set(flatten(inp)).issubset(written_io) and
+                        set(flatten(outp)).issubset(unwritten_io)) or \
+                        layer_type(layer) == 'InputLayer':
+                    schedule.append((layer, inp, outp, i))
+                    written_io |= set(flatten(inp))
+                    written_io |= set(flatten(outp))
+                    unwritten_io -= set(flatten(inp))
+                    unwritten_io -= set(flatten(outp))
+    return schedule
+
+
 def flatten(x):
     """Flattens a nested list or tuple
 
@@ -6,12 +6,19 @@ Converts keras model to C code
 # imports
 from keras2c.layer2c import Layers2C
 from keras2c.weights2c import Weights2C
+from keras2c.batch2c import Batch2C
+from keras2c.tasks2c import Tasks2C
 from keras2c.io_parsing import layer_type, get_all_io_names, get_layer_io_names, \
     get_model_io_names, flatten
 from keras2c.check_model import check_model
 from keras2c.make_test_suite import make_test_suite
+from keras2c.cache import get_cache_key, load_from_cache, save_to_cache, hash_arrays
+from keras2c.quantization import get_activation_scales
+from keras2c.convolution import CONV_ALGORITHMS, get_winograd_layers
 import numpy as np
+import struct
 import subprocess
+import zlib
 import keras
 import tensorflow as tf
 tf.compat.v1.disable_eager_execution()
@@ -24,7 +31,11 @@ __maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
 __email__ = "wconlin@princeton.edu"
 
 
-def model2c(model, function_name, malloc=False, verbose=True):
+def model2c(model, function_name, malloc=False, verbose=True, static_weights=False,
+            plan_memory=False, batch_size=None, separate_weights=False,
+            reentrant=False, quantize=None, calibration_data=None, weight_dtype=None,
+            sparse_threshold=None, specialize=False, pack_weights=False,
+            num_threads=None, parallel_layers=False, conv_algorithm='direct'):
     """Generates C code for model
 
     Writes main function definition to "function_name.c" and a public header 
@@ -35,10 +46,68 @@ def model2c(model, function_name, malloc=False, verbose=True):
         function_name (str): name of C function
         malloc (bool): whether to allocate variables on the stack or heap
         verbose (bool): whether to print info to stdout
+        static_weights (bool): whether to store weights as static const arrays
+            at file scope instead of initializing them on the stack every call.
+            Ignored if malloc is True.
+        plan_memory (bool): whether to pack the outputs of intermediate layers
+            into a single shared workspace, reusing memory once a tensor is no
+            longer needed
+        batch_size (int): if given, also write "function_name_batch" that
+            evaluates any number of samples per call, this many at a time
+        separate_weights (bool): whether to write the weights to
+            "function_name_weights.c", to be compiled separately and linked
+            with "function_name.c". Ignored if malloc is True.
+        reentrant (bool): whether to keep all mutable state and working
+            memory in a "function_name_ctx" context, created with
+            "function_name_ctx_init" and passed to each call, so that the
+            model can be evaluated by several threads at once, each with its
+            own context
+        quantize (str): if given, store the kernels of Dense and ConvND
+            layers as int8 and evaluate them with int32 accumulation. One of
+            'per_tensor' (one scale for the whole kernel) or 'per_channel'
+            (one scale per output channel)
+        calibration_data (array or list of arrays): representative inputs to
+            the model, used to set the scale of the quantized inputs of each
+            layer. Required if quantize is given
+        weight_dtype (str): if given, store the kernels of Dense, ConvND and
+            recurrent layers that are not quantized as 16 bit floats, either
+            'float16' or 'bfloat16'. They are converted to float as they are
+            used, and all arithmetic is done in float
+        sparse_threshold (float): if given, store the kernels of Dense and
+            recurrent layers in which at least this fraction of values are
+            zero in compressed sparse row format, and only multiply by the
+            nonzeros
+        specialize (bool): whether to write a kernel for each Dense and ConvND
+            layer with its sizes, strides and dilations as constants, so the
+            compiler can unroll and vectorize its loops
+        pack_weights (bool): whether to store the float kernels of Dense and
+            recurrent layers in the panel layout used by the matrix
+            multiplication, so they are not repacked when the model is run.
+            These layers are not specialized
+        num_threads (int): if given, the number of threads used by large
+            layers, set in "function_name_initialize". Only has an effect if
+            the library is built with OpenMP
+        parallel_layers (bool): whether to run the layers of the main function
+            as tasks on a pool of threads, started in "function_name_initialize",
+            so that independent branches of the model run at the same time.
+            The pool has num_threads threads, or one per core. Intermediate
+            tensors are kept in a workspace on the stack of each call, and
+            never share memory. Calls from several threads may run at once,
+            except for stateful models (unless reentrant) and malloc models,
+            whose calls take turns
+        conv_algorithm (str): how float ConvND layers are evaluated. 'direct'
+            multiplies the kernel at each output position in turn, 'im2col'
+            copies blocks of the patches of the input under the kernel to a
+            working array and multiplies them by the kernel as one matrix
+            product, 'winograd' uses Winograd convolution for Conv2D layers
+            with 3x3 kernels and strides and dilations of 1, with the kernel
+            transformed when the model is converted, and 'auto' chooses
+            between them for each layer by its sizes
 
     Returns:
         malloc_vars (list): names of variables loaded at runtime and stored on the heap
         stateful (bool): whether the model must maintain state between calls
+        files (list): names of the files written
     """
 
     model_inputs, model_outputs = get_model_io_names(model)
@@ -50,12 +119,39 @@ def model2c(model, function_name, malloc=False, verbose=True):
 
     if verbose:
         print('Gathering Weights')
-    stack_vars, malloc_vars, static_vars = Weights2C(
-        model, function_name, malloc).write_weights(verbose)
-    stateful = len(static_vars) > 0
-    layers = Layers2C(model, malloc).write_layers(verbose)
-
-    function_signature = 'void ' + function_name + '('
+    activation_scales = None
+    if quantize:
+        if verbose:
+            print('Calibrating quantized layers')
+        activation_scales = get_activation_scales(model, calibration_data)
+    weights = Weights2C(model, function_name, malloc, static_weights, plan_memory,
+                        separate_weights, reentrant, quantize, activation_scales,
+                        weight_dtype, sparse_threshold, pack_weights, parallel_layers,
+                        conv_algorithm)
+    stack_vars, malloc_vars, static_vars, global_vars = weights.write_weights(
+        verbose)
+    stateful = len(weights.static_vars) > 0
+    if parallel_layers:
+        layers2c = Tasks2C(model, function_name, malloc, weights, specialize)
+    else:
+        layers2c = Layers2C(model, malloc, weights.activation_scales,
+                            weights.half_kernels, weights.sparse_layers, specialize,
+                            weights.packed_kernels, weights.im2col_layers,
+                            weights.winograd_layers)
+    layers = layers2c.write_layers(verbose)
+    specialized = layers2c.specialized
+    if batch_size:
+        if verbose:
+            print('Writing batched function')
+        batch2c = Batch2C(model, function_name, malloc, weights, batch_size,
+                          specialize)
+        batch_layers = batch2c.write_batch_layers(verbose)
+        specialized.update(batch2c.specialized)
+        # context also holds the workspace of the batched function
+        static_vars = weights.write_static_vars()
+
+    ctx_arg = function_name + '_ctx* ctx, ' if reentrant else ''
+    function_signature = 'void ' + function_name + '(' + ctx_arg
     function_signature += ', '.join(['k2c_tensor* ' +
                                      in_nm + '_input' for in_nm in model_inputs]) + ', '
     function_signature += ', '.join(['k2c_tensor* ' +
@@ -65,27 +161,70 @@ def model2c(model, function_name, malloc=False, verbose=True):
                                               key for key in malloc_vars.keys()])
     function_signature += ')'
 
-    init_sig, init_fun = gen_function_initialize(function_name, malloc_vars)
-    term_sig, term_fun = gen_function_terminate(function_name, malloc_vars)
-    reset_sig, reset_fun = gen_function_reset(function_name)
+    batch_signature = 'void ' + function_name + '_batch(' + ctx_arg + 'size_t n, '
+    batch_signature += ', '.join(['k2c_tensor* ' + in_nm + '_input_batch'
+                                  for in_nm in model_inputs]) + ', '
+    batch_signature += ', '.join(['k2c_tensor* ' + out_nm + '_output_batch'
+                                  for out_nm in model_outputs])
+    if len(malloc_vars.keys()):
+        batch_signature += ',' + ','.join(['float* ' +
+                                           key for key in malloc_vars.keys()])
+    batch_signature += ')'
+
+    init_sig, init_fun = gen_function_initialize(function_name, malloc_vars,
+                                                 weights.malloc_buffers, num_threads,
+                                                 parallel_layers)
+    term_sig, term_fun = gen_function_terminate(function_name, malloc_vars,
+                                                weights.malloc_buffers, parallel_layers)
+    reset_sig, reset_fun = gen_function_reset(function_name, reentrant)
+    ctx_sigs, ctx_fun = gen_function_ctx(function_name)
 
     with open(function_name + '.c', 'x+') as source:
         source.write(includes)
         source.write(static_vars + '\n\n')
+        global_vars.write(source)
+        source.write('\n\n')
+        source.write(''.join(specialized.values()))
+        if parallel_layers:
+            source.write(layers2c.task_prologue)
+            weights.workspace_vars.write(source)
+            source.write(layers2c.task_epilogue)
         source.write(function_signature)
         source.write(' { \n\n')
-        source.write(stack_vars)
+        if not parallel_layers:
+            stack_vars.write(source)
         source.write(layers)
         source.write('\n } \n\n')
+        if batch_size:
+            source.write(batch_signature)
+            source.write(' { \n\n')
+            source.write(weights.workspace_decl)
+            stack_vars.write(source)
+            source.write(batch_layers)
+            source.write('\n } \n\n')
         source.write(init_fun)
         source.write(term_fun)
+        if reentrant:
+            source.write(ctx_fun)
         if stateful:
             source.write(reset_fun)
 
+    if separate_weights and not malloc:
+        with open(function_name + '_weights.c', 'x+') as source:
+            source.write('#include <math.h> \n\n')
+            weights.weights_vars.write(source)
+
     with open(function_name + '.h', 'x+') as header:
         header.write('#pragma once \n')
         header.write('#include "k2c_tensor_include.h" \n')
+        if reentrant:
+            header.write('typedef struct ' + function_name + '_ctx ' +
+                         function_name + '_ctx; \n')
+            header.write(ctx_sigs[0] + '; \n')
+            header.write(ctx_sigs[1] + '; \n')
         header.write(function_signature + '; \n')
+        if batch_size:
+            header.write(batch_signature + '; \n')
         header.write(init_sig + '; \n')
         header.write(term_sig + '; \n')
         if stateful:
@@ -94,40 +233,135 @@ def model2c(model, function_name, malloc=False, verbose=True):
         subprocess.run(['astyle', '-n', function_name + '.h'])
         subprocess.run(['astyle', '-n', function_name + '.c'])
 
-    return malloc_vars.keys(), stateful
+    files = [function_name + '.c', function_name + '.h']
+    if separate_weights and not malloc:
+        files.append(function_name + '_weights.c')
+    if any(key not in weights.malloc_buffers for key in malloc_vars):
+        files.append(function_name + '_weights.bin')
+    return malloc_vars.keys(), stateful, files
 
 
-def gen_function_reset(function_name):
+def gen_function_reset(function_name, reentrant=False):
     """Writes a reset function for stateful models
 
     Reset function is used to clear internal state of the model
 
     Args:
         function_name (str): name of main function
+        reentrant (bool): whether the state is held in a context
 
     Returns:
        signature (str): delcaration of the reset function
        function (str): definition of the reset function
     """
 
-    reset_sig = 'void ' + function_name + '_reset_states()'
+    if reentrant:
+        reset_sig = 'void ' + function_name + '_reset_states(' + \
+            function_name + '_ctx* ctx)'
+        states = 'ctx->states'
+    else:
+        reset_sig = 'void ' + function_name + '_reset_states()'
+        states = function_name + '_states'
 
     reset_fun = reset_sig
     reset_fun += ' { \n\n'
-    reset_fun += 'memset(&' + function_name + \
-                 '_states,0,sizeof(' + function_name + '_states)); \n'
+    reset_fun += 'memset(&' + states + ',0,sizeof(' + states + ')); \n'
     reset_fun += "} \n\n"
     return reset_sig, reset_fun
 
 
-def gen_function_initialize(function_name, malloc_vars):
+def gen_function_ctx(function_name):
+    """Writes functions to create and destroy a context for reentrant models
+
+    A context holds the state and working memory for one caller. Contexts
+    are independent, so different threads can evaluate the model at the same
+    time, each with its own context. Weights are shared between contexts.
+
+    Args:
+        function_name (str): name of main function
+
+    Returns:
+       signatures (tuple): declarations of the create and destroy functions
+       function (str): definitions of the create and destroy functions
+    """
+
+    init_sig = function_name + '_ctx* ' + function_name + '_ctx_init()'
+    free_sig = 'void ' + function_name + '_ctx_free(' + function_name + \
+        '_ctx* ctx)'
+
+    ctx_fun = init_sig
+    ctx_fun += ' { \n\n'
+    ctx_fun += '// state starts from zero. Returns NULL if out of memory \n'
+    ctx_fun += 'return (' + function_name + '_ctx*) calloc(1,sizeof(' + \
+        function_name + '_ctx)); \n'
+    ctx_fun += "} \n\n"
+    ctx_fun += free_sig
+    ctx_fun += ' { \n\n'
+    ctx_fun += 'free(ctx); \n'
+    ctx_fun += "} \n\n"
+    return (init_sig, free_sig), ctx_fun
+
+
+def write_weights_file(filename, arrays, alignment=64):
+    """Writes arrays to a binary weight file
+
+    The file starts with a 40 byte header: the magic string "K2CWGHTS",
+    uint32 format version, uint32 alignment, uint64 number of arrays,
+    uint64 file size, uint32 Adler-32 checksum of everything after the
+    header and 4 reserved bytes. This is followed by a table with the uint64
+    byte offset and uint64 number of elements of each array, and then the
+    arrays themselves as float32, each starting at a multiple of alignment
+    bytes. All values are little endian.
+
+    Args:
+        filename (str): file to write to
+        arrays (list): arrays to write, in the order they are indexed at runtime
+        alignment (int): alignment of each array in bytes
+
+    Returns:
+        None
+    """
+
+    header_size = 40
+    offset = header_size + 16*len(arrays)
+    table = []
+    data = []
+    for array in arrays:
+        pad = -offset % alignment
+        data.append(b'\0'*pad)
+        offset += pad
+        table.append(struct.pack('<QQ', offset, array.size))
+        array = np.ascontiguousarray(array, dtype='<f4').tobytes()
+        data.append(array)
+        offset += len(array)
+    body = b''.join(table + data)
+    header = b'K2CWGHTS' + struct.pack('<IIQQII', 1, alignment, len(arrays),
+                                       header_size + len(body),
+                                       zlib.adler32(body), 0)
+    with open(filename, 'wb') as f:
+        f.write(header)
+        f.write(body)
+
+
+def gen_function_initialize(function_name, malloc_vars, malloc_buffers=(),
+                            num_threads=None, parallel_layers=False):
     """Writes an initialize function
 
-    Initialize function is used to load variables into memory and do other start up tasks
+    Initialize function is used to load variables into memory and do other start up tasks.
+    Weights are written to the binary file "function_name_weights.bin", which is
+    mapped into memory read only. Working arrays are allocated and set to zero.
+    The fastest matrix multiplication kernels supported by the CPU are chosen,
+    the number of threads is set, and threads to run layers on are started.
 
     Args:
         function_name (str): name of main function
         malloc_vars (dict): variables to read in
+        malloc_buffers (list): names of variables that are working arrays
+            rather than weights
+        num_threads (int): number of threads used by large layers, or None
+            to leave it to OpenMP
+        parallel_layers (bool): whether to start threads to run the layers
+            on, num_threads of them or one per core
 
     Returns:
        signature (str): delcaration of the initialization function
@@ -139,26 +373,50 @@ def gen_function_initialize(function_name, malloc_vars):
                           key + ' \n' for key in malloc_vars.keys()])
     init_sig += ')'
 
-    init_fun = init_sig
+    weights = [key for key in malloc_vars.keys() if key not in malloc_buffers]
+    init_fun = ''
+    if len(weights):
+        fname = function_name + '_weights.bin'
+        write_weights_file(fname, [malloc_vars[key] for key in weights])
+        init_fun += 'static const char * ' + function_name + '_weights = NULL; \n'
+        init_fun += 'static size_t ' + function_name + '_weights_size = 0; \n\n'
+    init_fun += init_sig
     init_fun += ' { \n\n'
+    init_fun += 'k2c_simd_init(); \n'
+    if num_threads:
+        init_fun += 'k2c_set_num_threads(' + str(int(num_threads)) + '); \n'
+    if parallel_layers:
+        init_fun += 'k2c_start_threads(' + str(int(num_threads or 0)) + '); \n'
+    if len(weights):
+        init_fun += function_name + '_weights = k2c_map_weights("' + fname + \
+            '",&' + function_name + '_weights_size,K2C_VERIFY_WEIGHTS); \n'
     for key in malloc_vars.keys():
-        fname = function_name + key + ".csv"
-        np.savetxt(fname, malloc_vars[key], fmt="%.8e", delimiter=',')
-        init_fun += '*' + key + " = k2c_read_array(\"" + \
-            fname + "\"," + str(malloc_vars[key].size) + "); \n"
+        if key in weights:
+            init_fun += '*' + key + ' = k2c_weights_array(' + function_name + \
+                '_weights,' + function_name + '_weights_size,' + \
+                str(weights.index(key)) + ',' + \
+                str(malloc_vars[key].size) + '); \n'
+        else:
+            init_fun += '*' + key + ' = (float*) calloc(' + \
+                str(malloc_vars[key].size) + ',sizeof(float)); \n'
     init_fun += "} \n\n"
 
     return init_sig, init_fun
 
 
-def gen_function_terminate(function_name, malloc_vars):
+def gen_function_terminate(function_name, malloc_vars, malloc_buffers=(),
+                           parallel_layers=False):
     """Writes a terminate function
 
-    Terminate function is used to deallocate memory after completion
+    Terminate function is used to deallocate memory and stop threads after completion
 
     Args:
         function_name (str): name of main function
         malloc_vars (dict): variables to deallocate
+        malloc_buffers (list): names of variables that are working arrays
+            rather than weights
+        parallel_layers (bool): whether threads to run the layers on were
+            started
 
     Returns:
        signature (str): delcaration of the terminate function
@@ -173,13 +431,25 @@ def gen_function_terminate(function_name, malloc_vars):
     term_fun = term_sig
     term_fun += ' { \n\n'
     for key in malloc_vars.keys():
-        term_fun += "free(" + key + "); \n"
+        if key in malloc_buffers:
+            term_fun += "free(" + key + "); \n"
+    if any(key not in malloc_buffers for key in malloc_vars.keys()):
+        term_fun += 'k2c_unmap_weights(' + function_name + '_weights,' + \
+            function_name + '_weights_size); \n'
+        term_fun += function_name + '_weights = NULL; \n'
+    if parallel_layers:
+        term_fun += 'k2c_stop_threads(); \n'
     term_fun += "} \n\n"
 
     return term_sig, term_fun
 
 
-def k2c(model, function_name, malloc=False, num_tests=10, verbose=True):
+def k2c(model, function_name, malloc=False, num_tests=10, verbose=True,
+        static_weights=False, plan_memory=False, batch_size=None,
+        separate_weights=False, cache_dir=None, cache_size=2**30,
+        reentrant=False, quantize=None, calibration_data=None, weight_dtype=None,
+        sparse_threshold=None, specialize=False, pack_weights=False,
+        num_threads=None, parallel_layers=False, conv_algorithm='direct'):
     """Converts keras model to C code and generates test suite
 
     Args:
@@ -187,10 +457,76 @@ def k2c(model, function_name, malloc=False, num_tests=10, verbose=True):
         function_name (str): name of main function
         malloc (bool): whether to allocate variables on the stack or heap
         num_tests (int): how many tests to generate in the test suite
+        verbose (bool): whether to print info to stdout
+        static_weights (bool): whether to store weights as static const arrays
+            at file scope instead of initializing them on the stack every call
+        plan_memory (bool): whether to pack the outputs of intermediate layers
+            into a single shared workspace, reusing memory once a tensor is no
+            longer needed
+        batch_size (int): if given, also write "function_name_batch" that
+            evaluates any number of samples per call, this many at a time
+        separate_weights (bool): whether to write the weights to
+            "function_name_weights.c", to be compiled separately and linked
+            with "function_name.c"
+        cache_dir (str): if given, outputs are stored in this directory,
+            keyed by a hash of the model and options, and copied from it
+            instead of converting the model again when nothing has changed
+        cache_size (int): size of the cache in bytes above which least
+            recently used entries are removed
+        reentrant (bool): whether to keep all mutable state and working
+            memory in a context passed to each call, so that several threads
+            can evaluate the model at once
+        quantize (str): if given, store the kernels of Dense and ConvND
+            layers as int8, with either 'per_tensor' or 'per_channel' scales.
+            Outputs are then only approximately equal to those of the keras
+            model, and the test suite checks them with a looser tolerance
+        calibration_data (array or list of arrays): representative inputs to
+            the model, used to set the scale of the quantized inputs of each
+            layer. Required if quantize is given
+        weight_dtype (str): if given, store the kernels of Dense, ConvND and
+            recurrent layers that are not quantized as 16 bit floats, either
+            'float16' or 'bfloat16'. As with quantize, the test suite checks
+            the outputs with a looser tolerance, and reports the max error
+        sparse_threshold (float): if given, store the kernels of Dense and
+            recurrent layers in which at least this fraction of values are
+            zero (eg, 0.8 for a model pruned to 80% zeros) in compressed
+            sparse row format
+        specialize (bool): whether to write a kernel for each Dense and ConvND
+            layer with its sizes as constants, so the compiler can unroll and
+            vectorize its loops
+        pack_weights (bool): whether to store the kernels of Dense and
+            recurrent layers in the panel layout used by the matrix
+            multiplication, so that it only makes unit stride loads
+        num_threads (int): if given, the number of threads used by large
+            Conv, Dense and pooling layers. Only has an effect if the library
+            is built with "make OPENMP=1", and the generated code with
+            -fopenmp. Otherwise OpenMP uses OMP_NUM_THREADS, or every core
+        parallel_layers (bool): whether to run the layers of the main function
+            as tasks on a pool of num_threads threads (or one per core), so
+            that independent branches of the model run at the same time. The
+            program must be linked with -pthread. The generated function may
+            be called from several threads at once, except that calls of
+            stateful models (unless reentrant) and malloc models take turns
+        conv_algorithm (str): how float ConvND layers are evaluated, one of
+            'direct' (the kernel is multiplied at each output position in
+            turn), 'im2col' (the patches under the kernel are copied to a
+            working array and multiplied by the kernel as one matrix product),
+            'winograd' (Winograd convolution for Conv2D layers with 3x3
+            kernels and strides and dilations of 1) or 'auto' (chosen for
+            each layer by its sizes). Outputs of Winograd convolution with
+            4x4 tiles differ from direct convolution by up to about 1e-5 times
+            their size, so if any layer uses them the test suite checks the
+            outputs with a looser tolerance
 
     Raises:
         ValueError: if model is not instance of keras.models.Model 
             or keras.engine.training.Model
+        ValueError: if quantize is not one of None, 'per_tensor' or
+            'per_channel', or no calibration data is given
+        ValueError: if weight_dtype is not one of None, 'float16' or
+            'bfloat16'
+        ValueError: if conv_algorithm is not one of 'direct', 'im2col',
+            'winograd' or 'auto'
 
     Returns:
         None
@@ -206,24 +542,90 @@ def k2c(model, function_name, malloc=False, num_tests=10, verbose=True):
         raise ValueError('Unknown model type. Model should ' +
                          'either be an instance of keras.models.Model, ' +
                          'or a filepath to a saved .h5 model')
+    if quantize not in [None, 'per_tensor', 'per_channel']:
+        raise ValueError("Unknown quantization '" + str(quantize) + "'. " +
+                         "Should be one of 'per_tensor' or 'per_channel'")
+    if quantize and calibration_data is None:
+        raise ValueError('Quantization needs calibration data')
+    if weight_dtype not in [None, 'float16', 'bfloat16']:
+        raise ValueError("Unknown weight dtype '" + str(weight_dtype) + "'. " +
+                         "Should be one of 'float16' or 'bfloat16'")
+    if conv_algorithm not in CONV_ALGORITHMS:
+        raise ValueError("Unknown convolution algorithm '" + str(conv_algorithm) +
+                         "'. Should be one of " + ', '.join(CONV_ALGORITHMS))
+
+    if cache_dir is not None:
+        key = get_cache_key(model, {'function_name': function_name,
+                                    'malloc': malloc,
+                                    'num_tests': num_tests,
+                                    'static_weights': static_weights,
+                                    'plan_memory': plan_memory,
+                                    'batch_size': batch_size,
+                                    'separate_weights': separate_weights,
+                                    'reentrant': reentrant,
+                                    'quantize': quantize,
+                                    'calibration_data': hash_arrays(calibration_data),
+                                    'weight_dtype': weight_dtype,
+                                    'sparse_threshold': sparse_threshold,
+                                    'specialize': specialize,
+                                    'pack_weights': pack_weights,
+                                    'num_threads': num_threads,
+                                    'parallel_layers': parallel_layers,
+                                    'conv_algorithm': conv_algorithm})
+        if load_from_cache(cache_dir, key, function_name):
+            if verbose:
+                print("Copied C code for '" + function_name +
+                      "' from cache " + cache_dir)
+            return
 
     # check that the model can be converted
     check_model(model, function_name)
     if verbose:
         print('All checks passed')
 
-    malloc_vars, stateful = model2c(
-        model, function_name, malloc, verbose)
+    malloc_vars, stateful, files = model2c(
+        model, function_name, malloc, verbose, static_weights, plan_memory,
+        batch_size, separate_weights, reentrant, quantize, calibration_data,
+        weight_dtype, sparse_threshold, specialize, pack_weights, num_threads,
+        parallel_layers, conv_algorithm)
 
     s = 'Done \n'
     s += "C code is in '" + function_name + \
         ".c' with header file '" + function_name + ".h' \n"
+    if separate_weights and not malloc:
+        s += "Weights are in '" + function_name + \
+            "_weights.c', which should be compiled and linked with it \n"
+    # kernels of quantized and 16 bit layers are never transformed
+    winograd_layers = {}
+    if not quantize and not weight_dtype:
+        winograd_layers = get_winograd_layers(model, conv_algorithm)
+    if quantize or weight_dtype == 'bfloat16':
+        tol = 1e-1
+    elif weight_dtype == 'float16':
+        tol = 1e-2
+    elif 4 in winograd_layers.values():
+        tol = 1e-4
+    else:
+        tol = 1e-5
+    comment = None
+    if winograd_layers:
+        comment = 'Layers ' + ', '.join(
+            nm + ' (F(' + str(t) + 'x' + str(t) + ',3x3))'
+            for nm, t in winograd_layers.items()) + \
+            ' are evaluated by Winograd convolution. Their outputs differ from ' + \
+            'those of direct convolution by rounding, by up to about 1e-6 ' + \
+            '(2x2 tiles) or 1e-5 (4x4 tiles) times the largest output, so ' + \
+            'outputs are checked with a tolerance of ' + str(tol) + '.'
     if num_tests > 0:
         make_test_suite(model, function_name, malloc_vars,
-                        num_tests, stateful, verbose)
+                        num_tests, stateful, verbose, batch=bool(batch_size),
+                        reentrant=reentrant, tol=tol, comment=comment)
         s += "Tests are in '" + function_name + "_test_suite.c' \n"
+        files.append(function_name + '_test_suite.c')
     if malloc:
-        s += "Weight arrays are in .csv files of the form 'model_name_layer_name_array_type.csv' \n"
-        s += "They should be placed in the directory from which the main program is run."
+        s += "Weight arrays are in '" + function_name + "_weights.bin' \n"
+        s += "It should be placed in the directory from which the main program is run."
+    if cache_dir is not None:
+        save_to_cache(cache_dir, key, files, cache_size)
     if verbose:
         print(s)
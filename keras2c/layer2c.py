@@ -4,9 +4,15 @@ Writes individual layers to C code
 """
 
 # imports
-from keras2c.io_parsing import layer_type, get_model_io_names, get_all_io_names, get_layer_io_names, flatten
+from keras2c.io_parsing import layer_type, get_model_io_names, get_model_schedule
+from keras2c.graph_passes import get_folded_batch_norms, get_fused_activations, \
+    get_output_redirects, get_copied_activations
+from keras2c.specialize import specialized_dense, specialized_conv
+from keras2c.convolution import get_padding
+import numpy as np
 import tensorflow as tf
 tf.compat.v1.disable_eager_execution()
+maxndim = 5
 
 
 __author__ = "Rory Conlin"
@@ -18,33 +24,96 @@ __email__ = "wconlin@princeton.edu"
 
 class Layers2C():
 
-    def __init__(self, model, malloc):
+    def __init__(self, model, malloc, quantized=(), half=(), sparse=(),
+                 specialize=False, packed=(), im2col=(), winograd=()):
         self.model = model
         self.model_inputs, self.model_outputs = get_model_io_names(self.model)
         self.layers = ''
         self.malloc = malloc
+        self.folded_batch_norms = get_folded_batch_norms(self.model)
+        self.fused_activations = get_fused_activations(self.model)
+        self.activation_fusions = {producer.name: layer for layer, producer
+                                   in self.fused_activations.items()}
+        self.output_redirects = get_output_redirects(self.model)
+        # activations applied to a copy, since their input is read elsewhere
+        self.copied_activations = get_copied_activations(self.model)
+        # layers with int8 kernels
+        self.quantized = quantized
+        # layers with 16 bit kernels
+        self.half = half
+        # layers with kernels in CSR format
+        self.sparse = sparse
+        # layers with kernels packed in panels
+        self.packed = packed
+        # ConvND layers evaluated as a matrix product of their patches
+        self.im2col = im2col
+        # Conv2D layers evaluated by Winograd convolution
+        self.winograd = winograd
+        # Dense and ConvND layers call kernels written for their shapes
+        self.specialize = specialize
+        self.specialized = {}
 
     def write_layers(self, verbose=True):
-        written_io = set(self.model_inputs)
-        unwritten_io = set(get_all_io_names(self.model)) - written_io
-        while len(unwritten_io) > 0:
-            for layer in self.model.layers:
-                layer_inputs, layer_outputs = get_layer_io_names(layer)
-                for i, (inp, outp) in enumerate(zip(layer_inputs, layer_outputs)):
-                    if (set(flatten(inp)).issubset(written_io) and
-                            set(flatten(outp)).issubset(unwritten_io))or \
-                            layer_type(layer) == 'InputLayer':
-                        if verbose:
-                            print('Writing layer ', outp)
-                        method = getattr(
-                            self, 'write_layer_' + layer_type(layer))
-                        method(layer, inp, outp, i)
-                        written_io |= set(flatten(inp))
-                        written_io |= set(flatten(outp))
-                        unwritten_io -= set(flatten(inp))
-                        unwritten_io -= set(flatten(outp))
+        for layer, inp, outp, i in get_model_schedule(self.model):
+            if verbose:
+                print('Writing layer ', outp)
+            self.write_redirected_output(layer, outp, i)
+            method = getattr(self, 'write_layer_' + layer_type(layer))
+            method(layer, inp, outp, i)
         return self.layers
 
+    def write_redirected_output(self, layer, outp, i):
+        # layer writes straight into the output of the model
+        if isinstance(outp, str) and outp in self.output_redirects:
+            self.write_view('&' + outp + '_output',
+                            self.output_redirects[outp] + '_output',
+                            layer.get_output_at(i).shape[1:])
+
+    def write_view(self, outputs, inputs, shape):
+        self.write_declaration(self.format_view(outputs.replace('&', ''),
+                                                self.array_of(inputs), shape))
+
+    def write_declaration(self, decl):
+        # tensors that share data with another, rather than computing anything
+        self.layers += decl
+
+    @staticmethod
+    def array_of(tensor):
+        if tensor.startswith('&'):
+            return tensor[1:] + '.array'
+        return tensor + '->array'
+
+    def is_specialized(self, layer):
+        return self.specialize and layer.name not in self.quantized and \
+            layer.name not in self.packed and layer.name not in self.im2col and \
+            layer.name not in self.winograd and not self.get_kernel_suffix(layer)
+
+    def write_specialized_Dense(self, layer, i, activation):
+        fname = layer.name + '_specialized' + (str(i) if i else '')
+        shape = [int(j) for j in layer.get_input_at(i).shape[1:]]
+        self.specialized.setdefault(fname, specialized_dense(
+            fname, shape[-1], layer.get_config()['units'], activation))
+        return fname, int(np.prod(shape[:-1]))
+
+    def write_specialized_Conv(self, layer, i, activation):
+        fname = layer.name + '_specialized' + (str(i) if i else '')
+        config = layer.get_config()
+        inshp = [int(j) for j in layer.get_input_at(i).shape[1:]]
+        outshp = [int(j) for j in layer.get_output_at(i).shape[1:]]
+        self.specialized.setdefault(fname, specialized_conv(
+            fname, inshp, outshp, config['kernel_size'], config['strides'],
+            config['dilation_rate'], get_padding(layer), activation))
+        return fname
+
+    @staticmethod
+    def format_view(name, array, shape):
+        shape = [int(j) for j in shape]
+        ndim = len(shape)
+        shp = shape + [1]*(maxndim - ndim)
+        return 'k2c_tensor ' + name + ' = {' + array + ',' + str(ndim) + ',' + \
+            str(int(np.prod(shape))) + ',{' + ','.join(str(j) for j in shp) + \
+            '}}; \n'
+
     def format_io_names(self, layer, inp, outp, model_io=False):
         nm = layer.name
         pnm = '&' + nm
@@ -56,12 +125,18 @@ class Layers2C():
                 if j in self.model_inputs or 'timeslice' in j:
                     inp_nm.append(j + '_input')
                     is_model_input = True
+                elif j in self.model_outputs:
+                    inp_nm.append(j + '_output')
+                    is_model_input = True
                 else:
                     inp_nm.append('&' + j + '_output')
         else:
             if inp in self.model_inputs or 'timeslice' in inp:
                 inp_nm = inp + '_input'
                 is_model_input = True
+            elif inp in self.model_outputs:
+                inp_nm = inp + '_output'
+                is_model_input = True
             else:
                 inp_nm = '&' + inp + '_output'
         if isinstance(outp, list):
@@ -71,7 +146,7 @@ class Layers2C():
                     outp_nm.append(o + '_output')
                     is_model_output = True
                 else:
-                    outp_nm.append('&' + outp + '_output')
+                    outp_nm.append('&' + o + '_output')
         else:
             if outp in self.model_outputs or 'timeslice' in outp:
                 outp_nm = outp + '_output'
@@ -129,43 +204,79 @@ class Layers2C():
 
     def write_layer_LSTM(self, layer, inputs, outputs, i):
         nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
-        self.layers += 'k2c_lstm(' + outputs + ',' + inputs + ',' + nm + \
+        fname = 'k2c_lstm' + self.get_kernel_suffix(layer) + '('
+        self.layers += fname + outputs + ',' + inputs + ',' + nm + \
                        '_state,' + pnm + '_kernel, \n\t' + pnm + \
                        '_recurrent_kernel,' + pnm + '_bias,' + nm + \
-                       '_fwork, \n\t' + nm + '_go_backwards,' + nm + \
+                       '_fwork.array, \n\t' + nm + '_go_backwards,' + nm + \
                        '_return_sequences, \n\t' + \
                        'k2c_' + layer.get_config()['recurrent_activation'] + \
                        ',' + 'k2c_' + \
             layer.get_config()['activation'] + '); \n'
 
+    def get_kernel_suffix(self, layer):
+        # layers with compressed or 16 bit kernels call their own variant
+        if layer.name in self.sparse:
+            return '_s'
+        if layer.name in self.half:
+            return '_h'
+        return ''
+
     def write_layer_Dense(self, layer, inputs, outputs, i):
         nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
-        activation = 'k2c_' + layer.get_config()['activation']
-
-        self.layers += 'k2c_dense(' + outputs + ',' + inputs + ',' + pnm + \
-            '_kernel, \n\t' + pnm + '_bias,' + activation + ',' + \
-            nm + '_fwork); \n'
+        activation = self.get_kernel_activation(layer)
+
+        if nm in self.quantized:
+            self.layers += 'k2c_dense_q8(' + outputs + ',' + inputs + ',' + pnm + \
+                '_kernel, \n\t' + pnm + '_bias,' + nm + '_input_scale,' + \
+                activation + ',' + nm + '_qwork,' + nm + '_acc); \n'
+        elif self.get_kernel_suffix(layer):
+            self.layers += 'k2c_dense' + self.get_kernel_suffix(layer) + '(' + \
+                outputs + ',' + inputs + ',' + pnm + '_kernel, \n\t' + pnm + \
+                '_bias,' + activation + '); \n'
+        elif self.is_specialized(layer):
+            fname, rows = self.write_specialized_Dense(layer, i, activation)
+            self.layers += fname + '(' + self.array_of(outputs) + ',' + \
+                self.array_of(inputs) + ',' + nm + '_kernel.array, \n\t' + nm + \
+                '_bias.array,' + str(rows) + '); \n'
+        else:
+            self.layers += 'k2c_dense(' + outputs + ',' + inputs + ',' + pnm + \
+                '_kernel, \n\t' + pnm + '_bias,' + activation + ',NULL); \n'
+        self.write_activation_epilogue(layer, outputs)
 
     def write_layer_Conv(self, layer, inputs, outputs, i):
         nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
-        activation = 'k2c_' + layer.get_config()['activation']
+        activation = self.get_kernel_activation(layer)
         if layer_type(layer)[-2:] == '1D':
             fname = 'k2c_conv1d('
         elif layer_type(layer)[-2:] == '2D':
             fname = 'k2c_conv2d('
         elif layer_type(layer)[-2:] == '3D':
             fname = 'k2c_conv3d('
-        if layer.get_config()['padding'] == 'valid':
+        args = activation + '); \n'
+        if nm in self.quantized:
+            fname = fname[:-1] + '_q8('
+            args = nm + '_input_scale,' + activation + ',' + nm + '_qwork,' + \
+                nm + '_acc); \n'
+        elif nm in self.half:
+            fname = fname[:-1] + '_h('
+        elif nm in self.im2col:
+            fname = fname[:-1] + '_im2col('
+            cols = nm + '_cols.array' if self.im2col[nm] else 'NULL'
+            args = activation + ',' + cols + ',' + nm + '_block); \n'
+        if nm in self.winograd:
+            self.layers += 'k2c_conv2d_winograd(' + outputs + ',' + inputs + ',' + \
+                pnm + '_kernel, \n\t' + pnm + '_bias,' + nm + '_pad,' + activation + \
+                ',' + nm + '_work.array,' + nm + '_block); \n'
+        elif self.is_specialized(layer):
+            self.layers += self.write_specialized_Conv(layer, i, activation) + '(' + \
+                self.array_of(outputs) + ',' + self.array_of(inputs) + ',' + nm + \
+                '_kernel.array, \n\t' + nm + '_bias.array); \n'
+        else:
             self.layers += fname + outputs + ',' + inputs + ',' + \
                 pnm + '_kernel, \n\t' + pnm + '_bias,' + nm + \
-                '_stride,' + nm + '_dilation,' + activation + '); \n'
-        else:
-            self.write_layer_ZeroPad(layer, inputs, pnm +
-                                     '_padded_input', i)
-            self.layers += fname + outputs + ',' + pnm + \
-                '_padded_input,' + pnm + '_kernel, \n\t' + \
-                pnm + '_bias,' + nm + '_stride,' + nm + \
-                '_dilation,' + activation + '); \n'
+                '_stride,' + nm + '_dilation,' + nm + '_pad,' + args
+        self.write_activation_epilogue(layer, outputs)
 
     def write_layer_Conv1D(self, layer, inputs, outputs, i):
         self.write_layer_Conv(layer, inputs, outputs, i)
@@ -183,7 +294,7 @@ class Layers2C():
         self.write_layer_Pooling(layer, inputs, outputs, i)
 
     def write_layer_Pooling(self, layer, inputs, outputs, i):
-        nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
+        nm, _, inputs, outputs = self.format_io_names(layer, inputs, outputs)
         if 'Max' in layer_type(layer):
             s = 'k2c_maxpool'
         else:
@@ -192,15 +303,8 @@ class Layers2C():
             s += '1d(' + outputs + ','
         elif layer_type(layer)[-2:] == '2D':
             s += '2d(' + outputs + ','
-
-        if layer.get_config()['padding'] == 'valid':
-            s += inputs + ','
-        else:
-            self.write_layer_ZeroPad(layer, inputs, pnm +
-                                     '_padded_input', i)
-            s += pnm + '_padded_input,'
-
-        s += nm + '_pool_size, \n\t' + nm + '_stride); \n'
+        s += inputs + ',' + nm + '_pool_size, \n\t' + nm + '_stride,' + nm + \
+            '_pad); \n'
         self.layers += s
 
     def write_layer_MaxPooling2D(self, layer, inputs, outputs, i):
@@ -280,34 +384,27 @@ class Layers2C():
 
     def write_layer_GRU(self, layer, inputs, outputs, i):
         nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
-        self.layers += 'k2c_gru(' + outputs + ',' + inputs + ',' + \
+        fname = 'k2c_gru' + self.get_kernel_suffix(layer) + '('
+        self.layers += fname + outputs + ',' + inputs + ',' + \
             nm + '_state,' + pnm + '_kernel, \n\t' + \
             pnm + '_recurrent_kernel,' + pnm + '_bias,' + \
-            nm + '_fwork, \n\t' + nm + '_reset_after,' + \
+            nm + '_fwork.array, \n\t' + nm + '_reset_after,' + \
             nm + '_go_backwards,' + nm + '_return_sequences, \n\t' + \
             'k2c_' + layer.get_config()['recurrent_activation'] + \
             ',' + 'k2c_' + layer.get_config()['activation'] + '); \n'
 
     def write_layer_SimpleRNN(self, layer, inputs, outputs, i):
         nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
-        self.layers += 'k2c_simpleRNN(' + outputs + ',' + inputs + \
+        fname = 'k2c_simpleRNN' + self.get_kernel_suffix(layer) + '('
+        self.layers += fname + outputs + ',' + inputs + \
             ',' + nm + '_state,' + pnm + '_kernel, \n\t' + \
             pnm + '_recurrent_kernel,' + pnm + '_bias,' + \
-            nm + '_fwork, \n\t' + nm + '_go_backwards,' + \
+            nm + '_fwork.array, \n\t' + nm + '_go_backwards,' + \
             nm + '_return_sequences,' + 'k2c_' + \
             layer.get_config()['activation'] + '); \n'
 
     def write_layer_Activation(self, layer, inputs, outputs, i):
-        _, _, inputs, outputs, is_model_input, is_model_output = self.format_io_names(
-            layer, inputs, outputs, True)
-        activation = 'k2c_' + layer.get_config()['activation']
-        if is_model_input:
-            inp = inputs + '->'
-        else:
-            inp = inputs[1:] + '.'
-        self.layers += activation + '(' + inp + 'array,' + inp + 'numel); \n'
-        self.write_dummy_layer(layer, inputs, outputs, i,
-                               is_model_input, is_model_output)
+        self.write_layer_AdvancedActivation(layer, inputs, outputs, i)
 
     def write_layer_LeakyReLU(self, layer, inputs, outputs, i):
         self.write_layer_AdvancedActivation(layer, inputs, outputs, i)
@@ -325,13 +422,36 @@ class Layers2C():
         self.write_layer_AdvancedActivation(layer, inputs, outputs, i)
 
     def write_layer_AdvancedActivation(self, layer, inputs, outputs, i):
-        nm, _, inputs, outputs, is_model_input, is_model_output = self.format_io_names(
+        node = outputs
+        _, _, inputs, outputs, is_model_input, is_model_output = self.format_io_names(
             layer, inputs, outputs, True)
-        if is_model_input:
-            inp = inputs + '->'
+        if node in self.copied_activations:
+            # input is read elsewhere, so the activation is applied to a copy
+            if is_model_output:
+                self.write_dummy_layer(layer, inputs, outputs, i,
+                                       is_model_input, is_model_output)
+            else:
+                self.layers += 'memcpy(' + self.array_of(outputs) + ',' + \
+                    self.array_of(inputs) + ',' + outputs[1:] + \
+                    '.numel*sizeof(float)); \n'
+            self.write_activation(layer, outputs)
+            return
+        # fused activations are applied by the layer before them
+        if layer not in self.fused_activations:
+            self.write_activation(layer, inputs)
+        self.write_dummy_layer(layer, inputs, outputs, i,
+                               is_model_input, is_model_output)
+
+    def write_activation(self, layer, tensor):
+        nm = layer.name
+        if tensor.startswith('&'):
+            inp = tensor[1:] + '.'
         else:
-            inp = inputs + '.'
+            inp = tensor + '->'
 
+        if layer_type(layer) == 'Activation':
+            self.layers += 'k2c_' + layer.get_config()['activation'] + '(' + \
+                inp + 'array,' + inp + 'numel); \n'
         if layer_type(layer) == 'LeakyReLU':
             self.layers += 'k2c_LeakyReLU(' + inp + 'array,' + \
                 inp + 'numel,' + nm + '_alpha); \n'
@@ -348,12 +468,42 @@ class Layers2C():
             self.layers += 'k2c_ReLU(' + inp + 'array,' + inp + \
                            'numel,' + nm + '_max_value, \n\t' + \
                            nm + '_negative_slope,' + nm + '_threshold); \n'
-        self.write_dummy_layer(layer, inputs, outputs, i,
-                               is_model_input, is_model_output)
+
+    def get_kernel_activation(self, layer):
+        activation = layer.get_config()['activation']
+        fused = self.activation_fusions.get(layer.name)
+        # a plain activation can be passed to the kernel instead of its own
+        if fused is not None and activation == 'linear' and \
+           layer_type(fused) == 'Activation':
+            activation = fused.get_config()['activation']
+        return 'k2c_' + activation
+
+    def write_activation_epilogue(self, layer, outputs):
+        fused = self.activation_fusions.get(layer.name)
+        if fused is None or (layer.get_config()['activation'] == 'linear' and
+                             layer_type(fused) == 'Activation'):
+            return
+        if layer_type(fused) == 'Activation' and \
+           fused.get_config()['activation'] == 'softmax':
+            # softmax is over the last axis, so it is applied to each row,
+            # as k2c_dense does, and never across the samples of a batch
+            inp = outputs[1:] + '.' if outputs.startswith('&') else outputs + '->'
+            units = str(layer.get_config()['units'])
+            self.layers += 'for (size_t i = 0; i < ' + inp + 'numel; i += ' + \
+                units + ') { \n'
+            self.layers += 'k2c_softmax(&' + inp + 'array[i],' + units + '); \n'
+            self.layers += '} \n'
+            return
+        self.write_activation(fused, outputs)
 
     def write_dummy_layer(self, layer, inputs, outputs, i, is_model_input, is_model_output):
+        deref = '' if inputs.startswith('&') else '*'
         outputs = outputs.replace("&", "")
         inputs = inputs.replace("&", "")
+        if is_model_output and \
+           outputs[:-len('_output')] in self.output_redirects.values():
+            # data was already written to the output by the layer before
+            return
         if is_model_input and is_model_output:
             self.layers += outputs + '->ndim = ' + \
                 inputs + '->ndim; // copy data into output struct \n'
@@ -363,15 +513,6 @@ class Layers2C():
             self.layers += 'memcpy(' + outputs + '->array,' + inputs + '->array,' + \
                            outputs + \
                 '->numel*sizeof(' + outputs + '->array[0])); \n'
-        elif is_model_input:
-            self.layers += 'k2c_tensor ' + outputs + '; \n'
-            self.layers += outputs + '.ndim = ' + \
-                inputs + '->ndim; // copy data into output struct \n'
-            self.layers += outputs + '.numel = ' + inputs + '->numel; \n'
-            self.layers += 'memcpy(' + outputs + '.shape,' + inputs + \
-                           '->shape,K2C_MAX_NDIM*sizeof(size_t));  \n'
-            self.layers += outputs + '.array = &' + inputs + \
-                '->array[0]; // rename for clarity \n'
         elif is_model_output:
             self.layers += outputs + '->ndim = ' + \
                 inputs + '.ndim; // copy data into output struct \n'
@@ -382,25 +523,27 @@ class Layers2C():
                            outputs + \
                 '->numel*sizeof(' + outputs + '->array[0])); \n'
         else:
-            self.layers += 'k2c_tensor ' + outputs + '; \n'
-            self.layers += outputs + '.ndim = ' + \
-                inputs + '.ndim; // copy data into output struct \n'
-            self.layers += outputs + '.numel = ' + inputs + '.numel; \n'
-            self.layers += 'memcpy(' + outputs + '.shape,' + inputs + \
-                           '.shape,K2C_MAX_NDIM*sizeof(size_t));  \n'
-            self.layers += outputs + '.array = &' + inputs + \
-                '.array[0]; // rename for clarity \n'
+            # same data and shape, so just copy the descriptor
+            self.write_declaration('k2c_tensor ' + outputs + ' = ' + deref + inputs +
+                                   '; \n')
 
     def write_layer_Reshape(self, layer, inputs, outputs, i):
         nm, _, inputs, outputs, is_model_input, is_model_output = self.format_io_names(
             layer, inputs, outputs, True)
-        self.layers += 'k2c_reshape(' + outputs + ',' + inputs + ',' + nm + \
-            '_newshp,' + nm + '_newndim); \n'
+        if not is_model_output:
+            # same data with a new shape
+            self.write_view(outputs, inputs, layer.get_output_at(i).shape[1:])
+        elif outputs[:-len('_output')] not in self.output_redirects.values():
+            self.layers += 'k2c_reshape(' + outputs + ',' + inputs + ',' + nm + \
+                '_newshp,' + nm + '_newndim); \n'
 
     def write_layer_Flatten(self, layer, inputs, outputs, i):
         _, _, inputs, outputs, is_model_input, is_model_output = self.format_io_names(
             layer, inputs, outputs, True)
-        self.layers += 'k2c_flatten(' + outputs + ',' + inputs + '); \n'
+        if not is_model_output:
+            self.write_view(outputs, inputs, layer.get_output_at(i).shape[1:])
+        elif outputs[:-len('_output')] not in self.output_redirects.values():
+            self.layers += 'k2c_flatten(' + outputs + ',' + inputs + '); \n'
 
     def write_layer_Permute(self, layer, inputs, outputs, i):
         nm, _, inputs, outputs = self.format_io_names(layer, inputs, outputs)
@@ -420,6 +563,13 @@ class Layers2C():
                        nm + '_normalize,' + nm + '_fwork); \n'
 
     def write_layer_BatchNormalization(self, layer, inputs, outputs, i):
+        if layer in self.folded_batch_norms:
+            # folded into the previous layer, so it just renames its output
+            _, _, inputs, outputs, is_model_input, is_model_output = self.format_io_names(
+                layer, inputs, outputs, True)
+            self.write_dummy_layer(layer, inputs, outputs, i,
+                                   is_model_input, is_model_output)
+            return
         nm, pnm, inputs, outputs = self.format_io_names(layer, inputs, outputs)
         self.layers += 'k2c_batch_norm(' + outputs + ',' + inputs + \
                        ',' + pnm + '_mean,' + pnm + '_stdev,' + pnm + \
@@ -480,11 +630,7 @@ class Layers2C():
         self.write_layer_ZeroPad(layer, inputs, outputs, i)
 
     def write_layer_ZeroPad(self, layer, inputs, outputs, i):
-        if 'Zero' in layer_type(layer):
-            nm, _, inputs, outputs = self.format_io_names(
-                layer, inputs, outputs)
-        else:
-            nm = layer.name
+        nm, _, inputs, outputs = self.format_io_names(layer, inputs, outputs)
         if layer_type(layer)[-2:] == '1D':
             self.layers += 'k2c_pad1d('
         elif layer_type(layer)[-2:] == '2D':
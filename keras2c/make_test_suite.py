@@ -9,6 +9,7 @@ from keras2c.io_parsing import get_model_io_names
 from keras2c.weights2c import Weights2C
 import tensorflow as tf
 import subprocess
+import textwrap
 tf.compat.v1.disable_eager_execution()
 
 __author__ = "Rory Conlin"
@@ -18,7 +19,8 @@ __maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
 __email__ = "wconlin@princeton.edu"
 
 
-def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=False, verbose=True, tol=1e-5):
+def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=False, verbose=True, tol=1e-5,
+                    batch=False, reentrant=False, comment=None):
     if verbose:
         print('Writing tests')
     input_shape = []
@@ -32,8 +34,16 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
   #  for i in range(num_outputs):
   #      output_shape.insert(i, model.outputs[i].shape[1:])
 
+    # batched function carries state from one sample to the next, so it can't
+    # be compared against independent calls for stateful models
+    batch = batch and not stateful
+    batch_inputs = [[] for _ in model_inputs]
+    batch_outputs = [[] for _ in model_outputs]
     file = open(function_name + '_test_suite.c', "x+")
-    s = '#include <stdio.h> \n'
+    s = ''
+    if comment:
+        s += '/*\n' + textwrap.indent(textwrap.fill(comment, 76), ' * ') + '\n */\n\n'
+    s += '#include <stdio.h> \n'
     s += '#include <math.h> \n'
     s += '#include <time.h> \n'
     s += '#include "k2c_include.h" \n'
@@ -65,19 +75,33 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
                 raise Exception('Cannot find inputs to the \
                 network that result in a finite output')
         for j, _ in enumerate(model_inputs):
-            file.write(Weights2C.array2c((rand_inputs[j][0, :]), 'test' + str(i+1) +
-                                         '_' + model_inputs[j] + '_input'))
+            file.writelines(Weights2C.array2c_chunks((rand_inputs[j][0, :]), 'test' + str(i+1) +
+                                                     '_' + model_inputs[j] + '_input'))
 
             # write predictions
         if not isinstance(outputs, list):
             outputs = [outputs]
         for j, _ in enumerate(model_outputs):
             output = outputs[j][0, :]
-            file.write(Weights2C.array2c(output, 'keras_' +
-                                         model_outputs[j] + '_test' + str(i+1)))
-            file.write(Weights2C.array2c(np.zeros(output.shape), 'c_' +
-                                         model_outputs[j] + '_test' + str(i+1)))
-    s = ' float errors[' + str(num_tests*num_outputs) + '];\n'
+            file.writelines(Weights2C.array2c_chunks(output, 'keras_' +
+                                                     model_outputs[j] + '_test' + str(i+1)))
+            file.writelines(Weights2C.array2c_chunks(np.zeros(output.shape), 'c_' +
+                                                     model_outputs[j] + '_test' + str(i+1)))
+            batch_outputs[j].append(output.flatten())
+        for j, _ in enumerate(model_inputs):
+            batch_inputs[j].append(rand_inputs[j][0, :].flatten())
+    num_errors = num_tests*num_outputs
+    if batch:
+        num_errors += num_outputs
+        for j, _ in enumerate(model_inputs):
+            file.writelines(Weights2C.array2c_chunks(np.array(batch_inputs[j]), 'batch_' +
+                                                     model_inputs[j] + '_input'))
+        for j, _ in enumerate(model_outputs):
+            file.writelines(Weights2C.array2c_chunks(np.array(batch_outputs[j]), 'keras_' +
+                                                     model_outputs[j] + '_batch'))
+            file.writelines(Weights2C.array2c_chunks(np.zeros((num_tests, batch_outputs[j][0].size)),
+                                                     'c_' + model_outputs[j] + '_batch'))
+    s = ' float errors[' + str(num_errors) + '];\n'
     s += ' size_t num_tests = ' + str(num_tests) + '; \n'
     s += 'size_t num_outputs = ' + str(num_outputs) + '; \n'
     for var in malloc_vars:
@@ -86,8 +110,13 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
     init_sig = function_name + '_initialize(' + \
         ','.join(['&' + var for var in malloc_vars]) + '); \n'
     s += init_sig
+    # reentrant models take a context as their first argument
+    ctx = []
+    if reentrant:
+        s += function_name + '_ctx* ctx = ' + function_name + '_ctx_init(); \n'
+        ctx = ['ctx']
     if stateful:
-        reset_sig = function_name + '_reset_states();'
+        reset_sig = function_name + '_reset_states(' + ','.join(ctx) + ');'
         s += reset_sig
     s += 'clock_t t0 = clock(); \n'
     file.write(s)
@@ -100,7 +129,7 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
                     '_input' for inp in model_inputs]
         model_out = ['&c_' + outp + '_test' +
                      str(i+1) for outp in model_outputs]
-        s += ','.join(model_in + model_out + list(malloc_vars))
+        s += ','.join(ctx + model_in + model_out + list(malloc_vars))
         s += '); \n'
         file.write(s)
     file.write('\n')
@@ -110,6 +139,22 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
         str(num_tests) + '); \n'
     file.write(s)
 
+    if batch:
+        s = 't0 = clock(); \n'
+        s += function_name + '_batch(' + ','.join(ctx + [str(num_tests)]) + ','
+        model_in = ['&batch_' + inp + '_input' for inp in model_inputs]
+        model_out = ['&c_' + outp + '_batch' for outp in model_outputs]
+        s += ','.join(model_in + model_out + list(malloc_vars))
+        s += '); \n'
+        s += 't1 = clock(); \n'
+        s += 'printf("Average time over ' + str(num_tests) + \
+            ' batched tests: %e s \\n\", \n (double)(t1-t0)/(double)CLOCKS_PER_SEC/(double)' + \
+            str(num_tests) + '); \n'
+        for j, _ in enumerate(model_outputs):
+            s += 'errors[' + str(num_tests*num_outputs+j) + '] = maxabs(&keras_' + \
+                model_outputs[j] + '_batch,&c_' + model_outputs[j] + '_batch); \n'
+        file.write(s)
+
     for i in range(num_tests):
         for j, _ in enumerate(model_outputs):
             s = 'errors[' + str(i*num_outputs+j) + '] = maxabs(&keras_' + model_outputs[j] + '_test' + \
@@ -117,7 +162,7 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
                 model_outputs[j] + '_test' + str(i+1) + '); \n'
             file.write(s)
     s = 'float maxerror = errors[0]; \n'
-    s += 'for(size_t i=1; i< num_tests*num_outputs;i++){ \n'
+    s += 'for(size_t i=1; i< ' + str(num_errors) + ';i++){ \n'
     s += 'if (errors[i] > maxerror) { \n'
     s += 'maxerror = errors[i];}} \n'
     s += 'printf("Max absolute error for ' + \
@@ -128,7 +173,10 @@ def make_test_suite(model, function_name, malloc_vars, num_tests=10, stateful=Fa
     # s += 'printf(\"Error, test %d: %f \\n \",i,errors[i]);} \n'
     # file.write(s)
 
-    s = function_name + '_terminate(' + ','.join(malloc_vars) + '); \n'
+    s = ''
+    if reentrant:
+        s += function_name + '_ctx_free(ctx); \n'
+    s += function_name + '_terminate(' + ','.join(malloc_vars) + '); \n'
     s += 'if (maxerror > ' + str(tol) + ') { \n'
     s += 'return 1;} \n'
     s += 'return 0;\n} \n\n'
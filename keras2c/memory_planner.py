@@ -0,0 +1,143 @@
+"""memory_planner.py
+This file is part of keras2c
+Plans the reuse of memory for intermediate tensors
+"""
+
+# imports
+from keras2c.io_parsing import get_model_io_names, get_model_schedule, flatten
+from keras2c.graph_passes import get_output_redirects
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def get_tensor_aliases(model, buffers):
+    """Finds nodes of the model that share memory with another node
+
+    Layers that do not change the data (eg, Dropout or Activation) do not get
+    a buffer of their own, their output is the same memory as their input.
+    Layers with a fused activation that gives an output of the model write
+    straight into that output.
+
+    Args:
+        model (keras Model): model being converted
+        buffers (dict): names of buffers mapped to the name of the layer that
+            owns them
+
+    Returns:
+        aliases (dict): names of nodes mapped to the name of the node that
+            actually holds their data
+    """
+
+    model_inputs, model_outputs = get_model_io_names(model)
+    alias = get_output_redirects(model)
+    for layer, inp, outp, _ in get_model_schedule(model):
+        for o in flatten(outp):
+            if o in alias:
+                continue
+            if o + '_output' not in buffers and o not in model_outputs and \
+               len(flatten(inp)) == 1 and o not in model_inputs:
+                alias[o] = flatten(inp)[0]
+
+    def root(node):
+        while node in alias:
+            node = alias[node]
+        return node
+
+    return {node: root(node) for node in alias}
+
+
+def get_buffer_lifetimes(model, buffers):
+    """Gets the first and last step at which each buffer is in use
+
+    Buffers named after a node of the model ("<node>_output") live from the
+    step that writes them until the last step that reads them, or reads a
+    tensor that shares their memory (eg, the output of a Dropout layer).
+    All other buffers (padded inputs, working storage for wrapped layers etc.)
+    live only while the layer that owns them is being evaluated.
+
+    Args:
+        model (keras Model): model being converted
+        buffers (dict): names of buffers mapped to the name of the layer that
+            owns them
+
+    Returns:
+        lifetimes (dict): names of buffers mapped to a tuple of (first, last)
+            step at which they are used
+    """
+
+    schedule = get_model_schedule(model)
+    aliases = get_tensor_aliases(model, buffers)
+    last_step = len(schedule) - 1
+    produced = {}
+    owner_steps = {}
+    last_used = {}
+    for step, (layer, inp, outp, _) in enumerate(schedule):
+        owner_steps.setdefault(layer.name, []).append(step)
+        for o in flatten(outp):
+            produced.setdefault(o, step)
+        for node in flatten(inp) + flatten(outp):
+            last_used[aliases.get(node, node)] = step
+
+    lifetimes = {}
+    for name, owner in buffers.items():
+        node = name[:-len('_output')]
+        if name.endswith('_output') and node in produced:
+            lifetimes[name] = (produced[node], last_used.get(node, last_step))
+        elif owner in owner_steps:
+            lifetimes[name] = (min(owner_steps[owner]), max(owner_steps[owner]))
+        else:
+            # unknown usage, keep it alive for the whole call
+            lifetimes[name] = (0, last_step)
+    return lifetimes
+
+
+def plan_memory(sizes, lifetimes, alignment=16):
+    """Packs buffers into a single workspace, reusing memory where possible
+
+    Buffers are placed largest first, each at the offset that best fits it
+    among the memory not used by buffers already placed whose lifetimes
+    overlap with its own.
+
+    Args:
+        sizes (dict): names of buffers mapped to their size in elements
+        lifetimes (dict): names of buffers mapped to a tuple of (first, last)
+            step at which they are used
+        alignment (int): offsets are rounded up to a multiple of this many elements
+
+    Returns:
+        offsets (dict): names of buffers mapped to their offset in the workspace
+        workspace_size (int): total number of elements in the workspace
+    """
+
+    def align(n):
+        return -(-n // alignment) * alignment
+
+    offsets = {}
+    placed = []
+    workspace_size = 0
+    for name in sorted(sizes, key=lambda nm: (-sizes[nm], nm)):
+        size = align(max(int(sizes[name]), 1))
+        first, last = lifetimes[name]
+        conflicts = sorted((offsets[other], offsets[other] + align(max(int(sizes[other]), 1)))
+                           for other in placed
+                           if lifetimes[other][0] <= last and first <= lifetimes[other][1])
+        best = None
+        best_gap = None
+        prev_end = 0
+        for start, end in conflicts:
+            gap = start - prev_end
+            if gap >= size and (best_gap is None or gap < best_gap):
+                best = prev_end
+                best_gap = gap
+            prev_end = max(prev_end, end)
+        if best is None:
+            best = prev_end
+        offsets[name] = best
+        placed.append(name)
+        workspace_size = max(workspace_size, best + size)
+    return offsets, workspace_size
@@ -0,0 +1,62 @@
+"""packing.py
+This file is part of keras2c
+Rearranges kernels into the panel layout used by the matrix multiplication
+"""
+
+# imports
+import numpy as np
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+# must match K2C_GEMM_NC in k2c_include.h
+PANEL_COLS = 64
+
+
+def block_kernel(kernel, splits=()):
+    """Stores a 2D kernel as blocks of columns, one after the other
+
+    Args:
+        kernel (array): kernel to rearrange, of shape (rows, cols)
+        splits (list): columns at which the kernel is split into blocks that
+            are multiplied separately, as for the reset gate of GRU layers
+
+    Returns:
+        blocked (array): array of the same shape as the kernel, holding every
+            row of the first block, then every row of the next, and so on
+    """
+
+    blocks = np.split(np.asarray(kernel), list(splits), axis=1)
+    return np.concatenate([block.ravel() for block in blocks]).reshape(kernel.shape)
+
+
+def pack_kernel(kernel, splits=()):
+    """Packs a 2D kernel into panels of PANEL_COLS columns
+
+    Each panel holds every row of its columns, one row after the other, and
+    the last panel is padded with zeros, so that k2c_affine_matmul_p only
+    makes unit stride loads from the kernel.
+
+    Args:
+        kernel (array): kernel to pack, of shape (rows, cols)
+        splits (list): columns at which the kernel is split into blocks that
+            are multiplied separately and packed one after the other
+
+    Returns:
+        packed (array): 1D array of the packed kernel, of size
+            rows*ceil(cols/PANEL_COLS)*PANEL_COLS for each block
+    """
+
+    blocks = []
+    for block in np.split(np.asarray(kernel, dtype=np.float32), list(splits), axis=1):
+        rows, cols = block.shape
+        panels = -(-cols // PANEL_COLS)
+        padded = np.zeros((rows, panels*PANEL_COLS), dtype=np.float32)
+        padded[:, :cols] = block
+        blocks.append(padded.reshape(rows, panels, PANEL_COLS).transpose(1, 0, 2))
+    return np.concatenate([block.ravel() for block in blocks])
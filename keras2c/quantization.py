@@ -0,0 +1,132 @@
+"""quantization.py
+This file is part of keras2c
+Converts weights to int8 or 16 bit floating point for reduced precision storage
+"""
+
+# imports
+import numpy as np
+from keras2c.io_parsing import layer_type, get_layer_num_io
+import keras
+import tensorflow as tf
+tf.compat.v1.disable_eager_execution()
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def get_quantizable_layers(model):
+    """Finds layers that have int8 kernels
+
+    Args:
+        model (keras Model): model to parse
+
+    Returns:
+        layers (list): Dense and ConvND layers that are evaluated once
+    """
+
+    return [layer for layer in model.layers
+            if layer_type(layer) in ['Dense', 'Conv1D', 'Conv2D', 'Conv3D'] and
+            get_layer_num_io(layer) == (1, 1)]
+
+
+def get_activation_scales(model, calibration_data):
+    """Computes the scale of the input to each quantized layer
+
+    The model is evaluated on the calibration data, and the input of each
+    layer is quantized with a step of max(abs(input))/127, so that every value
+    seen during calibration fits in int8.
+
+    Args:
+        model (keras Model): model to quantize
+        calibration_data (array or list of arrays): representative inputs to
+            the model, with the batch dimension first
+
+    Raises:
+        ValueError: if no calibration data is given
+
+    Returns:
+        scales (dict): names of quantized layers mapped to the scale of their input
+    """
+
+    if calibration_data is None:
+        raise ValueError('Quantization needs calibration data')
+    if not isinstance(calibration_data, (list, tuple)):
+        calibration_data = [calibration_data]
+    layers = get_quantizable_layers(model)
+    values = {}
+    # inputs of the model can't also be fetched from it
+    probed = []
+    for layer in layers:
+        is_input = [layer.input is tensor for tensor in model.inputs]
+        if any(is_input):
+            values[layer.name] = calibration_data[is_input.index(True)]
+        else:
+            probed.append(layer)
+    if probed:
+        probe = keras.models.Model(inputs=model.inputs,
+                                   outputs=[layer.input for layer in probed])
+        outputs = probe.predict(calibration_data)
+        if len(probed) == 1:
+            outputs = [outputs]
+        for layer, value in zip(probed, outputs):
+            values[layer.name] = value
+    scales = {}
+    for layer in layers:
+        maxabs = float(np.max(np.abs(values[layer.name])))
+        scales[layer.name] = maxabs/127 if maxabs > 0 else 1.0
+    return scales
+
+
+def quantize_kernel(kernel, per_channel=True):
+    """Quantizes a kernel to int8 with a symmetric scale
+
+    Args:
+        kernel (array): kernel to quantize, output channels along the last axis
+        per_channel (bool): whether each output channel gets its own scale,
+            or the whole kernel shares one
+
+    Returns:
+        qkernel (array): kernel as int8
+        scale (array): scale of each output channel, so that kernel is
+            approximately qkernel*scale
+    """
+
+    axes = tuple(range(kernel.ndim - 1))
+    if per_channel:
+        maxabs = np.max(np.abs(kernel), axis=axes)
+    else:
+        maxabs = np.full(kernel.shape[-1], np.max(np.abs(kernel)))
+    scale = np.where(maxabs > 0, maxabs/127, 1.0).astype(np.float32)
+    qkernel = np.clip(np.rint(kernel/scale), -127, 127).astype(np.int8)
+    return qkernel, scale
+
+
+def half_kernel(kernel, weight_dtype):
+    """Converts a kernel to 16 bit floating point
+
+    Args:
+        kernel (array): kernel to convert
+        weight_dtype (str): 'float16' for IEEE half precision, or 'bfloat16'
+            for the upper 16 bits of a float32, rounded to nearest even
+
+    Raises:
+        ValueError: if weight_dtype is not 'float16' or 'bfloat16'
+
+    Returns:
+        hkernel (array): bits of the converted kernel as uint16
+    """
+
+    if weight_dtype == 'float16':
+        return np.asarray(kernel, dtype=np.float16).view(np.uint16)
+    if weight_dtype == 'bfloat16':
+        bits = np.ascontiguousarray(kernel, dtype=np.float32).view(np.uint32)
+        rounded = (bits.astype(np.uint64) + 0x7fff + ((bits >> 16) & 1)) >> 16
+        # nan must stay nan after rounding
+        rounded = np.where(np.isnan(kernel), (bits >> 16) | 0x40, rounded)
+        return rounded.astype(np.uint16)
+    raise ValueError("Unknown weight dtype '" + str(weight_dtype) + "'. " +
+                     "Should be one of 'float16' or 'bfloat16'")
@@ -0,0 +1,87 @@
+"""sparsity.py
+This file is part of keras2c
+Finds pruned kernels and converts them to compressed sparse storage
+"""
+
+# imports
+import numpy as np
+from keras2c.io_parsing import layer_type
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def get_sparsity(arrays):
+    """Gets the fraction of zeros in a set of arrays
+
+    Args:
+        arrays (list of arrays): arrays to check
+
+    Returns:
+        sparsity (float): number of zeros divided by the total number of
+            elements, 0 if there are no elements
+    """
+
+    size = sum(array.size for array in arrays)
+    if size == 0:
+        return 0.
+    return sum(array.size - np.count_nonzero(array) for array in arrays) / size
+
+
+def get_sparse_layers(model, threshold):
+    """Finds layers whose kernels are sparse enough to store in CSR format
+
+    Dense, LSTM, GRU and SimpleRNN layers are stored sparse if the fraction of
+    zeros in their kernel and recurrent kernel taken together is at least
+    threshold.
+
+    Args:
+        model (keras Model): model to parse
+        threshold (float): minimum fraction of zeros
+
+    Returns:
+        layers (set): names of layers with sparse kernels
+    """
+
+    layers = set()
+    for layer in model.layers:
+        if layer_type(layer) == 'Dense':
+            kernels = layer.get_weights()[:1]
+        elif layer_type(layer) in ['LSTM', 'GRU', 'SimpleRNN']:
+            kernels = layer.get_weights()[:2]
+        else:
+            continue
+        if get_sparsity(kernels) >= threshold:
+            layers.add(layer.name)
+    return layers
+
+
+def csr_kernel(kernel, splits=()):
+    """Converts a 2D kernel to compressed sparse row (CSR) format
+
+    Args:
+        kernel (array): kernel to convert, of shape (rows, cols)
+        splits (list): columns at which the kernel is split into blocks that
+            are multiplied separately. The rows of each block follow those of
+            the one before, with columns counted from the start of the block
+
+    Returns:
+        values (array): nonzeros of the kernel, row by row
+        indices (array): column of each nonzero, as uint32
+        indptr (array): array[blocks*rows+1] of the offset in values of the
+            start of each row, as uint32
+    """
+
+    values, indices, counts = [], [], []
+    for block in np.split(np.asarray(kernel), list(splits), axis=1):
+        rows, cols = np.nonzero(block)
+        values.append(block[rows, cols].astype(np.float32))
+        indices.append(cols.astype(np.uint32))
+        counts.append(np.bincount(rows, minlength=block.shape[0]))
+    indptr = np.zeros(len(counts)*kernel.shape[0] + 1, dtype=np.uint32)
+    indptr[1:] = np.cumsum(np.concatenate(counts))
+    return np.concatenate(values), np.concatenate(indices), indptr
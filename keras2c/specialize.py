@@ -0,0 +1,154 @@
+"""specialize.py
+This file is part of keras2c
+Writes kernels specialized to the shapes of a single layer
+"""
+
+# imports
+import numpy as np
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def flat_index(subs, shape):
+    """Writes a C expression for the flat index of a subscript
+
+    Args:
+        subs (list): C expressions for the subscript along each axis
+        shape (list): size of each axis, only the sizes after the first are used
+
+    Returns:
+        index (str): C expression for the row major flat index
+    """
+
+    index = subs[0]
+    for sub, size in zip(subs[1:], shape[1:]):
+        if ' ' in index:
+            index = '(' + index + ')'
+        index = index + '*' + str(size) + ' + ' + sub
+    return index
+
+
+def specialized_dense(name, innerdim, outcols, activation):
+    """Writes a Dense kernel with the size of the kernel fixed
+
+    Each row of the output is initialized with the bias, and the activation
+    is applied to each row, as in k2c_dense.
+
+    Args:
+        name (str): name of the C function
+        innerdim (int): number of rows of the kernel
+        outcols (int): number of columns of the kernel
+        activation (str): name of the activation function to apply
+
+    Returns:
+        code (str): definition of a C function that takes the output, input,
+            kernel and bias arrays, and the number of rows of the input
+    """
+
+    innerdim = str(int(innerdim))
+    outcols = str(int(outcols))
+    s = 'static void ' + name + '(float * restrict output, ' + \
+        'const float * restrict input, \n\tconst float * restrict kernel, ' + \
+        'const float * restrict bias, const size_t rows) { \n'
+    s += 'for (size_t i = 0; i < rows; ++i) { \n'
+    s += 'float * restrict y = &output[i*' + outcols + ']; \n'
+    s += 'const float * x = &input[i*' + innerdim + ']; \n'
+    s += 'for (size_t j = 0; j < ' + outcols + '; ++j) { \n'
+    s += 'y[j] = bias[j]; \n'
+    s += '} \n'
+    s += 'for (size_t k = 0; k < ' + innerdim + '; ++k) { \n'
+    s += 'for (size_t j = 0; j < ' + outcols + '; ++j) { \n'
+    s += 'y[j] += x[k]*kernel[k*' + outcols + ' + j]; \n'
+    s += '} \n'
+    s += '} \n'
+    if activation != 'k2c_linear':
+        s += activation + '(y,' + outcols + '); \n'
+    s += '} \n'
+    s += '} \n\n'
+    return s
+
+
+def specialized_conv(name, inshp, outshp, kernel_size, stride, dilation, pad,
+                     activation):
+    """Writes a 1D, 2D or 3D convolution with all sizes fixed
+
+    The input is padded implicitly, as in k2c_conv2d: along padded axes the
+    kernel loops are limited to the part of the kernel inside the input.
+
+    Args:
+        name (str): name of the C function
+        inshp (list): shape of the input, channels last
+        outshp (list): shape of the output, channels last
+        kernel_size (list): size of the kernel along each spatial axis
+        stride (list): stride along each spatial axis
+        dilation (list): dilation rate along each spatial axis
+        pad (list): padding before and after each spatial axis
+        activation (str): name of the activation function to apply
+
+    Returns:
+        code (str): definition of a C function that takes the output, input,
+            kernel and bias arrays
+    """
+
+    ndim = len(kernel_size)
+    in_channels = str(int(inshp[-1]))
+    out_channels = str(int(outshp[-1]))
+    xs = ['x' + str(d) for d in range(ndim)]
+    zs = ['z' + str(d) for d in range(ndim)]
+    padded = [pad[2*d] > 0 or pad[2*d+1] > 0 for d in range(ndim)]
+    pos = [x + '*' + str(int(st)) + ' + ' + str(int(di)) + '*' + z +
+           (' - ' + str(int(pad[2*d])) if pad[2*d] else '')
+           for d, (x, z, st, di) in enumerate(zip(xs, zs, stride, dilation))]
+
+    s = 'static void ' + name + '(float * restrict output, ' + \
+        'const float * restrict input, \n\tconst float * restrict kernel, ' + \
+        'const float * restrict bias) { \n'
+    for x, size in zip(xs, outshp[:-1]):
+        s += 'for (size_t ' + x + ' = 0; ' + x + ' < ' + str(int(size)) + \
+            '; ++' + x + ') { \n'
+    s += 'float * restrict y = &output[(' + flat_index(xs, outshp[:-1]) + ')*' + \
+        out_channels + ']; \n'
+    s += 'for (size_t k = 0; k < ' + out_channels + '; ++k) { \n'
+    s += 'y[k] = bias[k]; \n'
+    s += '} \n'
+    for d in range(ndim):
+        if not padded[d]:
+            continue
+        # first and one past the last position of the kernel inside the input
+        start = xs[d] + '*' + str(int(stride[d]))
+        before = str(int(pad[2*d]))
+        di = str(int(dilation[d]))
+        last = '(' + str(int(pad[2*d] + inshp[d])) + ' - ' + start + ' + ' + \
+            str(int(dilation[d]) - 1) + ')/' + di
+        s += 'const size_t ' + zs[d] + '_first = ' + start + ' < ' + before + \
+            ' ? (' + before + ' - ' + start + ' + ' + str(int(dilation[d]) - 1) + \
+            ')/' + di + ' : 0; \n'
+        s += 'const size_t ' + zs[d] + '_last = ' + last + ' < ' + \
+            str(int(kernel_size[d])) + ' ? ' + last + ' : ' + \
+            str(int(kernel_size[d])) + '; \n'
+    for d, (z, size) in enumerate(zip(zs, kernel_size)):
+        if padded[d]:
+            s += 'for (size_t ' + z + ' = ' + z + '_first; ' + z + ' < ' + z + \
+                '_last; ++' + z + ') { \n'
+        else:
+            s += 'for (size_t ' + z + ' = 0; ' + z + ' < ' + str(int(size)) + \
+                '; ++' + z + ') { \n'
+    s += 'const float * x = &input[(' + flat_index(pos, inshp[:-1]) + ')*' + \
+        in_channels + ']; \n'
+    s += 'const float * w = &kernel[(' + flat_index(zs, kernel_size) + ')*' + \
+        str(int(inshp[-1])*int(outshp[-1])) + ']; \n'
+    s += 'for (size_t q = 0; q < ' + in_channels + '; ++q) { \n'
+    s += 'for (size_t k = 0; k < ' + out_channels + '; ++k) { \n'
+    s += 'y[k] += x[q]*w[q*' + out_channels + ' + k]; \n'
+    s += '} \n'
+    s += '} \n'
+    s += '} \n' * (2*ndim)
+    if activation != 'k2c_linear':
+        s += activation + '(output,' + str(int(np.prod(outshp))) + '); \n'
+    s += '} \n\n'
+    return s
@@ -0,0 +1,191 @@
+"""tasks2c.py
+This file is part of keras2c
+Writes the layers of the main function as tasks that can run concurrently
+"""
+
+# imports
+from keras2c.io_parsing import layer_type, get_model_schedule, flatten
+from keras2c.layer2c import Layers2C
+from keras2c.memory_planner import get_tensor_aliases
+import tensorflow as tf
+tf.compat.v1.disable_eager_execution()
+
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+def get_task_dependencies(model, buffers, steps):
+    """Finds the tasks that each task must wait for
+
+    A task waits for the last task to write any data it reads or writes, and
+    for every task since then that read data it writes, so the results are
+    the same as running the tasks in order. Nodes that share memory (eg, the
+    output of an Activation layer and its input) count as the same data.
+    Tasks that evaluate the same layer also run in order, since they share
+    its working arrays and state.
+
+    Args:
+        model (keras Model): model being converted
+        buffers (dict): names of buffers mapped to the name of the layer that
+            owns them
+        steps (list): index in the schedule of the model of the step run by
+            each task, in increasing order
+
+    Returns:
+        deps (list): set of earlier tasks that each task waits for
+    """
+
+    schedule = get_model_schedule(model)
+    aliases = get_tensor_aliases(model, buffers)
+    last_write = {}
+    readers = {}
+    last_of_layer = {}
+    deps = []
+    for task, step in enumerate(steps):
+        layer, inp, outp, _ = schedule[step]
+        read = set(aliases.get(node, node) for node in flatten(inp))
+        written = set(aliases.get(node, node) for node in flatten(outp))
+        waits = set(last_write[node] for node in read | written if node in last_write)
+        for node in written:
+            waits |= readers.get(node, set())
+        if layer.name in last_of_layer:
+            waits.add(last_of_layer[layer.name])
+        waits.discard(task)
+        deps.append(waits)
+        for node in read:
+            readers.setdefault(node, set()).add(task)
+        for node in written:
+            last_write[node] = task
+            readers[node] = set()
+        last_of_layer[layer.name] = task
+    return deps
+
+
+class Tasks2C(Layers2C):
+    """Writes the layers of the main function as tasks
+
+    Each layer that does any work becomes one case of a task function, and
+    the main function passes its arguments to k2c_run_tasks, which runs each
+    task once the tasks it depends on have finished, so independent branches
+    of the model are evaluated at the same time. Tensors that only share the
+    data of another are declared once, before any task runs, and the
+    parameters and working arrays of each layer are declared only in the
+    tasks that evaluate it.
+
+    Each call declares its own workspace and passes it to its tasks, so the
+    main function may be called from several threads at once. Models whose
+    calls share state (the states of stateful layers, unless reentrant, or
+    the working arrays allocated by malloc) give their task graph a lock, so
+    their calls take turns.
+    """
+
+    def __init__(self, model, function_name, malloc, weights, specialize=False):
+        super().__init__(model, malloc, weights.activation_scales,
+                         weights.half_kernels, weights.sparse_layers, specialize,
+                         weights.packed_kernels, weights.im2col_layers,
+                         weights.winograd_layers)
+        self.function_name = function_name
+        self.weights = weights
+        self.declarations = ''
+        self.task_prologue = ''
+        self.task_epilogue = ''
+
+    def write_declaration(self, decl):
+        self.declarations += decl
+
+    def get_task_args(self):
+        args = []
+        if self.weights.reentrant:
+            args.append((self.function_name + '_ctx* ', 'ctx'))
+        args += [('k2c_tensor* ', nm + '_input') for nm in self.model_inputs]
+        args += [('k2c_tensor* ', nm + '_output') for nm in self.model_outputs]
+        args += [('float* ', key) for key in self.weights.malloc_vars.keys()]
+        if self.weights.workspace_decl:
+            args.append(('float* ', 'workspace'))
+        return args
+
+    def write_layers(self, verbose=True):
+        tasks = []
+        steps = []
+        for step, (layer, inp, outp, i) in enumerate(get_model_schedule(self.model)):
+            if verbose:
+                print('Writing layer ', outp)
+            self.layers = ''
+            self.write_redirected_output(layer, outp, i)
+            method = getattr(self, 'write_layer_' + layer_type(layer))
+            method(layer, inp, outp, i)
+            if self.layers.strip():
+                tasks.append((layer, self.layers))
+                steps.append(step)
+        deps = get_task_dependencies(self.model, self.weights.buffers, steps)
+        self.layers = ''
+
+        fn = self.function_name
+        args = self.get_task_args()
+        s = 'struct ' + fn + '_task_args { \n'
+        for ctype, name in args:
+            s += ctype + name + '; \n'
+        s += '}; \n\n'
+        s += 'static void ' + fn + '_task(void * task_args, const size_t task) { \n\n'
+        s += 'struct ' + fn + '_task_args * args = (struct ' + fn + \
+            '_task_args *) task_args; \n'
+        for ctype, name in args:
+            s += ctype + name + ' = args->' + name + '; \n'
+        self.task_prologue = s
+
+        s = self.declarations + '\n'
+        s += 'switch (task) { \n'
+        for task, (layer, code) in enumerate(tasks):
+            # working arrays and parameters of the layer, and of an activation
+            # fused into it, are only declared by the tasks that use them
+            s += 'case ' + str(task) + ': { \n'
+            s += str(self.weights.layer_vars.get(layer.name, ''))
+            fused = self.activation_fusions.get(layer.name)
+            if fused is not None:
+                s += str(self.weights.layer_vars.get(fused.name, ''))
+            s += code + '} \n'
+            s += 'break; \n'
+        s += '} \n'
+        s += '} \n\n'
+        s += self.write_task_graph(deps)
+        self.task_epilogue = s
+
+        s = self.weights.workspace_decl
+        s += 'struct ' + fn + '_task_args args = {' + \
+            ','.join(name for _, name in args) + '}; \n'
+        s += 'k2c_run_tasks(&' + fn + '_tasks,&args); \n'
+        return s
+
+    def write_task_graph(self, deps):
+        fn = self.function_name
+        ntasks = len(deps)
+        succ = [[] for _ in range(ntasks)]
+        for task, waits in enumerate(deps):
+            for dep in sorted(waits):
+                succ[dep].append(task)
+        succ_start = [0]
+        for s in succ:
+            succ_start.append(succ_start[-1] + len(s))
+        flat = [task for s in succ for task in s]
+
+        def array(name, values):
+            return 'static const size_t ' + fn + name + '[' + \
+                str(max(len(values), 1)) + '] = {' + \
+                (','.join(str(v) for v in values) or '0') + '}; \n'
+
+        s = array('_task_deps', [len(waits) for waits in deps])
+        s += array('_task_succ_start', succ_start)
+        s += array('_task_succ', flat)
+        if not self.weights.reentrant and (self.weights.static_vars or self.malloc):
+            s += 'static k2c_task_lock ' + fn + '_task_lock = K2C_TASK_LOCK_INIT; \n'
+            lock = '&' + fn + '_task_lock'
+        else:
+            lock = 'NULL'
+        s += 'static const k2c_task_graph ' + fn + '_tasks = {' + fn + '_task,' + \
+            str(ntasks) + ',' + fn + '_task_deps,' + fn + '_task_succ_start,' + \
+            fn + '_task_succ,' + lock + '}; \n\n'
+        return s
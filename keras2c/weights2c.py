@@ -4,12 +4,23 @@ Gets weights and other parameters from each layer and writes to C file
 """
 
 # imports
+import io
 import numpy as np
 from keras2c.io_parsing import layer_type, get_layer_io_names, get_model_io_names
+from keras2c.memory_planner import get_buffer_lifetimes, plan_memory
+from keras2c.graph_passes import get_folded_batch_norms, get_output_redirects, \
+    get_copied_activations
+from keras2c.quantization import quantize_kernel, half_kernel
+from keras2c.sparsity import get_sparse_layers, csr_kernel
+from keras2c.packing import block_kernel, pack_kernel, PANEL_COLS
+from keras2c.convolution import get_conv_algorithm, get_conv_shapes, im2col_block, \
+    winograd_tile, winograd_block, winograd_kernel, get_padding
 from keras import backend as K
 import tensorflow as tf
 tf.compat.v1.disable_eager_execution()
 maxndim = 5
+# must match K2C_RNN_BLOCK in k2c_include.h
+RNN_BLOCK = 32
 
 
 __author__ = "Rory Conlin"
@@ -19,26 +30,118 @@ __maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
 __email__ = "wconlin@princeton.edu"
 
 
+class CodeBuffer():
+    """Collects C source to be written to a file
+
+    Weight arrays are kept as arrays and only formatted as they are written,
+    so the full text of the initializers is never held in memory at once.
+    """
+
+    def __init__(self):
+        self.pieces = []
+
+    def __iadd__(self, other):
+        self.pieces.append(other)
+        return self
+
+    def append_chunks(self, func, *args):
+        self.pieces.append((func, args))
+
+    def write(self, f):
+        for piece in self.pieces:
+            if isinstance(piece, str):
+                f.write(piece)
+            else:
+                func, args = piece
+                f.writelines(func(*args))
+
+    def since(self, start):
+        # pieces added after the first start of them
+        tail = CodeBuffer()
+        tail.pieces = self.pieces[start:]
+        return tail
+
+    def __str__(self):
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
+
+
 class Weights2C():
 
-    def __init__(self, model, function_name, malloc=False):
+    def __init__(self, model, function_name, malloc=False, static_weights=False,
+                 plan_memory=False, separate_weights=False, reentrant=False,
+                 quantize=None, activation_scales=None, weight_dtype=None,
+                 sparse_threshold=None, pack_weights=False, parallel_layers=False,
+                 conv_algorithm='direct'):
 
         self.model = model
         self.function_name = function_name
         self.model_io = get_model_io_names(self.model)
         self.malloc = malloc
-        self.stack_vars = ''
+        self.static_weights = static_weights
+        self.plan_memory = plan_memory
+        self.separate_weights = separate_weights
+        self.reentrant = reentrant
+        self.quantize = quantize
+        # layers with int8 kernels, mapped to the scale of their input
+        self.activation_scales = activation_scales if quantize else {}
+        # kernels of all other Dense, ConvND and recurrent layers are stored
+        # as 16 bit floats if weight_dtype is given
+        self.weight_dtype = weight_dtype
+        self.half_kernels = set()
+        # layers with enough zeros in their kernels are stored in CSR format
+        if sparse_threshold is not None:
+            self.sparse_layers = get_sparse_layers(model, sparse_threshold)
+        else:
+            self.sparse_layers = set()
+        # all other float kernels of Dense and recurrent layers are stored in
+        # panels if pack_weights is True
+        self.pack_weights = pack_weights
+        self.packed_kernels = set()
+        # layers run as concurrent tasks, each of which declares the stack
+        # variables, so working arrays are placed in a workspace and weights
+        # are made static
+        self.parallel_layers = parallel_layers
+        # float ConvND layers evaluated as a matrix product, mapped to the
+        # number of output positions done at a time, and Conv2D layers
+        # evaluated by Winograd convolution, mapped to their tile size
+        self.conv_algorithm = conv_algorithm
+        self.im2col_layers = {}
+        self.winograd_layers = {}
+        # mutable state lives in a context passed to each call if reentrant
+        if reentrant:
+            self.states_name = 'ctx->states'
+        else:
+            self.states_name = function_name + '_states'
+        self.workspace_size = 0
+        self.workspace_decl = ''
+        self.batch_workspace_size = 0
+        self.stack_vars = CodeBuffer()
+        # parts of stack_vars written by each layer, and for the workspace
+        self.layer_vars = {}
+        self.workspace_vars = CodeBuffer()
+        self.global_vars = CodeBuffer()
+        self.weights_vars = CodeBuffer()
         self.malloc_vars = {}
+        self.malloc_buffers = []
         self.static_vars = {}
+        self.buffers = {}
+        self.current_layer = None
+        self.folded_batch_norms = get_folded_batch_norms(model)
+        self.batch_norm_folds = {producer.name: layer for layer, producer
+                                 in self.folded_batch_norms.items()}
+        self.output_redirects = get_output_redirects(model)
+        self.copied_activations = get_copied_activations(model)
 
     @staticmethod
-    def array2c(array, name, malloc=False):
-        temp = array.flatten(order='C')
-        size = array.size
-        shp = array.shape
-        ndim = len(shp)
-        shp = np.concatenate((shp, np.ones(maxndim-ndim)))
+    def array2c(array, name, malloc=False, static=False):
         if malloc:
+            temp = np.ravel(array)
+            size = array.size
+            shp = array.shape
+            ndim = len(shp)
+            shp = np.concatenate((shp, np.ones(maxndim-ndim)))
             to_malloc = {}
             s = 'k2c_tensor ' + name + ' = {' + name + \
                 '_array,' + str(int(ndim)) + ',' + str(int(size)) + ',{' + \
@@ -47,34 +150,166 @@ class Weights2C():
             to_malloc.update({name + '_array': temp})
             return s, to_malloc
         else:
-            count = 0
-            s = 'float ' + name + '_array[' + str(size) + '] = '
-            if np.max(np.abs(temp)) < 1e-16:
-                s += '{' + str(0) + '}; \n'
+            return ''.join(Weights2C.array2c_chunks(array, name, static))
+
+    @staticmethod
+    def array2c_chunks(array, name, static=False, chunk_size=10240):
+        if static:
+            yield 'static const float ' + name + '_array[' + str(array.size) + '] = '
+        else:
+            yield 'float ' + name + '_array[' + str(array.size) + '] = '
+        yield from Weights2C.initializer_chunks(array, chunk_size)
+        yield Weights2C.tensor2c(array, name, static)
+
+    @staticmethod
+    def initializer_chunks(array, chunk_size=10240):
+        temp = np.ravel(array)
+        size = array.size
+        if size == 0 or np.abs(temp).max() < 1e-16:
+            yield '{' + str(0) + '}; \n'
+        else:
+            yield '{\n'
+            finite = np.isfinite(temp).all()
+            if np.issubdtype(temp.dtype, np.integer):
+                token = '%d,'
             else:
-                s += '{\n'
-                for i in range(size):
-                    if temp[i] == np.inf:
-                        s += "HUGE_VALF,"
-                    elif temp[i] == -np.inf:
-                        s += "-HUGE_VALF,"
-                    else:
-                        s += "{:+.8e}".format(temp[i]) + ','
-                    count += 1
-                    if (count) % 5 is 0:
-                        s += '\n'
-                s += '}; \n'
-            s += 'k2c_tensor ' + name + ' = {&' + name + \
-                '_array[0],' + str(int(ndim)) + ',' + str(int(size)) + ',{' + \
-                np.array2string(shp.astype(int), separator=',')[
-                    1:-1] + '}}; \n'
-            return s
+                token = '%+.8e,'
+            # format a whole chunk at once, 5 values per line
+            for start in range(0, size, chunk_size):
+                vals = temp[start:start+chunk_size].tolist()
+                fmt = (token * 5 + '\n') * (len(vals) // 5) + \
+                    token * (len(vals) % 5)
+                s = fmt % tuple(vals)
+                if not finite:
+                    s = s.replace('+inf,', 'HUGE_VALF,').replace(
+                        '-inf,', '-HUGE_VALF,')
+                yield s
+            yield '}; \n'
+
+    @staticmethod
+    def tensor2c(array, name, static=False, array_name=None):
+        if array_name is None:
+            array_name = name + '_array'
+        size = array.size
+        shp = array.shape
+        ndim = len(shp)
+        shp = np.concatenate((shp, np.ones(maxndim-ndim)))
+        if static:
+            # weights are read only, cast away const for the tensor struct
+            s = 'static const k2c_tensor ' + name + ' = {(float*)&' + array_name
+        else:
+            s = 'k2c_tensor ' + name + ' = {&' + array_name
+        s += '[0],' + str(int(ndim)) + ',' + str(int(size)) + ',{' + \
+            np.array2string(shp.astype(int), separator=',')[
+                1:-1] + '}}; \n'
+        return s
 
     def write_weights_array2c(self, array, name):
-        temp = self.array2c(array, name, self.malloc)
         if self.malloc:
+            temp = self.array2c(array, name, self.malloc)
             self.stack_vars += temp[0]
             self.malloc_vars.update(temp[1])
+        elif self.separate_weights:
+            # arrays have external linkage, so prefix them to avoid clashes
+            # with other models linked into the same program
+            array_name = self.function_name + '_' + name + '_array'
+            decl = 'const float ' + array_name + '[' + str(array.size) + ']'
+            self.weights_vars += decl + ' = '
+            self.weights_vars.append_chunks(self.initializer_chunks, array)
+            self.global_vars += 'extern ' + decl + '; \n'
+            self.global_vars += self.tensor2c(array, name, True, array_name)
+        elif self.static_weights or self.parallel_layers:
+            self.global_vars.append_chunks(self.array2c_chunks, array, name, True)
+        else:
+            self.stack_vars.append_chunks(self.array2c_chunks, array, name)
+
+    def write_kernel(self, layer, kernel, name='_kernel', splits=()):
+        nm = layer.name
+        if nm in self.activation_scales and name == '_kernel':
+            self.write_quantized_kernel(layer, kernel)
+        elif nm in self.sparse_layers:
+            self.write_sparse_kernel(kernel, nm + name, splits)
+        elif self.weight_dtype and layer_type(layer) in ['Dense', 'Conv1D', 'Conv2D',
+                                                          'Conv3D', 'LSTM', 'GRU',
+                                                          'SimpleRNN']:
+            self.half_kernels.add(nm)
+            fmt = 'K2C_BFLOAT16' if self.weight_dtype == 'bfloat16' else 'K2C_FLOAT16'
+            self.write_const_tensor(half_kernel(block_kernel(kernel, splits),
+                                                self.weight_dtype), nm + name,
+                                    'uint16_t', 'k2c_htensor', fmt)
+        elif self.pack_weights and layer_type(layer) in ['Dense', 'LSTM', 'GRU',
+                                                          'SimpleRNN']:
+            self.write_packed_kernel(kernel, nm + name, splits)
+            self.packed_kernels.add(nm)
+        else:
+            self.write_weights_array2c(block_kernel(kernel, splits), nm + name)
+
+    def write_quantized_kernel(self, layer, kernel):
+        nm = layer.name
+        qkernel, scale = quantize_kernel(kernel, self.quantize == 'per_channel')
+        self.global_vars += 'static const float ' + nm + '_kernel_scale[' + \
+            str(scale.size) + '] = '
+        self.global_vars.append_chunks(self.initializer_chunks, scale)
+        self.write_const_tensor(qkernel, nm + '_kernel', 'int8_t', 'k2c_qtensor',
+                                '&' + nm + '_kernel_scale[0]')
+        insize = np.prod(layer.input_shape[1:])
+        self.stack_vars += 'float ' + nm + '_input_scale = ' + \
+            '%+.8e' % self.activation_scales[nm] + '; \n'
+        self.stack_vars += 'int8_t ' + nm + '_qwork[' + str(int(insize)) + ']; \n'
+        self.stack_vars += 'int32_t ' + nm + '_acc[' + str(kernel.shape[-1]) + \
+            ']; \n'
+
+    def write_sparse_kernel(self, kernel, name, splits=()):
+        values, indices, indptr = csr_kernel(kernel, splits)
+        for array, suffix, ctype in [(values, '_values', 'float'),
+                                     (indices, '_indices', 'uint32_t'),
+                                     (indptr, '_indptr', 'uint32_t')]:
+            # empty arrays are not allowed in C
+            self.global_vars += 'static const ' + ctype + ' ' + name + suffix + \
+                '[' + str(max(array.size, 1)) + '] = '
+            self.global_vars.append_chunks(self.initializer_chunks, array)
+        shp = np.concatenate((kernel.shape, np.ones(maxndim-kernel.ndim)))
+        self.global_vars += 'static const k2c_stensor ' + name + ' = {&' + \
+            name + '_values[0],&' + name + '_indices[0],&' + name + \
+            '_indptr[0],' + str(kernel.ndim) + ',' + str(kernel.size) + ',{' + \
+            np.array2string(shp.astype(int), separator=',')[1:-1] + '}}; \n'
+
+    def write_packed_kernel(self, kernel, name, splits):
+        if not self.packed_kernels:
+            self.global_vars += '#if K2C_GEMM_NC != ' + str(PANEL_COLS) + ' \n' + \
+                '#error "kernels are packed in panels of ' + str(PANEL_COLS) + \
+                ' columns" \n#endif \n'
+        packed = pack_kernel(kernel, splits)
+        self.global_vars += 'static const float ' + name + '_array[' + \
+            str(packed.size) + '] = '
+        self.global_vars.append_chunks(self.initializer_chunks, packed)
+        # shape is that of the unpacked kernel
+        self.global_vars += self.tensor2c(kernel, name, True)[:-4] + \
+            ',K2C_PACKED}; \n'
+
+    def write_const_tensor(self, array, name, ctype, tensor_type, extra):
+        # compressed and reduced precision weights are always read only
+        # arrays at file scope
+        self.global_vars += 'static const ' + ctype + ' ' + name + '_array[' + \
+            str(array.size) + '] = '
+        self.global_vars.append_chunks(self.initializer_chunks, array)
+        shp = np.concatenate((array.shape, np.ones(maxndim-array.ndim)))
+        self.global_vars += 'static const ' + tensor_type + ' ' + name + ' = {&' + \
+            name + '_array[0],' + str(array.ndim) + ',' + str(array.size) + ',{' + \
+            np.array2string(shp.astype(int), separator=',')[1:-1] + '},' + \
+            extra + '}; \n'
+
+    def write_buffer_array2c(self, shape, name):
+        self.buffers[name] = ([int(i) for i in shape], self.current_layer)
+        if self.plan_memory or self.reentrant or self.parallel_layers:
+            # placed in the shared workspace once all buffers are known
+            return
+        # working arrays are mutable, so they are never made static
+        temp = self.array2c(np.zeros(shape), name, self.malloc)
+        if self.malloc:
+            self.stack_vars += temp[0]
+            self.malloc_vars.update(temp[1])
+            self.malloc_buffers += list(temp[1].keys())
         else:
             self.stack_vars += temp
 
@@ -84,12 +319,99 @@ class Weights2C():
 
     def write_weights(self, verbose=True):
         for layer in self.model.layers:
+            self.current_layer = layer.name
             method = getattr(self, 'write_weights_' + layer_type(layer))
+            start = len(self.stack_vars.pieces)
             method(layer)
-        return self.stack_vars, self.malloc_vars, self.write_static_vars()
+            # kept apart so each task only declares what its layer uses
+            self.layer_vars[layer.name] = self.stack_vars.since(start)
+        start = len(self.stack_vars.pieces)
+        if self.plan_memory or self.reentrant or self.parallel_layers:
+            self.write_workspace(verbose)
+        self.workspace_vars = self.stack_vars.since(start)
+        return self.stack_vars, self.malloc_vars, self.write_static_vars(), \
+            self.global_vars
+
+    def write_workspace(self, verbose=True):
+        owners = {name: owner for name, (_, owner) in self.buffers.items()}
+        sizes = {name: np.prod(shape) for name, (shape, _) in self.buffers.items()}
+        if self.plan_memory and not self.parallel_layers:
+            lifetimes = get_buffer_lifetimes(self.model, owners)
+        else:
+            # all buffers alive at once, so nothing is shared. Lifetimes
+            # assume the layers run in order, so they are not used if layers
+            # may run concurrently
+            lifetimes = {name: (0, 0) for name in sizes}
+        offsets, workspace_size = plan_memory(sizes, lifetimes)
+        self.workspace_size = workspace_size
+        if verbose:
+            print('Workspace size: ' + str(workspace_size) + ' floats, ' +
+                  'unshared size: ' + str(int(sum(sizes.values()))) + ' floats')
+        if self.reentrant:
+            self.stack_vars += 'float * workspace = ctx->workspace; \n'
+        elif self.malloc:
+            self.malloc_vars.update({'workspace': np.zeros(workspace_size)})
+            self.malloc_buffers.append('workspace')
+        elif self.parallel_layers:
+            # declared by each call and passed to its tasks, so calls from
+            # several threads do not share it
+            self.workspace_decl = 'float workspace[' + \
+                str(max(workspace_size, 1)) + ']; \n'
+        else:
+            self.stack_vars += 'float workspace[' + \
+                str(max(workspace_size, 1)) + ']; \n'
+        for name, (shape, _) in self.buffers.items():
+            ndim = len(shape)
+            shp = np.concatenate((shape, np.ones(maxndim-ndim)))
+            self.stack_vars += 'k2c_tensor ' + name + ' = {&workspace[' + \
+                str(offsets[name]) + '],' + str(ndim) + ',' + \
+                str(int(sizes[name])) + ',{' + \
+                np.array2string(shp.astype(int), separator=',')[1:-1] + \
+                '}}; \n'
+        self.stack_vars += '\n\n'
+
+    def write_batch_workspace(self, sizes, lifetimes, verbose=True):
+        if self.plan_memory:
+            offsets, workspace_size = plan_memory(sizes, lifetimes)
+        else:
+            offsets = {}
+            workspace_size = 0
+            for name in sizes:
+                offsets[name] = workspace_size
+                workspace_size += -(-int(sizes[name]) // 16) * 16
+        self.batch_workspace_size = workspace_size
+        if verbose:
+            print('Batch workspace size: ' + str(workspace_size) + ' floats')
+        if workspace_size == 0:
+            s = ''
+        elif self.reentrant:
+            s = 'float * batch_workspace = ctx->batch_workspace; \n'
+        elif self.malloc:
+            # allocated once in the initialize function and passed to each call
+            self.malloc_vars.update({'batch_workspace': np.zeros(workspace_size)})
+            self.malloc_buffers.append('batch_workspace')
+            s = ''
+        else:
+            s = 'float batch_workspace[' + str(workspace_size) + ']; \n'
+        return s, offsets
 
     def write_static_vars(self):
-        if len(self.static_vars) > 0:
+        if self.reentrant:
+            s = 'struct ' + self.function_name + '_ctx \n'
+            s += '{ \n'
+            if len(self.static_vars) > 0:
+                s += 'struct { \n'
+                for k, v in self.static_vars.items():
+                    s += 'float ' + k + '[' + str(v) + ']; \n'
+                s += '} states; \n'
+            s += 'float workspace[' + str(max(self.workspace_size, 1)) + ']; \n'
+            if self.batch_workspace_size:
+                s += 'float batch_workspace[' + \
+                    str(self.batch_workspace_size) + ']; \n'
+            s += '}; \n'
+            s += 'typedef struct ' + self.function_name + '_ctx ' + \
+                self.function_name + '_ctx; \n'
+        elif len(self.static_vars) > 0:
             s = 'static struct ' + self.function_name + '_static_vars \n'
             s += '{ \n'
             for k, v in self.static_vars.items():
@@ -104,14 +426,21 @@ class Weights2C():
         if len(outputs) > 1:
             for i, outp in enumerate(outputs):
                 outshp = layer.get_output_at(i).shape[1:]
-                if outp not in self.model_io[1]:
-                    self.write_weights_array2c(
-                        np.zeros(outshp), outp + '_output')
+                if outp not in self.model_io[1] and outp not in self.output_redirects:
+                    self.write_buffer_array2c(outshp, outp + '_output')
         else:
             outshp = layer.output_shape[1:]
-            if outputs[0] not in self.model_io[1]:
-                self.write_weights_array2c(
-                    np.zeros(outshp), outputs[0] + '_output')
+            if outputs[0] not in self.model_io[1] and \
+               outputs[0] not in self.output_redirects:
+                self.write_buffer_array2c(outshp, outputs[0] + '_output')
+
+    def write_activation_outputs(self, layer):
+        # applied in place, unless the input is read elsewhere
+        _, outputs = get_layer_io_names(layer)
+        for i, outp in enumerate(outputs):
+            if outp in self.copied_activations and outp not in self.model_io[1]:
+                self.write_buffer_array2c(layer.get_output_at(i).shape[1:],
+                                          outp + '_output')
 
     def write_weights_Bidirectional(self, layer):
         try:
@@ -154,10 +483,10 @@ class Weights2C():
         self.write_weights_layer(layer.layer)
         timeslice_input = np.squeeze(np.zeros(layer.layer.input_shape))
         timeslice_output = np.squeeze(np.zeros(layer.layer.output_shape))
-        self.write_weights_array2c(
-            timeslice_input, layer.layer.name + '_timeslice_input')
-        self.write_weights_array2c(
-            timeslice_output, layer.layer.name + '_timeslice_output')
+        self.write_buffer_array2c(
+            timeslice_input.shape, layer.layer.name + '_timeslice_input')
+        self.write_buffer_array2c(
+            timeslice_output.shape, layer.layer.name + '_timeslice_output')
         self.stack_vars += 'const size_t ' + layer.name +\
                            '_timesteps = ' + str(layer.input_shape[1]) + '; \n'
         self.stack_vars += 'const size_t ' + layer.name +\
@@ -173,14 +502,15 @@ class Weights2C():
     def write_weights_InputLayer(self, layer):
         self.stack_vars += ''
 
-    def write_weights_BatchNormalization(self, layer):
+    @staticmethod
+    def get_batch_norm_params(layer):
         center = layer.get_config()['center']
         scale = layer.get_config()['scale']
         if isinstance(layer.get_config()['axis'], (list, tuple, np.ndarray)):
             axis = layer.get_config()['axis'][0]-1
         else:
             axis = layer.get_config()['axis']-1
-            epsilon = layer.get_config()['epsilon']
+        epsilon = layer.get_config()['epsilon']
 
         if center and scale:
             gamma = layer.get_weights()[0]
@@ -204,6 +534,22 @@ class Weights2C():
             gamma = np.ones(mean.shape)
 
         stdev = np.sqrt(variance + epsilon)
+        return axis, mean, stdev, gamma, beta
+
+    def fold_batch_norm(self, layer, kernel, bias):
+        if layer.name not in self.batch_norm_folds:
+            return kernel, bias
+        _, mean, stdev, gamma, beta = self.get_batch_norm_params(
+            self.batch_norm_folds[layer.name])
+        # output channels are the last axis of the kernel
+        scale = gamma / stdev
+        return kernel * scale, (bias - mean) * scale + beta
+
+    def write_weights_BatchNormalization(self, layer):
+        if layer in self.folded_batch_norms:
+            # applied by the previous layer's kernel and bias
+            return
+        axis, mean, stdev, gamma, beta = self.get_batch_norm_params(layer)
         self.write_outputs(layer)
         self.stack_vars += 'size_t ' + layer.name + \
             '_axis = ' + str(axis) + '; \n'
@@ -216,8 +562,10 @@ class Weights2C():
     def write_weights_LSTM(self, layer):
         units = layer.get_config()['units']
         self.write_outputs(layer)
-        self.stack_vars += 'float ' + layer.name + \
-                           '_fwork[' + str(8*units) + '] = {0}; \n'
+        # the input product for up to RNN_BLOCK timesteps is kept after the
+        # working space of the cell, 4*units floats for each of them
+        timesteps = min(layer.input_shape[1], RNN_BLOCK)
+        self.write_buffer_array2c(((timesteps + 1)*4*units,), layer.name + '_fwork')
         self.stack_vars += 'int ' + layer.name + '_go_backwards = ' + \
             str(int(layer.get_config()['go_backwards'])) + ';\n'
         self.stack_vars += 'int ' + layer.name + '_return_sequences = ' + \
@@ -225,7 +573,7 @@ class Weights2C():
         if layer.get_config()['stateful']:
             self.static_vars.update({layer.name + '_state': 2*units})
             self.stack_vars += 'float * ' + layer.name + '_state = ' + \
-                self.function_name + '_states.' + \
+                self.states_name + '.' + \
                 layer.name + '_state; \n'
         else:
             self.stack_vars += 'float ' + layer.name + \
@@ -238,20 +586,22 @@ class Weights2C():
             bias = weights[2]
         else:
             bias = np.zeros(4*units)
-        ckernel = np.concatenate(np.split(kernel, 4, axis=1), axis=0)
-        crecurrent_kernel = np.concatenate(
-            np.split(recurrent_kernel, 4, axis=1), axis=0)
-        self.write_weights_array2c(ckernel, layer.name + '_kernel')
-        self.write_weights_array2c(
-            crecurrent_kernel, layer.name + '_recurrent_kernel')
-        self.write_weights_array2c(bias, layer.name + '_bias')
+        # gates are stored side by side in the order i, f, o, c, so that all
+        # of them are found with one product and the gates with the recurrent
+        # activation are next to each other
+        order = np.r_[0:2*units, 3*units:4*units, 2*units:3*units]
+        self.write_kernel(layer, kernel[:, order])
+        self.write_kernel(layer, recurrent_kernel[:, order], '_recurrent_kernel')
+        self.write_weights_array2c(bias[order], layer.name + '_bias')
         self.stack_vars += '\n \n'
 
     def write_weights_GRU(self, layer):
         units = layer.get_config()['units']
         self.write_outputs(layer)
-        self.stack_vars += 'float ' + layer.name + \
-            '_fwork[' + str(6*units) + '] = {0}; \n'
+        # the input product for up to RNN_BLOCK timesteps is kept after the
+        # working space of the cell, 3*units floats for each of them
+        timesteps = min(layer.input_shape[1], RNN_BLOCK)
+        self.write_buffer_array2c(((3*timesteps + 4)*units,), layer.name + '_fwork')
         self.stack_vars += 'int ' + layer.name + '_reset_after = ' + \
             str(int(layer.get_config()['reset_after'])) + ';\n'
         self.stack_vars += 'int ' + layer.name + '_go_backwards = ' + \
@@ -261,7 +611,7 @@ class Weights2C():
         if layer.get_config()['stateful']:
             self.static_vars.update({layer.name + '_state': units})
             self.stack_vars += 'float * ' + layer.name + '_state = ' + \
-                self.function_name + '_states.' + \
+                self.states_name + '.' + \
                 layer.name + '_state; \n'
         else:
             self.stack_vars += 'float ' + layer.name + \
@@ -282,12 +632,14 @@ class Weights2C():
             bias = np.zeros(3*units)
             rbias = np.zeros(3*units)
         cbias = np.concatenate([bias, rbias], axis=0)
-        ckernel = np.concatenate(np.split(kernel, 3, axis=1), axis=0)
-        crecurrent_kernel = np.concatenate(
-            np.split(recurrent_kernel, 3, axis=1), axis=0)
-        self.write_weights_array2c(ckernel, layer.name + '_kernel')
-        self.write_weights_array2c(crecurrent_kernel, layer.name +
-                                   '_recurrent_kernel')
+        self.write_kernel(layer, kernel)
+        if layer.get_config()['reset_after']:
+            self.write_kernel(layer, recurrent_kernel, '_recurrent_kernel')
+        else:
+            # h is multiplied by the reset state instead of the state, so its
+            # columns are stored after those of z and r
+            self.write_kernel(layer, recurrent_kernel, '_recurrent_kernel',
+                              [2*units])
         self.write_weights_array2c(cbias, layer.name + '_bias')
         self.stack_vars += '\n \n'
 
@@ -298,12 +650,14 @@ class Weights2C():
             str(int(layer.get_config()['go_backwards'])) + ';\n'
         self.stack_vars += 'int ' + layer.name + '_return_sequences = ' + \
             str(int(layer.get_config()['return_sequences'])) + ';\n'
-        self.stack_vars += 'float ' + layer.name + \
-            '_fwork[' + str(2*units) + '] = {0}; \n'
+        # the input product for up to RNN_BLOCK timesteps is kept after the
+        # working space of the cell, units floats for each of them
+        timesteps = min(layer.input_shape[1], RNN_BLOCK)
+        self.write_buffer_array2c(((timesteps + 1)*units,), layer.name + '_fwork')
         if layer.get_config()['stateful']:
             self.static_vars.update({layer.name + '_state': units})
             self.stack_vars += 'float * ' + layer.name + '_state = ' + \
-                self.function_name + '_states.' + \
+                self.states_name + '.' + \
                 layer.name + '_state; \n'
         else:
             self.stack_vars += 'float ' + layer.name + \
@@ -316,9 +670,8 @@ class Weights2C():
             bias = weights[2]
         else:
             bias = np.zeros(units)
-        self.write_weights_array2c(kernel, layer.name + '_kernel')
-        self.write_weights_array2c(recurrent_kernel, layer.name +
-                                   '_recurrent_kernel')
+        self.write_kernel(layer, kernel)
+        self.write_kernel(layer, recurrent_kernel, '_recurrent_kernel')
         self.write_weights_array2c(bias, layer.name + '_bias')
         self.stack_vars += '\n \n'
 
@@ -330,43 +683,21 @@ class Weights2C():
             b = weights[1]
         else:
             b = np.zeros(A.shape[1])
+        A, b = self.fold_batch_norm(layer, A, b)
 
-        self.write_weights_array2c(A, layer.name + '_kernel')
+        self.write_kernel(layer, A)
         self.write_weights_array2c(b, layer.name + '_bias')
-        self.stack_vars += 'float ' + layer.name + \
-            '_fwork[' + str(np.prod(layer.input_shape[1:]) +
-                            np.prod(A.shape)) + '] = {0}; \n'
         self.stack_vars += '\n \n'
 
     def write_weights_Conv1D(self, layer):
-        padding = layer.get_config()['padding']
         stride = layer.get_config()['strides'][0]
         dilation = layer.get_config()['dilation_rate'][0]
-        kernel_size = layer.get_config()['kernel_size'][0]
         self.stack_vars += 'size_t ' + layer.name + \
             '_stride = ' + str(stride) + '; \n'
         self.stack_vars += 'size_t ' + layer.name + \
             '_dilation = ' + str(dilation) + '; \n'
+        self.write_padding(layer)
         self.write_outputs(layer)
-        inshp = layer.get_input_at(0).shape[1:]
-        if padding == 'causal':
-            pad_along_height = dilation*(kernel_size-1)
-            pad_top = pad_along_height
-            pad_bottom = 0
-            self.write_weights_array2c(np.zeros((inshp[0]+pad_top+pad_bottom, inshp[1])),
-                                       layer.name + '_padded_input')
-            self.stack_vars += 'size_t ' + layer.name + '_pad[2] = {' + str(pad_top) + ','\
-                + str(pad_bottom) + '}; \n'
-            self.stack_vars += 'float ' + layer.name + '_fill = 0.0f; \n'
-        elif padding == 'same':
-            pad_along_height = dilation*(kernel_size-1)
-            pad_top = int(pad_along_height // 2)
-            pad_bottom = int(pad_along_height - pad_top)
-            self.write_weights_array2c(np.zeros((inshp[0]+pad_top+pad_bottom, inshp[1])),
-                                       layer.name + '_padded_input')
-            self.stack_vars += 'size_t ' + layer.name + '_pad[2] = {' + str(pad_top) + ','\
-                + str(pad_bottom) + '}; \n'
-            self.stack_vars += 'float ' + layer.name + '_fill = 0.0f; \n'
 
         weights = layer.get_weights()
         kernel = weights[0]
@@ -374,37 +705,21 @@ class Weights2C():
             bias = weights[1]
         else:
             bias = np.zeros(kernel.shape[2])
-        self.write_weights_array2c(kernel, layer.name + '_kernel')
+        kernel, bias = self.fold_batch_norm(layer, kernel, bias)
+        self.write_conv_kernel(layer, kernel)
         self.write_weights_array2c(bias, layer.name + '_bias')
         self.stack_vars += '\n \n'
 
     def write_weights_Conv2D(self, layer):
-        padding = layer.get_config()['padding']
         stride = layer.get_config()['strides']
         dilation = layer.get_config()['dilation_rate']
-        kernel_size = layer.get_config()['kernel_size']
         self.stack_vars += 'size_t ' + layer.name + \
             '_stride[2] = {' + ','.join([str(i) for i in stride]) + '}; \n'
         self.stack_vars += 'size_t ' + layer.name + \
             '_dilation[2] = {' + ','.join([str(i)
                                            for i in dilation]) + '}; \n'
+        self.write_padding(layer)
         self.write_outputs(layer)
-        if padding == 'same':
-            inshp = layer.get_input_at(0).shape[1:]
-            pad_along_height = dilation[0]*(kernel_size[0]-1)
-            pad_top = int(pad_along_height // 2)
-            pad_bottom = int(pad_along_height - pad_top)
-            pad_along_width = dilation[1]*(kernel_size[1]-1)
-            pad_left = pad_along_width//2
-            pad_right = pad_along_width - pad_left
-            padshp = (inshp[0]+pad_along_height,
-                      inshp[1]+pad_along_width, inshp[2])
-            pad = [pad_top, pad_bottom, pad_left, pad_right]
-            self.write_weights_array2c(np.zeros(padshp), layer.name +
-                                       '_padded_input')
-            self.stack_vars += 'size_t ' + layer.name + \
-                '_pad[4] = {' + ','.join([str(i) for i in pad]) + '}; \n'
-            self.stack_vars += 'float ' + layer.name + '_fill = 0.0f; \n'
 
         weights = layer.get_weights()
         kernel = weights[0]
@@ -412,54 +727,62 @@ class Weights2C():
             bias = weights[1]
         else:
             bias = np.zeros(kernel.shape[3])
-        self.write_weights_array2c(kernel, layer.name + '_kernel')
+        kernel, bias = self.fold_batch_norm(layer, kernel, bias)
+        self.write_conv_kernel(layer, kernel)
         self.write_weights_array2c(bias, layer.name + '_bias')
         self.stack_vars += '\n \n'
 
     def write_weights_Conv3D(self, layer):
-        padding = layer.get_config()['padding']
         stride = layer.get_config()['strides']
         dilation = layer.get_config()['dilation_rate']
-        kernel_size = layer.get_config()['kernel_size']
         self.stack_vars += 'size_t ' + layer.name + \
             '_stride[3] = {' + ','.join([str(i) for i in stride]) + '}; \n'
         self.stack_vars += 'size_t ' + layer.name + \
             '_dilation[3] = {' + ','.join([str(i)
                                            for i in dilation]) + '}; \n'
+        self.write_padding(layer)
         self.write_outputs(layer)
-        if padding == 'same':
-            inshp = layer.get_input_at(0).shape[1:]
-            pad_along_height = dilation[0]*(kernel_size[0]-1)
-            pad_top = int(pad_along_height // 2)
-            pad_bottom = int(pad_along_height - pad_top)
-            pad_along_width = dilation[1]*(kernel_size[1]-1)
-            pad_left = pad_along_width//2
-            pad_right = pad_along_width - pad_left
-            pad_along_depth = dilation[1]*(kernel_size[1]-1)
-            pad_front = pad_along_depth//2
-            pad_back = pad_along_depth - pad_front
-            padshp = (inshp[0]+pad_along_height,
-                      inshp[1]+pad_along_width,
-                      inshp[2]+pad_along_depth,
-                      inshp[3])
-            pad = [pad_top, pad_bottom, pad_left,
-                   pad_right, pad_front, pad_back]
-            self.write_weights_array2c(np.zeros(padshp), layer.name +
-                                       '_padded_input')
-            self.stack_vars += 'size_t ' + layer.name + \
-                '_pad[6] = {' + ','.join([str(i) for i in pad]) + '}; \n'
-            self.stack_vars += 'float ' + layer.name + '_fill = 0.0f; \n'
 
         weights = layer.get_weights()
         kernel = weights[0]
         if layer.get_config()['use_bias']:
             bias = weights[1]
         else:
-            bias = np.zeros(kernel.shape[3])
-        self.write_weights_array2c(kernel, layer.name + '_kernel')
+            bias = np.zeros(kernel.shape[4])
+        kernel, bias = self.fold_batch_norm(layer, kernel, bias)
+        self.write_conv_kernel(layer, kernel)
         self.write_weights_array2c(bias, layer.name + '_bias')
         self.stack_vars += '\n \n'
 
+    def write_padding(self, layer):
+        pad = get_padding(layer)
+        self.stack_vars += 'size_t ' + layer.name + '_pad[' + str(len(pad)) + \
+            '] = {' + ','.join([str(i) for i in pad]) + '}; \n'
+
+    def write_conv_kernel(self, layer, kernel):
+        nm = layer.name
+        algorithm = 'direct'
+        # int8 and 16 bit kernels are always evaluated directly
+        if nm not in self.activation_scales and not self.weight_dtype:
+            algorithm = get_conv_algorithm(layer, self.conv_algorithm)
+        if algorithm == 'winograd':
+            tile = winograd_tile(layer)
+            block, size = winograd_block(layer, tile)
+            self.winograd_layers[nm] = tile
+            # kernel is transformed once, when the model is converted
+            self.write_weights_array2c(winograd_kernel(kernel, tile), nm + '_kernel')
+            self.stack_vars += 'size_t ' + nm + '_block = ' + str(block) + '; \n'
+            self.write_buffer_array2c((size,), nm + '_work')
+            return
+        self.write_kernel(layer, kernel)
+        if algorithm == 'im2col':
+            block = im2col_block(layer)
+            self.im2col_layers[nm] = block
+            self.stack_vars += 'size_t ' + nm + '_block = ' + str(block) + '; \n'
+            if block:
+                self.write_buffer_array2c((block, get_conv_shapes(layer)[1]),
+                                          nm + '_cols')
+
     def write_weights_MaxPooling1D(self, layer):
         return self.write_weights_Pooling1D(layer)
 
@@ -467,26 +790,14 @@ class Weights2C():
         return self.write_weights_Pooling1D(layer)
 
     def write_weights_Pooling1D(self, layer):
-        pad = layer.get_config()['padding']
         stride = layer.get_config()['strides'][0]
         pool_size = layer.get_config()['pool_size'][0]
         self.stack_vars += 'size_t ' + layer.name + \
             '_stride = ' + str(stride) + '; \n'
         self.stack_vars += 'size_t ' + layer.name + \
             '_pool_size = ' + str(pool_size) + '; \n'
+        self.write_padding(layer)
         self.write_outputs(layer)
-        inshp = layer.get_input_at(0).shape[1:]
-        outshp = layer.get_output_at(0).shape[1:]
-        if pad == 'same':
-            pad_along_height = max((outshp[0] - 1) * stride +
-                                   pool_size - inshp[0], 0)
-            pad_top = int(pad_along_height // 2)
-            pad_bottom = int(pad_along_height - pad_top)
-            self.write_weights_array2c(np.zeros((inshp[0]+pad_top+pad_bottom, inshp[1])),
-                                       layer.name + '_padded_input')
-            self.stack_vars += 'size_t ' + layer.name + '_pad[2] = {' + str(pad_top) + ','\
-                + str(pad_bottom) + '}; \n'
-            self.stack_vars += 'float ' + layer.name + '_fill = -HUGE_VALF; \n'
         self.stack_vars += '\n\n'
 
     def write_weights_MaxPooling2D(self, layer):
@@ -496,7 +807,6 @@ class Weights2C():
         return self.write_weights_Pooling2D(layer)
 
     def write_weights_Pooling2D(self, layer):
-        padding = layer.get_config()['padding']
         stride = layer.get_config()['strides']
         pool_size = layer.get_config()['pool_size']
         self.stack_vars += 'size_t ' + layer.name + \
@@ -504,26 +814,8 @@ class Weights2C():
         self.stack_vars += 'size_t ' + layer.name + \
             '_pool_size[2] = {' + ','.join([str(i)
                                             for i in pool_size]) + '}; \n'
+        self.write_padding(layer)
         self.write_outputs(layer)
-        if padding == 'same':
-            inshp = layer.get_input_at(0).shape[1:]
-            outshp = layer.get_output_at(0).shape[1:]
-            pad_along_height = max((outshp[0] - 1) * stride[0] +
-                                   pool_size[0] - inshp[0], 0)
-            pad_top = int(pad_along_height // 2)
-            pad_bottom = int(pad_along_height - pad_top)
-            pad_along_width = max((outshp[1] - 1) * stride[1] +
-                                  pool_size[1] - inshp[1], 0)
-            pad_left = pad_along_width//2
-            pad_right = pad_along_width - pad_left
-            padshp = (inshp[0]+pad_along_height,
-                      inshp[1]+pad_along_width, inshp[2])
-            pad = [pad_top, pad_bottom, pad_left, pad_right]
-            self.write_weights_array2c(np.zeros(padshp), layer.name +
-                                       '_padded_input')
-            self.stack_vars += 'size_t ' + layer.name + \
-                '_pad[4] = {' + ','.join([str(i) for i in pad]) + '}; \n'
-            self.stack_vars += 'float ' + layer.name + '_fill = -HUGE_VALF; \n'
         self.stack_vars += '\n\n'
 
     def write_weights_GlobalMaxPooling1D(self, layer):
@@ -588,29 +880,32 @@ class Weights2C():
             self.stack_vars += 'size_t ' + layer.name + '_axis = ' +\
                 str(ax-1) + '; \n'
         if outp not in self.model_io[1]:
-            self.write_weights_array2c(np.zeros(outshp),
-                                       outp + '_output')
+            self.write_buffer_array2c(outshp, outp + '_output')
         self.stack_vars += '\n\n'
 
     def write_weights_ELU(self, layer):
+        self.write_activation_outputs(layer)
         alpha = layer.get_config()['alpha']
         self.stack_vars += 'float ' + layer.name + \
             '_alpha = ' + str(alpha) + '; \n'
         self.stack_vars += '\n\n'
 
     def write_weights_LeakyReLU(self, layer):
+        self.write_activation_outputs(layer)
         alpha = layer.get_config()['alpha']
         self.stack_vars += 'float ' + layer.name + \
             '_alpha = ' + str(alpha) + '; \n'
         self.stack_vars += '\n\n'
 
     def write_weights_ThresholdedReLU(self, layer):
+        self.write_activation_outputs(layer)
         theta = layer.get_config()['theta']
-        self.stack_vars = 'float ' + layer.name + \
+        self.stack_vars += 'float ' + layer.name + \
             '_theta = ' + str(theta) + '; \n'
         self.stack_vars += '\n\n'
 
     def write_weights_ReLU(self, layer):
+        self.write_activation_outputs(layer)
         max_value = layer.get_config()['max_value']
         negative_slope = layer.get_config()['negative_slope']
         threshold = layer.get_config()['threshold']
@@ -625,13 +920,14 @@ class Weights2C():
         self.stack_vars += '\n\n'
 
     def write_weights_PReLU(self, layer):
+        self.write_activation_outputs(layer)
         self.write_weights_array2c(
             layer.get_weights()[0], layer.name + '_alpha')
         self.stack_vars += '\n\n'
 
     def write_weights_Reshape(self, layer):
+        # output is a view of the input, so only needs the shape
         nm = layer.name
-        self.write_outputs(layer)
         newshp = layer.get_config()['target_shape']
         newndim = len(newshp)
         newshp = np.concatenate((newshp, np.ones(maxndim-newndim)))
@@ -793,17 +1089,25 @@ class Weights2C():
         pass
 
     def write_weights_Flatten(self, layer):
-        _, outputs = get_layer_io_names(layer)
-        for i, outp in enumerate(outputs):
-            inshp = layer.get_input_at(i).shape[1:]
-            if outp not in self.model_io[1]:
-                self.write_weights_array2c(
-                    np.zeros(inshp).flatten(), outp + '_output')
+        # output is a view of the input
+        pass
 
     def write_weights_Activation(self, layer):
         # no weights needed
-        pass
+        self.write_activation_outputs(layer)
 
     def write_weights_Dropout(self, layer):
         # no weights needed
         pass
+
+    def write_weights_GaussianNoise(self, layer):
+        # no weights needed
+        pass
+
+    def write_weights_GaussianDropout(self, layer):
+        # no weights needed
+        pass
+
+    def write_weights_AlphaDropout(self, layer):
+        # no weights needed
+        pass
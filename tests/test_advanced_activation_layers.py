@@ -80,3 +80,40 @@ class TestAdvancedActivation(unittest.TestCase):
         keras2c_main.k2c(model, name)
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
+
+    def test_FusedActivation1(self):
+        inshp = (10, 12, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(6, (3, 3), padding='same')(a)
+        c = keras.layers.PReLU(alpha_initializer='glorot_uniform')(b)
+        d = keras.layers.Conv2D(4, (3, 3), activation='tanh')(c)
+        e = keras.layers.LeakyReLU(alpha=0.3)(d)
+        f = keras.layers.Flatten()(e)
+        g = keras.layers.Dense(8)(f)
+        h = keras.layers.Activation('softmax')(g)
+        model = keras.models.Model(inputs=a, outputs=h)
+        name = 'test___FusedActivation1' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_FusedActivation2(self):
+        inshp = (10, 4)
+        init = keras.initializers.RandomUniform(minval=0.1, maxval=1.0)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv1D(5, 3)(a)
+        c = keras.layers.BatchNormalization(moving_mean_initializer=init,
+                                            moving_variance_initializer=init)(b)
+        d = keras.layers.ELU(alpha=1.3)(c)
+        e = keras.layers.Dense(6)(d)
+        f = keras.layers.Dense(6)(e)
+        g = keras.layers.Add()([e, f])
+        # not fused, since it follows an Add layer
+        h = keras.layers.ReLU(max_value=1.0, threshold=0.1)(g)
+        i = keras.layers.Dense(3)(h)
+        j = keras.layers.ThresholdedReLU(theta=0.1)(i)
+        model = keras.models.Model(inputs=a, outputs=j)
+        name = 'test___FusedActivation2' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
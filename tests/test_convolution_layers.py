@@ -67,6 +67,29 @@ class TestConvolutionLayers(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_Conv3D3(self):
+        inshp = (7, 6, 9, 3)
+        filters = 5
+        kernel_size = (2, 3, 5)
+        strides = 1
+        padding = 'same'
+        dilation_rate = (1, 1, 2)
+        activation = 'relu'
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv3D(filters=filters,
+                                kernel_size=kernel_size,
+                                strides=strides,
+                                padding=padding,
+                                dilation_rate=dilation_rate,
+                                activation=activation,
+                                use_bias=True,
+                                bias_initializer='glorot_uniform')(a)
+        model = keras.models.Model(inputs=a, outputs=b)
+        name = 'test___Conv3D3' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
     def test_Conv2D1(self):
         inshp = (25, 32, 3)
         filters = 13
@@ -112,6 +135,29 @@ class TestConvolutionLayers(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_Conv2D3(self):
+        inshp = (11, 16, 5)
+        filters = 7
+        kernel_size = (4, 3)
+        strides = (2, 3)
+        padding = 'same'
+        dilation_rate = 1
+        activation = 'tanh'
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(filters=filters,
+                                kernel_size=kernel_size,
+                                strides=strides,
+                                padding=padding,
+                                dilation_rate=dilation_rate,
+                                activation=activation,
+                                use_bias=True,
+                                bias_initializer='glorot_uniform')(a)
+        model = keras.models.Model(inputs=a, outputs=b)
+        name = 'test___Conv2D3' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
     def test_Conv1D1(self):
         inshp = (25, 32)
         filters = 13
@@ -33,8 +33,11 @@ def build_and_run(name, return_output=False):
     else:
         ccflags = '-Ofast -std=c99 -I./include/'
 
-    cc = 'gcc ' + ccflags + ' -o ' + name + ' ' + name + '.c ' + \
-        name + '_test_suite.c -L./include/ -l:libkeras2c.a -lm'
+    sources = name + '.c ' + name + '_test_suite.c '
+    if os.path.exists(name + '_weights.c'):
+        sources += name + '_weights.c '
+    cc = 'gcc ' + ccflags + ' -o ' + name + ' ' + sources + \
+        '-L./include/ -l:libkeras2c.a -lm -pthread'
     build_code = subprocess.run(cc.split()).returncode
     if build_code != 0:
         return 'build failed'
@@ -73,6 +76,18 @@ class TestCoreLayers(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_Dense3(self):
+        # rows, inner dimension and units that don't fill whole blocks
+        inshp = (7, 300)
+        units = 70
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Dense(units)(a)
+        model = keras.models.Model(inputs=a, outputs=b)
+        name = 'test___Dense3' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
     def test_Dropout_Reshape_Flatten(self):
         inshp = (10, 40, 30)
         a = keras.layers.Input(inshp)
@@ -85,6 +100,46 @@ class TestCoreLayers(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_Dropout_Reshape_Flatten2(self):
+        inshp = (6, 4)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Flatten()(a)
+        c = keras.layers.Dense(12)(b)
+        d = keras.layers.Reshape((3, 4))(c)
+        e = keras.layers.Conv1D(5, 2)(d)
+        f = keras.layers.Dropout(.3)(e)
+        g = keras.layers.GaussianNoise(.2)(f)
+        h = keras.layers.Flatten()(g)
+        i = keras.layers.Dense(6)(h)
+        j = keras.layers.ActivityRegularization()(i)
+        k = keras.layers.Reshape((2, 3))(j)
+        model = keras.models.Model(inputs=a, outputs=k)
+        name = 'test___flatten_dropout_reshape2' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Dropout_Reshape_Flatten3(self):
+        # activations of views of data that is read elsewhere
+        a = keras.layers.Input((12,))
+        b = keras.layers.Dense(12)(a)
+        c = keras.layers.Reshape((3, 4))(b)
+        d = keras.layers.Activation('tanh')(c)
+        e = keras.layers.Flatten()(d)
+        f = keras.layers.Add()([b, e])
+        g = keras.layers.Reshape((4, 3))(a)
+        h = keras.layers.ReLU(negative_slope=.5)(g)
+        i = keras.layers.Flatten()(h)
+        j = keras.layers.Activation('sigmoid')(b)
+        model = keras.models.Model(inputs=a, outputs=[f, i, j])
+        for k, options in enumerate([{}, {'plan_memory': True}, {'batch_size': 3}]):
+            with self.subTest(**options):
+                name = 'test___flatten_dropout_reshape3' + str(k) + \
+                    str(int(time.time()))
+                keras2c_main.k2c(model, name, **options)
+                rcode = build_and_run(name)
+                self.assertEqual(rcode, 0)
+
     def test_Permute(self):
         inshp = (6, 12, 9)
         a = keras.layers.Input(inshp)
@@ -213,6 +268,42 @@ class TestNormalization(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_BatchNormFold1(self):
+        inshp = (10, 12, 3)
+        init = keras.initializers.RandomUniform(minval=0.1, maxval=1.0)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(6, (3, 3), padding='same')(a)
+        c = keras.layers.BatchNormalization(beta_initializer=init,
+                                            gamma_initializer=init,
+                                            moving_mean_initializer=init,
+                                            moving_variance_initializer=init)(b)
+        d = keras.layers.Flatten()(c)
+        e = keras.layers.Dense(8)(d)
+        f = keras.layers.BatchNormalization(center=False,
+                                            moving_mean_initializer=init,
+                                            moving_variance_initializer=init)(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        name = 'test___BatchNormFold1' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_BatchNormFold2(self):
+        inshp = (10, 4)
+        init = keras.initializers.RandomUniform(minval=0.1, maxval=1.0)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv1D(5, 3, use_bias=False)(a)
+        c = keras.layers.BatchNormalization(moving_mean_initializer=init,
+                                            moving_variance_initializer=init)(b)
+        # not folded, since the activation comes before the normalization
+        d = keras.layers.Conv1D(5, 3, activation='relu')(c)
+        e = keras.layers.BatchNormalization(moving_mean_initializer=init,
+                                            moving_variance_initializer=init)(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        name = 'test___BatchNormFold2' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
 
 class TestSharedLayers(unittest.TestCase):
     """tests for shared layers"""
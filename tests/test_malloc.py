@@ -6,6 +6,9 @@ Implements tests for dynamic memory allocation
 #!/usr/bin/env python3
 
 import unittest
+import struct
+import zlib
+import numpy as np
 import keras
 from keras2c import keras2c_main
 import subprocess
@@ -60,6 +63,46 @@ class TestMalloc(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_weights_file(self):
+        arrays = [np.arange(5, dtype=float), np.ones((3, 7)), np.array([-2.5])]
+        name = 'test___weights_file' + str(int(time.time())) + '.bin'
+        keras2c_main.write_weights_file(name, arrays, alignment=32)
+        with open(name, 'rb') as f:
+            blob = f.read()
+        os.remove(name)
+        self.assertEqual(blob[:8], b'K2CWGHTS')
+        version, alignment, num_arrays, size, checksum, _ = struct.unpack(
+            '<IIQQII', blob[8:40])
+        self.assertEqual((version, alignment, num_arrays), (1, 32, 3))
+        self.assertEqual(size, len(blob))
+        self.assertEqual(checksum, zlib.adler32(blob[40:]))
+        for i, array in enumerate(arrays):
+            offset, numel = struct.unpack('<QQ', blob[40+16*i:56+16*i])
+            self.assertEqual(offset % alignment, 0)
+            self.assertEqual(numel, array.size)
+            stored = np.frombuffer(blob, '<f4', numel, offset)
+            np.testing.assert_array_equal(stored, array.flatten())
+
+    def test_weights_file_bounds(self):
+        a = keras.layers.Input((5,))
+        b = keras.layers.Dense(7)(a)
+        model = keras.models.Model(inputs=a, outputs=b)
+        name = 'test___weights_file_bounds' + str(int(time.time()))
+        keras2c_main.k2c(model, name, malloc=True)
+        # point the last array past the end of the file
+        with open(name + '_weights.bin', 'r+b') as f:
+            blob = bytearray(f.read())
+            num_arrays, size = struct.unpack('<QQ', blob[16:32])
+            entry = 40 + 16*(num_arrays - 1)
+            blob[entry:entry+8] = struct.pack('<Q', size - 4)
+            blob[32:36] = struct.pack('<I', zlib.adler32(bytes(blob[40:])))
+            f.seek(0)
+            f.write(blob)
+        rcode = build_and_run(name)
+        subprocess.run('rm ' + name + '*', shell=True)
+        self.assertNotEqual(rcode, 0)
+        self.assertNotEqual(rcode, 'build failed')
+
 
 if __name__ == "__main__":
     unittest.main()
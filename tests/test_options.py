@@ -0,0 +1,908 @@
+"""test_options.py
+This file is part of the test suite for keras2c
+Implements tests for code generation options
+"""
+
+#!/usr/bin/env python3
+
+import unittest
+import numpy as np
+import keras
+from keras2c import keras2c_main
+from keras2c.memory_planner import plan_memory
+from keras2c.weights2c import Weights2C
+from keras2c.cache import evict
+from keras2c.quantization import quantize_kernel, half_kernel
+from keras2c.sparsity import csr_kernel
+from keras2c.packing import block_kernel, pack_kernel, PANEL_COLS
+from keras2c.convolution import get_conv_algorithm, im2col_block, GEMM_ROWS, \
+    winograd_kernel, winograd_tile, get_padding
+import subprocess
+import time
+import os
+import shutil
+import tempfile
+from test_core_layers import build_and_run
+
+__author__ = "Rory Conlin"
+__copyright__ = "Copyright 2019, Rory Conlin"
+__license__ = "GNU GPLv3"
+__maintainer__ = "Rory Conlin, https://github.com/f0uriest/keras2c"
+__email__ = "wconlin@princeton.edu"
+
+
+class TestStaticWeights(unittest.TestCase):
+    """tests for weights stored as static const arrays"""
+
+    def test_StaticWeights1(self):
+        model = keras.models.Sequential()
+        model.add(keras.layers.Conv2D(8, (3, 3), padding='same',
+                                      input_shape=(16, 16, 3)))
+        model.add(keras.layers.Activation('relu'))
+        model.add(keras.layers.MaxPooling2D(pool_size=(2, 2)))
+        model.add(keras.layers.Flatten())
+        model.add(keras.layers.Dense(20, activation='relu'))
+        model.add(keras.layers.Dense(10, activation='softmax'))
+        name = 'test___StaticWeights1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, static_weights=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_StaticWeights2(self):
+        inshp = (12, 7)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(10, return_sequences=True)(a)
+        c = keras.layers.GRU(8)(b)
+        d = keras.layers.Dense(5, activation='tanh')(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        name = 'test___StaticWeights2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, static_weights=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_StaticWeights3(self):
+        a = keras.layers.Input((5, 4, 3))
+        b = keras.layers.Dense(6, activation='relu')(a)
+        c = keras.layers.Dense(4)(keras.layers.Flatten()(b))
+        model = keras.models.Model(inputs=a, outputs=c)
+        name = 'test___StaticWeights3' + str(int(time.time()))
+        keras2c_main.k2c(model, name, static_weights=True)
+        with open(name + '.c') as f:
+            code = f.read()
+        # dense layers multiply inputs of any rank without working space
+        self.assertNotIn('_fwork', code)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestPlanMemory(unittest.TestCase):
+    """tests for sharing memory between intermediate tensors"""
+
+    def test_plan_memory(self):
+        sizes = {'a': 100, 'b': 40, 'c': 100, 'd': 7, 'e': 60}
+        lifetimes = {'a': (0, 1), 'b': (1, 2), 'c': (2, 3),
+                     'd': (0, 3), 'e': (3, 4)}
+        offsets, size = plan_memory(sizes, lifetimes)
+        for x in sizes:
+            for y in sizes:
+                if x < y and lifetimes[x][0] <= lifetimes[y][1] and \
+                   lifetimes[y][0] <= lifetimes[x][1]:
+                    self.assertTrue(offsets[x] + sizes[x] <= offsets[y] or
+                                    offsets[y] + sizes[y] <= offsets[x])
+        self.assertTrue(size < sum(sizes.values()))
+
+    def test_PlanMemory1(self):
+        inshp = (16, 16, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(8, (3, 3), padding='same',
+                                activation='relu')(a)
+        c = keras.layers.Conv2D(8, (3, 3), padding='same')(b)
+        d = keras.layers.Dropout(0.2)(c)
+        e = keras.layers.Add()([b, d])
+        f = keras.layers.MaxPooling2D(pool_size=(2, 2), padding='same')(e)
+        g = keras.layers.Conv2D(4, (3, 3))(f)
+        h = keras.layers.Concatenate()([g, keras.layers.Cropping2D(1)(f)])
+        i = keras.layers.Flatten()(h)
+        j = keras.layers.Dense(10, activation='softmax')(i)
+        model = keras.models.Model(inputs=a, outputs=j)
+        name = 'test___PlanMemory1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, plan_memory=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_PlanMemory2(self):
+        inshp = (10, 8)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(12, return_sequences=True)(a)
+        c = keras.layers.Conv1D(6, 3, padding='causal')(b)
+        d = keras.layers.Dense(6, activation='tanh')(c)
+        e = keras.layers.Multiply()([c, d])
+        f = keras.layers.GRU(5)(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        name = 'test___PlanMemory2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, malloc=True, plan_memory=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestBatch(unittest.TestCase):
+    """tests for batched inference"""
+
+    def test_Batch1(self):
+        model = keras.models.Sequential()
+        model.add(keras.layers.Dense(32, activation='relu', input_shape=(12,)))
+        model.add(keras.layers.Dropout(0.5))
+        model.add(keras.layers.Dense(16, activation='tanh'))
+        model.add(keras.layers.Dense(5, activation='softmax'))
+        name = 'test___Batch1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, batch_size=4, static_weights=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Batch2(self):
+        a = keras.layers.Input((12, 12, 2))
+        b = keras.layers.Conv2D(4, (3, 3), padding='same')(a)
+        c = keras.layers.Activation('relu')(b)
+        d = keras.layers.MaxPooling2D()(c)
+        e = keras.layers.Flatten()(d)
+        f = keras.layers.Dense(12, activation='relu')(e)
+        g = keras.layers.Dropout(0.2)(f)
+        h = keras.layers.Dense(3)(g)
+        i = keras.layers.Reshape((3, 4))(g)
+        j = keras.layers.LSTM(4)(keras.layers.Permute((2, 1))(i))
+        k = keras.layers.Concatenate()([h, j])
+        model = keras.models.Model(inputs=a, outputs=k)
+        name = 'test___Batch2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, batch_size=3, plan_memory=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Batch3(self):
+        inshp = (6, 4)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Dense(8, activation='softmax')(a)
+        c = keras.layers.GRU(5, return_sequences=True)(b)
+        d = keras.layers.Dense(3)(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        name = 'test___Batch3' + str(int(time.time()))
+        keras2c_main.k2c(model, name, malloc=True, batch_size=16)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Batch4(self):
+        inshp = (6, 4)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Flatten()(a)
+        c = keras.layers.Dense(12)(b)
+        d = keras.layers.Reshape((3, 4))(c)
+        e = keras.layers.Conv1D(5, 2)(d)
+        f = keras.layers.Dropout(.3)(e)
+        g = keras.layers.ReLU()(f)
+        h = keras.layers.Flatten()(g)
+        i = keras.layers.Dense(6)(h)
+        j = keras.layers.Reshape((2, 3))(i)
+        model = keras.models.Model(inputs=a, outputs=j)
+        name = 'test___Batch4' + str(int(time.time()))
+        keras2c_main.k2c(model, name, plan_memory=True, batch_size=3)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Batch5(self):
+        # softmax fused into a Dense layer with its own activation
+        a = keras.layers.Input((10,))
+        b = keras.layers.Dense(7, activation='relu')(a)
+        c = keras.layers.Activation('softmax')(b)
+        model = keras.models.Model(inputs=a, outputs=c)
+        name = 'test___Batch5' + str(int(time.time()))
+        keras2c_main.k2c(model, name, batch_size=4)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestSeparateWeights(unittest.TestCase):
+    """tests for weights written to a separate source file"""
+
+    def test_SeparateWeights1(self):
+        model = keras.models.Sequential()
+        model.add(keras.layers.Conv1D(6, 3, padding='same', input_shape=(10, 4)))
+        model.add(keras.layers.LSTM(5, return_sequences=True))
+        model.add(keras.layers.Flatten())
+        model.add(keras.layers.Dense(8, activation='relu'))
+        name = 'test___SeparateWeights1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, separate_weights=True, batch_size=4)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestReentrant(unittest.TestCase):
+    """tests for models that keep their state in a context"""
+
+    def test_Reentrant1(self):
+        inshp = (4, 4, 6)
+        a = keras.layers.Input(batch_shape=inshp)
+        b = keras.layers.LSTM(5, return_sequences=True, stateful=True)(a)
+        c = keras.layers.Dense(3)(b)
+        model = keras.models.Model(inputs=a, outputs=c)
+        name = 'test___Reentrant1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, reentrant=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Reentrant2(self):
+        inshp = (10, 4)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv1D(6, 3, padding='same')(a)
+        c = keras.layers.GRU(5, return_sequences=True)(b)
+        d = keras.layers.Flatten()(c)
+        e = keras.layers.Dense(8, activation='relu')(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        name = 'test___Reentrant2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, malloc=True, plan_memory=True,
+                         batch_size=4, reentrant=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestQuantize(unittest.TestCase):
+    """tests for layers with int8 kernels"""
+
+    def test_quantize_kernel(self):
+        kernel = np.random.random((3, 4, 6)) - 0.5
+        kernel[..., 2] *= 10
+        for per_channel in [True, False]:
+            qkernel, scale = quantize_kernel(kernel, per_channel)
+            self.assertEqual(qkernel.dtype, np.int8)
+            self.assertEqual(scale.shape, (6,))
+            self.assertTrue(np.all(np.abs(qkernel*scale - kernel) <= scale/2 + 1e-7))
+        self.assertEqual(len(np.unique(scale)), 1)
+
+    def test_Quantize1(self):
+        inshp = (5, 8)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Dense(16, activation='relu')(a)
+        c = keras.layers.Flatten()(b)
+        d = keras.layers.Dense(10)(c)
+        e = keras.layers.Activation('softmax')(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        name = 'test___Quantize1' + str(int(time.time()))
+        calibration_data = 4*np.random.random((100,) + inshp) - 2
+        keras2c_main.k2c(model, name, batch_size=4, quantize='per_channel',
+                         calibration_data=calibration_data)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Quantize2(self):
+        inshp = (8, 7, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(6, (3, 3), padding='same', activation='relu')(a)
+        c = keras.layers.Reshape((56, 6))(b)
+        d = keras.layers.Conv1D(4, 3, strides=2)(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        name = 'test___Quantize2' + str(int(time.time()))
+        calibration_data = 4*np.random.random((100,) + inshp) - 2
+        keras2c_main.k2c(model, name, malloc=True, quantize='per_tensor',
+                         calibration_data=calibration_data)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestHalfWeights(unittest.TestCase):
+    """tests for kernels stored as 16 bit floats"""
+
+    def test_half_kernel(self):
+        kernel = np.array([1.0, -2.5, 1e-6, 65504, 0, np.inf, 1 + 2**-8, 1 + 3*2**-8],
+                          dtype=np.float32)
+        self.assertTrue(np.array_equal(half_kernel(kernel, 'float16'),
+                                       kernel.astype(np.float16).view(np.uint16)))
+        bf16 = half_kernel(kernel, 'bfloat16')
+        widened = (bf16.astype(np.uint32) << 16).view(np.float32)
+        self.assertTrue(np.allclose(widened[:6], kernel[:6], rtol=2**-8, atol=0))
+        # ties round to even
+        self.assertEqual(widened[6], 1.0)
+        self.assertEqual(widened[7], 1 + 2**-6)
+
+    def test_HalfWeights1(self):
+        inshp = (8, 7, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(6, (3, 3), padding='same', activation='relu')(a)
+        c = keras.layers.Reshape((56, 6))(b)
+        d = keras.layers.Conv1D(4, 3, strides=2)(c)
+        e = keras.layers.Flatten()(d)
+        f = keras.layers.Dense(10, activation='tanh')(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        name = 'test___HalfWeights1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, batch_size=3, weight_dtype='float16')
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_HalfWeights2(self):
+        inshp = (10, 4)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(8, return_sequences=True)(a)
+        c = keras.layers.GRU(6, return_sequences=True, go_backwards=True,
+                             reset_after=False)(b)
+        d = keras.layers.SimpleRNN(5)(c)
+        e = keras.layers.Dense(3)(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        name = 'test___HalfWeights2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, weight_dtype='bfloat16')
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+def prune(model, sparsity):
+    # zero out the smallest kernel values of each layer
+    for layer in model.layers:
+        weights = layer.get_weights()
+        for j, w in enumerate(weights[:2]):
+            if w.ndim == 2:
+                weights[j] = np.where(np.abs(w) < np.quantile(np.abs(w), sparsity),
+                                      0, w)
+        layer.set_weights(weights)
+
+
+class TestSparse(unittest.TestCase):
+    """tests for kernels stored in compressed sparse row format"""
+
+    def test_csr_kernel(self):
+        kernel = np.random.random((7, 5))
+        kernel[kernel < 0.7] = 0
+        kernel[3] = 0
+        values, indices, indptr = csr_kernel(kernel)
+        self.assertEqual(indptr[-1], np.count_nonzero(kernel))
+        dense = np.zeros_like(kernel)
+        for row in range(kernel.shape[0]):
+            for p in range(indptr[row], indptr[row+1]):
+                dense[row, indices[p]] = values[p]
+        self.assertTrue(np.allclose(dense, kernel))
+
+    def test_csr_kernel_splits(self):
+        kernel = np.random.random((6, 9))
+        kernel[kernel < 0.5] = 0
+        values, indices, indptr = csr_kernel(kernel, [6])
+        self.assertEqual(indptr.size, 2*6 + 1)
+        dense = np.zeros_like(kernel)
+        for row in range(2*6):
+            for p in range(indptr[row], indptr[row+1]):
+                dense[row % 6, indices[p] + 6*(row // 6)] = values[p]
+        self.assertTrue(np.allclose(dense, kernel))
+
+    def test_Sparse1(self):
+        inshp = (4, 20)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Dense(30, activation='relu')(a)
+        c = keras.layers.Flatten()(b)
+        d = keras.layers.Dense(10)(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        prune(model, 0.85)
+        name = 'test___Sparse1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, batch_size=3, sparse_threshold=0.8)
+        with open(name + '.c') as f:
+            self.assertEqual(f.read().count('k2c_dense_s('), 4)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Sparse2(self):
+        inshp = (10, 6)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(12, return_sequences=True)(a)
+        c = keras.layers.GRU(10, return_sequences=True, go_backwards=True)(b)
+        d = keras.layers.GRU(9, return_sequences=True, reset_after=False)(c)
+        e = keras.layers.SimpleRNN(8)(d)
+        f = keras.layers.Dense(3)(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        prune(model, 0.9)
+        name = 'test___Sparse2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, sparse_threshold=0.8)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestSpecialize(unittest.TestCase):
+    """tests for kernels written for the shapes of each layer"""
+
+    def test_Specialize1(self):
+        inshp = (6, 5, 4, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv3D(4, (3, 2, 3), padding='same', dilation_rate=(1, 2, 1))(a)
+        c = keras.layers.Conv3D(5, (2, 2, 2), strides=(2, 1, 2))(b)
+        d = keras.layers.Reshape((24, 5))(c)
+        e = keras.layers.Conv1D(3, 4, strides=2, padding='causal')(d)
+        f = keras.layers.Dense(7)(e)
+        g = keras.layers.LeakyReLU()(f)
+        model = keras.models.Model(inputs=a, outputs=g)
+        name = 'test___Specialize1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, specialize=True, batch_size=3)
+        with open(name + '.c') as f:
+            code = f.read()
+        self.assertEqual(code.count('static void '), 4)
+        self.assertNotIn('k2c_conv3d(', code)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Specialize2(self):
+        inshp = (10, 8, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(6, (3, 3), padding='same', activation='relu')(a)
+        c = keras.layers.Conv2D(4, (3, 2), strides=(2, 1), dilation_rate=1)(b)
+        d = keras.layers.Flatten()(c)
+        e = keras.layers.Dense(5, activation='softmax')(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        name = 'test___Specialize2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, specialize=True, plan_memory=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestPackWeights(unittest.TestCase):
+    """tests for kernels stored in panels"""
+
+    def test_pack_kernel(self):
+        kernel = np.random.random((5, 2*PANEL_COLS + 3)).astype(np.float32)
+        packed = pack_kernel(kernel, [PANEL_COLS + 3])
+        self.assertEqual(packed.size, 5*3*PANEL_COLS)
+        panels = packed[:5*2*PANEL_COLS].reshape(2, 5, PANEL_COLS)
+        self.assertTrue(np.array_equal(panels[0], kernel[:, :PANEL_COLS]))
+        self.assertTrue(np.array_equal(panels[1, :, :3], kernel[:, PANEL_COLS:PANEL_COLS+3]))
+        self.assertFalse(panels[1, :, 3:].any())
+        self.assertTrue(np.array_equal(packed[5*2*PANEL_COLS:].reshape(5, PANEL_COLS),
+                                       kernel[:, PANEL_COLS+3:]))
+
+    def test_block_kernel(self):
+        kernel = np.random.random((4, 9))
+        blocked = block_kernel(kernel, [6])
+        self.assertEqual(blocked.shape, kernel.shape)
+        self.assertTrue(np.array_equal(blocked.ravel()[:24], kernel[:, :6].ravel()))
+        self.assertTrue(np.array_equal(blocked.ravel()[24:], kernel[:, 6:].ravel()))
+        self.assertTrue(np.array_equal(block_kernel(kernel), kernel))
+
+    def test_PackWeights1(self):
+        inshp = (9, 30)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Dense(130, activation='relu')(a)
+        c = keras.layers.Flatten()(b)
+        d = keras.layers.Dense(10, activation='softmax')(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        name = 'test___PackWeights1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, pack_weights=True, batch_size=5)
+        with open(name + '.c') as f:
+            self.assertEqual(f.read().count('K2C_PACKED}'), 2)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_PackWeights2(self):
+        inshp = (6, 30)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(70, return_sequences=True)(a)
+        c = keras.layers.GRU(20, return_sequences=True, reset_after=False)(b)
+        d = keras.layers.GRU(65, return_sequences=True, reset_after=True)(c)
+        e = keras.layers.SimpleRNN(9, go_backwards=True)(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        name = 'test___PackWeights2' + str(int(time.time()))
+        keras2c_main.k2c(model, name, pack_weights=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestConvAlgorithm(unittest.TestCase):
+    """tests for convolutions evaluated as a matrix product"""
+
+    def test_get_conv_algorithm(self):
+        a = keras.layers.Input((16, 16, 8))
+        b = keras.layers.Conv2D(16, 3, padding='same')(a)
+        c = keras.layers.Conv2D(2, 3)(b)
+        d = keras.layers.Conv2D(16, 1)(b)
+        e = keras.layers.Conv2D(16, 15, strides=2)(a)
+        f = keras.layers.Conv2D(16, 3)(b)
+        model = keras.models.Model(inputs=a, outputs=[c, d, e, f])
+        conv, narrow, pointwise, large, wide = model.layers[1:]
+        self.assertEqual(get_conv_algorithm(conv, 'auto'), 'im2col')
+        self.assertEqual(get_conv_algorithm(conv, 'winograd'), 'winograd')
+        self.assertEqual(get_conv_algorithm(wide, 'auto'), 'winograd')
+        self.assertEqual(get_conv_algorithm(large, 'winograd'), 'direct')
+        self.assertEqual(winograd_tile(wide), 2)
+        self.assertEqual(get_conv_algorithm(conv, 'direct'), 'direct')
+        self.assertEqual(get_conv_algorithm(narrow, 'auto'), 'direct')
+        self.assertEqual(get_conv_algorithm(narrow, 'im2col'), 'im2col')
+        self.assertEqual(get_conv_algorithm(large, 'auto'), 'direct')
+        self.assertEqual(im2col_block(pointwise), 0)
+        self.assertEqual(im2col_block(large), 1)
+        self.assertGreaterEqual(im2col_block(conv), GEMM_ROWS)
+
+    def test_get_padding(self):
+        a = keras.layers.Input((11, 16, 5))
+        b = keras.layers.Conv2D(4, (4, 3), strides=(2, 3), padding='same')(a)
+        c = keras.layers.Conv2D(4, 3, dilation_rate=2, padding='same')(b)
+        d = keras.layers.Conv2D(4, 3)(c)
+        e = keras.layers.MaxPooling2D(3, strides=2, padding='same')(d)
+        f = keras.layers.Input((9, 4))
+        g = keras.layers.Conv1D(4, 3, dilation_rate=2, padding='causal')(f)
+        h = keras.layers.AveragePooling1D(4, padding='same')(g)
+        i = keras.layers.Input((4, 5, 9, 3))
+        j = keras.layers.Conv3D(2, (2, 3, 5), dilation_rate=(1, 1, 2), padding='same')(i)
+        model = keras.models.Model(inputs=[a, f, i], outputs=[e, h, j])
+        layers = {layer.name: layer for layer in model.layers}
+        pads = [get_padding(layers[t.name.split('/')[0]]) for t in [b, c, d, e, g, h, j]]
+        self.assertEqual(pads, [[1, 2, 1, 1], [2, 2, 2, 2], [0, 0, 0, 0], [0, 1, 0, 1],
+                                [4, 0], [1, 2], [0, 1, 1, 1, 4, 4]])
+
+    def test_winograd_kernel(self):
+        # transforms of the input and output tiles, from k2c_convolution_layers.c
+        BT = {2: np.array([[1, 0, -1, 0], [0, 1, 1, 0], [0, -1, 1, 0], [0, 1, 0, -1]]),
+              4: np.array([[4, 0, -5, 0, 1, 0], [0, -4, -4, 1, 1, 0],
+                           [0, 4, -4, -1, 1, 0], [0, -2, -1, 2, 1, 0],
+                           [0, 2, -1, -2, 1, 0], [0, 4, 0, -5, 0, 1]])}
+        AT = {2: np.array([[1, 1, 1, 0], [0, 1, -1, -1]]),
+              4: np.array([[1, 1, 1, 1, 1, 0], [0, 1, -1, 2, -2, 0],
+                           [0, 1, 1, 4, 4, 0], [0, 1, -1, 8, -8, 1]])}
+        kernel = np.random.random((3, 3, 2, 5))
+        for tile in [2, 4]:
+            d = np.random.random((tile + 2, tile + 2, 2))
+            U = winograd_kernel(kernel, tile)
+            V = np.einsum('ik,klc,jl->ijc', BT[tile], d, BT[tile])
+            Y = np.einsum('ik,klo,jl->ijo', AT[tile],
+                          np.einsum('ijc,ijco->ijo', V, U), AT[tile])
+            direct = np.array([[np.einsum('klc,klco->o', d[i:i+3, j:j+3], kernel)
+                                for j in range(tile)] for i in range(tile)])
+            self.assertEqual(U.shape, (tile + 2, tile + 2, 2, 5))
+            self.assertTrue(np.allclose(Y, direct, rtol=1e-5))
+
+    def test_ConvAlgorithm1(self):
+        a = keras.layers.Input((6, 5, 4, 3))
+        b = keras.layers.Conv3D(4, (3, 2, 3), padding='same', dilation_rate=(1, 2, 1))(a)
+        c = keras.layers.Conv3D(5, (2, 2, 2), strides=(2, 1, 2))(b)
+        d = keras.layers.Reshape((24, 5))(c)
+        e = keras.layers.Conv1D(3, 4, strides=2, padding='causal')(d)
+        f = keras.layers.Conv1D(4, 3, dilation_rate=2, activation='relu')(e)
+        g = keras.layers.Reshape((4, 4, 2))(f)
+        h = keras.layers.Conv2D(6, 1)(g)
+        i = keras.layers.Conv2D(3, (2, 2), padding='same', dilation_rate=(1, 2))(h)
+        model = keras.models.Model(inputs=a, outputs=i)
+        name = 'test___ConvAlgorithm1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, conv_algorithm='im2col', batch_size=3)
+        with open(name + '.c') as f:
+            code = f.read()
+        for conv in ['k2c_conv1d', 'k2c_conv2d', 'k2c_conv3d']:
+            self.assertIn(conv + '_im2col(', code)
+            self.assertNotIn(conv + '(', code)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_ConvAlgorithm2(self):
+        a = keras.layers.Input((12, 10, 3))
+        b = keras.layers.Conv2D(8, (3, 3), padding='same', activation='relu')(a)
+        c = keras.layers.Conv2D(16, (3, 3), strides=2)(b)
+        d = keras.layers.Conv2D(2, (2, 2))(c)
+        e = keras.layers.Flatten()(d)
+        f = keras.layers.Dense(5, activation='softmax')(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        for options in [{'plan_memory': True, 'specialize': True}, {'malloc': True}]:
+            with self.subTest(**options):
+                name = 'test___ConvAlgorithm2' + str(len(options)) + \
+                    str(int(time.time()))
+                keras2c_main.k2c(model, name, conv_algorithm='auto', **options)
+                rcode = build_and_run(name)
+                self.assertEqual(rcode, 0)
+
+    def test_ConvAlgorithm3(self):
+        a = keras.layers.Input((27, 30, 16))
+        b = keras.layers.Conv2D(16, (3, 3), padding='same', activation='relu')(a)
+        c = keras.layers.Conv2D(16, (3, 3))(b)
+        d = keras.layers.MaxPooling2D(2)(c)
+        e = keras.layers.Conv2D(8, (3, 3), padding='same')(d)
+        f = keras.layers.Conv2D(4, (3, 3), strides=2)(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        name = 'test___ConvAlgorithm3' + str(int(time.time()))
+        keras2c_main.k2c(model, name, conv_algorithm='winograd', batch_size=2)
+        with open(name + '.c') as f:
+            code = f.read()
+        self.assertEqual(code.count('k2c_conv2d_winograd('), 6)
+        self.assertEqual(code.count('k2c_conv2d('), 2)
+        with open(name + '_test_suite.c') as f:
+            self.assertIn('(F(4x4,3x3))', f.read())
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_ConvAlgorithm4(self):
+        a = keras.layers.Input((13, 11, 6))
+        b = keras.layers.Conv2D(8, (4, 3), strides=(2, 3), padding='same')(a)
+        c = keras.layers.Conv2D(8, 3, dilation_rate=(2, 1), padding='same')(b)
+        d = keras.layers.Conv2D(8, 3, padding='same', activation='relu')(c)
+        e = keras.layers.Reshape((28, 8))(d)
+        f = keras.layers.Conv1D(6, 3, dilation_rate=2, padding='causal')(e)
+        model = keras.models.Model(inputs=a, outputs=f)
+        for options in [{'conv_algorithm': 'im2col'}, {'conv_algorithm': 'winograd'},
+                        {'specialize': True}]:
+            with self.subTest(**options):
+                name = 'test___ConvAlgorithm4' + list(options)[0] + \
+                    str(int(time.time()))
+                keras2c_main.k2c(model, name, **options)
+                with open(name + '.c') as f:
+                    self.assertNotIn('k2c_pad', f.read())
+                rcode = build_and_run(name)
+                self.assertEqual(rcode, 0)
+
+
+class TestSimd(unittest.TestCase):
+    """tests for each version of the matrix multiplication kernels"""
+
+    def test_Simd1(self):
+        inshp = (8, 8, 5)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(70, 3, padding='same')(a)
+        c = keras.layers.Reshape((64, 70))(b)
+        d = keras.layers.LSTM(20, return_sequences=True)(c)
+        e = keras.layers.Dense(67)(d)
+        f = keras.layers.Flatten()(e)
+        g = keras.layers.Dense(9)(f)
+        model = keras.models.Model(inputs=a, outputs=g)
+        for level in ['generic', 'avx2', 'avx512']:
+            with self.subTest(level=level):
+                name = 'test___Simd1' + level + str(int(time.time()))
+                keras2c_main.k2c(model, name, batch_size=6)
+                os.environ['K2C_SIMD'] = level
+                try:
+                    rcode = build_and_run(name)
+                finally:
+                    del os.environ['K2C_SIMD']
+                self.assertEqual(rcode, 0)
+
+
+class TestParallel(unittest.TestCase):
+    """tests for layers split between threads with OpenMP"""
+
+    def test_Parallel1(self):
+        inshp = (40, 40, 3)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.Conv2D(32, 3, padding='same')(a)
+        c = keras.layers.MaxPooling2D(3, strides=1)(b)
+        d = keras.layers.AveragePooling2D(3, strides=1, padding='same')(c)
+        e = keras.layers.Reshape((38*38, 32))(d)
+        f = keras.layers.Conv1D(16, 3, dilation_rate=2)(e)
+        g = keras.layers.AveragePooling1D(3, strides=2, padding='same')(f)
+        h = keras.layers.Dense(90)(g)
+        i = keras.layers.GlobalAveragePooling1D()(h)
+        j = keras.layers.Dense(5)(i)
+        model = keras.models.Model(inputs=a, outputs=j)
+        name = 'test___Parallel1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, num_threads=3, batch_size=4)
+        with open(name + '.c') as f:
+            self.assertIn('k2c_set_num_threads(3);', f.read())
+
+        # build a copy of the library with OpenMP
+        libdir = tempfile.mkdtemp()
+        try:
+            for fname in os.listdir('./include/'):
+                if fname.endswith(('.c', '.h')) or fname == 'makefile':
+                    shutil.copy(os.path.join('./include/', fname), libdir)
+            lib_code = subprocess.run(['make', 'OPENMP=1'], cwd=libdir).returncode
+            self.assertEqual(lib_code, 0)
+            cc = 'gcc -O2 -fopenmp -std=c99 -I' + libdir + ' -o ' + name + ' ' + \
+                name + '.c ' + name + '_test_suite.c -L' + libdir + \
+                ' -l:libkeras2c.a -lm'
+            self.assertEqual(subprocess.run(cc.split()).returncode, 0)
+            self.assertEqual(subprocess.run(['./' + name]).returncode, 0)
+        finally:
+            shutil.rmtree(libdir)
+
+        # and without, where the number of threads is ignored
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+
+class TestParallelLayers(unittest.TestCase):
+    """tests for layers run as tasks on a pool of threads"""
+
+    def test_ParallelLayers1(self):
+        a = keras.layers.Input((12, 12, 8))
+        b1 = keras.layers.Conv2D(16, 1, activation='relu')(a)
+        b2 = keras.layers.Conv2D(16, 3, padding='same')(a)
+        b2 = keras.layers.Activation('relu')(b2)
+        b3 = keras.layers.MaxPooling2D(3, strides=1, padding='same')(a)
+        b3 = keras.layers.Conv2D(8, 1)(b3)
+        c = keras.layers.Concatenate()([b1, b2, b3])
+        d = keras.layers.Activation('tanh')(c)
+        e = keras.layers.Add()([b1, b2])
+        shared = keras.layers.Dense(10)
+        f = shared(keras.layers.GlobalAveragePooling2D()(d))
+        g = shared(keras.layers.GlobalMaxPooling2D()(keras.layers.Concatenate()([e, b3, b1])))
+        model = keras.models.Model(inputs=a, outputs=[f, g])
+        name = 'test___ParallelLayers1' + str(int(time.time()))
+        keras2c_main.k2c(model, name, parallel_layers=True, num_threads=4)
+        with open(name + '.c') as f:
+            code = f.read()
+        self.assertIn('k2c_start_threads(4);', code)
+        self.assertIn('k2c_stop_threads();', code)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_ParallelLayers2(self):
+        a = keras.layers.Input((10, 6))
+        b = keras.layers.Input((10, 6))
+        c = keras.layers.LSTM(8, return_sequences=True)(a)
+        d = keras.layers.GRU(8, return_sequences=True)(b)
+        e = keras.layers.Conv1D(8, 3, padding='causal')(a)
+        f = keras.layers.Multiply()([c, d, e])
+        g = keras.layers.Flatten()(f)
+        h = keras.layers.Dense(5)(g)
+        model = keras.models.Model(inputs=[a, b], outputs=h)
+        for options in [{'malloc': True, 'batch_size': 3}, {'reentrant': True}]:
+            with self.subTest(**options):
+                name = 'test___ParallelLayers2' + str(len(options)) + \
+                    str(int(time.time()))
+                keras2c_main.k2c(model, name, parallel_layers=True, **options)
+                with open(name + '.c') as f:
+                    code = f.read()
+                # working arrays are only declared by the task of their layer
+                task = code[code.index('_task(void'):code.index('switch (task)')]
+                self.assertNotIn('= {0}', task)
+                rcode = build_and_run(name)
+                self.assertEqual(rcode, 0)
+
+    def test_ParallelLayers3(self):
+        a = keras.layers.Input((16,), name='x')
+        b = keras.layers.Dense(32, activation='relu')(a)
+        c = keras.layers.Dense(32, activation='tanh')(a)
+        d = keras.layers.Add()([b, c])
+        e = keras.layers.Dense(8, name='y')(d)
+        model = keras.models.Model(inputs=a, outputs=e)
+        # several threads call the model at once, each with its own input,
+        # and check their outputs against the ones from calls made one at a time
+        driver = """
+#include <pthread.h>
+#include "k2c_include.h"
+#include "NAME.h"
+
+static float refs[4][8];
+
+static void * caller(void * arg) {
+    const size_t t = (size_t) arg;
+    float x[16], y[8];
+    k2c_tensor x_input = {x,1,16,{16,1,1,1,1}};
+    k2c_tensor y_output = {y,1,8,{8,1,1,1,1}};
+    for (size_t i = 0; i < 16; ++i) {
+        x[i] = (float) t - 0.1f*i;
+    }
+    for (size_t n = 0; n < 2000; ++n) {
+        NAME(&x_input, &y_output);
+        for (size_t j = 0; j < 8; ++j) {
+            if (y[j] != refs[t][j]) {
+                return arg;
+            }
+        }
+    }
+    return NULL;
+}
+
+int main() {
+    pthread_t threads[4];
+    int failed = 0;
+    NAME_initialize();
+    for (size_t t = 0; t < 4; ++t) {
+        float x[16];
+        k2c_tensor x_input = {x,1,16,{16,1,1,1,1}};
+        k2c_tensor y_output = {refs[t],1,8,{8,1,1,1,1}};
+        for (size_t i = 0; i < 16; ++i) {
+            x[i] = (float) t - 0.1f*i;
+        }
+        NAME(&x_input, &y_output);
+    }
+    for (size_t t = 0; t < 4; ++t) {
+        pthread_create(&threads[t], NULL, caller, (void *) t);
+    }
+    for (size_t t = 0; t < 4; ++t) {
+        void * result;
+        pthread_join(threads[t], &result);
+        failed |= result != NULL;
+    }
+    NAME_terminate();
+    return failed;
+}
+"""
+        for num_threads in [1, 3]:
+            with self.subTest(num_threads=num_threads):
+                name = 'test___ParallelLayers3' + str(num_threads) + \
+                    str(int(time.time()))
+                keras2c_main.k2c(model, name, parallel_layers=True,
+                                 num_threads=num_threads, num_tests=0)
+                with open(name + '.c') as f:
+                    code = f.read()
+                self.assertNotIn('static float ' + name + '_workspace', code)
+                with open(name + '_test_suite.c', 'w') as f:
+                    f.write(driver.replace('NAME', name))
+                rcode = build_and_run(name)
+                self.assertEqual(rcode, 0)
+
+
+class TestCache(unittest.TestCase):
+    """tests for caching of converted models"""
+
+    def test_Cache1(self):
+        model = keras.models.Sequential()
+        model.add(keras.layers.Dense(8, activation='relu', input_shape=(6,)))
+        model.add(keras.layers.Dense(3))
+        name = 'test___Cache1' + str(int(time.time()))
+        cache_dir = tempfile.mkdtemp()
+        keras2c_main.k2c(model, name, cache_dir=cache_dir)
+        with open(name + '_test_suite.c') as f:
+            tests = f.read()
+        for fname in [name + '.c', name + '.h', name + '_test_suite.c']:
+            os.remove(fname)
+        # test inputs are random, so they only match if copied from the cache
+        keras2c_main.k2c(model, name, cache_dir=cache_dir)
+        with open(name + '_test_suite.c') as f:
+            self.assertEqual(f.read(), tests)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        for fname in [name + '.c', name + '.h', name + '_test_suite.c']:
+            os.remove(fname)
+        # changing the weights or options gives a new entry
+        model.layers[0].set_weights([w + 1 for w in model.layers[0].get_weights()])
+        keras2c_main.k2c(model, name, cache_dir=cache_dir, static_weights=True)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        shutil.rmtree(cache_dir)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_Cache2(self):
+        model = keras.models.Sequential()
+        model.add(keras.layers.Dense(4, input_shape=(3,)))
+        name = 'test___Cache2' + str(int(time.time()))
+        cache_dir = tempfile.mkdtemp()
+        # stale output of an earlier conversion with other options
+        with open(name + '_weights.c', 'w') as f:
+            f.write('stale')
+        keras2c_main.k2c(model, name, cache_dir=cache_dir)
+        os.remove(name + '_weights.c')
+        entry = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        self.assertEqual(sorted(os.listdir(entry)),
+                         sorted([name + '.c', name + '.h', name + '_test_suite.c']))
+        shutil.rmtree(cache_dir)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_evict(self):
+        cache_dir = tempfile.mkdtemp()
+        for i in range(4):
+            entry = os.path.join(cache_dir, str(i))
+            os.mkdir(entry)
+            with open(os.path.join(entry, 'foo.c'), 'w') as f:
+                f.write('x'*100)
+            os.utime(entry, (1000 + i, 1000 + i))
+        # entry 0 was used most recently
+        os.utime(os.path.join(cache_dir, '0'), (2000, 2000))
+        evict(cache_dir, 250)
+        self.assertEqual(sorted(os.listdir(cache_dir)), ['0', '3'])
+        shutil.rmtree(cache_dir)
+
+
+class TestArray2C(unittest.TestCase):
+    """tests for writing arrays as C initializers"""
+
+    def test_array2c(self):
+        array = np.random.random((7, 3, 2)) - 0.5
+        array[1, 2, 0] = np.inf
+        array[4, 0, 1] = -np.inf
+        expected = 'float foo_array[42] = {\n'
+        for i, x in enumerate(array.flatten()):
+            if x == np.inf:
+                expected += 'HUGE_VALF,'
+            elif x == -np.inf:
+                expected += '-HUGE_VALF,'
+            else:
+                expected += '{:+.8e}'.format(x) + ','
+            if (i+1) % 5 == 0:
+                expected += '\n'
+        expected += '}; \n'
+        expected += 'k2c_tensor foo = {&foo_array[0],3,42,{7,3,2,1,1}}; \n'
+        for chunk_size in [5, 10, 10240]:
+            s = ''.join(Weights2C.array2c_chunks(array, 'foo',
+                                                 chunk_size=chunk_size))
+            self.assertEqual(s, expected)
+        self.assertEqual(Weights2C.array2c(array, 'foo'), expected)
+        self.assertEqual(Weights2C.array2c(np.zeros((2, 3)), 'bar'),
+                         'float bar_array[6] = {0}; \n' +
+                         'k2c_tensor bar = {&bar_array[0],2,6,{2,3,1,1,1}}; \n')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -106,6 +106,35 @@ class TestRecurrentLayers(unittest.TestCase):
         rcode = build_and_run(name)
         self.assertEqual(rcode, 0)
 
+    def test_LSTM4(self):
+        inshp = (150, 12)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(20, go_backwards=True,
+                              return_sequences=True)(a)
+        c = keras.layers.GRU(16, return_sequences=True,
+                             reset_after=False)(b)
+        d = keras.layers.SimpleRNN(10)(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        name = 'test___LSTM4' + str(int(time.time()))
+        keras2c_main.k2c(model, name, plan_memory=True)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
+    def test_LSTM5(self):
+        # more timesteps than are multiplied at once, in both directions
+        inshp = (70, 9)
+        a = keras.layers.Input(inshp)
+        b = keras.layers.LSTM(12, return_sequences=True)(a)
+        c = keras.layers.GRU(14, go_backwards=True, return_sequences=True,
+                             reset_after=True)(b)
+        d = keras.layers.SimpleRNN(8, go_backwards=True,
+                                   return_sequences=True)(c)
+        model = keras.models.Model(inputs=a, outputs=d)
+        name = 'test___LSTM5' + str(int(time.time()))
+        keras2c_main.k2c(model, name)
+        rcode = build_and_run(name)
+        self.assertEqual(rcode, 0)
+
     def test_GRU1(self):
         inshp = (12, 46)
         units = 17